@@ -14,6 +14,9 @@ from process import (
     translator,
     translator_sec,
 )
+from patch import REVISION_STAGES, model_load_stages
+from translation_agent.usage import UsageTracker, track_usage
+from translation_agent.utils import TIER_DRAFT, TIER_FULL, TIER_STANDARD
 
 # 配置文件路径
 CONFIG_FILE = os.path.join(os.path.dirname(__file__), "user_config.json")
@@ -24,6 +27,13 @@ uploaded_filename = None
 # 标志：是否正在加载配置（防止 endpoint.change 覆盖模型名）
 is_loading_config = False
 
+# 质量档位：(显示名称, 档位)
+TIER_CHOICES = [
+    ("初稿（仅初译）", TIER_DRAFT),
+    ("标准（初译+一次修订）", TIER_STANDARD),
+    ("完整（反思+改进）", TIER_FULL),
+]
+
 
 def huanik(
     endpoint: str,
@@ -42,6 +52,10 @@ def huanik(
     max_tokens: int,
     temperature: int,
     rpm: int,
+    tier: str = TIER_FULL,
+    rpm2: int = 60,
+    tpm2: int = 0,
+    concurrency2: int = 0,
 ):
     if not source_text or source_lang == target_lang:
         raise gr.Error(
@@ -59,31 +73,54 @@ def huanik(
         else:
             raise gr.Error(f"模型加载失败: {e}") from e
 
+    if choice:
+        # 修订阶段路由到额外端点：每次点击翻译时配置一次，使用它自己的
+        # RPM/TPM限速和并发上限，translator_sec 只检查路由是否存在
+        try:
+            model_load_stages(
+                REVISION_STAGES,
+                endpoint2,
+                base2,
+                model2,
+                api_key2,
+                rpm=rpm2,
+                tpm=tpm2,
+                max_concurrency=concurrency2,
+            )
+        except Exception as e:
+            error_msg = str(e)
+            if "404" in error_msg or "Not Found" in error_msg:
+                raise gr.Error(f"额外端点配置错误 (404): 请检查基础URL和模型名称是否正确。错误详情: {e}") from e
+            elif "401" in error_msg or "Unauthorized" in error_msg:
+                raise gr.Error(f"额外端点API密钥无效 (401): 请检查API密钥是否正确。错误详情: {e}") from e
+            else:
+                raise gr.Error(f"额外端点模型加载失败: {e}") from e
+
     source_text = re.sub(r"(?m)^\s*$\n?", "", source_text)
 
-    if choice:
-        init_translation, reflect_translation, final_translation = (
-            translator_sec(
-                endpoint2=endpoint2,
-                base2=base2,
-                model2=model2,
-                api_key2=api_key2,
+    usage = UsageTracker("huanik")
+    with track_usage(usage):
+        if choice:
+            init_translation, reflect_translation, final_translation = (
+                translator_sec(
+                    source_lang=source_lang,
+                    target_lang=target_lang,
+                    source_text=source_text,
+                    country=country,
+                    max_tokens=max_tokens,
+                    tier=tier,
+                )
+            )
+
+        else:
+            init_translation, reflect_translation, final_translation = translator(
                 source_lang=source_lang,
                 target_lang=target_lang,
                 source_text=source_text,
                 country=country,
                 max_tokens=max_tokens,
+                tier=tier,
             )
-        )
-
-    else:
-        init_translation, reflect_translation, final_translation = translator(
-            source_lang=source_lang,
-            target_lang=target_lang,
-            source_text=source_text,
-            country=country,
-            max_tokens=max_tokens,
-        )
 
     final_diff = gr.HighlightedText(
         diff_texts(init_translation, final_translation),
@@ -99,17 +136,25 @@ def huanik(
         endpoint, model, api_key, base,
         endpoint2, model2, api_key2, base2,
         source_lang, target_lang, country,
-        max_tokens, temperature, rpm, choice
+        max_tokens, temperature, rpm, choice, tier,
+        rpm2, tpm2, concurrency2
     )
 
-    return init_translation, reflect_translation, final_translation, final_diff
+    return (
+        init_translation,
+        reflect_translation,
+        final_translation,
+        final_diff,
+        usage.format_summary(),
+    )
 
 
 def save_config(
     endpoint, model, api_key, base,
     endpoint2, model2, api_key2, base2,
     source_lang, target_lang, country,
-    max_tokens, temperature, rpm, choice
+    max_tokens, temperature, rpm, choice, tier=TIER_FULL,
+    rpm2=60, tpm2=0, concurrency2=0
 ):
     """保存配置到本地文件"""
     try:
@@ -129,6 +174,10 @@ def save_config(
             "temperature": temperature,
             "rpm": rpm,
             "choice": choice,
+            "pipeline_tier": tier,
+            "rpm2": rpm2,
+            "tpm2": tpm2,
+            "concurrency2": concurrency2,
         }
         with open(CONFIG_FILE, "w", encoding="utf-8") as f:
             json.dump(config, f, indent=2, ensure_ascii=False)
@@ -174,6 +223,10 @@ def load_config():
                 cfg("max_tokens", 1000),
                 cfg("temperature", 0.3),
                 cfg("rpm", 60),
+                cfg("pipeline_tier", TIER_FULL),
+                cfg("rpm2", 60),
+                cfg("tpm2", 0),
+                cfg("concurrency2", 0),
                 choice_val,
                 gr.update(value="✅ 已自动加载历史配置", visible=True),
                 gr.update(visible=choice_val),
@@ -190,7 +243,7 @@ def load_config():
         "OpenAI", "gpt-4o", "", gr.update(value="", visible=False),
         "OpenAI", "gpt-4o", "", gr.update(value="", visible=False),
         "Chinese", "English", "United States",
-        1000, 0.3, 60, False,
+        1000, 0.3, 60, TIER_FULL, 60, 0, 0, False,
         gr.update(value="使用默认配置（未找到历史配置）", visible=True),
         gr.update(visible=False),
     )
@@ -547,6 +600,24 @@ with gr.Blocks(theme="soft", css=CSS, fill_height=True) as demo:
                     visible=False,
                     placeholder="例如: http://localhost:11434 或 http://api.example.com (会自动添加/v1后缀)"
                 )
+                # 额外端点有自己的限速和并发上限，与主端点互不占用额度
+                rpm2 = gr.Slider(
+                    label="额外端点每分钟请求数",
+                    minimum=1,
+                    maximum=1000,
+                    value=60,
+                    step=1,
+                )
+                tpm2 = gr.Number(
+                    label="额外端点每分钟Token数（0为不限制）",
+                    value=0,
+                    precision=0,
+                )
+                concurrency2 = gr.Number(
+                    label="额外端点并发上限（0为不限制）",
+                    value=0,
+                    precision=0,
+                )
             with gr.Row():
                 source_lang = gr.Textbox(
                     label="源语言",
@@ -584,6 +655,12 @@ with gr.Blocks(theme="soft", css=CSS, fill_height=True) as demo:
                     value=60,
                     step=1,
                 )
+                tier = gr.Dropdown(
+                    label="质量档位",
+                    choices=TIER_CHOICES,
+                    value=TIER_FULL,
+                    info="每个分块的LLM工作量：初稿只做初译，标准加一次修订",
+                )
             save_config_btn = gr.Button(value="💾 保存配置", variant="secondary", size="sm")
             config_status = gr.Textbox(
                 label="配置状态", 
@@ -614,6 +691,10 @@ with gr.Blocks(theme="soft", css=CSS, fill_height=True) as demo:
                 )
             with gr.Tab("差异对比"):
                 output_diff = gr.HighlightedText(visible=False)
+            with gr.Tab("用量统计"):
+                output_usage = gr.Textbox(
+                    label="Token用量与费用", lines=14
+                )
     with gr.Row():
         submit = gr.Button(value="翻译")
         upload = gr.UploadButton(label="上传文件", file_types=["text"])
@@ -639,8 +720,8 @@ with gr.Blocks(theme="soft", css=CSS, fill_height=True) as demo:
             endpoint, model, api_key, base,
             endpoint2, model2, api_key2, base2,
             source_lang, target_lang, country,
-            max_tokens, temperature, rpm, choice,
-            config_status, AddEndpoint
+            max_tokens, temperature, rpm, tier, rpm2, tpm2, concurrency2,
+            choice, config_status, AddEndpoint
         ]
     )
     
@@ -658,7 +739,8 @@ with gr.Blocks(theme="soft", css=CSS, fill_height=True) as demo:
             endpoint, model, api_key, base,
             endpoint2, model2, api_key2, base2,
             source_lang, target_lang, country,
-            max_tokens, temperature, rpm, choice
+            max_tokens, temperature, rpm, choice, tier,
+            rpm2, tpm2, concurrency2
         ],
         outputs=[config_status]
     )
@@ -682,8 +764,14 @@ with gr.Blocks(theme="soft", css=CSS, fill_height=True) as demo:
             max_tokens,
             temperature,
             rpm,
+            tier,
+            rpm2,
+            tpm2,
+            concurrency2,
+        ],
+        outputs=[
+            output_init, output_reflect, output_final, output_diff, output_usage
         ],
-        outputs=[output_init, output_reflect, output_final, output_diff],
     )
     upload.upload(fn=read_doc, inputs=upload, outputs=source_text)
     
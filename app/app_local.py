@@ -5,7 +5,6 @@ import threading
 import sys
 from glob import glob
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List, Dict, Tuple, Optional
 import time
 
@@ -21,8 +20,12 @@ from process import (
     extract_pdf,
     extract_text,
     model_load,
-    translator,
-    translator_sec,
+)
+from patch import model_load_stages
+from translation_agent import translate_many
+from translation_agent.usage import (
+    UsageTracker,
+    write_usage_report,
 )
 
 # 配置文件路径
@@ -51,6 +54,7 @@ class TranslationTask:
         self.error_message = ""
         self.start_time = None
         self.end_time = None
+        self.usage = UsageTracker(filename)
 
 
 def save_config(
@@ -218,58 +222,42 @@ def read_uploaded_files(files: List) -> List[Tuple[str, str]]:
     return file_contents
 
 
-def translate_single_file(
-    task: TranslationTask,
+def load_models(
     endpoint: str, base: str, model: str, api_key: str,
     choice: bool, endpoint2: str, base2: str, model2: str, api_key2: str,
-    source_lang: str, target_lang: str, country: str,
-    max_tokens: int, temperature: int, rpm: int
-) -> TranslationTask:
-    """翻译单个文件"""
-    try:
+    temperature: int, rpm: int,
+):
+    """加载模型；启用额外端点时，反思和改进阶段使用额外端点"""
+    model_load(endpoint, base, model, api_key, temperature, rpm)
+    if choice:
+        model_load_stages(("reflect", "improve", "revise", "edit"), endpoint2, base2, model2, api_key2)
+
+
+def on_task_progress(task_id: str, finished_jobs: int, total_jobs: int):
+    """调度器进度回调"""
+    task = translation_tasks.get(task_id)
+    if task is None:
+        return
+    if task.start_time is None:
         task.status = "翻译中"
         task.start_time = time.time()
-        task.progress = 10
-        
-        # 加载模型
-        model_load(endpoint, base, model, api_key, temperature, rpm)
-        task.progress = 20
-        
-        # 执行翻译
-        if choice:
-            init_translation, reflect_translation, final_translation = translator_sec(
-                endpoint2=endpoint2,
-                base2=base2,
-                model2=model2,
-                api_key2=api_key2,
-                source_lang=source_lang,
-                target_lang=target_lang,
-                source_text=task.content,
-                country=country,
-                max_tokens=max_tokens,
-            )
-        else:
-            init_translation, reflect_translation, final_translation = translator(
-                source_lang=source_lang,
-                target_lang=target_lang,
-                source_text=task.content,
-                country=country,
-                max_tokens=max_tokens,
-            )
-        
-        task.init_translation = init_translation
-        task.reflect_translation = reflect_translation
-        task.final_translation = final_translation
-        task.progress = 100
-        task.status = "已完成"
-        task.end_time = time.time()
-        
-    except Exception as e:
+    task.progress = 10 + int(finished_jobs / max(total_jobs, 1) * 90)
+
+
+def finish_task(task: TranslationTask, result) -> TranslationTask:
+    """将调度器返回的结果写入任务"""
+    task.end_time = time.time()
+    if result.error is not None:
         task.status = "失败"
-        task.error_message = str(e)
+        task.error_message = str(result.error)
         task.progress = 0
-        task.end_time = time.time()
+        return task
     
+    task.init_translation = result.init_translation
+    task.reflect_translation = result.reflection
+    task.final_translation = result.final_translation
+    task.progress = 100
+    task.status = "已完成"
     return task
 
 
@@ -319,30 +307,45 @@ def start_batch_translation(
         max_tokens, temperature, rpm, choice
     )
     
+    batch_usage = UsageTracker("batch")
+    
     # 启动后台翻译线程
     def run_translations():
-        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_TASKS) as executor:
-            future_to_task = {
-                executor.submit(
-                    translate_single_file,
-                    task,
-                    endpoint, base, model, api_key,
-                    choice, endpoint2, base2, model2, api_key2,
-                    source_lang, target_lang, country,
-                    max_tokens, temperature, rpm
-                ): task for task in tasks
-            }
-            
-            for future in as_completed(future_to_task):
-                task = future_to_task[future]
-                try:
-                    completed_task = future.result()
-                    # 保存翻译结果到文件
-                    if completed_task.status == "已完成":
-                        save_translation_to_file(completed_task, output_folder)
-                except Exception as e:
+        try:
+            load_models(
+                endpoint, base, model, api_key,
+                choice, endpoint2, base2, model2, api_key2,
+                temperature, rpm,
+            )
+            # 所有文件的分块共享一个调度队列，按剩余工作量优先
+            results = translate_many(
+                {task.task_id: task.content for task in tasks},
+                source_lang,
+                target_lang,
+                country,
+                max_tokens=max_tokens,
+                max_workers=MAX_CONCURRENT_TASKS,
+                trackers={task.task_id: [task.usage, batch_usage] for task in tasks},
+                on_progress=on_task_progress,
+            )
+            for result in results:
+                task = finish_task(translation_tasks[result.key], result)
+                # 保存翻译结果到文件
+                if task.status == "已完成":
+                    save_translation_to_file(task, output_folder)
+        except Exception as e:
+            for task in tasks:
+                if task.status in ("等待中", "翻译中"):
                     task.status = "失败"
                     task.error_message = str(e)
+        
+        # 写出token用量与费用报告
+        try:
+            write_usage_report(
+                [task.usage for task in tasks], output_folder, batch=batch_usage
+            )
+        except Exception as e:
+            print(f"保存用量报告时出错: {e}")
     
     # 在后台线程中运行翻译
     threading.Thread(target=run_translations, daemon=True).start()
@@ -482,7 +485,7 @@ def update_progress_display():
                 <div style="background: #e9ecef; height: 6px; border-radius: 3px; overflow: hidden;">
                     <div style="background: {status_color}; height: 100%; width: {task.progress}%; transition: width 0.3s;"></div>
                 </div>
-                <small style="color: #666;">进度: {task.progress}%</small>
+                <small style="color: #666;">进度: {task.progress}% · Token: {task.usage.total.prompt_tokens}/{task.usage.total.completion_tokens} · ${task.usage.cost():.4f}</small>
             </div>
             {f'<div style="color: #dc3545; font-size: 12px; margin-top: 4px;">错误: {task.error_message}</div>' if task.error_message else ''}
         </div>
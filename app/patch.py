@@ -1,13 +1,17 @@
 import os
 import time
+from collections import deque
+from contextlib import contextmanager
 from functools import wraps
-from threading import Lock
+from threading import BoundedSemaphore, Lock
 from typing import Optional, Union
 
+import httpx
 import openai
 import sys
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
 import translation_agent.utils as utils
+from translation_agent.usage import current_stage
 
 # Try to import gradio, if it fails use a placeholder
 try:
@@ -24,36 +28,129 @@ TEMPERATURE = 0.3
 # Hide js_mode in UI now, update in plan.
 JS_MODE = False
 ENDPOINT = ""
+client = None
+
+
+# 流水线的所有阶段，用于 stage_pools
+PIPELINE_STAGES = ("initial", "reflect", "improve", "revise", "edit", "rate")
+# 交给额外端点（强模型）的修订阶段
+REVISION_STAGES = ("reflect", "improve", "revise", "edit")
+
+
+class Route:
+    """一个端点+模型：独立的客户端（连接池）、RPM/TPM限速和并发上限。
+
+    rpm、tpm、max_concurrency 为0表示不限制。TPM按最近一分钟内已完成请求
+    实际用掉的token计算，用满后新请求等到最早的记录滑出窗口。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        client,
+        model: str,
+        rpm: int = 0,
+        tpm: int = 0,
+        max_concurrency: int = 0,
+    ):
+        self.name = name
+        self.client = client
+        self.model = model
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_concurrency = max_concurrency
+        self._lock = Lock()
+        self._next_slot = 0.0
+        self._tokens = deque()  # (完成时间, token数)
+        self._slots = (
+            BoundedSemaphore(max_concurrency) if max_concurrency > 0 else None
+        )
+
+    def _wait_for_tpm(self):
+        while True:
+            with self._lock:
+                now = time.time()
+                while self._tokens and self._tokens[0][0] <= now - 60:
+                    self._tokens.popleft()
+                used = sum(tokens for _, tokens in self._tokens)
+                if self.tpm <= 0 or used < self.tpm:
+                    return
+                left_to_wait = self._tokens[0][0] + 60 - now
+            time.sleep(left_to_wait)
+
+    def _wait_for_rpm(self):
+        if self.rpm <= 0:
+            return
+        # 只在锁内预约发送时间，请求本身在锁外执行，
+        # 这样并发的请求可以同时进行，而发送间隔仍不低于RPM限制
+        with self._lock:
+            start = max(time.time(), self._next_slot)
+            self._next_slot = start + 60.0 / self.rpm
+        left_to_wait = start - time.time()
+        if left_to_wait > 0:
+            time.sleep(left_to_wait)
+
+    @contextmanager
+    def slot(self):
+        """占用一个请求名额：依次等待并发上限、TPM和RPM"""
+        if self._slots is not None:
+            self._slots.acquire()
+        try:
+            self._wait_for_tpm()
+            self._wait_for_rpm()
+            yield
+        finally:
+            if self._slots is not None:
+                self._slots.release()
+
+    def record_response(self, response):
+        """把响应用掉的token计入TPM窗口"""
+        usage = getattr(response, "usage", None)
+        tokens = getattr(usage, "total_tokens", 0) or 0
+        if self.tpm > 0 and tokens:
+            with self._lock:
+                self._tokens.append((time.time(), tokens))
+
+
+# model_load加载的默认路由，未在STAGE_ROUTES中的阶段都使用它
+DEFAULT_ROUTE = None
+# Stage name -> Route serving that stage instead of the default
+STAGE_ROUTES = {}
+_default_route_lock = Lock()
+
+
+def _http_options(max_connections: int = 0) -> dict:
+    """每个客户端有自己的连接池；设置并发上限时连接池大小与之一致"""
+    if max_connections <= 0:
+        return {}
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_connections,
+    )
+    return {"http_client": openai.DefaultHttpxClient(limits=limits)}
 
 
 # Add your LLMs here
-def model_load(
+def create_client(
     endpoint: str,
     base_url: str,
-    model: str,
     api_key: Optional[str] = None,
-    temperature: float = TEMPERATURE,
-    rpm: int = RPM,
-    js_mode: bool = JS_MODE,
-):
-    global client, RPM, MODEL, TEMPERATURE, JS_MODE, ENDPOINT
-    ENDPOINT = endpoint
-    RPM = rpm
-    MODEL = model
-    TEMPERATURE = temperature
-    JS_MODE = js_mode
-
+    max_connections: int = 0,
+) -> openai.OpenAI:
+    options = _http_options(max_connections)
     if endpoint == "OpenAI":
-        client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        return openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"), **options)
     elif endpoint == "Groq":
-        client = openai.OpenAI(
+        return openai.OpenAI(
             api_key=api_key if api_key else os.getenv("GROQ_API_KEY"),
             base_url="https://api.groq.com/openai/v1",
+            **options,
         )
     elif endpoint == "TogetherAI":
-        client = openai.OpenAI(
+        return openai.OpenAI(
             api_key=api_key if api_key else os.getenv("TOGETHER_API_KEY"),
             base_url="https://api.together.xyz/v1",
+            **options,
         )
     elif endpoint == "CUSTOM":
         if not base_url:
@@ -67,17 +164,106 @@ def model_load(
                 base_url = base_url + "v1"
             else:
                 base_url = base_url + "/v1"
-        client = openai.OpenAI(api_key=api_key, base_url=base_url)
+        return openai.OpenAI(api_key=api_key, base_url=base_url, **options)
     elif endpoint == "Ollama":
-        client = openai.OpenAI(
-            api_key="ollama", base_url="http://localhost:11434/v1"
+        return openai.OpenAI(
+            api_key="ollama", base_url="http://localhost:11434/v1", **options
         )
     else:
-        client = openai.OpenAI(
-            api_key=api_key if api_key else os.getenv("OPENAI_API_KEY")
+        return openai.OpenAI(
+            api_key=api_key if api_key else os.getenv("OPENAI_API_KEY"),
+            **options,
         )
 
 
+def model_load(
+    endpoint: str,
+    base_url: str,
+    model: str,
+    api_key: Optional[str] = None,
+    temperature: float = TEMPERATURE,
+    rpm: int = RPM,
+    js_mode: bool = JS_MODE,
+    tpm: int = 0,
+    max_concurrency: int = 0,
+):
+    global client, RPM, MODEL, TEMPERATURE, JS_MODE, ENDPOINT, DEFAULT_ROUTE
+    ENDPOINT = endpoint
+    RPM = rpm
+    MODEL = model
+    TEMPERATURE = temperature
+    JS_MODE = js_mode
+
+    client = create_client(endpoint, base_url, api_key, max_concurrency)
+    DEFAULT_ROUTE = Route("main", client, model, rpm, tpm, max_concurrency)
+    STAGE_ROUTES.clear()
+
+
+def model_load_stages(
+    stages,
+    endpoint: str,
+    base_url: str,
+    model: str,
+    api_key: Optional[str] = None,
+    rpm: Optional[int] = None,
+    tpm: int = 0,
+    max_concurrency: int = 0,
+):
+    """让指定阶段（如 "reflect"、"improve"）使用另一个端点和模型。
+
+    与在翻译途中调用model_load切换全局客户端不同，按阶段路由在多个文档、
+    多个分块交错执行时也能保证每个请求发往正确的端点。这些阶段共用一个
+    Route：独立的连接池、RPM/TPM限速和并发上限，与主端点互不占用额度；
+    rpm为None时沿用主端点的RPM数值。调用model_load会清除路由。
+    """
+    route = Route(
+        "/".join(stages),
+        create_client(endpoint, base_url, api_key, max_concurrency),
+        model,
+        RPM if rpm is None else rpm,
+        tpm,
+        max_concurrency,
+    )
+    for stage in stages:
+        STAGE_ROUTES[stage] = route
+
+
+def stage_route() -> Route:
+    """当前线程所处阶段使用的路由
+
+    未调用model_load时，默认路由在第一次请求时创建一次并缓存，
+    所有请求共用同一个限速窗口和并发上限。
+    """
+    global DEFAULT_ROUTE
+    route = STAGE_ROUTES.get(current_stage())
+    if route is not None:
+        return route
+    if DEFAULT_ROUTE is None:
+        with _default_route_lock:
+            if DEFAULT_ROUTE is None:
+                DEFAULT_ROUTE = Route("main", client, MODEL, RPM)
+    return DEFAULT_ROUTE
+
+
+def require_stage_routes(stages=REVISION_STAGES):
+    """检查这些阶段已由model_load_stages路由到额外端点，否则报错"""
+    missing = [stage for stage in stages if stage not in STAGE_ROUTES]
+    if missing:
+        raise_error(
+            f"额外端点未配置（阶段: {', '.join(missing)}）：请先调用model_load_stages"
+        )
+
+
+def stage_pools(stages=PIPELINE_STAGES) -> dict:
+    """阶段 -> (路由名称, 并发上限)，传给 translate_many 按端点分配并发"""
+    pools = {}
+    for stage in stages:
+        route = STAGE_ROUTES.get(stage, DEFAULT_ROUTE)
+        if route is not None:
+            pools[stage] = (route.name, route.max_concurrency)
+    return pools
+
+
 def raise_error(error_text, original_exception=None):
     """Unified error handling function, compatible with gradio and non-gradio environments"""
     if GRADIO_AVAILABLE and gr is not None:
@@ -92,38 +278,28 @@ def raise_error(error_text, original_exception=None):
             raise Exception(error_text)
 
 
-def rate_limit(get_max_per_minute):
-    def decorator(func):
-        lock = Lock()
-        last_called = [0.0]
-
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            with lock:
-                max_per_minute = get_max_per_minute()
-                min_interval = 60.0 / max_per_minute
-                elapsed = time.time() - last_called[0]
-                left_to_wait = min_interval - elapsed
-
-                if left_to_wait > 0:
-                    time.sleep(left_to_wait)
-
-                ret = func(*args, **kwargs)
-                last_called[0] = time.time()
-                return ret
+def rate_limit(func):
+    """按当前阶段的路由限速：每个端点有自己的并发上限和RPM/TPM额度"""
 
-        return wrapper
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        # 试运行（预估）的请求不会发送到API，无需限速
+        if utils.overriding_client() is not None:
+            return func(*args, **kwargs)
+        with stage_route().slot():
+            return func(*args, **kwargs)
 
-    return decorator
+    return wrapper
 
 
-@rate_limit(lambda: RPM)
+@rate_limit
 def get_completion(
     prompt: str,
     system_message: str = "You are a helpful assistant.",
     model: str = "gpt-4-turbo",
     temperature: float = 0.3,
     json_mode: bool = False,
+    prediction: Optional[str] = None,
 ) -> Union[str, dict]:
     """
         Generate a completion using the OpenAI API with reasonable timeout control.
@@ -138,6 +314,8 @@ def get_completion(
             Defaults to 0.3.
         json_mode (bool, optional): Whether to return the response in JSON format.
             Defaults to False.
+        prediction (str, optional): Predicted output, sent only to endpoints that support it.
+            Defaults to None.
 
     Returns:
         Union[str, dict]: The generated completion.
@@ -145,9 +323,13 @@ def get_completion(
             If json_mode is False, returns the generated text as a string.
     """
 
-    model = MODEL
+    route = stage_route()
+    api_client, model = route.client, route.model
     temperature = TEMPERATURE
-    json_mode = JS_MODE
+    # 调用方显式要求JSON输出（如合并的反思改进调用）时总是启用
+    json_mode = json_mode or JS_MODE
+    # 改进阶段以初译作为预测输出，不支持的端点由chat_completion自动去掉
+    params = utils.prediction_params(prediction)
 
     # 设置合理的超时时间：根据提示长度调整，但不要过于严格
     prompt_length = len(prompt)
@@ -160,7 +342,8 @@ def get_completion(
 
     if json_mode:
         try:
-            response = client.chat.completions.create(
+            response = utils.chat_completion(
+                api_client,
                 model=model,
                 temperature=temperature,
                 top_p=1,
@@ -169,8 +352,10 @@ def get_completion(
                     {"role": "system", "content": system_message},
                     {"role": "user", "content": prompt},
                 ],
-                timeout=timeout_seconds  # 添加超时控制
+                timeout=timeout_seconds,  # 添加超时控制
+                **params,
             )
+            route.record_response(response)
             if not response.choices or len(response.choices) == 0:
                 raise_error("API返回空响应: 模型未返回任何内容")
             return response.choices[0].message.content
@@ -190,7 +375,8 @@ def get_completion(
                 raise_error(f"发生意外错误: {e}", e)
     else:
         try:
-            response = client.chat.completions.create(
+            response = utils.chat_completion(
+                api_client,
                 model=model,
                 temperature=temperature,
                 top_p=1,
@@ -198,8 +384,10 @@ def get_completion(
                     {"role": "system", "content": system_message},
                     {"role": "user", "content": prompt},
                 ],
-                timeout=timeout_seconds  # 添加超时控制
+                timeout=timeout_seconds,  # 添加超时控制
+                **params,
             )
+            route.record_response(response)
             if not response.choices or len(response.choices) == 0:
                 raise_error("API返回空响应: 模型未返回任何内容")
             return response.choices[0].message.content
@@ -224,10 +412,13 @@ utils.get_completion = get_completion
 one_chunk_initial_translation = utils.one_chunk_initial_translation
 one_chunk_reflect_on_translation = utils.one_chunk_reflect_on_translation
 one_chunk_improve_translation = utils.one_chunk_improve_translation
+one_chunk_reflect_and_improve = utils.one_chunk_reflect_and_improve
 one_chunk_translate_text = utils.one_chunk_translate_text
 num_tokens_in_string = utils.num_tokens_in_string
 multichunk_initial_translation = utils.multichunk_initial_translation
 multichunk_reflect_on_translation = utils.multichunk_reflect_on_translation
 multichunk_improve_translation = utils.multichunk_improve_translation
+multichunk_reflect_and_improve = utils.multichunk_reflect_and_improve
 multichunk_translation = utils.multichunk_translation
 calculate_chunk_size = utils.calculate_chunk_size
+split_source_text = utils.split_source_text
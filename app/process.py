@@ -1,28 +1,34 @@
 from difflib import Differ
+from typing import Optional
 
 import docx
 import pymupdf
 from icecream import ic
-# Delay import of langchain_text_splitters to avoid initialization issues
-RecursiveCharacterTextSplitter = None
-
-def get_text_splitter():
-    """Lazy load RecursiveCharacterTextSplitter"""
-    global RecursiveCharacterTextSplitter
-    if RecursiveCharacterTextSplitter is None:
-        from langchain_text_splitters import RecursiveCharacterTextSplitter as RCT
-        RecursiveCharacterTextSplitter = RCT
-    return RecursiveCharacterTextSplitter
 from patch import (
-    calculate_chunk_size,
     model_load,
     multichunk_improve_translation,
     multichunk_initial_translation,
+    multichunk_reflect_and_improve,
     multichunk_reflect_on_translation,
     num_tokens_in_string,
     one_chunk_improve_translation,
     one_chunk_initial_translation,
+    one_chunk_reflect_and_improve,
     one_chunk_reflect_on_translation,
+    require_stage_routes,
+    split_source_text,
+)
+from translation_agent.utils import (
+    CHECK_HEURISTIC,
+    REVISION_COMBINED,
+    TIER_FULL,
+    accept_draft,
+    chunk_improve_translation,
+    chunk_reflect_and_improve,
+    chunk_reflect_on_translation,
+    escalated_chunks,
+    record_revision_skipped,
+    tier_revision_mode,
 )
 try:
     from simplemma import simple_tokenizer
@@ -148,8 +154,14 @@ def translator(
     source_text: str,
     country: str,
     max_tokens: int = 1000,
+    tier: str = TIER_FULL,
 ):
-    """Translate the source_text from source_lang to target_lang."""
+    """Translate the source_text from source_lang to target_lang.
+
+    tier: "draft" 只做初始翻译；"standard" 初译后一次合并的反思改进调用；
+    "full" 反思与改进分两次调用。
+    """
+    revision_mode = tier_revision_mode(tier)
     num_tokens_in_text = num_tokens_in_string(source_text)
 
     ic(num_tokens_in_text)
@@ -162,6 +174,16 @@ def translator(
             source_lang, target_lang, source_text
         )
 
+        if revision_mode is None:
+            return init_translation, "", init_translation
+
+        if revision_mode == REVISION_COMBINED:
+            progress((2, 3), desc="反思并改进中...")
+            reflection, final_translation = one_chunk_reflect_and_improve(
+                source_lang, target_lang, source_text, init_translation, country
+            )
+            return init_translation, reflection, final_translation
+
         progress((2, 3), desc="反思评估中...")
         reflection = one_chunk_reflect_on_translation(
             source_lang, target_lang, source_text, init_translation, country
@@ -177,21 +199,10 @@ def translator(
     else:
         ic("Translating text as multiple chunks")
 
-        token_size = calculate_chunk_size(
-            token_count=num_tokens_in_text, token_limit=max_tokens
+        source_text_chunks = split_source_text(
+            source_text, max_tokens, num_tokens_in_text
         )
 
-        ic(token_size)
-
-        TextSplitter = get_text_splitter()
-        text_splitter = TextSplitter.from_tiktoken_encoder(
-            model_name="gpt-4",
-            chunk_size=token_size,
-            chunk_overlap=0,
-        )
-
-        source_text_chunks = text_splitter.split_text(source_text)
-
         progress((1, 3), desc="初始翻译中...")
         translation_1_chunks = multichunk_initial_translation(
             source_lang, target_lang, source_text_chunks
@@ -199,6 +210,24 @@ def translator(
 
         init_translation = "".join(translation_1_chunks)
 
+        if revision_mode is None:
+            return init_translation, "", init_translation
+
+        if revision_mode == REVISION_COMBINED:
+            progress((2, 3), desc="反思并改进中...")
+            reflection_chunks, translation_2_chunks = multichunk_reflect_and_improve(
+                source_lang,
+                target_lang,
+                source_text_chunks,
+                translation_1_chunks,
+                country,
+            )
+            return (
+                init_translation,
+                "".join(reflection_chunks),
+                "".join(translation_2_chunks),
+            )
+
         progress((2, 3), desc="反思评估中...")
         reflection_chunks = multichunk_reflect_on_translation(
             source_lang,
@@ -225,17 +254,31 @@ def translator(
 
 
 def translator_sec(
-    endpoint2: str,
-    base2: str,
-    model2: str,
-    api_key2: str,
     source_lang: str,
     target_lang: str,
     source_text: str,
     country: str,
     max_tokens: int = 1000,
+    tier: str = TIER_FULL,
+    quality_threshold: Optional[float] = None,
+    quality_check: str = CHECK_HEURISTIC,
 ):
-    """Translate the source_text from source_lang to target_lang."""
+    """Translate the source_text from source_lang to target_lang.
+
+    tier: "draft" 只做初始翻译；"standard" 初译后一次合并的反思改进调用；
+    "full" 反思与改进分两次调用。
+
+    级联：初译由主端点（快模型）完成。设置 quality_threshold 后，每个分块的
+    初译先经过检查（本地启发式，或 quality_check="self_rating" 时再由快模型
+    自评），通过的分块直接采用初译，只有未通过的分块交给额外端点（强模型）
+    反思和改进。升级比例与节省的延迟记录在绑定的 UsageTracker 中。
+
+    额外端点须事先用 model_load_stages 配置好（含独立的RPM/TPM和并发上限），
+    这里只检查路由存在，不会为每个文档重建客户端和限速器。
+    """
+    revision_mode = tier_revision_mode(tier)
+    if revision_mode is not None:
+        require_stage_routes()
     num_tokens_in_text = num_tokens_in_string(source_text)
 
     ic(num_tokens_in_text)
@@ -248,28 +291,26 @@ def translator_sec(
             source_lang, target_lang, source_text
         )
 
-        try:
-            model_load(endpoint2, base2, model2, api_key2)
-        except Exception as e:
-            error_msg = str(e)
-            if "404" in error_msg or "Not Found" in error_msg:
-                error_text = f"额外端点配置错误 (404): 请检查基础URL和模型名称是否正确。错误详情: {e}"
-                if GRADIO_AVAILABLE:
-                    raise gr.Error(error_text) from e
-                else:
-                    raise Exception(error_text) from e
-            elif "401" in error_msg or "Unauthorized" in error_msg:
-                error_text = f"额外端点API密钥无效 (401): 请检查API密钥是否正确。错误详情: {e}"
-                if GRADIO_AVAILABLE:
-                    raise gr.Error(error_text) from e
-                else:
-                    raise Exception(error_text) from e
-            else:
-                error_text = f"额外端点模型加载失败: {e}"
-                if GRADIO_AVAILABLE:
-                    raise gr.Error(error_text) from e
-                else:
-                    raise Exception(error_text) from e
+        if revision_mode is None:
+            return init_translation, "", init_translation
+
+        if accept_draft(
+            source_text,
+            init_translation,
+            source_lang,
+            target_lang,
+            quality_threshold,
+            quality_check,
+        ):
+            record_revision_skipped(revision_mode)
+            return init_translation, "", init_translation
+
+        if revision_mode == REVISION_COMBINED:
+            progress((2, 3), desc="反思并改进中...")
+            reflection, final_translation = one_chunk_reflect_and_improve(
+                source_lang, target_lang, source_text, init_translation, country
+            )
+            return init_translation, reflection, final_translation
 
         progress((2, 3), desc="反思评估中...")
         reflection = one_chunk_reflect_on_translation(
@@ -286,21 +327,10 @@ def translator_sec(
     else:
         ic("Translating text as multiple chunks")
 
-        token_size = calculate_chunk_size(
-            token_count=num_tokens_in_text, token_limit=max_tokens
-        )
-
-        ic(token_size)
-
-        TextSplitter = get_text_splitter()
-        text_splitter = TextSplitter.from_tiktoken_encoder(
-            model_name="gpt-4",
-            chunk_size=token_size,
-            chunk_overlap=0,
+        source_text_chunks = split_source_text(
+            source_text, max_tokens, num_tokens_in_text
         )
 
-        source_text_chunks = text_splitter.split_text(source_text)
-
         progress((1, 3), desc="初始翻译中...")
         translation_1_chunks = multichunk_initial_translation(
             source_lang, target_lang, source_text_chunks
@@ -308,48 +338,64 @@ def translator_sec(
 
         init_translation = "".join(translation_1_chunks)
 
-        try:
-            model_load(endpoint2, base2, model2, api_key2)
-        except Exception as e:
-            error_msg = str(e)
-            if "404" in error_msg or "Not Found" in error_msg:
-                error_text = f"额外端点配置错误 (404): 请检查基础URL和模型名称是否正确。错误详情: {e}"
-                if GRADIO_AVAILABLE:
-                    raise gr.Error(error_text) from e
-                else:
-                    raise Exception(error_text) from e
-            elif "401" in error_msg or "Unauthorized" in error_msg:
-                error_text = f"额外端点API密钥无效 (401): 请检查API密钥是否正确。错误详情: {e}"
-                if GRADIO_AVAILABLE:
-                    raise gr.Error(error_text) from e
-                else:
-                    raise Exception(error_text) from e
-            else:
-                error_text = f"额外端点模型加载失败: {e}"
-                if GRADIO_AVAILABLE:
-                    raise gr.Error(error_text) from e
-                else:
-                    raise Exception(error_text) from e
+        if revision_mode is None:
+            return init_translation, "", init_translation
 
-        progress((2, 3), desc="反思评估中...")
-        reflection_chunks = multichunk_reflect_on_translation(
+        escalated = escalated_chunks(
             source_lang,
             target_lang,
             source_text_chunks,
             translation_1_chunks,
-            country,
+            revision_mode,
+            quality_threshold,
+            quality_check,
         )
+        if not escalated:
+            return init_translation, "", init_translation
+
+        reflection_chunks = [""] * len(source_text_chunks)
+        translation_2_chunks = list(translation_1_chunks)
+
+        if revision_mode == REVISION_COMBINED:
+            progress((2, 3), desc="反思并改进中...")
+            for i in escalated:
+                reflection_chunks[i], translation_2_chunks[i] = chunk_reflect_and_improve(
+                    source_lang,
+                    target_lang,
+                    source_text_chunks,
+                    i,
+                    translation_1_chunks[i],
+                    country,
+                )
+            return (
+                init_translation,
+                "".join(reflection_chunks),
+                "".join(translation_2_chunks),
+            )
+
+        progress((2, 3), desc="反思评估中...")
+        for i in escalated:
+            reflection_chunks[i] = chunk_reflect_on_translation(
+                source_lang,
+                target_lang,
+                source_text_chunks,
+                i,
+                translation_1_chunks[i],
+                country,
+            )
 
         reflection = "".join(reflection_chunks)
 
         progress((3, 3), desc="改进翻译中...")
-        translation_2_chunks = multichunk_improve_translation(
-            source_lang,
-            target_lang,
-            source_text_chunks,
-            translation_1_chunks,
-            reflection_chunks,
-        )
+        for i in escalated:
+            translation_2_chunks[i] = chunk_improve_translation(
+                source_lang,
+                target_lang,
+                source_text_chunks,
+                i,
+                translation_1_chunks[i],
+                reflection_chunks[i],
+            )
 
         final_translation = "".join(translation_2_chunks)
 
@@ -1 +1,3 @@
+from .packing import translate_packed
+from .scheduler import translate_many
 from .utils import translate
@@ -0,0 +1,195 @@
+import argparse
+import time
+from typing import Dict, List, Optional, Sequence
+
+from . import utils
+from .usage import UsageTracker, track_usage
+
+
+def _revise(
+    revision_mode: str,
+    source_lang: str,
+    target_lang: str,
+    chunks: List[str],
+    translation_1_chunks: List[str],
+    country: str,
+) -> List[str]:
+    """Run the revision stages of one mode, the way translate() does."""
+    if len(chunks) == 1:
+        source_text, translation_1 = chunks[0], translation_1_chunks[0]
+        if revision_mode == utils.REVISION_COMBINED:
+            _, translation_2 = utils.one_chunk_reflect_and_improve(
+                source_lang, target_lang, source_text, translation_1, country
+            )
+        elif revision_mode == utils.REVISION_EDITS:
+            _, translation_2 = utils.one_chunk_edit_translation(
+                source_lang, target_lang, source_text, translation_1, country
+            )
+        else:
+            reflection = utils.one_chunk_reflect_on_translation(
+                source_lang, target_lang, source_text, translation_1, country
+            )
+            translation_2 = utils.one_chunk_improve_translation(
+                source_lang, target_lang, source_text, translation_1, reflection
+            )
+        return [translation_2]
+
+    if revision_mode == utils.REVISION_COMBINED:
+        _, translation_2_chunks = utils.multichunk_reflect_and_improve(
+            source_lang, target_lang, chunks, translation_1_chunks, country
+        )
+    elif revision_mode == utils.REVISION_EDITS:
+        _, translation_2_chunks = utils.multichunk_edit_translation(
+            source_lang, target_lang, chunks, translation_1_chunks, country
+        )
+    else:
+        reflection_chunks = utils.multichunk_reflect_on_translation(
+            source_lang, target_lang, chunks, translation_1_chunks, country
+        )
+        translation_2_chunks = utils.multichunk_improve_translation(
+            source_lang,
+            target_lang,
+            chunks,
+            translation_1_chunks,
+            reflection_chunks,
+        )
+    return translation_2_chunks
+
+
+def benchmark_revision_modes(
+    source_text: str,
+    source_lang: str,
+    target_lang: str,
+    revision_modes: Sequence[str] = (
+        utils.REVISION_SEPARATE,
+        utils.REVISION_EDITS,
+    ),
+    country: str = "",
+    max_tokens: int = utils.MAX_TOKENS_PER_CHUNK,
+) -> List[Dict]:
+    """
+    Measure the completion tokens and latency of each revision mode.
+
+    The initial translation is made once and every mode revises the same
+    translation, so the rows differ only by their revision stages. Calls go
+    to the configured client (or a client installed with utils.use_client).
+
+    Args:
+        source_text (str): The text to be translated.
+        source_lang (str): The source language of the text.
+        target_lang (str): The target language for translation.
+        revision_modes (Sequence[str]): The modes to compare; the first one
+            is the baseline.
+        country (str): Country specified for the target language.
+        max_tokens (int): The maximum number of tokens per chunk.
+
+    Returns:
+        List[dict]: One row per mode with its calls, skipped calls, prompt
+            and completion tokens, summed request latency, wall time and
+            completion tokens relative to the baseline.
+    """
+    num_tokens = utils.num_tokens_in_string(source_text)
+    if num_tokens < max_tokens:
+        chunks = [source_text]
+        translation_1_chunks = [
+            utils.one_chunk_initial_translation(
+                source_lang, target_lang, source_text
+            )
+        ]
+    else:
+        chunks = utils.split_source_text(source_text, max_tokens, num_tokens)
+        translation_1_chunks = utils.multichunk_initial_translation(
+            source_lang, target_lang, chunks
+        )
+
+    rows = []
+    for revision_mode in revision_modes:
+        tracker = UsageTracker(revision_mode)
+        start = time.perf_counter()
+        with track_usage(tracker):
+            _revise(
+                revision_mode,
+                source_lang,
+                target_lang,
+                chunks,
+                translation_1_chunks,
+                country,
+            )
+        total = tracker.total
+        rows.append(
+            {
+                "mode": revision_mode,
+                "calls": total.calls,
+                "skipped": total.skipped,
+                "prompt_tokens": total.prompt_tokens,
+                "completion_tokens": total.completion_tokens,
+                "latency": round(total.latency, 3),
+                "wall_time": round(time.perf_counter() - start, 3),
+            }
+        )
+
+    baseline = rows[0]["completion_tokens"] if rows else 0
+    for row in rows:
+        row["completion_ratio"] = (
+            row["completion_tokens"] / baseline if baseline else None
+        )
+    return rows
+
+
+def format_benchmark(rows: List[Dict]) -> str:
+    """Format benchmark rows as a text table."""
+    lines = [
+        f"{'mode':>10} {'calls':>6} {'skipped':>7} {'prompt':>10} "
+        f"{'completion':>10} {'vs base':>7} {'latency s':>9} {'wall s':>8}"
+    ]
+    for row in rows:
+        ratio = row["completion_ratio"]
+        ratio = f"{ratio:.0%}" if ratio is not None else "-"
+        lines.append(
+            f"{row['mode']:>10} {row['calls']:>6} {row['skipped']:>7} "
+            f"{row['prompt_tokens']:>10} {row['completion_tokens']:>10} "
+            f"{ratio:>7} {row['latency']:>9.2f} {row['wall_time']:>8.2f}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None):
+    modes = [
+        utils.REVISION_SEPARATE,
+        utils.REVISION_COMBINED,
+        utils.REVISION_EDITS,
+    ]
+    parser = argparse.ArgumentParser(
+        description="Compare the token use and latency of revision modes."
+    )
+    parser.add_argument("path", help="document to translate")
+    parser.add_argument("--source-lang", default="Chinese")
+    parser.add_argument("--target-lang", default="English")
+    parser.add_argument("--country", default="")
+    parser.add_argument(
+        "--max-tokens", type=int, default=utils.MAX_TOKENS_PER_CHUNK
+    )
+    parser.add_argument(
+        "--modes",
+        nargs="+",
+        choices=modes,
+        default=[utils.REVISION_SEPARATE, utils.REVISION_EDITS],
+    )
+    args = parser.parse_args(argv)
+
+    with open(args.path, encoding="utf-8") as f:
+        source_text = f.read()
+
+    rows = benchmark_revision_modes(
+        source_text,
+        args.source_lang,
+        args.target_lang,
+        args.modes,
+        country=args.country,
+        max_tokens=args.max_tokens,
+    )
+    print(format_benchmark(rows))
+
+
+if __name__ == "__main__":
+    main()
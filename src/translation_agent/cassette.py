@@ -0,0 +1,223 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from types import SimpleNamespace
+from typing import Dict, Optional
+
+from .usage import current_stage
+
+
+MODE_OFF = "off"
+MODE_RECORD = "record"
+MODE_REPLAY = "replay"
+
+# Request parameters that do not change the completion and are left out of
+# the cassette key.
+_VOLATILE_PARAMS = ("timeout",)
+
+
+class CassetteMiss(KeyError):
+    """Raised in replay mode when a request was never recorded."""
+
+
+def request_key(params: Dict) -> str:
+    """Return a stable key for the parameters of a completion request."""
+    stable = {k: v for k, v in params.items() if k not in _VOLATILE_PARAMS}
+    payload = json.dumps(stable, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _dump_response(response) -> Dict:
+    if hasattr(response, "model_dump"):
+        return response.model_dump()
+    if isinstance(response, SimpleNamespace):
+        return {k: _dump_value(v) for k, v in vars(response).items()}
+    return dict(response)
+
+
+def _dump_value(value):
+    if isinstance(value, SimpleNamespace):
+        return _dump_response(value)
+    if isinstance(value, list):
+        return [_dump_value(v) for v in value]
+    return value
+
+
+def _load_response(data):
+    """Rebuild an attribute-accessible response from its recorded dict."""
+    if isinstance(data, dict):
+        return SimpleNamespace(
+            **{k: _load_response(v) for k, v in data.items()}
+        )
+    if isinstance(data, list):
+        return [_load_response(v) for v in data]
+    return data
+
+
+class Cassette:
+    """
+    Record completion requests and responses to a JSONL file and replay them.
+
+    In record mode every request is forwarded to the real client and the
+    response is appended to the cassette together with its latency. In
+    replay mode responses are served from the cassette, sleeping for the
+    recorded latency multiplied by ``latency_scale``, so whole batches can be
+    rerun offline to profile local overhead. Identical requests are replayed
+    in recording order; once exhausted the last response is reused.
+
+    Args:
+        path (str): The cassette file.
+        mode (str): "record" or "replay".
+        latency_scale (float): Multiplier for replayed latency, 0 disables it.
+    """
+
+    def __init__(
+        self, path: str, mode: str = MODE_REPLAY, latency_scale: float = 1.0
+    ):
+        if mode not in (MODE_RECORD, MODE_REPLAY):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self._lock = threading.Lock()
+        self._entries: Dict[str, deque] = {}
+        self._last: Dict[str, Dict] = {}
+        self.recorded = 0
+        self.calls: Counter = Counter()
+        self.misses = 0
+
+        if mode == MODE_REPLAY:
+            self._load()
+        else:
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+            open(path, "w", encoding="utf-8").close()
+
+    def _load(self):
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                self._entries.setdefault(entry["key"], deque()).append(entry)
+                self.recorded += 1
+
+    def create(self, api_client, **params):
+        """Serve one ``chat.completions.create`` call."""
+        key = request_key(params)
+        stage = current_stage()
+        if self.mode == MODE_RECORD:
+            return self._record(api_client, key, stage, params)
+        return self._replay(key, stage)
+
+    def _record(self, api_client, key, stage, params):
+        start = time.perf_counter()
+        response = api_client.chat.completions.create(**params)
+        latency = time.perf_counter() - start
+        entry = {
+            "key": key,
+            "stage": stage,
+            "latency": latency,
+            "request": {
+                k: v for k, v in params.items() if k not in _VOLATILE_PARAMS
+            },
+            "response": _dump_response(response),
+        }
+        line = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+            self.recorded += 1
+            self.calls[stage] += 1
+        return response
+
+    def _replay(self, key, stage):
+        with self._lock:
+            queue = self._entries.get(key)
+            if queue:
+                entry = queue.popleft()
+                self._last[key] = entry
+            elif key in self._last:
+                entry = self._last[key]
+            else:
+                self.misses += 1
+                raise CassetteMiss(
+                    f"Request not found in cassette {self.path} "
+                    f"(stage: {stage})"
+                )
+            self.calls[stage] += 1
+
+        if self.latency_scale > 0:
+            time.sleep(entry.get("latency", 0.0) * self.latency_scale)
+        return _load_response(entry["response"])
+
+    def summary(self) -> Dict:
+        """Return call counts for diffing runs against the recording."""
+        with self._lock:
+            unused = sum(len(q) for q in self._entries.values())
+            return {
+                "mode": self.mode,
+                "path": self.path,
+                "recorded": self.recorded,
+                "calls": sum(self.calls.values()),
+                "calls_per_stage": dict(self.calls),
+                "unused": unused if self.mode == MODE_REPLAY else 0,
+                "misses": self.misses,
+            }
+
+
+_active: Optional[Cassette] = None
+
+
+def active_cassette() -> Optional[Cassette]:
+    """Return the cassette installed with ``use_cassette``, if any."""
+    return _active
+
+
+@contextmanager
+def use_cassette(
+    path: str, mode: str = MODE_REPLAY, latency_scale: float = 1.0
+):
+    """
+    Route every completion made inside the block through a cassette.
+
+    The cassette is installed process-wide so that worker threads started
+    inside the block are recorded or replayed as well.
+
+    Example:
+        >>> with use_cassette("novel.jsonl", mode="record"):
+        ...     translate("Chinese", "English", text, "United States")
+        >>> with use_cassette("novel.jsonl", latency_scale=0) as cassette:
+        ...     translate("Chinese", "English", text, "United States")
+        >>> cassette.summary()["calls"]
+    """
+    global _active
+    previous = _active
+    _active = Cassette(path, mode, latency_scale)
+    try:
+        yield _active
+    finally:
+        _active = previous
+
+
+@contextmanager
+def cassette_from_config(config: Optional[Dict]):
+    """
+    Install a cassette described by a config dict, or do nothing.
+
+    The dict has the keys "mode" ("off", "record" or "replay"), "path" and
+    "latency_scale", as stored under "cassette" in translation_config.json.
+    """
+    config = config or {}
+    mode = config.get("mode", MODE_OFF)
+    if mode == MODE_OFF or not config.get("path"):
+        yield None
+        return
+    with use_cassette(
+        config["path"], mode, float(config.get("latency_scale", 1.0))
+    ) as cassette:
+        yield cassette
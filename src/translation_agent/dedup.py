@@ -0,0 +1,115 @@
+import hashlib
+from collections import Counter
+from typing import Dict, Hashable, List, Sequence, Tuple
+
+from .memory import normalize_segment
+
+
+# Paragraphs looked at from each end of a document. Boilerplate is short;
+# longer repeated runs are more likely copied text that needs its context.
+MAX_EDGE_PARAGRAPHS = 5
+
+
+def document_key(text: str) -> str:
+    """
+    Return the hash two copies of a document share.
+
+    Only byte-identical texts are copies: a copy is given its original's
+    output verbatim, so any difference in whitespace, line endings or
+    Unicode form would show up in the output.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _edge_paragraphs(text: str, repeated) -> List[str]:
+    """Return the leading and trailing paragraphs of a text in repeated."""
+    paragraphs = [normalize_segment(line) for line in text.split("\n")]
+    paragraphs = [p for p in paragraphs if p]
+    head = 0
+    while (
+        head < min(len(paragraphs), MAX_EDGE_PARAGRAPHS)
+        and paragraphs[head] in repeated
+    ):
+        head += 1
+    tail = len(paragraphs)
+    while (
+        tail > max(head, len(paragraphs) - MAX_EDGE_PARAGRAPHS)
+        and paragraphs[tail - 1] in repeated
+    ):
+        tail -= 1
+    return paragraphs[:head] + paragraphs[tail:]
+
+
+class BatchDuplicates:
+    """
+    The duplicate documents and boilerplate paragraphs of a batch.
+
+    Attributes:
+        copies (Dict): Maps the key of a document kept in the batch to the
+            (key, text) of its copies, which are left out.
+        units (List[str]): Paragraphs repeated at the start or end of at
+            least two documents (author notes, separators, ads), once each.
+        paragraphs (int): Occurrences of the units beyond the first.
+    """
+
+    def __init__(self):
+        self.copies: Dict[Hashable, List[Tuple[Hashable, str]]] = {}
+        self.units: List[str] = []
+        self.paragraphs = 0
+
+    @property
+    def documents(self) -> int:
+        """The number of documents left out as copies."""
+        return sum(len(copies) for copies in self.copies.values())
+
+
+def find_duplicates(
+    items: Sequence[Tuple[Hashable, str]], min_count: int = 2
+) -> BatchDuplicates:
+    """
+    Hash the documents and paragraphs of a batch to find what repeats.
+
+    Documents are copies only if they are byte-identical; the first of
+    each group is kept. Paragraphs are compared in their translation
+    memory form (see memory.normalize_segment). Only repeated paragraphs at
+    the start or end of a document count, since only those can be served
+    without splitting the text around them (see
+    memory.TranslationMemory.match). They are translated once, without the
+    text around them, so unlike copies they can come out differently from
+    a translation in context.
+
+    Args:
+        items (Sequence[Tuple[Hashable, str]]): (key, text) per document.
+        min_count (int): Occurrences that make a paragraph boilerplate.
+
+    Returns:
+        BatchDuplicates: The copies and the paragraphs to translate once.
+    """
+    duplicates = BatchDuplicates()
+    kept: Dict[str, Hashable] = {}
+    texts = []
+    for key, text in items:
+        digest = document_key(text)
+        if digest in kept:
+            duplicates.copies.setdefault(kept[digest], []).append((key, text))
+            continue
+        kept[digest] = key
+        texts.append(text)
+
+    counts = Counter(
+        paragraph
+        for text in texts
+        for paragraph in map(normalize_segment, text.split("\n"))
+        if paragraph
+    )
+    repeated = {p for p, count in counts.items() if count >= min_count}
+    edge_counts = Counter(
+        paragraph
+        for text in texts
+        for paragraph in _edge_paragraphs(text, repeated)
+    )
+    for paragraph, count in edge_counts.items():
+        if count >= min_count:
+            duplicates.units.append(paragraph)
+            duplicates.paragraphs += count - 1
+    return duplicates
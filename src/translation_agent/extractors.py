@@ -0,0 +1,459 @@
+import ast
+import io
+import json
+import os
+import re
+import tokenize
+from functools import partial
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from .masking import _FENCE, _looks_like_code
+
+
+# Comments that are read by tools, not people.
+_PY_DIRECTIVE = re.compile(
+    r"^#!|coding[:=]|^#\s*(?:type:|noqa|pragma|pylint:|fmt:|isort:|mypy:)"
+)
+_CPP_DIRECTIVE = re.compile(r"NOLINT|clang-format|IWYU|cppcheck-suppress")
+_PY_PREFIX = re.compile(r"#+[ \t]*")
+_CPP_PREFIX = re.compile(r"//+!?[ \t]*")
+_CPP_TOKEN = re.compile(
+    r'(?P<raw>R"(?P<delim>[^()\\\s]{0,16})\((?s:.*?)\)(?P=delim)")'
+    r"|(?P<string>\"(?:[^\"\\\n]|\\.)*\"|'(?:[^'\\\n]|\\.)*')"
+    r"|(?P<line>//[^\n]*)"
+    r"|(?P<block>/\*(?s:.*?)\*/)"
+)
+_DECORATION = re.compile(r"[ \t]*(?:\*+(?!/)[ \t]?)?")
+_DOCSTRING = re.compile(r"^([A-Za-z]*)('''|\"\"\"|'|\")(.*)\2$", re.DOTALL)
+_JSON_STRING = re.compile(r'"(?:[^"\\]|\\.)*"')
+# Strings without spaces made of words joined by separators: identifiers,
+# keys, paths, URLs, e-mail addresses, MIME types.
+_IDENTIFIER = re.compile(r"[\w.\-/:#@+%?=&~]*[_./:#@=&][\w.\-/:#@+%?=&~]*")
+_LINK_DEFINITION = re.compile(r"^ {0,3}\[[^\]]+\]:\s*\S+")
+
+_Slot = Tuple[int, Callable[[str], str]]
+
+
+def _has_letters(text: str) -> bool:
+    return any(char.isalpha() for char in text)
+
+
+class Extraction:
+    """
+    The translatable segments of a structured file and the text around them.
+
+    Joining the parts gives the file back: a string part is copied as it
+    is, an (index, encode) part is replaced with encode(translation of
+    segment index), which puts the comment markers, indentation, quotes or
+    escapes of the original back around the translation. Identical segments
+    are translated once.
+
+    Example:
+        >>> extraction = extract_segments(source_code, ".py")
+        >>> segments = extraction.segments
+        >>> translations = [translate(sl, tl, s, "") for s in segments]
+        >>> translated_code = extraction.rebuild(translations)
+    """
+
+    def __init__(self, parts: List[Union[str, _Slot]], segments: List[str]):
+        self.parts = parts
+        self.segments = segments
+
+    @property
+    def kept(self) -> int:
+        """The number of parts copied as they are, besides whitespace."""
+        return sum(
+            1 for part in self.parts if isinstance(part, str) and part.strip()
+        )
+
+    def rebuild(self, translations: Sequence[str]) -> str:
+        """
+        Put the translations of the segments back into the file.
+
+        Args:
+            translations (Sequence[str]): One translation per segment.
+        """
+        return "".join(
+            part if isinstance(part, str) else part[1](translations[part[0]])
+            for part in self.parts
+        )
+
+
+class _Builder:
+    """Cut a text into the parts of an Extraction, front to back."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.position = 0
+        self.parts: List[Union[str, _Slot]] = []
+        self.index: Dict[str, int] = {}
+
+    def slot(
+        self, start: int, end: int, segment: str, encode: Callable[[str], str]
+    ):
+        if start > self.position:
+            self.parts.append(self.text[self.position : start])
+        index = self.index.setdefault(segment, len(self.index))
+        self.parts.append((index, encode))
+        self.position = end
+
+    def build(self) -> Extraction:
+        if self.position < len(self.text):
+            self.parts.append(self.text[self.position :])
+        return Extraction(self.parts, list(self.index))
+
+
+def _lines(translation: str) -> List[str]:
+    return [line.rstrip() for line in translation.strip().split("\n")]
+
+
+def _encode_lines(translation: str, first: str, rest: Optional[str]) -> str:
+    """Write a translation as comment lines; one line if rest is None."""
+    lines = _lines(translation)
+    if rest is None:
+        return first + " ".join(line.strip() for line in lines if line)
+    tail = "".join(
+        "\n" + (rest + line if line else rest.rstrip()) for line in lines[1:]
+    )
+    return first + lines[0] + tail
+
+
+def _encode_block_comment(translation: str, rest: Optional[str]) -> str:
+    """Write a translation as /* */ comment lines that cannot close it."""
+    return _encode_lines(translation, "", rest).replace("*/", "* /")
+
+
+def _line_comments(
+    builder: _Builder,
+    comments: List[Tuple[int, int, bool]],
+    prefix: re.Pattern,
+    directive: re.Pattern,
+):
+    """
+    Add the line comments of a file, found at (start, end, alone) offsets.
+
+    Runs of comments alone on consecutive lines at the same column become
+    one segment, so a sentence wrapped over several lines is translated as
+    one. Directives, commented-out code and comments without letters are
+    copied as they are, and end a run.
+    """
+    text = builder.text
+    run: List[Tuple[int, int, str]] = []
+
+    def close_run():
+        if not run:
+            return
+        start, _, marker = run[0]
+        line_start = text.rfind("\n", 0, start) + 1
+        rest = None
+        if len(run) > 1 or text[line_start:start].strip() == "":
+            rest = text[line_start:start] + marker
+        builder.slot(
+            start + len(marker),
+            run[-1][1],
+            "\n".join(text[s + len(m) : e] for s, e, m in run),
+            partial(_encode_lines, first="", rest=rest),
+        )
+        run.clear()
+
+    for start, end, alone in comments:
+        comment = text[start:end]
+        marker = prefix.match(comment).group(0)
+        body = comment[len(marker) :].rstrip()
+        if (
+            directive.search(comment)
+            or not _has_letters(body)
+            or _looks_like_code(body)
+        ):
+            close_run()
+            continue
+        end = start + len(marker) + len(body)
+        if run:
+            previous_start, previous_end, previous_marker = run[-1]
+            column = start - text.rfind("\n", 0, start)
+            previous_column = previous_start - text.rfind(
+                "\n", 0, previous_start
+            )
+            joined = (
+                alone
+                and marker == previous_marker
+                and column == previous_column
+                and text.count("\n", previous_end, start) == 1
+            )
+            if not joined:
+                close_run()
+        run.append((start, end, marker))
+        if not alone:
+            close_run()
+    close_run()
+
+
+def _encode_docstring(
+    translation: str, quote: str, indent: str, blank: str, raw: bool
+) -> str:
+    lines = _lines(translation)
+    if len(quote) == 1:
+        text = " ".join(line.strip() for line in lines if line)
+    else:
+        text = lines[0] + "".join(
+            "\n" + (indent + line if line else blank) for line in lines[1:]
+        )
+    if not raw:
+        text = text.replace("\\", "\\\\")
+    return text.replace(quote, "".join("\\" + char for char in quote))
+
+
+def _docstring(builder: _Builder, start: int, end: int):
+    """Add the text of a docstring, leaving its quotes and layout."""
+    literal = builder.text[start:end]
+    match = _DOCSTRING.match(literal)
+    if match is None or "b" in match.group(1).lower():
+        return
+    inner = match.group(3)
+    if not _has_letters(inner) or "\\" in inner:
+        return
+    lines = inner.strip().split("\n")
+    indents = [
+        len(line) - len(line.lstrip()) for line in lines[1:] if line.strip()
+    ]
+    width = min(indents) if indents else 0
+    segment = "\n".join(
+        [lines[0].strip()] + [line[width:].rstrip() for line in lines[1:]]
+    )
+    inner_start = start + match.start(3)
+    body_start = inner_start + len(inner) - len(inner.lstrip())
+    body_end = inner_start + len(inner.rstrip())
+    line_start = builder.text.rfind("\n", 0, start) + 1
+    indent = builder.text[line_start:start]
+    # Blank lines keep the whitespace the author's editor left.
+    blank = next((line for line in lines if line and not line.strip()), "")
+    if indents:
+        indent = next(line for line in lines[1:] if line.strip())[:width]
+    builder.slot(
+        body_start,
+        body_end,
+        segment,
+        partial(
+            _encode_docstring,
+            quote=match.group(2),
+            indent=indent,
+            blank=blank,
+            raw="r" in match.group(1).lower(),
+        ),
+    )
+
+
+def extract_python(source: str) -> Optional[Extraction]:
+    """
+    Extract the comments and docstrings of Python source code.
+
+    Returns:
+        Optional[Extraction]: The extraction, None if the code does not
+            parse.
+    """
+    try:
+        tree = ast.parse(source)
+        tokens = list(tokenize.generate_tokens(io.StringIO(source).readline))
+    except (SyntaxError, tokenize.TokenError, ValueError):
+        return None
+    docstrings = set()
+    for node in ast.walk(tree):
+        if not isinstance(
+            node,
+            (ast.Module, ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef),
+        ):
+            continue
+        if node.body and isinstance(node.body[0], ast.Expr):
+            value = node.body[0].value
+            if isinstance(value, ast.Constant) and isinstance(
+                value.value, str
+            ):
+                docstrings.add((value.lineno, value.col_offset))
+
+    offsets = [0]
+    for line in source.split("\n"):
+        offsets.append(offsets[-1] + len(line) + 1)
+
+    builder = _Builder(source)
+    comments: List[Tuple[int, int, bool]] = []
+    for token in tokens:
+        (row, col), (end_row, end_col) = token.start, token.end
+        start, end = offsets[row - 1] + col, offsets[end_row - 1] + end_col
+        if token.type == tokenize.COMMENT:
+            alone = token.line[:col].strip() == ""
+            comments.append((start, end, alone))
+        elif token.type == tokenize.STRING and (row, col) in docstrings:
+            _line_comments(builder, comments, _PY_PREFIX, _PY_DIRECTIVE)
+            comments = []
+            _docstring(builder, start, end)
+    _line_comments(builder, comments, _PY_PREFIX, _PY_DIRECTIVE)
+    return builder.build()
+
+
+def _block_comment(builder: _Builder, start: int, end: int):
+    """Add the text of a /* */ comment, leaving its decoration."""
+    comment = builder.text[start:end]
+    opener = re.match(r"/\*[*!]?", comment).group(0)
+    inner = comment[len(opener) : -2]
+    lines = inner.split("\n")
+    offsets, leaders, bodies = [], [], []
+    offset = start + len(opener)
+    for i, line in enumerate(lines):
+        decoration = _DECORATION.match(line).group(0) if i else ""
+        rest = line[len(decoration) :]
+        body = rest.strip()
+        leader = line[: len(decoration) + len(rest) - len(rest.lstrip())]
+        offsets.append(offset + len(leader))
+        leaders.append(leader)
+        bodies.append(body)
+        offset += len(line) + 1
+    content = [i for i, body in enumerate(bodies) if body]
+    if not content or not _has_letters(inner) or _CPP_DIRECTIVE.search(inner):
+        return
+    first, last = content[0], content[-1]
+    rest = next((leaders[i] for i in content if i > 0), None)
+    builder.slot(
+        offsets[first],
+        offsets[last] + len(bodies[last]),
+        "\n".join(bodies[first : last + 1]),
+        partial(_encode_block_comment, rest=rest),
+    )
+
+
+def extract_cpp(source: str) -> Extraction:
+    """Extract the comments of C or C++ source code."""
+    builder = _Builder(source)
+    comments: List[Tuple[int, int, bool]] = []
+    for match in _CPP_TOKEN.finditer(source):
+        kind = match.lastgroup
+        start, end = match.span()
+        if kind == "line":
+            line_start = source.rfind("\n", 0, start) + 1
+            alone = source[line_start:start].strip() == ""
+            comments.append((start, end, alone))
+        elif kind == "block":
+            _line_comments(builder, comments, _CPP_PREFIX, _CPP_DIRECTIVE)
+            comments = []
+            _block_comment(builder, start, end)
+    _line_comments(builder, comments, _CPP_PREFIX, _CPP_DIRECTIVE)
+    return builder.build()
+
+
+def _encode_json(
+    translation: str, lead: str, trail: str, ascii: bool
+) -> str:
+    text = lead + translation.strip() + trail
+    return json.dumps(text, ensure_ascii=ascii)
+
+
+def extract_json(source: str) -> Optional[Extraction]:
+    """
+    Extract the string values of a JSON document.
+
+    Keys, and values that look like identifiers, paths or URLs, are kept.
+
+    Returns:
+        Optional[Extraction]: The extraction, None if it is not valid JSON.
+    """
+    try:
+        json.loads(source)
+    except ValueError:
+        return None
+    builder = _Builder(source)
+    for match in _JSON_STRING.finditer(source):
+        start, end = match.span()
+        if re.match(r"\s*:", source[end : end + 64]):
+            continue
+        value = json.loads(match.group(0))
+        if not _has_letters(value) or _IDENTIFIER.fullmatch(value):
+            continue
+        segment = value.strip()
+        builder.slot(
+            start,
+            end,
+            segment,
+            partial(
+                _encode_json,
+                lead=value[: len(value) - len(value.lstrip())],
+                trail=value[len(value.rstrip()) :],
+                ascii="\\u" in match.group(0),
+            ),
+        )
+    return builder.build()
+
+
+def _encode_markdown(translation: str) -> str:
+    return translation.strip("\n")
+
+
+def extract_markdown(source: str) -> Extraction:
+    """
+    Extract the prose of a Markdown document.
+
+    Fenced code blocks and link reference definitions are kept; link
+    targets inside the prose are left to placeholder masking (see
+    masking.mask_untranslatable).
+    """
+    builder = _Builder(source)
+    lines = source.split("\n")
+    offset = 0
+    fenced = False
+    run: List[Tuple[int, str]] = []
+
+    def close_run():
+        while run and not run[-1][1].strip():
+            run.pop()
+        if run and any(_has_letters(line) for _, line in run):
+            start = run[0][0]
+            end = run[-1][0] + len(run[-1][1])
+            builder.slot(
+                start,
+                end,
+                source[start:end],
+                _encode_markdown,
+            )
+        run.clear()
+
+    for line in lines:
+        if _FENCE.match(line):
+            close_run()
+            fenced = not fenced
+        elif fenced or _LINK_DEFINITION.match(line):
+            close_run()
+        elif run or line.strip():
+            run.append((offset, line))
+        offset += len(line) + 1
+    close_run()
+    return builder.build()
+
+
+EXTRACTORS = {
+    ".py": extract_python,
+    ".c": extract_cpp,
+    ".cc": extract_cpp,
+    ".cpp": extract_cpp,
+    ".cxx": extract_cpp,
+    ".h": extract_cpp,
+    ".hpp": extract_cpp,
+    ".json": extract_json,
+    ".md": extract_markdown,
+}
+
+
+def extract_segments(text: str, file_name: str) -> Optional[Extraction]:
+    """
+    Extract the translatable segments of a file by its type.
+
+    Args:
+        text (str): The content of the file.
+        file_name (str): The name or extension of the file.
+
+    Returns:
+        Optional[Extraction]: The extraction, None for other file types and
+            for files that do not parse, which are translated as text.
+    """
+    extension = os.path.splitext(file_name)[1] or file_name
+    extractor = EXTRACTORS.get(extension.lower())
+    if extractor is None:
+        return None
+    return extractor(text)
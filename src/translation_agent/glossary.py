@@ -0,0 +1,164 @@
+import json
+import os
+import threading
+from typing import Dict, Optional
+
+from . import utils
+from .usage import usage_stage
+
+
+GLOSSARY_STAGE = "glossary"
+# Length limit given to the model for the rolling synopsis of the book.
+GLOSSARY_SYNOPSIS_MAX_WORDS = 200
+# Most names and terms sent with the prompts of one document.
+MAX_CONTEXT_TERMS = 100
+
+GLOSSARY_SYSTEM_MESSAGE = "You are an expert editor keeping the glossary of a book being translated."
+
+
+class BookGlossary:
+    """
+    Names, terms and a rolling synopsis shared by the documents of a book.
+
+    Every document of a batch is translated with the entries it mentions
+    and the synopsis of the book so far (see context), and each finished
+    document adds the names and terms it introduced (see update). A term
+    keeps the first translation chosen for it, so later chapters follow the
+    earlier ones instead of being corrected towards them again.
+
+    Args:
+        path (str, optional): The JSON file the store is kept in, loaded if
+            it exists and rewritten after every update.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self.terms: Dict[str, str] = {}
+        self.synopsis = ""
+        self.documents = 0
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            self.terms = dict(data.get("terms", {}))
+            self.synopsis = data.get("synopsis", "")
+            self.documents = data.get("documents", 0)
+
+    def relevant_terms(self, source_text: str) -> Dict[str, str]:
+        """Return the entries whose source term occurs in the text."""
+        with self._lock:
+            terms = list(self.terms.items())
+        found = [(s, t) for s, t in terms if s and s in source_text]
+        # Longer terms are the more specific ones.
+        found.sort(key=lambda item: -len(item[0]))
+        return dict(found[:MAX_CONTEXT_TERMS])
+
+    def context(self, source_text: str) -> str:
+        """
+        Return the compact notes sent with the prompts of a document.
+
+        Args:
+            source_text (str): The document.
+
+        Returns:
+            str: The synopsis of the book so far and the entries the
+                document mentions, or "" if there are none yet.
+        """
+        terms = self.relevant_terms(source_text)
+        with self._lock:
+            synopsis = self.synopsis
+        if not terms and not synopsis:
+            return ""
+        notes = "This text is part of a book. Keep the translation consistent with the other parts:"
+        if synopsis:
+            notes += f"\nThe book so far: {synopsis}"
+        if terms:
+            notes += "\nUse these translations of names and terms, and do not suggest others:"
+            notes += "".join(f"\n{s} = {t}" for s, t in terms.items())
+        return notes
+
+    def update(
+        self,
+        source_lang: str,
+        target_lang: str,
+        source_text: str,
+        translation: str,
+    ) -> int:
+        """
+        Add the names and terms of a translated document to the store.
+
+        One call in the "glossary" stage extracts the entries the document
+        introduces, with the translations it used, and rolls the synopsis
+        forward. An answer that cannot be parsed leaves the store unchanged.
+
+        Args:
+            source_lang (str): The source language of the document.
+            target_lang (str): The target language of the translation.
+            source_text (str): The document.
+            translation (str): Its final translation.
+
+        Returns:
+            int: The number of entries added.
+        """
+        known = self.relevant_terms(source_text)
+        with self._lock:
+            synopsis = self.synopsis
+        known_terms = "".join(f"\n{s} = {t}" for s, t in known.items())
+
+        prompt = f"""A book is being translated from {source_lang} to {target_lang} one part at a time. \
+Below are the synopsis of the book so far, the names and terms whose translation is already fixed, \
+a new part of the book delimited by XML tags <SOURCE_TEXT></SOURCE_TEXT> and its translation delimited by <TRANSLATION></TRANSLATION>.
+
+Synopsis so far: {synopsis or "(this is the first part)"}
+Fixed names and terms:{known_terms or " (none)"}
+
+<SOURCE_TEXT>
+{source_text}
+</SOURCE_TEXT>
+
+<TRANSLATION>
+{translation}
+</TRANSLATION>
+
+Answer with a JSON object with two keys:
+"terms": an object mapping each name of a person, place or organisation and each recurring special term that this part introduces \
+and that is not fixed yet, written as in the source text, to the translation used for it in this part;
+"synopsis": the synopsis of the book so far, updated with this part, in {source_lang} and in at most {GLOSSARY_SYNOPSIS_MAX_WORDS} words."""
+
+        with usage_stage(GLOSSARY_STAGE):
+            response = utils.get_completion(
+                prompt, system_message=GLOSSARY_SYSTEM_MESSAGE, json_mode=True
+            )
+        data = utils.parse_json_response(response)
+        if not isinstance(data, dict):
+            return 0
+
+        added = 0
+        with self._lock:
+            terms = data.get("terms")
+            if isinstance(terms, dict):
+                for source, target in terms.items():
+                    source, target = str(source).strip(), str(target).strip()
+                    if source and target and source not in self.terms:
+                        self.terms[source] = target
+                        added += 1
+            if isinstance(data.get("synopsis"), str) and data["synopsis"]:
+                self.synopsis = data["synopsis"].strip()
+            self.documents += 1
+            self._save()
+        return added
+
+    def _save(self):
+        if not self.path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        data = {
+            "terms": self.terms,
+            "synopsis": self.synopsis,
+            "documents": self.documents,
+        }
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.path)
@@ -0,0 +1,216 @@
+import difflib
+import json
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from . import utils
+from .memory import _paragraphs, normalize_segment
+from .usage import record_memory
+
+
+# Where the GUI keeps the alignment of each output, inside the output folder.
+ALIGNMENT_DIR = ".alignments"
+
+
+def _keep_layout(line: str, target: str) -> str:
+    indent = line[: len(line) - len(line.lstrip())]
+    ending = line[len(line.rstrip()) :]
+    return indent + target + ending
+
+
+class UpdatePlan:
+    """
+    A new version of a text split into kept and changed blocks.
+
+    The chunks joined give the new text. The chunks at the ``changed``
+    indices are translated, with the chunks around them as context (see
+    utils.multichunk_translation); the others keep the stored translation
+    of their paragraphs, found in ``served``.
+    """
+
+    def __init__(
+        self,
+        chunks: List[str],
+        changed: List[int],
+        served: Dict[int, str],
+        segments: int,
+        hits: int,
+    ):
+        self.chunks = chunks
+        self.changed = changed
+        self.served = served
+        self.segments = segments
+        self.hits = hits
+
+    @property
+    def complete(self) -> bool:
+        """Whether no paragraph changed."""
+        return not self.changed
+
+    def join(self, translations: Sequence[str]) -> str:
+        """
+        Splice the translations of the changed chunks between the kept ones.
+
+        Args:
+            translations (Sequence[str]): One entry per chunk; only those at
+                the changed indices are used.
+        """
+        parts = []
+        for index, chunk in enumerate(self.chunks):
+            if index in self.served:
+                parts.append(self.served[index])
+                continue
+            ending = chunk[len(chunk.rstrip("\n")) :]
+            parts.append(translations[index].rstrip("\n") + ending)
+        return "".join(parts)
+
+
+class Alignment:
+    """
+    The paragraphs of a translated text paired with their translations.
+
+    Kept with an output, it lets the next version of the source be
+    translated incrementally: the paragraphs an author left as they were
+    keep their translation, and only the edited ones are translated again
+    (see plan).
+
+    Example:
+        >>> alignment = Alignment.load(path)
+        >>> translation = translate(sl, tl, text, "", alignment=alignment)
+        >>> Alignment.from_translation(sl, tl, text, translation).save(path)
+
+    Args:
+        source_lang (str): The source language of the text.
+        target_lang (str): The target language of the translation.
+        pairs (List[Tuple[str, str]]): (source, translation) per paragraph.
+    """
+
+    def __init__(
+        self,
+        source_lang: str,
+        target_lang: str,
+        pairs: List[Tuple[str, str]],
+    ):
+        self.source_lang = source_lang
+        self.target_lang = target_lang
+        self.pairs = pairs
+
+    @classmethod
+    def from_translation(
+        cls,
+        source_lang: str,
+        target_lang: str,
+        source_text: str,
+        translation: str,
+    ) -> Optional["Alignment"]:
+        """
+        Pair the paragraphs (non-empty lines) of a text and its translation.
+
+        Returns:
+            Alignment: The alignment, or None if the translation has a
+                different number of paragraphs than its source.
+        """
+        sources = _paragraphs(source_text)
+        targets = _paragraphs(translation)
+        if not sources or len(sources) != len(targets):
+            return None
+        pairs = [(s.strip(), t.strip()) for s, t in zip(sources, targets)]
+        return cls(source_lang, target_lang, pairs)
+
+    def save(self, path: str):
+        """Write the alignment to a JSON file."""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        data = {
+            "source_lang": self.source_lang,
+            "target_lang": self.target_lang,
+            "pairs": self.pairs,
+        }
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["Alignment"]:
+        """Read an alignment written by save, None if there is none."""
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        pairs = [(source, target) for source, target in data["pairs"]]
+        return cls(data["source_lang"], data["target_lang"], pairs)
+
+    def plan(
+        self, source_text: str, max_tokens: int = utils.MAX_TOKENS_PER_CHUNK
+    ) -> UpdatePlan:
+        """
+        Diff a new version of the source against the aligned one.
+
+        Paragraphs are compared in their normalised form (see
+        memory.normalize_segment), so whitespace edits do not count as
+        changes. Runs of changed paragraphs become the chunks to translate,
+        split further if they reach max_tokens. The paragraphs kept, and
+        their source tokens, are recorded in the bound usage trackers like
+        translation memory hits.
+
+        Args:
+            source_text (str): The new version of the text.
+            max_tokens (int): The maximum number of tokens per chunk.
+
+        Returns:
+            UpdatePlan: The kept and changed blocks of the new text.
+        """
+        lines = source_text.split("\n")
+        rows = [i for i, line in enumerate(lines) if line.strip()]
+        old = [normalize_segment(source) for source, _ in self.pairs]
+        new = [normalize_segment(lines[i]) for i in rows]
+
+        kept: Dict[int, str] = {}
+        matcher = difflib.SequenceMatcher(None, old, new, autojunk=False)
+        for tag, i1, i2, j1, _ in matcher.get_opcodes():
+            if tag != "equal":
+                continue
+            for k in range(i2 - i1):
+                row = rows[j1 + k]
+                kept[row] = _keep_layout(lines[row], self.pairs[i1 + k][1])
+
+        # Runs of kept and of changed lines; blank lines stay in their run.
+        runs: List[Tuple[bool, List[int]]] = []
+        for row, line in enumerate(lines):
+            is_kept = row in kept
+            if not line.strip():
+                is_kept = runs[-1][0] if runs else True
+            if runs and runs[-1][0] == is_kept:
+                runs[-1][1].append(row)
+            else:
+                runs.append((is_kept, [row]))
+
+        chunks: List[str] = []
+        changed: List[int] = []
+        served: Dict[int, str] = {}
+        for n, (is_kept, run) in enumerate(runs):
+            ending = "\n" if n + 1 < len(runs) else ""
+            text = "\n".join(lines[row] for row in run) + ending
+            if is_kept:
+                served[len(chunks)] = (
+                    "\n".join(kept.get(row, lines[row]) for row in run)
+                    + ending
+                )
+                chunks.append(text)
+                continue
+            num_tokens = utils.num_tokens_in_string(text)
+            parts = [text]
+            if num_tokens >= max_tokens:
+                parts = utils.split_source_text(text, max_tokens, num_tokens)
+            for part in parts:
+                changed.append(len(chunks))
+                chunks.append(part)
+
+        tokens = 0
+        if kept:
+            tokens = utils.num_tokens_in_string(
+                "\n".join(lines[row] for row in sorted(kept))
+            )
+        record_memory(len(rows), len(kept), tokens)
+        return UpdatePlan(chunks, changed, served, len(rows), len(kept))
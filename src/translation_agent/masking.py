@@ -0,0 +1,264 @@
+import re
+import unicodedata
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from . import utils
+from .usage import record_masked
+
+
+# Placeholders stand for text that is not sent; the brackets are rare in
+# any source text and survive translation as they are.
+PLACEHOLDER = "⟦{}⟧"
+_PLACEHOLDER = re.compile(r"⟦\s*(\d+)\s*⟧")
+
+# The scripts a language is written in, by the first word of its name.
+LANGUAGE_SCRIPTS = {
+    "chinese": ("HAN",),
+    "japanese": ("HAN", "HIRAGANA", "KATAKANA"),
+    "korean": ("HANGUL",),
+    "english": ("LATIN",),
+    "spanish": ("LATIN",),
+    "french": ("LATIN",),
+    "german": ("LATIN",),
+    "italian": ("LATIN",),
+    "portuguese": ("LATIN",),
+    "dutch": ("LATIN",),
+    "polish": ("LATIN",),
+    "turkish": ("LATIN",),
+    "vietnamese": ("LATIN",),
+    "indonesian": ("LATIN",),
+    "russian": ("CYRILLIC",),
+    "ukrainian": ("CYRILLIC",),
+    "greek": ("GREEK",),
+    "arabic": ("ARABIC",),
+    "hebrew": ("HEBREW",),
+    "thai": ("THAI",),
+    "hindi": ("DEVANAGARI",),
+}
+
+_URL_LINE = re.compile(
+    r"^<?(?:https?://|ftp://|www\.)\S+>?$|^[\w.+-]+@[\w-]+\.[\w.-]+$"
+)
+_FENCE = re.compile(r"^\s*(```|~~~)")
+_CODE_START = re.compile(
+    r"^(?:#include\b|#define\b|#!|import \w|from [\w.]+ import\b|"
+    r"def \w+\(|class \w+[:(\s]|(?:if|for|while) \(|[{}])"
+)
+# Keywords that also start English sentences count only with code endings.
+_CODE_KEYWORD = re.compile(
+    r"^(?:return|const|let|var|function|public|private|static)\b"
+)
+_CODE_END = re.compile(r"(?:[;{}]|\)\s*:)$")
+_CODE_SYMBOLS = set("{}()[];=<>")
+
+# Spans inside translatable lines that are copied, not translated: inline
+# code, Markdown link targets, HTML tags, URLs and long numbers.
+_INLINE = re.compile(
+    r"`[^`\n]+`"
+    r"|(?<=\]\()[^()\s]+(?:\s+\"[^\"\n]*\")?(?=\))"
+    r"|</?[A-Za-z][\w:-]*(?:\s[^<>\n]*)?/?>"
+    r"|(?:https?|ftp)://[^\s<>()\[\]\"'`]+|www\.[^\s<>()\[\]\"'`]+"
+    r"|(?<![\w.,])\d[\d,.]{4,}\d(?![\w])"
+)
+# Shorter spans (<b>, `x`) cost about as many tokens as their placeholder.
+MIN_INLINE_CHARS = 6
+
+
+@lru_cache(maxsize=4096)
+def _script(char: str) -> str:
+    name = unicodedata.name(char, "")
+    if name.startswith("CJK"):
+        return "HAN"
+    return name.split(" ", 1)[0]
+
+
+def language_scripts(language: str) -> Tuple[str, ...]:
+    """Return the scripts a language is written in, () if unknown."""
+    words = language.strip().lower().split()
+    return LANGUAGE_SCRIPTS.get(words[0], ()) if words else ()
+
+
+def _looks_like_code(line: str) -> bool:
+    if _CODE_START.match(line):
+        return True
+    if _CODE_KEYWORD.match(line):
+        return bool(_CODE_END.search(line))
+    symbols = sum(1 for char in line if char in _CODE_SYMBOLS)
+    return bool(_CODE_END.search(line)) and symbols >= 2
+
+
+def classify_segment(
+    segment: str, source_lang: str, target_lang: str
+) -> Optional[str]:
+    """
+    Tell whether a line of text needs no translation, and why.
+
+    Args:
+        segment (str): One line of a text.
+        source_lang (str): The source language of the text.
+        target_lang (str): The target language for translation.
+
+    Returns:
+        Optional[str]: "url" for a lone URL or e-mail address, "number" for
+            a line without letters (numbers, separators), "code" for a line
+            of source code, "target" for a line written only in the script
+            of the target language, None for a line to translate (and for
+            blank lines).
+    """
+    line = segment.strip()
+    if not line:
+        return None
+    if _URL_LINE.match(line):
+        return "url"
+    letters = [char for char in line if char.isalpha()]
+    if not letters:
+        return "number"
+    source = language_scripts(source_lang)
+    target = language_scripts(target_lang)
+    scripts = {_script(char) for char in letters}
+    in_source = bool(scripts.intersection(source))
+    # Comments in a non-Latin source language are translated.
+    if not (in_source and "LATIN" not in source) and _looks_like_code(line):
+        return "code"
+    if source and target and not set(source).intersection(target):
+        if not in_source and scripts.intersection(target):
+            return "target"
+    return None
+
+
+class MaskedText:
+    """
+    A text whose untranslatable parts are replaced with placeholders.
+
+    Each run of untranslatable lines becomes one placeholder line, and each
+    masked span inside a line one inline placeholder (see PLACEHOLDER);
+    blank lines are left as they are.
+    """
+
+    def __init__(self, text: str, kept: Dict[int, str], tokens: int = 0):
+        self.text = text
+        self.kept = kept
+        # Source tokens taken out of the text by the placeholders.
+        self.tokens = tokens
+
+    @property
+    def translatable(self) -> bool:
+        """Whether anything besides placeholders is left to translate."""
+        return any(
+            char.isalnum() for char in _PLACEHOLDER.sub("", self.text)
+        )
+
+    @property
+    def notes(self) -> str:
+        """The instruction sent with the prompts of a masked text."""
+        if not self.kept:
+            return ""
+        return "Markers such as ⟦1⟧ stand for text that must stay as it is: copy every marker unchanged, where it belongs in the translation."
+
+    def missing(self, source: str, translation: str) -> List[int]:
+        """Return the placeholders of a source part its translation lost."""
+        found = {int(n) for n in _PLACEHOLDER.findall(translation)}
+        wanted = [int(n) for n in _PLACEHOLDER.findall(source)]
+        return [n for n in wanted if n not in found]
+
+    def unmask(self, text: str) -> str:
+        """Put the kept text back in place of the placeholders."""
+        return _PLACEHOLDER.sub(
+            lambda m: self.kept.get(int(m.group(1)), m.group(0)), text
+        )
+
+    def restore(self, translation: str) -> Optional[str]:
+        """
+        Put the kept text back into the translation of the masked text.
+
+        Returns:
+            Optional[str]: The translation with the kept text, or None if a
+                placeholder went missing.
+        """
+        if self.missing(self.text, translation):
+            return None
+        return self.unmask(translation)
+
+
+def mask_untranslatable(
+    source_text: str,
+    source_lang: str,
+    target_lang: str,
+    lines: bool = True,
+    inline: bool = False,
+) -> MaskedText:
+    """
+    Replace the parts of a text that need no translation with placeholders.
+
+    With lines, fenced code blocks are kept whole, and so are lines
+    classified by classify_segment. With inline, inline code, Markdown link
+    targets, HTML tags, URLs and long numbers inside the other lines are
+    kept too, so they are neither paid for in every prompt nor mangled. The
+    parts kept, and the source tokens they take out of the text, are
+    recorded in the bound usage trackers.
+
+    Args:
+        source_text (str): The text.
+        source_lang (str): The source language of the text.
+        target_lang (str): The target language for translation.
+        lines (bool): Keep untranslatable lines.
+        inline (bool): Keep markup, URLs and numbers inside lines.
+
+    Returns:
+        MaskedText: The masked text, unchanged if nothing was kept or if
+            the text already holds placeholder brackets.
+    """
+    if "⟦" in source_text:
+        return MaskedText(source_text, {})
+    text_lines = source_text.split("\n")
+    keep = [False] * len(text_lines)
+    fenced = False
+    for i, line in enumerate(text_lines if lines else ()):
+        if _FENCE.match(line):
+            keep[i] = True
+            fenced = not fenced
+        elif fenced:
+            keep[i] = True
+        elif classify_segment(line, source_lang, target_lang):
+            keep[i] = True
+
+    output: List[str] = []
+    kept: Dict[int, str] = {}
+    run: List[str] = []
+
+    def placeholder(original: str) -> str:
+        kept[len(kept) + 1] = original
+        return PLACEHOLDER.format(len(kept))
+
+    def close_run():
+        if run:
+            output.append(placeholder("\n".join(run)))
+            run.clear()
+
+    def mask_span(match) -> str:
+        span = match.group(0)
+        if len(span) < MIN_INLINE_CHARS:
+            return span
+        # Trailing sentence punctuation belongs to the text, not the URL.
+        stripped = span.rstrip(".,;:!?")
+        return placeholder(stripped) + span[len(stripped) :]
+
+    for i, line in enumerate(text_lines):
+        if keep[i]:
+            run.append(line)
+            continue
+        close_run()
+        output.append(_INLINE.sub(mask_span, line) if inline else line)
+    close_run()
+
+    if not kept:
+        return MaskedText(source_text, {})
+    tokens = utils.num_tokens_in_string("\n".join(kept.values()))
+    tokens -= utils.num_tokens_in_string(
+        "\n".join(PLACEHOLDER.format(n) for n in kept)
+    )
+    tokens = max(tokens, 0)
+    record_masked(len(kept), tokens)
+    return MaskedText("\n".join(output), kept, tokens)
+
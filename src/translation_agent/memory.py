@@ -0,0 +1,256 @@
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+from typing import Iterable, List, Optional, Tuple
+
+from . import utils
+from .usage import record_memory
+
+
+def normalize_segment(text: str) -> str:
+    """Return the form of a segment used as its memory key."""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def _segment_key(text: str) -> str:
+    return hashlib.sha256(normalize_segment(text).encode("utf-8")).hexdigest()
+
+
+def _paragraphs(text: str) -> List[str]:
+    return [line for line in text.split("\n") if line.strip()]
+
+
+class MemoryMatch:
+    """
+    A text split into paragraphs served from memory and a part to translate.
+
+    Only the matched paragraphs before the first and after the last
+    unmatched one are served (headers, disclaimers, closing boilerplate and
+    texts matched entirely), so the part left to translate is one span that
+    keeps its context.
+    """
+
+    def __init__(
+        self,
+        head: List[str],
+        middle: str,
+        tail: List[str],
+        segments: int,
+        hits: int,
+    ):
+        self.head = head
+        self.middle = middle
+        self.tail = tail
+        self.segments = segments
+        self.hits = hits
+
+    @property
+    def complete(self) -> bool:
+        """Whether the whole text was served from memory."""
+        return not self.middle.strip()
+
+    def join(self, translation: str) -> str:
+        """Put the translation of the middle part between the served lines."""
+        if self.complete:
+            return "\n".join(self.head + self.tail)
+        return "\n".join(self.head + [translation] + self.tail)
+
+
+class TranslationMemory:
+    """
+    Exact-match translation memory kept in SQLite.
+
+    Paragraphs are stored per language pair, keyed by their normalised text
+    (see normalize_segment), and filled from finished translations whose
+    paragraphs line up with the source (see add_aligned). The memory can be
+    shared by threads.
+
+    Args:
+        path (str): The database file, ":memory:" for a private in-memory
+            database.
+    """
+
+    def __init__(self, path: str = ":memory:"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS segments (
+                    source_lang TEXT NOT NULL,
+                    target_lang TEXT NOT NULL,
+                    source_key TEXT NOT NULL,
+                    source_text TEXT NOT NULL,
+                    target_text TEXT NOT NULL,
+                    PRIMARY KEY (source_lang, target_lang, source_key)
+                )"""
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            (count,) = self._conn.execute(
+                "SELECT COUNT(*) FROM segments"
+            ).fetchone()
+        return count
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def rows(
+        self, source_lang: str, target_lang: str, after: int = -1
+    ) -> List[Tuple[int, str, str]]:
+        """
+        Return the segments of a language pair stored after a row id.
+
+        Replacing a segment gives it a new row id, so the rows stored after
+        the largest id seen are the ones added or changed since.
+
+        Returns:
+            List[Tuple[int, str, str]]: (row id, source, target) in id order.
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT rowid, source_text, target_text FROM segments "
+                "WHERE source_lang = ? AND target_lang = ? AND rowid > ? "
+                "ORDER BY rowid",
+                (source_lang, target_lang, after),
+            ).fetchall()
+
+    def rows_by_id(
+        self, rowids: Iterable[int]
+    ) -> List[Tuple[int, str, str]]:
+        """Return (row id, source, target) of the rows still stored."""
+        rowids = list(rowids)
+        if not rowids:
+            return []
+        marks = ", ".join("?" * len(rowids))
+        with self._lock:
+            return self._conn.execute(
+                "SELECT rowid, source_text, target_text FROM segments "
+                f"WHERE rowid IN ({marks})",
+                rowids,
+            ).fetchall()
+
+    def lookup(
+        self, source_lang: str, target_lang: str, segment: str
+    ) -> Optional[str]:
+        """
+        Return the stored translation of a segment, or None.
+
+        A lookup only reads the database; hits are counted in the bound
+        usage trackers by match, not written back per segment.
+        """
+        key = _segment_key(segment)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT target_text FROM segments "
+                "WHERE source_lang = ? AND target_lang = ? AND source_key = ?",
+                (source_lang, target_lang, key),
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def add(
+        self, source_lang: str, target_lang: str, source: str, target: str
+    ):
+        """Store the translation of one segment, replacing an older one."""
+        self.add_many(source_lang, target_lang, [(source, target)])
+
+    def add_many(self, source_lang: str, target_lang: str, pairs):
+        """Store (source, target) segment pairs, skipping empty ones."""
+        rows = [
+            (
+                source_lang,
+                target_lang,
+                _segment_key(source),
+                normalize_segment(source),
+                target.strip(),
+            )
+            for source, target in pairs
+            if source.strip() and target.strip()
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO segments "
+                "(source_lang, target_lang, source_key, source_text, "
+                "target_text) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def add_aligned(
+        self,
+        source_lang: str,
+        target_lang: str,
+        source_text: str,
+        translation: str,
+    ) -> int:
+        """
+        Store the paragraphs of a finished translation.
+
+        Paragraphs are non-empty lines, paired in order. A translation with
+        a different number of paragraphs than its source cannot be aligned
+        and is not stored.
+
+        Returns:
+            int: The number of paragraphs stored.
+        """
+        sources = _paragraphs(source_text)
+        targets = _paragraphs(translation)
+        if not sources or len(sources) != len(targets):
+            return 0
+        self.add_many(source_lang, target_lang, zip(sources, targets))
+        return len(sources)
+
+    def match(
+        self, source_lang: str, target_lang: str, source_text: str
+    ) -> MemoryMatch:
+        """
+        Serve the leading and trailing paragraphs of a text from memory.
+
+        The paragraphs served, and their source tokens, are recorded in the
+        bound usage trackers.
+
+        Args:
+            source_lang (str): The source language of the text.
+            target_lang (str): The target language for translation.
+            source_text (str): The text.
+
+        Returns:
+            MemoryMatch: The served lines and the part left to translate.
+        """
+        lines = source_text.split("\n")
+
+        def served(line: str) -> Optional[str]:
+            if not line.strip():
+                return line
+            target = self.lookup(source_lang, target_lang, line)
+            if target is None:
+                return None
+            indent = line[: len(line) - len(line.lstrip())]
+            ending = line[len(line.rstrip()) :]
+            return indent + target + ending
+
+        head: List[str] = []
+        for line in lines:
+            target = served(line)
+            if target is None:
+                break
+            head.append(target)
+        tail: List[str] = []
+        if len(head) < len(lines):
+            for line in reversed(lines[len(head) :]):
+                target = served(line)
+                if target is None:
+                    break
+                tail.insert(0, target)
+
+        middle = "\n".join(lines[len(head) : len(lines) - len(tail)])
+        served_lines = lines[: len(head)] + lines[len(lines) - len(tail) :]
+        hits = sum(1 for line in served_lines if line.strip())
+        tokens = 0
+        if hits:
+            tokens = utils.num_tokens_in_string("\n".join(served_lines))
+        segments = len(_paragraphs(source_text))
+        record_memory(segments, hits, tokens)
+        return MemoryMatch(head, middle, tail, segments, hits)
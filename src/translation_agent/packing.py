@@ -0,0 +1,408 @@
+import re
+from typing import List, Optional, Sequence, Union
+
+from icecream import ic
+
+from . import utils
+from .usage import record_skip, usage_stage
+
+
+# Source tokens packed into one request by default.
+PACK_MAX_TOKENS = 1000
+
+# The stages a pack goes through, each one packed request (or fewer).
+PACK_STAGES = ("initial", "reflect", "improve")
+
+_SEGMENT = re.compile(r"<SEGMENT_(\d+)>\n?(.*?)\n?</SEGMENT_\1>", re.DOTALL)
+
+_CRITERIA = """(i) accuracy (by correcting errors of addition, mistranslation, omission, or untranslated text),
+(ii) fluency (by applying {target_lang} grammar, spelling and punctuation rules, and ensuring there are no unnecessary repetitions),
+(iii) style (by ensuring the translations reflect the style of the source text and take into account any cultural context),
+(iv) terminology (by ensuring terminology use is consistent and reflects the source text domain; and by only ensuring you use equivalent idioms {target_lang})."""
+
+
+def pack_segments(
+    token_counts: Sequence[int], max_tokens: int = PACK_MAX_TOKENS
+) -> List[List[int]]:
+    """
+    Group consecutive segments into packs of at most ``max_tokens`` tokens.
+
+    A segment longer than the budget gets a pack of its own.
+
+    Args:
+        token_counts (Sequence[int]): The number of tokens of each segment.
+        max_tokens (int): The token budget of a pack.
+
+    Returns:
+        List[List[int]]: The segment indices of each pack, in order.
+    """
+    packs = []
+    current: List[int] = []
+    size = 0
+    for index, tokens in enumerate(token_counts):
+        if current and size + tokens > max_tokens:
+            packs.append(current)
+            current, size = [], 0
+        current.append(index)
+        size += tokens
+    if current:
+        packs.append(current)
+    return packs
+
+
+def _number_segments(parts: Sequence[str]) -> str:
+    return "\n\n".join(
+        f"<SEGMENT_{i}>\n{part}\n</SEGMENT_{i}>"
+        for i, part in enumerate(parts, 1)
+    )
+
+
+def _output_format(count: int, content: str, json_mode: bool) -> str:
+    if json_mode:
+        return (
+            f'Respond with a JSON object whose keys are the segment numbers '
+            f'"1" to "{count}" and whose values are the {content} of those '
+            f"segments."
+        )
+    return (
+        f"Output the {content} of each segment between the same numbered "
+        f"tags as the segment, from <SEGMENT_1></SEGMENT_1> to "
+        f"<SEGMENT_{count}></SEGMENT_{count}>, and nothing else."
+    )
+
+
+def parse_segments(
+    response: Union[str, dict, list], count: int
+) -> Optional[List[str]]:
+    """
+    Split the answer of a packed request into one output per segment.
+
+    JSON objects keyed by segment number, JSON lists and numbered
+    <SEGMENT_n> tags are accepted.
+
+    Args:
+        response: The completion returned by get_completion.
+        count (int): The number of segments in the pack.
+
+    Returns:
+        Optional[List[str]]: The output of each segment, or None if the
+            answer does not hold exactly one non-empty output per segment.
+    """
+    data = utils.parse_json_response(response)
+    if isinstance(data, dict) and isinstance(data.get("segments"), list):
+        data = data["segments"]
+
+    outputs = None
+    if isinstance(data, dict):
+        try:
+            numbered = {int(k): v for k, v in data.items()}
+        except ValueError:
+            numbered = {}
+        if set(numbered) == set(range(1, count + 1)):
+            outputs = [numbered[i] for i in range(1, count + 1)]
+    elif isinstance(data, list) and len(data) == count:
+        outputs = data
+    if outputs is None and isinstance(response, str):
+        tagged = {}
+        for number, text in _SEGMENT.findall(response):
+            tagged.setdefault(int(number), text)
+        if set(tagged) == set(range(1, count + 1)):
+            outputs = [tagged[i] for i in range(1, count + 1)]
+
+    if outputs is None:
+        return None
+    if not all(isinstance(o, str) and o.strip() for o in outputs):
+        return None
+    return outputs
+
+
+def _run_packed(items: List, request, fallback) -> List[str]:
+    """
+    Run a packed request, splitting the pack when its answer is misaligned.
+
+    ``request`` maps a list of items to their outputs or None; a single item
+    is handed to ``fallback``, the unpacked pipeline function.
+    """
+    if len(items) == 1:
+        return [fallback(items[0])]
+    outputs = request(items)
+    if outputs is not None:
+        return outputs
+    ic("Misaligned packed output, splitting the pack", len(items))
+    half = len(items) // 2
+    return _run_packed(items[:half], request, fallback) + _run_packed(
+        items[half:], request, fallback
+    )
+
+
+def packed_initial_translation(
+    source_lang: str,
+    target_lang: str,
+    source_texts: List[str],
+    json_mode: bool = True,
+) -> List[str]:
+    """
+    Translate several short texts with one request.
+
+    Args:
+        source_lang (str): The source language of the texts.
+        target_lang (str): The target language for translation.
+        source_texts (List[str]): The texts to be translated.
+        json_mode (bool): Ask for a JSON answer instead of numbered tags.
+
+    Returns:
+        List[str]: The translation of each text.
+    """
+
+    system_message = f"You are an expert linguist, specializing in translation from {source_lang} to {target_lang}."
+
+    def request(texts):
+        prompt = f"""This is an {source_lang} to {target_lang} translation of {len(texts)} independent segments, each delimited by numbered XML tags <SEGMENT_1></SEGMENT_1> to <SEGMENT_{len(texts)}></SEGMENT_{len(texts)}>. \
+Please provide the {target_lang} translation of every segment. Translate each segment on its own: never merge, split or reorder segments. \
+Do not provide any explanations or text apart from the translations.
+
+{_number_segments(texts)}
+
+{_output_format(len(texts), "translations", json_mode)}"""
+
+        with usage_stage("initial"):
+            response = utils.get_completion(
+                prompt, system_message=system_message, json_mode=json_mode
+            )
+        return parse_segments(response, len(texts))
+
+    def fallback(text):
+        return utils.one_chunk_initial_translation(
+            source_lang, target_lang, text
+        )
+
+    return _run_packed(list(source_texts), request, fallback)
+
+
+def packed_reflect_on_translation(
+    source_lang: str,
+    target_lang: str,
+    source_texts: List[str],
+    translations: List[str],
+    country: str = "",
+    json_mode: bool = True,
+    quality_threshold: Optional[float] = None,
+) -> List[str]:
+    """
+    Reflect on the translations of several short texts with one request.
+
+    Args:
+        source_lang (str): The source language of the texts.
+        target_lang (str): The target language of the translations.
+        source_texts (List[str]): The original texts.
+        translations (List[str]): The initial translation of each text.
+        country (str): Country specified for the target language.
+        json_mode (bool): Ask for a JSON answer instead of numbered tags.
+        quality_threshold (float, optional): Translations scoring at least
+            this in quality.score_translation are not reflected on and get
+            NO_CHANGES as reflection.
+
+    Returns:
+        List[str]: The reflection on each translation.
+    """
+
+    system_message = f"You are an expert linguist specializing in translation from {source_lang} to {target_lang}. \
+You will be provided with source texts and their translations and your goal is to improve the translations."
+
+    style = ""
+    if country != "":
+        style = f"\nThe final style and tone of the translations should match the style of {target_lang} colloquially spoken in {country}.\n"
+
+    def request(items):
+        segments = _number_segments(
+            [
+                f"<SOURCE_TEXT>\n{source_texts[i]}\n</SOURCE_TEXT>\n"
+                f"<TRANSLATION>\n{translations[i]}\n</TRANSLATION>"
+                for i in items
+            ]
+        )
+        prompt = f"""Your task is to carefully read {len(items)} independent source texts and their translations from {source_lang} to {target_lang}, and then give constructive criticism and helpful suggestions to improve each translation.
+{style}
+Each source text and its translation are delimited by XML tags <SOURCE_TEXT></SOURCE_TEXT> and <TRANSLATION></TRANSLATION> inside numbered tags <SEGMENT_1></SEGMENT_1> to <SEGMENT_{len(items)}></SEGMENT_{len(items)}>:
+
+{segments}
+
+When writing suggestions, pay attention to whether there are ways to improve each translation's
+{_CRITERIA.format(target_lang=target_lang)}
+
+For each segment, write a list of specific, helpful and constructive suggestions for improving its translation, or only NO_CHANGES if the translation needs no changes.
+{_output_format(len(items), "suggestions", json_mode)}"""
+
+        with usage_stage("reflect"):
+            response = utils.get_completion(
+                prompt, system_message=system_message, json_mode=json_mode
+            )
+        return parse_segments(response, len(items))
+
+    def fallback(i):
+        return utils.one_chunk_reflect_on_translation(
+            source_lang, target_lang, source_texts[i], translations[i], country
+        )
+
+    reflections = [utils.NO_CHANGES] * len(source_texts)
+    pending = []
+    for i, source_text in enumerate(source_texts):
+        if utils.accept_draft(
+            source_text,
+            translations[i],
+            source_lang,
+            target_lang,
+            quality_threshold,
+        ):
+            record_skip("reflect")
+        else:
+            pending.append(i)
+
+    if pending:
+        for i, reflection in zip(
+            pending, _run_packed(pending, request, fallback)
+        ):
+            reflections[i] = reflection
+    return reflections
+
+
+def packed_improve_translation(
+    source_lang: str,
+    target_lang: str,
+    source_texts: List[str],
+    translations: List[str],
+    reflections: List[str],
+    json_mode: bool = True,
+) -> List[str]:
+    """
+    Improve the translations of several short texts with one request.
+
+    Translations whose reflection finds nothing to fix are kept as they are
+    and left out of the request.
+
+    Args:
+        source_lang (str): The source language of the texts.
+        target_lang (str): The target language of the translations.
+        source_texts (List[str]): The original texts.
+        translations (List[str]): The initial translation of each text.
+        reflections (List[str]): The reflection on each translation.
+        json_mode (bool): Ask for a JSON answer instead of numbered tags.
+
+    Returns:
+        List[str]: The improved translation of each text.
+    """
+
+    system_message = f"You are an expert linguist, specializing in translation editing from {source_lang} to {target_lang}."
+
+    def request(items):
+        segments = _number_segments(
+            [
+                f"<SOURCE_TEXT>\n{source_texts[i]}\n</SOURCE_TEXT>\n"
+                f"<TRANSLATION>\n{translations[i]}\n</TRANSLATION>\n"
+                f"<EXPERT_SUGGESTIONS>\n{reflections[i]}\n"
+                "</EXPERT_SUGGESTIONS>"
+                for i in items
+            ]
+        )
+        prompt = f"""Your task is to carefully read, then edit, {len(items)} independent translations from {source_lang} to {target_lang}, taking into
+account the expert suggestions and constructive criticisms given for each one.
+
+Each source text, its translation and the expert suggestions are delimited by XML tags <SOURCE_TEXT></SOURCE_TEXT>, <TRANSLATION></TRANSLATION> and <EXPERT_SUGGESTIONS></EXPERT_SUGGESTIONS> \
+inside numbered tags <SEGMENT_1></SEGMENT_1> to <SEGMENT_{len(items)}></SEGMENT_{len(items)}>:
+
+{segments}
+
+Please take into account the expert suggestions when editing each translation. Edit the translations by ensuring:
+
+{_CRITERIA.format(target_lang=target_lang)}
+
+Never merge, split or reorder segments.
+{_output_format(len(items), "new translations", json_mode)}"""
+
+        with usage_stage("improve"):
+            response = utils.get_completion(
+                prompt, system_message=system_message, json_mode=json_mode
+            )
+        return parse_segments(response, len(items))
+
+    def fallback(i):
+        return utils.one_chunk_improve_translation(
+            source_lang,
+            target_lang,
+            source_texts[i],
+            translations[i],
+            reflections[i],
+        )
+
+    improved = list(translations)
+    pending = []
+    for i, reflection in enumerate(reflections):
+        if utils.reflection_finds_nothing(reflection):
+            record_skip("improve")
+        else:
+            pending.append(i)
+
+    if pending:
+        for i, translation in zip(
+            pending, _run_packed(pending, request, fallback)
+        ):
+            improved[i] = translation
+    return improved
+
+
+def translate_packed(
+    source_texts: List[str],
+    source_lang: str,
+    target_lang: str,
+    country: str = "",
+    max_tokens: int = PACK_MAX_TOKENS,
+    quality_threshold: Optional[float] = None,
+    json_mode: bool = True,
+) -> List[str]:
+    """
+    Translate many short texts, packing them into shared requests.
+
+    Texts are grouped in order into packs of up to ``max_tokens`` source
+    tokens, and every pack goes through the initial, reflect and improve
+    stages with one request per stage, instead of three requests per text.
+    A pack whose answer cannot be split back into its texts is split in
+    half and retried; single texts use the unpacked prompts.
+
+    Args:
+        source_texts (List[str]): The texts to be translated.
+        source_lang (str): The source language of the texts.
+        target_lang (str): The target language for translation.
+        country (str): Country specified for the target language.
+        max_tokens (int): The source token budget of a pack.
+        quality_threshold (float, optional): Texts whose initial translation
+            scores at least this in quality.score_translation skip the
+            reflect and improve stages.
+        json_mode (bool): Ask for JSON answers instead of numbered tags.
+
+    Returns:
+        List[str]: The final translation of each text.
+    """
+    token_counts = [utils.num_tokens_in_string(t) for t in source_texts]
+    final_translations = [""] * len(source_texts)
+
+    for pack in pack_segments(token_counts, max_tokens):
+        texts = [source_texts[i] for i in pack]
+        translations = packed_initial_translation(
+            source_lang, target_lang, texts, json_mode
+        )
+        reflections = packed_reflect_on_translation(
+            source_lang,
+            target_lang,
+            texts,
+            translations,
+            country,
+            json_mode,
+            quality_threshold,
+        )
+        improved = packed_improve_translation(
+            source_lang, target_lang, texts, translations, reflections, json_mode
+        )
+        for i, translation in zip(pack, improved):
+            final_translations[i] = translation
+
+    return final_translations
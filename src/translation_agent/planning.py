@@ -0,0 +1,475 @@
+import argparse
+import json
+import re
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+from . import utils
+from .synopsis import SYNOPSIS_MAX_WORDS, SynopsisCache, document_synopsis
+from .usage import (
+    UsageStats,
+    UsageTracker,
+    current_stage,
+    estimate_cost,
+    latency_model,
+    merge_price_table,
+    track_usage,
+)
+
+
+# Per-message overhead of the chat format (role and separators).
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_OVERHEAD_TOKENS = 3
+# Shortest prompt prefix providers serve from their prompt cache.
+CACHE_MIN_PREFIX_TOKENS = 1024
+# Completion tokens of a synopsis: about two per word of its length limit.
+SYNOPSIS_COMPLETION_TOKENS = 2 * SYNOPSIS_MAX_WORDS
+
+_TRANSLATE_THIS = re.compile(
+    r"<TRANSLATE_THIS>\n?(.*?)\n?</TRANSLATE_THIS>", re.DOTALL
+)
+# Only the text blocks, which sit on lines of their own, not the tag names
+# quoted in the instructions.
+_SOURCE_TEXT = re.compile(r"<SOURCE_TEXT>\n(.*?)\n</SOURCE_TEXT>", re.DOTALL)
+
+
+class DryRunClient:
+    """
+    Stand-in for an OpenAI client that answers without calling an LLM.
+
+    Prompt tokens are counted exactly from the messages the pipeline builds.
+    Completion lengths are estimated from the part of the source the call
+    works on: ``output_ratio`` times its tokens for translations and
+    ``reflection_ratio`` times its tokens for reflections, and synopses
+    are assumed to fill their length limit. Edit lists are
+    answered with no edits, so plans assume they always apply locally.
+    Prompt prefixes sent before are counted as cached, see cached_tokens.
+    """
+
+    def __init__(
+        self,
+        source_lang: str,
+        target_lang: str,
+        output_ratio: float = 1.0,
+        reflection_ratio: float = 0.5,
+    ):
+        self.source_lang = source_lang
+        self.target_lang = target_lang
+        self.output_ratio = output_ratio
+        self.reflection_ratio = reflection_ratio
+        self.chat = SimpleNamespace(
+            completions=SimpleNamespace(create=self.create)
+        )
+        self._prefixes = set()
+
+    def target_text(self, prompt: str) -> str:
+        """Return the part of the source text a prompt asks to work on."""
+        matches = _TRANSLATE_THIS.findall(prompt)
+        if matches:
+            return matches[-1]
+        match = _SOURCE_TEXT.search(prompt)
+        if match:
+            return match.group(1)
+        marker = f"{self.source_lang}: "
+        if marker in prompt:
+            text = prompt.split(marker, 1)[1]
+            return text.rsplit(f"\n\n{self.target_lang}:", 1)[0]
+        return prompt
+
+    def cached_tokens(self, messages: List[Dict]) -> int:
+        """
+        Return the prompt tokens a provider would serve from its cache.
+
+        The messages up to the end of the source text, or of the synopsis
+        sent in its place, count as cached when
+        an earlier call sent the same prefix and it is at least
+        CACHE_MIN_PREFIX_TOKENS long.
+        """
+        prompt = (messages[-1].get("content") or "") if messages else ""
+        end = prompt.find("\n</SOURCE_TEXT>")
+        if end < 0:
+            end = prompt.find("\n</SYNOPSIS>")
+        if end < 0:
+            return 0
+        prefix = tuple(m.get("content") or "" for m in messages[:-1])
+        prefix += (prompt[:end],)
+        seen = prefix in self._prefixes
+        self._prefixes.add(prefix)
+        tokens = sum(
+            MESSAGE_OVERHEAD_TOKENS + utils.num_tokens_in_string(part)
+            for part in prefix
+        )
+        if not seen or tokens < CACHE_MIN_PREFIX_TOKENS:
+            return 0
+        return tokens
+
+    def estimate_completion_tokens(self, prompt: str) -> int:
+        stage = current_stage()
+        ratio = self.output_ratio
+        if stage in ("reflect", "edit"):
+            ratio = self.reflection_ratio
+        elif stage == "revise":
+            ratio = self.reflection_ratio + self.output_ratio
+        tokens = utils.num_tokens_in_string(self.target_text(prompt))
+        estimate = max(1, round(tokens * ratio))
+        if stage == "synopsis":
+            return min(estimate, SYNOPSIS_COMPLETION_TOKENS)
+        return estimate
+
+    def create(self, **params):
+        messages = params.get("messages", [])
+        prompt_tokens = REPLY_OVERHEAD_TOKENS + sum(
+            MESSAGE_OVERHEAD_TOKENS
+            + utils.num_tokens_in_string(m.get("content") or "")
+            for m in messages
+        )
+        prompt = messages[-1]["content"] if messages else ""
+        completion_tokens = self.estimate_completion_tokens(prompt)
+        content = " ".join(["lorem"] * completion_tokens)
+        if params.get("response_format", {}).get("type") == "json_object":
+            if current_stage() == "edit":
+                content = json.dumps({"edits": [], "notes": content})
+            else:
+                content = json.dumps(
+                    {"reflection": content, "translation": content}
+                )
+        return SimpleNamespace(
+            model=params.get("model", ""),
+            usage=SimpleNamespace(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                prompt_tokens_details=SimpleNamespace(
+                    cached_tokens=self.cached_tokens(messages)
+                ),
+            ),
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+        )
+
+
+class TranslationPlan:
+    """The calls and tokens a translation would cost."""
+
+    def __init__(self, document_tokens: int, chunks: List[str]):
+        self.document_tokens = document_tokens
+        self.chunks = chunks
+        self.usage = UsageTracker("plan")
+
+    @property
+    def calls(self) -> int:
+        return self.usage.total.calls
+
+    @property
+    def prompt_tokens(self) -> int:
+        return self.usage.total.prompt_tokens
+
+    @property
+    def cached_tokens(self) -> int:
+        return self.usage.total.cached_tokens
+
+    @property
+    def completion_tokens(self) -> int:
+        return self.usage.total.completion_tokens
+
+    def to_dict(self) -> Dict:
+        return {
+            "document_tokens": self.document_tokens,
+            "chunks": len(self.chunks),
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "completion_tokens": self.completion_tokens,
+            "stages": {
+                k: v.to_dict() for k, v in self.usage.stages.items()
+            },
+        }
+
+
+def _run_pipeline(
+    source_lang: str,
+    target_lang: str,
+    source_text: str,
+    chunks: List[str],
+    country: str,
+    revision_mode: Optional[str],
+):
+    """
+    Drive the real pipeline functions the way translate() does.
+
+    A revision_mode of None runs the initial translation only.
+    """
+    if len(chunks) == 1:
+        utils.one_chunk_translate_text(
+            source_lang, target_lang, source_text, country, revision_mode
+        )
+        return
+
+    translation_1_chunks = utils.multichunk_initial_translation(
+        source_lang, target_lang, chunks
+    )
+    if revision_mode is None:
+        return
+    if revision_mode == utils.REVISION_COMBINED:
+        utils.multichunk_reflect_and_improve(
+            source_lang, target_lang, chunks, translation_1_chunks, country
+        )
+        return
+    if revision_mode == utils.REVISION_EDITS:
+        utils.multichunk_edit_translation(
+            source_lang, target_lang, chunks, translation_1_chunks, country
+        )
+        return
+    reflection_chunks = utils.multichunk_reflect_on_translation(
+        source_lang, target_lang, chunks, translation_1_chunks, country
+    )
+    utils.multichunk_improve_translation(
+        source_lang, target_lang, chunks, translation_1_chunks, reflection_chunks
+    )
+
+
+def plan_translation(
+    source_text: str,
+    source_lang: str,
+    target_lang: str,
+    country: str = "",
+    max_tokens: int = utils.MAX_TOKENS_PER_CHUNK,
+    reflection: bool = True,
+    output_ratio: float = 1.0,
+    reflection_ratio: float = 0.5,
+    price_table: Optional[Dict] = None,
+    revision_mode: str = utils.REVISION_SEPARATE,
+    tier: str = utils.TIER_FULL,
+    synopsis_tokens: int = 0,
+) -> TranslationPlan:
+    """
+    Compute the LLM calls and tokens a translation would issue, offline.
+
+    The real chunking and prompt building code runs against a DryRunClient,
+    so the number of calls and the prompt tokens match what translate() and
+    process.translator send. Completion tokens are estimates.
+
+    Args:
+        source_text (str): The text to be translated.
+        source_lang (str): The source language of the text.
+        target_lang (str): The target language for translation.
+        country (str): Country specified for the target language.
+        max_tokens (int): The maximum number of tokens per chunk.
+        reflection (bool): Whether the stages after the initial translation
+            run at all; False plans the same calls as TIER_DRAFT.
+        output_ratio (float): Translation tokens per source token.
+        reflection_ratio (float): Reflection tokens per source token.
+        price_table (dict, optional): Prices used for the cost estimate.
+        revision_mode (str): REVISION_SEPARATE, REVISION_COMBINED or
+            REVISION_EDITS.
+        tier (str): The pipeline tier, see utils.tier_revision_mode.
+        synopsis_tokens (int): Plan the synopsis calls, and the smaller
+            chunk prompts, of a text this long or longer (see
+            utils.translate). Cached synopses are not taken into account.
+
+    Returns:
+        TranslationPlan: The planned calls and token usage per stage.
+    """
+    document_tokens = utils.num_tokens_in_string(source_text)
+    chunks = utils.split_source_text(source_text, max_tokens, document_tokens)
+
+    plan = TranslationPlan(document_tokens, chunks)
+    if price_table is not None:
+        plan.usage.price_table = price_table
+
+    if reflection:
+        revision_mode = utils.tier_revision_mode(tier, revision_mode)
+    else:
+        revision_mode = None
+
+    client = DryRunClient(
+        source_lang, target_lang, output_ratio, reflection_ratio
+    )
+    with utils.use_client(client), track_usage(plan.usage):
+        synopsis = None
+        if (
+            synopsis_tokens
+            and len(chunks) > 1
+            and document_tokens >= synopsis_tokens
+        ):
+            synopsis = document_synopsis(
+                source_lang, source_text, SynopsisCache()
+            )
+        with utils.use_synopsis(synopsis):
+            _run_pipeline(
+                source_lang,
+                target_lang,
+                source_text,
+                chunks,
+                country,
+                revision_mode,
+            )
+    return plan
+
+
+def estimate_batch(
+    plans: List[TranslationPlan],
+    stage_models: Dict[str, str],
+    concurrency: int = 1,
+    rpm: int = 0,
+    tpm: int = 0,
+    price_table: Optional[Dict] = None,
+) -> Dict:
+    """
+    Aggregate plans and estimate the cost and wall time of running them.
+
+    Wall time is the largest of three bounds: the summed request latency
+    predicted by ``latency_model`` (measured on this endpoint) spread over
+    ``concurrency`` workers, the RPM limit and the TPM limit.
+
+    Args:
+        plans (List[TranslationPlan]): One plan per document.
+        stage_models (Dict[str, str]): The model serving each stage.
+        concurrency (int): Number of requests in flight at once.
+        rpm (int): Requests per minute limit, 0 for none.
+        tpm (int): Tokens per minute limit, 0 for none.
+        price_table (dict, optional): Overrides of the default prices.
+
+    Returns:
+        dict: calls, prompt_tokens, cached_tokens (expected prompt cache
+            hits), completion_tokens, cost, seconds (None
+            when no latency has been measured for a model) and per-stage
+            totals.
+    """
+    price_table = merge_price_table(price_table)
+    stages: Dict[str, UsageStats] = {}
+    for plan in plans:
+        for stage, stats in plan.usage.stages.items():
+            stages.setdefault(stage, UsageStats()).merge(stats)
+
+    total = UsageStats()
+    cost = 0.0
+    latency: Optional[float] = 0.0
+    for stage, stats in stages.items():
+        total.merge(stats)
+        model = stage_models.get(stage) or stage_models.get("initial", "")
+        cost += estimate_cost(model, stats, price_table)
+        predicted = latency_model.predict(
+            model, stats.calls, stats.completion_tokens
+        )
+        if predicted is None:
+            latency = None
+        elif latency is not None:
+            latency += predicted
+
+    seconds = None
+    if latency is not None:
+        seconds = latency / max(concurrency, 1)
+        if rpm:
+            seconds = max(seconds, total.calls / rpm * 60)
+        if tpm:
+            seconds = max(seconds, total.total_tokens / tpm * 60)
+
+    return {
+        "documents": len(plans),
+        "calls": total.calls,
+        "prompt_tokens": total.prompt_tokens,
+        "cached_tokens": total.cached_tokens,
+        "completion_tokens": total.completion_tokens,
+        "cost": cost,
+        "seconds": seconds,
+        "stages": {k: v.to_dict() for k, v in stages.items()},
+    }
+
+
+def _truncate(source_text: str, fraction: float) -> str:
+    """Cut the text at the paragraph boundary closest to ``fraction``."""
+    target = int(len(source_text) * fraction)
+    cut = source_text.rfind("\n", 0, target)
+    return source_text[: cut if cut > 0 else target]
+
+
+def token_growth_curve(
+    source_text: str, points: int = 8, **plan_kwargs
+) -> List[TranslationPlan]:
+    """
+    Plan growing prefixes of a document to show how tokens scale with size.
+
+    With the full document sent as context in every multichunk call, total
+    prompt tokens grow roughly quadratically with the document length.
+
+    Args:
+        source_text (str): The document.
+        points (int): Number of prefixes, evenly spaced up to the full text.
+        **plan_kwargs: Passed to plan_translation.
+
+    Returns:
+        List[TranslationPlan]: One plan per prefix, shortest first.
+    """
+    plans = []
+    for i in range(1, points + 1):
+        prefix = source_text
+        if i < points:
+            prefix = _truncate(source_text, i / points)
+        if prefix.strip():
+            plans.append(plan_translation(prefix, **plan_kwargs))
+    return plans
+
+
+def format_curve(plans: List[TranslationPlan]) -> str:
+    """Format a growth curve as a text table."""
+    rows = [
+        f"{'doc tokens':>10} {'chunks':>6} {'calls':>6} {'prompt':>10} "
+        f"{'completion':>10} {'prompt/doc':>10}"
+    ]
+    for plan in plans:
+        ratio = plan.prompt_tokens / max(plan.document_tokens, 1)
+        rows.append(
+            f"{plan.document_tokens:>10} {len(plan.chunks):>6} "
+            f"{plan.calls:>6} {plan.prompt_tokens:>10} "
+            f"{plan.completion_tokens:>10} {ratio:>10.1f}"
+        )
+    return "\n".join(rows)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Estimate LLM calls and tokens of a translation offline."
+    )
+    parser.add_argument("path", help="document to analyse")
+    parser.add_argument("--source-lang", default="Chinese")
+    parser.add_argument("--target-lang", default="English")
+    parser.add_argument("--country", default="")
+    parser.add_argument(
+        "--max-tokens", type=int, default=utils.MAX_TOKENS_PER_CHUNK
+    )
+    parser.add_argument("--no-reflection", action="store_true")
+    parser.add_argument(
+        "--revision-mode",
+        choices=[
+            utils.REVISION_SEPARATE,
+            utils.REVISION_COMBINED,
+            utils.REVISION_EDITS,
+        ],
+        default=utils.REVISION_SEPARATE,
+    )
+    parser.add_argument(
+        "--tier", choices=utils.PIPELINE_TIERS, default=utils.TIER_FULL
+    )
+    parser.add_argument("--output-ratio", type=float, default=1.0)
+    parser.add_argument("--points", type=int, default=8)
+    args = parser.parse_args(argv)
+
+    with open(args.path, encoding="utf-8") as f:
+        source_text = f.read()
+
+    plans = token_growth_curve(
+        source_text,
+        points=args.points,
+        source_lang=args.source_lang,
+        target_lang=args.target_lang,
+        country=args.country,
+        max_tokens=args.max_tokens,
+        reflection=not args.no_reflection,
+        output_ratio=args.output_ratio,
+        revision_mode=args.revision_mode,
+        tier=args.tier,
+    )
+    print(format_curve(plans))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+import re
+from collections import Counter
+from typing import List, Optional
+
+
+# Tags of the pipeline prompts that must never reach a translation.
+PROMPT_TAGS = (
+    "TRANSLATE_THIS",
+    "SOURCE_TEXT",
+    "TRANSLATION",
+    "EXPERT_SUGGESTIONS",
+    "SYNOPSIS",
+    "PRECEDING_TEXT",
+    "FOLLOWING_TEXT",
+)
+
+# Target languages written in CJK scripts; leftover CJK characters are only
+# suspicious when translating into other languages.
+CJK_LANGUAGES = (
+    "chinese",
+    "mandarin",
+    "cantonese",
+    "japanese",
+    "korean",
+    "中文",
+    "汉语",
+    "日语",
+    "日文",
+    "韩语",
+)
+
+# One CJK character carries roughly as much text as this many Latin letters.
+CJK_CHAR_WEIGHT = 3.0
+# Accepted range of translated to source weighted length.
+MIN_LENGTH_RATIO = 0.5
+MAX_LENGTH_RATIO = 2.0
+
+_CJK = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]")
+_PROMPT_TAG = re.compile(r"</?(?:%s)>" % "|".join(PROMPT_TAGS))
+
+
+class QualityReport:
+    """The heuristic score of a translation and the issues found."""
+
+    def __init__(self, score: float, issues: List[str]):
+        self.score = score
+        self.issues = issues
+
+    def __repr__(self) -> str:
+        return f"QualityReport(score={self.score:.2f}, issues={self.issues})"
+
+
+def _weighted_length(text: str) -> float:
+    cjk = len(_CJK.findall(text))
+    other = len(re.sub(r"\s", "", text)) - cjk
+    return cjk * CJK_CHAR_WEIGHT + other
+
+
+def _lines(text: str) -> List[str]:
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+
+def _is_cjk_language(language: str) -> bool:
+    language = language.lower()
+    return any(name in language for name in CJK_LANGUAGES)
+
+
+def score_translation(
+    source_text: str,
+    translation: str,
+    source_lang: str = "",
+    target_lang: str = "",
+) -> QualityReport:
+    """
+    Score a translation locally, without any LLM call.
+
+    The score starts at 1.0 and loses points for a length out of proportion
+    with the source, leftover source-script (CJK) characters in a non-CJK
+    translation, lines repeated more often than in the source, missing
+    paragraphs and leaked prompt tags.
+
+    Args:
+        source_text (str): The text in the source language.
+        translation (str): Its translation.
+        source_lang (str): The source language of the text.
+        target_lang (str): The target language of the translation.
+
+    Returns:
+        QualityReport: A score between 0.0 and 1.0 and the issues found.
+    """
+    issues = []
+    penalty = 0.0
+
+    if not translation.strip():
+        return QualityReport(0.0, ["empty translation"])
+
+    if _PROMPT_TAG.search(translation):
+        issues.append("leaked prompt tags")
+        penalty += 0.6
+
+    source_length = _weighted_length(source_text)
+    if source_length:
+        ratio = _weighted_length(translation) / source_length
+        if ratio < MIN_LENGTH_RATIO or ratio > MAX_LENGTH_RATIO:
+            issues.append(f"length ratio {ratio:.2f}")
+            penalty += 0.4
+
+    if (
+        _CJK.search(source_text)
+        and target_lang
+        and not _is_cjk_language(target_lang)
+    ):
+        letters = len(re.sub(r"\s", "", translation))
+        leftover = len(_CJK.findall(translation)) / max(letters, 1)
+        if leftover > 0.01:
+            issues.append(f"{leftover:.0%} untranslated source script")
+            penalty += min(0.5, leftover * 5)
+
+    source_counts = Counter(_lines(source_text))
+    repeated = [
+        line
+        for line, count in Counter(_lines(translation)).items()
+        if count > 1 and len(line) > 10
+    ]
+    source_repeated = sum(1 for count in source_counts.values() if count > 1)
+    if len(repeated) > source_repeated:
+        issues.append(f"{len(repeated)} repeated lines")
+        penalty += 0.3
+
+    source_lines = sum(source_counts.values())
+    translated_lines = len(_lines(translation))
+    if source_lines > 1 and translated_lines < 0.8 * source_lines:
+        issues.append(
+            f"{translated_lines} of {source_lines} paragraphs translated"
+        )
+        penalty += 0.3
+
+    return QualityReport(max(0.0, 1.0 - penalty), issues)
+
+
+def passes_quality_gate(
+    source_text: str,
+    translation: str,
+    source_lang: str,
+    target_lang: str,
+    threshold: Optional[float],
+) -> bool:
+    """
+    Whether a translation scores well enough to skip reflection.
+
+    Args:
+        source_text (str): The text in the source language.
+        translation (str): Its initial translation.
+        source_lang (str): The source language of the text.
+        target_lang (str): The target language of the translation.
+        threshold (float, optional): Minimum score to skip reflection. None
+            disables the gate, so every translation is reflected on.
+
+    Returns:
+        bool: True if the reflect and improve calls can be skipped.
+    """
+    if threshold is None:
+        return False
+    report = score_translation(
+        source_text, translation, source_lang, target_lang
+    )
+    return report.score >= threshold
@@ -0,0 +1,1250 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import ExitStack
+from typing import (
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
+
+from . import packing, utils
+from .dedup import find_duplicates
+from .extractors import Extraction
+from .fuzzy import FuzzyMemory
+from .glossary import BookGlossary
+from .incremental import Alignment, UpdatePlan
+from .masking import MaskedText, mask_untranslatable
+from .memory import MemoryMatch, TranslationMemory, normalize_segment
+from .synopsis import SynopsisCache, document_synopsis
+from .usage import (
+    SharedTracker,
+    UsageTracker,
+    bound_trackers,
+    record_duplicates,
+    record_masked,
+    record_skip,
+    track_usage,
+)
+
+
+# Seconds between checks of should_stop / is_paused while jobs are running.
+POLL_INTERVAL = 0.5
+
+# Key prefixes of the parts of a batch that are not documents of their own:
+# boilerplate paragraphs translated once, and segments of structured files.
+_UNIT = object()
+_SEGMENT = object()
+
+
+class DocumentResult:
+    """The translation of one document of a ``translate_many`` batch."""
+
+    def __init__(
+        self,
+        key: Hashable,
+        source_text: str,
+        chunks: List[str],
+        tier: str = utils.TIER_FULL,
+    ):
+        self.key = key
+        self.source_text = source_text
+        self.chunks = chunks
+        # The pipeline tier the document was translated with.
+        self.tier = tier
+        self.translation_1_chunks = [""] * len(chunks)
+        self.reflection_chunks = [""] * len(chunks)
+        self.translation_2_chunks = [""] * len(chunks)
+        # The synopsis sent as context instead of the whole text, if any.
+        self.synopsis: Optional[str] = None
+        # The paragraphs served from a translation memory; the chunks then
+        # only cover the span between them.
+        self.memory_match: Optional[MemoryMatch] = None
+        # The update of an earlier translation; only its changed chunks are
+        # translated.
+        self.update: Optional[UpdatePlan] = None
+        # The placeholders standing for untranslatable lines in the chunks.
+        self.masked: Optional[MaskedText] = None
+        # The structure of a source file whose segments are the chunks.
+        self.extraction: Optional[Extraction] = None
+        self.error: Optional[Exception] = None
+
+    def _joined(self, chunks: List[str]) -> str:
+        if self.extraction is not None:
+            return self.extraction.rebuild(chunks)
+        if self.update is not None:
+            return self.update.join(chunks)
+        translation = "".join(chunks)
+        if self.masked is not None:
+            translation = self.masked.unmask(
+                translation if self.chunks else self.masked.text
+            )
+        if self.memory_match is None:
+            return translation
+        return self.memory_match.join(translation)
+
+    @property
+    def init_translation(self) -> str:
+        return self._joined(self.translation_1_chunks)
+
+    @property
+    def reflection(self) -> str:
+        return "".join(self.reflection_chunks)
+
+    @property
+    def final_translation(self) -> str:
+        return self._joined(self.translation_2_chunks)
+
+
+class _Document:
+    """Scheduling state of one document."""
+
+    def __init__(
+        self,
+        result: DocumentResult,
+        single_chunk: bool,
+        work_per_job: int,
+        trackers: Sequence[UsageTracker],
+        stages: Sequence[str],
+        indices: Optional[Sequence[int]] = None,
+    ):
+        self.result = result
+        self.single_chunk = single_chunk
+        self.work_per_job = max(work_per_job, 1)
+        self.trackers = tuple(trackers)
+        self.stages = tuple(stages)
+        # The chunks to translate; the others are context only.
+        if indices is None:
+            indices = range(len(result.chunks))
+        self.indices = list(indices)
+        self.total_jobs = len(self.indices) * len(self.stages)
+        self.done_jobs = 0
+        # Initial translation jobs, and how many of them are done.
+        self.draft_jobs = len(self.indices)
+        self.drafted_jobs = 0
+        self.started = False
+        # Whether the document is text of the book, which takes the glossary
+        # and fuzzy memory, rather than boilerplate shared by the batch.
+        self.in_book = True
+        # The documents yielded once this one is done.
+        self.members = [result]
+        # Whether the chunk prompts carry a synopsis instead of the text.
+        self.needs_synopsis = False
+        self._synopsis_lock = threading.Lock()
+        self._book_context: Optional[str] = None
+
+    @property
+    def failed(self) -> bool:
+        return self.result.error is not None
+
+    def store(self, index: int, output: Dict[str, str]):
+        for name, value in output.items():
+            getattr(self.result, name)[index] = value
+
+    def fail(self, error: Exception):
+        self.result.error = error
+        for member in self.members:
+            member.error = error
+
+    @property
+    def remaining_work(self) -> int:
+        return (self.total_jobs - self.done_jobs) * self.work_per_job
+
+    def synopsis(
+        self, source_lang: str, cache: Optional[SynopsisCache]
+    ) -> Optional[str]:
+        """
+        Return the synopsis of the document, or None if it has none.
+
+        The first job to ask builds it; jobs asking meanwhile wait for it.
+        """
+        if not self.needs_synopsis:
+            return None
+        with self._synopsis_lock:
+            if self.result.synopsis is None:
+                self.result.synopsis = document_synopsis(
+                    source_lang, self.result.source_text, cache
+                )
+            return self.result.synopsis
+
+    def book_context(
+        self,
+        glossary: Optional[BookGlossary],
+        fuzzy: Optional[FuzzyMemory] = None,
+    ) -> Optional[str]:
+        """
+        Return the glossary notes and fuzzy-memory references sent with the
+        prompts of the document.
+
+        They are taken when the first job starts, so later updates of the
+        glossary do not change the prompt prefix halfway through.
+        """
+        if not self.in_book or (glossary is None and fuzzy is None):
+            return None
+        if self._book_context is None:
+            notes = []
+            if glossary is not None:
+                notes.append(
+                    glossary.context(
+                        "\n".join(m.source_text for m in self.members)
+                    )
+                )
+            if fuzzy is not None:
+                notes.append(
+                    fuzzy.references(
+                        "\n".join("".join(m.chunks) for m in self.members)
+                    )
+                )
+            self._book_context = "\n\n".join(n for n in notes if n)
+        return self._book_context
+
+
+class _Pack(_Document):
+    """
+    Small documents translated together, with one packed request per stage.
+
+    Each member document is charged the share of the usage matching its
+    share of the source tokens.
+    """
+
+    def __init__(
+        self,
+        members: List[DocumentResult],
+        token_counts: List[int],
+        trackers: List[Sequence[UsageTracker]],
+        stages: Sequence[str] = packing.PACK_STAGES,
+    ):
+        total = sum(token_counts)
+        shared = [
+            SharedTracker(tracker, tokens / max(total, 1))
+            for tokens, member_trackers in zip(token_counts, trackers)
+            for tracker in member_trackers
+        ]
+        result = DocumentResult(
+            tuple(member.key for member in members),
+            "",
+            [member.chunks[0] for member in members],
+        )
+        super().__init__(result, False, total, shared, stages)
+        self.total_jobs = len(self.stages)
+        self.draft_jobs = 1
+        self.members = members
+
+    def store(self, index: int, output: Dict[str, List[str]]):
+        for name, values in output.items():
+            setattr(self.result, name, list(values))
+            for member, value in zip(self.members, values):
+                getattr(member, name)[0] = value
+
+
+class _JobQueue:
+    """
+    Ready chunk-stage jobs ordered by the remaining work of their document.
+
+    With ``draft_first`` every initial translation job goes before any
+    revision job, whatever its document.
+
+    Priorities are only ever lowered (a document's remaining work shrinks as
+    its jobs finish), so entries are updated lazily: a popped entry whose
+    priority is stale is pushed back with the current one.
+    """
+
+    def __init__(self, draft_first: bool = False):
+        self.draft_first = draft_first
+        self._heap = []
+        self._counter = itertools.count()
+
+    def __bool__(self) -> bool:
+        return bool(self._heap)
+
+    def _priority(self, document: _Document, stage: int):
+        return (self.draft_first and stage > 0, -document.remaining_work)
+
+    def push(self, document: _Document, index: int, stage: int):
+        priority = self._priority(document, stage)
+        heapq.heappush(
+            self._heap, (priority, next(self._counter), document, index, stage)
+        )
+
+    def pop(self, accept: Optional[Callable[[_Document, int], bool]] = None):
+        """
+        Pop the most urgent job, or None.
+
+        Jobs for which ``accept(document, stage)`` is False stay queued and
+        the next job is considered instead.
+        """
+        held = []
+        job = None
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            priority, _, document, index, stage = entry
+            if document.failed:
+                continue
+            if priority != self._priority(document, stage):
+                self.push(document, index, stage)
+                continue
+            if accept is not None and not accept(document, stage):
+                held.append(entry)
+                continue
+            job = document, index, stage
+            break
+        for entry in held:
+            heapq.heappush(self._heap, entry)
+        return job
+
+
+def _run_pack_stage(
+    pack: _Pack,
+    stage: str,
+    source_lang: str,
+    target_lang: str,
+    country: str,
+    quality_threshold: Optional[float],
+) -> Dict[str, List[str]]:
+    """Run one pipeline stage on all documents of a pack."""
+    result = pack.result
+    if stage == "initial":
+        return {
+            "translation_1_chunks": packing.packed_initial_translation(
+                source_lang, target_lang, result.chunks
+            )
+        }
+    if stage == "reflect":
+        return {
+            "reflection_chunks": packing.packed_reflect_on_translation(
+                source_lang,
+                target_lang,
+                result.chunks,
+                result.translation_1_chunks,
+                country,
+                quality_threshold=quality_threshold,
+            )
+        }
+    return {
+        "translation_2_chunks": packing.packed_improve_translation(
+            source_lang,
+            target_lang,
+            result.chunks,
+            result.translation_1_chunks,
+            result.reflection_chunks,
+        )
+    }
+
+
+def _run_stage(
+    document: _Document,
+    index: int,
+    stage: str,
+    source_lang: str,
+    target_lang: str,
+    country: str,
+    quality_threshold: Optional[float] = None,
+) -> Dict[str, str]:
+    """
+    Run one pipeline stage on one chunk, the way translate() would.
+
+    Returns the outputs keyed by the DocumentResult list they belong in.
+    """
+    if isinstance(document, _Pack):
+        return _run_pack_stage(
+            document,
+            stage,
+            source_lang,
+            target_lang,
+            country,
+            quality_threshold,
+        )
+
+    result = document.result
+    chunks = result.chunks
+    translation_1 = result.translation_1_chunks[index]
+    reflection = result.reflection_chunks[index]
+
+    if document.single_chunk:
+        if stage == "initial":
+            return {
+                "translation_1_chunks": utils.one_chunk_initial_translation(
+                    source_lang, target_lang, chunks[0]
+                )
+            }
+        if stage == "reflect":
+            return {
+                "reflection_chunks": utils.one_chunk_reflect_on_translation(
+                    source_lang, target_lang, chunks[0], translation_1, country
+                )
+            }
+        if stage == "revise":
+            reflection, translation_2 = utils.one_chunk_reflect_and_improve(
+                source_lang, target_lang, chunks[0], translation_1, country
+            )
+        elif stage == "edit":
+            reflection, translation_2 = utils.one_chunk_edit_translation(
+                source_lang, target_lang, chunks[0], translation_1, country
+            )
+        else:
+            translation_2 = utils.one_chunk_improve_translation(
+                source_lang, target_lang, chunks[0], translation_1, reflection
+            )
+        return {
+            "reflection_chunks": reflection,
+            "translation_2_chunks": translation_2,
+        }
+
+    if stage == "initial":
+        return {
+            "translation_1_chunks": utils.chunk_initial_translation(
+                source_lang, target_lang, chunks, index
+            )
+        }
+    if stage == "reflect":
+        return {
+            "reflection_chunks": utils.chunk_reflect_on_translation(
+                source_lang, target_lang, chunks, index, translation_1, country
+            )
+        }
+    if stage == "revise":
+        reflection, translation_2 = utils.chunk_reflect_and_improve(
+            source_lang, target_lang, chunks, index, translation_1, country
+        )
+    elif stage == "edit":
+        reflection, translation_2 = utils.chunk_edit_translation(
+            source_lang, target_lang, chunks, index, translation_1, country
+        )
+    else:
+        translation_2 = utils.chunk_improve_translation(
+            source_lang, target_lang, chunks, index, translation_1, reflection
+        )
+    return {
+        "reflection_chunks": reflection,
+        "translation_2_chunks": translation_2,
+    }
+
+
+def _run_job(
+    document: _Document,
+    index: int,
+    stage: int,
+    source_lang: str,
+    target_lang: str,
+    country: str,
+    quality_threshold: Optional[float],
+    quality_check: str,
+    synopsis_cache: Optional[SynopsisCache],
+    glossary: Optional[BookGlossary],
+    fuzzy: Optional[FuzzyMemory],
+    trackers: Sequence[UsageTracker],
+    api_client,
+) -> Dict[str, str]:
+    """
+    Run a job on a worker thread with the caller's context bound.
+
+    The initial stage of a document that is revised also runs the cascade
+    check, which may call the drafting model; its verdict is returned under
+    "accepted". A single-chunk document the fuzzy memory can draft skips
+    the initial call and the check, and is always revised.
+    """
+    with ExitStack() as stack:
+        stack.enter_context(track_usage(*trackers, *document.trackers))
+        if api_client is not None:
+            stack.enter_context(utils.use_client(api_client))
+        synopsis = document.synopsis(source_lang, synopsis_cache)
+        stack.enter_context(utils.use_synopsis(synopsis))
+        stack.enter_context(
+            utils.use_book_context(document.book_context(glossary, fuzzy))
+        )
+        if document.result.masked is not None:
+            stack.enter_context(
+                utils.use_book_context(document.result.masked.notes)
+            )
+        revised = len(document.stages) > 1 and not isinstance(
+            document, _Pack
+        )
+        if (
+            fuzzy is not None
+            and document.in_book
+            and stage == 0
+            and revised
+            and document.single_chunk
+        ):
+            draft = fuzzy.draft(document.result.chunks[index])
+            if draft is not None:
+                record_skip("initial")
+                return {"translation_1_chunks": draft}
+        output = _run_stage(
+            document,
+            index,
+            document.stages[stage],
+            source_lang,
+            target_lang,
+            country,
+            quality_threshold,
+        )
+        # Packs apply the quality gate in their reflect stage.
+        if stage == 0 and revised:
+            output["accepted"] = utils.accept_draft(
+                document.result.chunks[index],
+                output["translation_1_chunks"],
+                source_lang,
+                target_lang,
+                quality_threshold,
+                quality_check,
+            )
+        return output
+
+
+def _update_glossary(
+    document: _Document,
+    glossary: BookGlossary,
+    source_lang: str,
+    target_lang: str,
+    trackers: Sequence[UsageTracker],
+    api_client,
+):
+    """Add the names and terms of a finished document to the glossary."""
+    with ExitStack() as stack:
+        stack.enter_context(track_usage(*trackers, *document.trackers))
+        if api_client is not None:
+            stack.enter_context(utils.use_client(api_client))
+        for member in document.members:
+            glossary.update(
+                source_lang,
+                target_lang,
+                member.source_text,
+                member.final_translation,
+            )
+
+
+def _copy_result(
+    result: DocumentResult,
+    key: Hashable,
+    source_text: str,
+    stages: Sequence[str],
+    trackers: Sequence[UsageTracker],
+) -> DocumentResult:
+    """
+    Return the result of a document for a duplicate of it.
+
+    The copy counts the calls of the original as skipped.
+    """
+    copy = DocumentResult(key, source_text, list(result.chunks), result.tier)
+    copy.translation_1_chunks = list(result.translation_1_chunks)
+    copy.reflection_chunks = list(result.reflection_chunks)
+    copy.translation_2_chunks = list(result.translation_2_chunks)
+    copy.synopsis = result.synopsis
+    copy.memory_match = result.memory_match
+    copy.update = result.update
+    copy.masked = result.masked
+    copy.extraction = result.extraction
+    copy.error = result.error
+    if copy.error is None:
+        jobs = len(result.chunks)
+        if result.update is not None:
+            jobs = len(result.update.changed)
+        with track_usage(*trackers):
+            for stage in stages:
+                for _ in range(jobs):
+                    record_skip(stage)
+            record_duplicates(1, 0, jobs * len(stages))
+    return copy
+
+
+def _extract_files(
+    items: Sequence[Tuple[Hashable, str]],
+    extractions: Mapping[Hashable, Extraction],
+    tier: str,
+    trackers: Mapping[Hashable, Sequence[UsageTracker]],
+) -> Tuple[
+    List[Tuple[Hashable, str]],
+    Dict[Hashable, DocumentResult],
+    Dict[Hashable, Tuple[Hashable, int]],
+    List[DocumentResult],
+]:
+    """
+    Split the structured files of a batch into their segments.
+
+    Returns:
+        tuple: The (key, text) entries to translate, with each segment under
+            a part key of its own; the result of every file with segments,
+            by key; the (file key, index) of every segment, by part key; and
+            the results of the files without any segment, which are done.
+    """
+    entries = []
+    files: Dict[Hashable, DocumentResult] = {}
+    segments: Dict[Hashable, Tuple[Hashable, int]] = {}
+    done = []
+    for key, text in items:
+        extraction = extractions.get(key)
+        if extraction is None:
+            entries.append((key, text))
+            continue
+        result = DocumentResult(key, text, list(extraction.segments), tier)
+        result.extraction = extraction
+        with track_usage(*trackers.get(key, ())):
+            saved = utils.num_tokens_in_string(text)
+            if extraction.segments:
+                saved -= utils.num_tokens_in_string(
+                    "\n".join(extraction.segments)
+                )
+            record_masked(extraction.kept, max(saved, 0))
+        if not extraction.segments:
+            done.append(result)
+            continue
+        files[key] = result
+        for index, segment in enumerate(extraction.segments):
+            segments[(_SEGMENT, key, index)] = key, index
+            entries.append(((_SEGMENT, key, index), segment))
+    return entries, files, segments, done
+
+
+def _hold_repeats(
+    entries: Sequence[Tuple[Hashable, str]], paragraphs: Set[str]
+) -> Tuple[List[Tuple[Hashable, str]], List[Tuple[Hashable, str]]]:
+    """
+    Split entries into those ready to queue and those to hold.
+
+    An entry repeating one of the boilerplate ``paragraphs`` is held until
+    their translations are in the memory, which then serves them.
+
+    Returns:
+        tuple: The ready entries and the held ones, in their order.
+    """
+    ready = []
+    held = []
+    for key, text in entries:
+        if any(
+            normalize_segment(line) in paragraphs for line in text.split("\n")
+        ):
+            held.append((key, text))
+        else:
+            ready.append((key, text))
+    return ready, held
+
+
+def _plan_document(
+    key: Hashable,
+    source_text: str,
+    source_lang: str,
+    target_lang: str,
+    tier: str,
+    max_tokens: int,
+    memory: Optional[TranslationMemory],
+    alignment: Optional[Alignment],
+    mask_lines: bool,
+    mask_inline: bool,
+    trackers: Sequence[UsageTracker],
+) -> Tuple[DocumentResult, int]:
+    """
+    Work out what is left to translate of a document and split it.
+
+    An alignment for the same languages plans the edited runs; otherwise
+    the memory serves the paragraphs it has at the start and end, and the
+    rest is masked and split into chunks.
+
+    Returns:
+        tuple: The DocumentResult with its chunks (none when nothing is
+            left to translate, ``error`` set when planning raised) and the
+            number of tokens of the text to translate.
+    """
+    match = None
+    update = None
+    masked = None
+    num_tokens = 0
+    if alignment is not None and (
+        alignment.source_lang,
+        alignment.target_lang,
+    ) != (source_lang, target_lang):
+        alignment = None
+    try:
+        text = source_text
+        if alignment is not None:
+            with track_usage(*trackers):
+                update = alignment.plan(text, max_tokens)
+            if not update.hits:
+                update = None
+        if update is None and memory is not None and alignment is None:
+            with track_usage(*trackers):
+                match = memory.match(source_lang, target_lang, text)
+            text = match.middle
+        if update is not None:
+            chunks = update.chunks
+            num_tokens = utils.num_tokens_in_string(text)
+        elif match is not None and match.complete:
+            chunks = []
+        else:
+            if mask_lines or mask_inline:
+                with track_usage(*trackers):
+                    masked = mask_untranslatable(
+                        text,
+                        source_lang,
+                        target_lang,
+                        lines=mask_lines,
+                        inline=mask_inline,
+                    )
+                if masked.kept:
+                    text = masked.text
+                else:
+                    masked = None
+            if masked is not None and not masked.translatable:
+                chunks = []
+            else:
+                num_tokens = utils.num_tokens_in_string(text)
+                chunks = utils.split_source_text(text, max_tokens, num_tokens)
+    except Exception as e:
+        result = DocumentResult(key, source_text, [], tier)
+        result.error = e
+        return result, 0
+    result = DocumentResult(key, source_text, chunks, tier)
+    result.memory_match = match
+    result.update = update
+    result.masked = masked
+    return result, num_tokens
+
+
+def _skip_revision(
+    document: _Document, index: int, trackers: Sequence[UsageTracker]
+):
+    """Finish a chunk whose initial translation passed the quality gate."""
+    result = document.result
+    result.translation_2_chunks[index] = result.translation_1_chunks[index]
+    for stage in document.stages[1:]:
+        for tracker in (*trackers, *document.trackers):
+            tracker.record_skip(stage)
+    document.done_jobs += len(document.stages) - 1
+
+
+def translate_many(
+    documents: Union[Mapping[Hashable, str], Iterable[str]],
+    source_lang: str,
+    target_lang: str,
+    country: str = "",
+    max_tokens: int = utils.MAX_TOKENS_PER_CHUNK,
+    max_workers: int = 4,
+    revision_mode: str = utils.REVISION_SEPARATE,
+    quality_threshold: Optional[float] = None,
+    tier: str = utils.TIER_FULL,
+    quality_check: str = utils.CHECK_HEURISTIC,
+    pack_tokens: int = 0,
+    draft_first: bool = False,
+    synopsis_tokens: int = 0,
+    synopsis_cache: Optional[SynopsisCache] = None,
+    glossary: Optional[BookGlossary] = None,
+    memory: Optional[TranslationMemory] = None,
+    fuzzy: Optional[FuzzyMemory] = None,
+    alignments: Optional[Mapping[Hashable, Alignment]] = None,
+    deduplicate: bool = False,
+    skip_untranslatable: bool = False,
+    mask_markup: bool = False,
+    extractions: Optional[Mapping[Hashable, Extraction]] = None,
+    stage_pools: Optional[Mapping[str, Tuple[Hashable, int]]] = None,
+    trackers: Optional[Mapping[Hashable, Sequence[UsageTracker]]] = None,
+    on_progress: Optional[Callable[[Hashable, int, int], None]] = None,
+    on_draft: Optional[Callable[[DocumentResult], None]] = None,
+    should_stop: Optional[Callable[[], bool]] = None,
+    is_paused: Optional[Callable[[], bool]] = None,
+) -> Iterator[DocumentResult]:
+    """
+    Translate a batch of documents, yielding each one as soon as it is done.
+
+    Every document is split into chunks and every chunk into its initial,
+    reflect and improve stages. The resulting jobs share one priority queue
+    served by ``max_workers`` threads, so the chunks of a long document run
+    in parallel instead of tying up one worker, and jobs of the document with
+    the most remaining work go first to keep the batch makespan short. The
+    prompts are the ones translate() sends.
+
+    Usage trackers bound to the calling thread, and a client installed with
+    ``utils.use_client``, apply to all jobs.
+
+    Args:
+        documents: A mapping of key to text, or an iterable of texts keyed by
+            their position.
+        source_lang (str): The source language of the texts.
+        target_lang (str): The target language for translation.
+        country (str): Country specified for the target language.
+        max_tokens (int): The maximum number of tokens per chunk.
+        max_workers (int): Number of requests in flight at once.
+        revision_mode (str): REVISION_SEPARATE for reflect and improve calls,
+            REVISION_COMBINED for one JSON call per chunk, REVISION_EDITS for
+            an edit list applied locally.
+        quality_threshold (float, optional): Chunks whose initial translation
+            scores at least this in quality.score_translation skip the
+            remaining stages. None revises every chunk.
+        tier (str): TIER_DRAFT for the initial translation only,
+            TIER_STANDARD for one revision call per chunk, TIER_FULL for the
+            revision_mode as given (see utils.tier_revision_mode).
+        quality_check (str): How drafts are checked against the
+            quality_threshold before they are escalated to the revision
+            stages, see utils.accept_draft. Packed documents always use the
+            local heuristics.
+        pack_tokens (int): Documents shorter than this many tokens are
+            packed together, up to this many source tokens per request, and
+            go through the initial, reflect and improve stages as one pack
+            whatever the revision_mode (only the initial stage with
+            TIER_DRAFT). 0 disables packing.
+        draft_first (bool): Run the initial translation of every document
+            before any reflect or improve job, so the whole batch has drafts
+            as early as possible and revision runs as a second phase.
+        synopsis_tokens (int): Documents of at least this many tokens that
+            are split into chunks send a synopsis of the whole text, and the
+            neighbouring chunks, with every chunk prompt instead of the text
+            itself. The first job of such a document builds the synopsis
+            (see synopsis.document_synopsis). 0 always sends the whole text.
+        synopsis_cache (SynopsisCache, optional): Where synopses are looked
+            up and stored, so reruns and other target languages reuse them.
+        glossary (BookGlossary, optional): The names, terms and synopsis
+            shared by the documents of a book. Every prompt of a document
+            carries the entries it mentions, and each finished document
+            updates the glossary with one "glossary" call, run on a worker
+            while the batch goes on. Updates run one at a time, earliest
+            document first, each from the synopsis the last one wrote.
+        memory (TranslationMemory, optional): Paragraphs at the start and
+            end of a document found in this memory are served without any
+            call, and a document found entirely is yielded at once. Finished
+            translations are added to it.
+        fuzzy (FuzzyMemory, optional): Prior translations of paragraphs
+            similar to a document's are sent with its prompts as references,
+            and a single-chunk document that revises translated paragraphs
+            is revised from them without an initial call. The index is
+            refreshed as documents finish.
+        alignments (Mapping, optional): Maps a document key to the
+            Alignment of an earlier version of the document. Only runs of
+            paragraphs edited since are translated, with the whole text as
+            context, and the others keep their translation; a document
+            without edits is yielded at once. The translation memory is not
+            consulted for these documents.
+        deduplicate (bool): Translate each document of the batch once and
+            yield copies of the result for its byte-identical duplicates;
+            a copy gets the same output as its original. Paragraphs
+            repeated at the start or end of several documents (author
+            notes, separators, ads) are translated once, packed, in the
+            same queue as the documents, and served to every document like
+            translation memory hits; the documents repeating them are
+            queued once they are done. Those paragraphs are translated
+            without their documents as context, so their translation, and
+            the text around them, can differ from a run without
+            deduplication. The copies and the calls they skipped are
+            counted in the usage trackers.
+        skip_untranslatable (bool): Lines that need no translation (see
+            masking.classify_segment) are replaced with placeholders before
+            a document is split into chunks, and put back in the result. A
+            chunk whose translation loses a placeholder is translated again
+            unmasked. Masked documents are not packed.
+        mask_markup (bool): Inline code, Markdown link targets, HTML tags,
+            URLs and long numbers inside the lines are masked the same way,
+            which saves their prompt tokens in every stage and keeps them
+            from being mangled.
+        extractions (Mapping, optional): Maps a document key to the
+            Extraction of a structured file (source code, JSON, Markdown;
+            see extractors.extract_segments). Only its segments are
+            translated, as documents of their own that are packed and
+            masked with mask_markup and share the queue of the batch, and
+            the file is rebuilt around their translations; the chunks of
+            the result are the segments. The
+            source tokens left out are counted in the usage trackers like
+            masked text. on_draft is not called for these documents.
+        stage_pools (Mapping, optional): Maps a stage to the (pool, cap) of
+            the endpoint serving it, where cap is the most jobs of that pool
+            in flight at once (0 for no cap besides max_workers). A job whose
+            pool is full stays queued while jobs of other pools start, so
+            stages routed to different endpoints use both quotas at the same
+            time instead of tying up workers waiting on one of them.
+        trackers (Mapping, optional): Extra usage trackers per document key.
+        on_progress (Callable, optional): Called with (key, finished jobs,
+            total jobs) when a document starts and after each of its jobs.
+        on_draft (Callable, optional): Called with the DocumentResult once
+            the initial translation of all its chunks is done; its
+            ``init_translation`` is complete, the revision still runs.
+        should_stop (Callable, optional): When it returns True no new jobs
+            are started; running jobs finish and unfinished documents are
+            not yielded.
+        is_paused (Callable, optional): No new jobs are started while it
+            returns True.
+
+    Yields:
+        DocumentResult: One per document, in completion order. A document
+            whose job raised is yielded with ``error`` set and its remaining
+            jobs are dropped.
+
+    Example:
+        >>> for result in translate_many(chapters, "Chinese", "English"):
+        ...     save(result.key, result.final_translation)
+    """
+    if isinstance(documents, Mapping):
+        items = list(documents.items())
+    else:
+        items = list(enumerate(documents))
+    trackers = trackers or {}
+    alignments = alignments or {}
+    caller_trackers = bound_trackers()
+    api_client = utils.overriding_client()
+    revision_mode = utils.tier_revision_mode(tier, revision_mode)
+    stages = ("initial",) + utils.revision_stages(revision_mode)
+    pack_stages = packing.PACK_STAGES if revision_mode else ("initial",)
+
+    extractions = extractions or {}
+    copies: Dict[Hashable, List[Tuple[Hashable, str]]] = {}
+    # Boilerplate paragraphs translated once for the batch, by part key.
+    units: Dict[Hashable, str] = {}
+    if deduplicate:
+        duplicates = find_duplicates(items)
+        copies = duplicates.copies
+        copied = {key for c in copies.values() for key, _ in c}
+        items = [(key, text) for key, text in items if key not in copied]
+        units = {(_UNIT, i): unit for i, unit in enumerate(duplicates.units)}
+        if units:
+            if memory is None:
+                memory = TranslationMemory()
+            record_duplicates(0, duplicates.paragraphs, 0)
+    position = {key: i for i, (key, _) in enumerate(items)}
+
+    def owner(key: Hashable) -> Hashable:
+        """Return the key of the batch document a part belongs to."""
+        return segments[key][0] if key in segments else key
+
+    def emit(result: DocumentResult) -> Iterator[DocumentResult]:
+        yield result
+        for key, text in copies.get(result.key, ()):
+            yield _copy_result(
+                result, key, text, stages, trackers.get(key, ())
+            )
+
+    entries, files, segments, empty = _extract_files(
+        items, extractions, tier, trackers
+    )
+    for result in empty:
+        yield from emit(result)
+    remaining = {key: len(result.chunks) for key, result in files.items()}
+
+    # Documents repeating a boilerplate paragraph wait for its translation,
+    # which the memory then serves; the others are queued at once.
+    held = []
+    if units:
+        entries, held = _hold_repeats(entries, set(units.values()))
+    entries = list(units.items()) + entries
+    units_left = len(units)
+
+    queue = _JobQueue(draft_first)
+
+    def enqueue(entries) -> Iterator[DocumentResult]:
+        """Queue the jobs of documents; yield those served without any."""
+        small: Dict[Tuple[int, bool], List] = {}
+        for key, source_text in entries:
+            in_book = key not in units
+            part_trackers = trackers.get(owner(key), ())
+            # Units and segments are short texts of their own: they are
+            # packed even without pack_tokens, and segments always masked.
+            part = not in_book or key in segments
+            limit = pack_tokens
+            if part:
+                limit = pack_tokens or packing.PACK_MAX_TOKENS
+            result, num_tokens = _plan_document(
+                key,
+                source_text,
+                source_lang,
+                target_lang,
+                tier,
+                max_tokens,
+                memory if in_book else None,
+                alignments.get(key),
+                skip_untranslatable and not part,
+                in_book and (mask_markup or key in segments),
+                part_trackers,
+            )
+            chunks = result.chunks
+            update = result.update
+            if (
+                result.error is not None
+                or not chunks
+                or (update is not None and update.complete)
+            ):
+                # Failed to plan, served from the translation memory or
+                # the earlier translation as a whole, or nothing to
+                # translate.
+                yield result
+                continue
+            if update is not None:
+                document = _Document(
+                    result,
+                    False,
+                    num_tokens,
+                    part_trackers,
+                    stages,
+                    update.changed,
+                )
+                document.needs_synopsis = (
+                    synopsis_tokens > 0 and num_tokens >= synopsis_tokens
+                )
+                for index in document.indices:
+                    queue.push(document, index, 0)
+                continue
+            if (
+                result.masked is None
+                and num_tokens < min(limit, max_tokens)
+                and len(chunks) == 1
+            ):
+                small.setdefault((limit, in_book), []).append(
+                    (result, num_tokens)
+                )
+                continue
+            # Every call of a document sends the whole text (or, with a
+            # synopsis, about a chunk's worth of it) as context.
+            document = _Document(
+                result,
+                num_tokens < max_tokens,
+                num_tokens,
+                part_trackers,
+                stages,
+            )
+            document.in_book = in_book
+            document.needs_synopsis = (
+                len(chunks) > 1
+                and synopsis_tokens > 0
+                and num_tokens >= synopsis_tokens
+            )
+            for index in range(len(chunks)):
+                queue.push(document, index, 0)
+
+        for (limit, in_book), group in small.items():
+            token_counts = [tokens for _, tokens in group]
+            for pack in packing.pack_segments(token_counts, limit):
+                members = [group[i][0] for i in pack]
+                if len(members) == 1:
+                    result = members[0]
+                    document = _Document(
+                        result,
+                        True,
+                        token_counts[pack[0]],
+                        trackers.get(owner(result.key), ()),
+                        stages,
+                    )
+                else:
+                    document = _Pack(
+                        members,
+                        [token_counts[i] for i in pack],
+                        [
+                            trackers.get(owner(member.key), ())
+                            for member in members
+                        ],
+                        pack_stages,
+                    )
+                document.in_book = in_book
+                queue.push(document, 0, 0)
+
+    def settle(member: DocumentResult) -> Iterator[DocumentResult]:
+        """Yield the batch documents a finished document completes."""
+        nonlocal units_left
+        if member.key in units:
+            if member.error is None:
+                memory.add(
+                    source_lang,
+                    target_lang,
+                    member.source_text,
+                    member.final_translation,
+                )
+            units_left -= 1
+            if not units_left:
+                for result in enqueue(held):
+                    yield from settle(result)
+        elif member.key in segments:
+            key, index = segments[member.key]
+            document = files[key]
+            document.translation_1_chunks[index] = member.init_translation
+            document.reflection_chunks[index] = member.reflection
+            document.translation_2_chunks[index] = member.final_translation
+            if document.error is None:
+                document.error = member.error
+            remaining[key] -= 1
+            total = len(document.chunks)
+            if on_progress is not None:
+                on_progress(key, total - remaining[key], total)
+            if not remaining[key]:
+                yield from emit(document)
+        else:
+            yield from emit(member)
+
+    for result in enqueue(entries):
+        yield from settle(result)
+
+    def finish(document: _Document) -> List[DocumentResult]:
+        if memory is not None and document.in_book:
+            for member in document.members:
+                memory.add_aligned(
+                    source_lang,
+                    target_lang,
+                    member.source_text,
+                    member.final_translation,
+                )
+            if fuzzy is not None:
+                fuzzy.refresh()
+        return document.members
+
+    def report(document: _Document):
+        if on_progress is not None:
+            for member in document.members:
+                if member.key in position:
+                    on_progress(
+                        member.key, document.done_jobs, document.total_jobs
+                    )
+
+    stage_pools = stage_pools or {}
+    in_flight: Dict[Hashable, int] = {}
+
+    def pool_of(document: _Document, stage: int):
+        return stage_pools.get(document.stages[stage], (None, 0))
+
+    def pool_free(document: _Document, stage: int) -> bool:
+        pool, cap = pool_of(document, stage)
+        return cap <= 0 or in_flight.get(pool, 0) < cap
+
+    running: Dict = {}
+    # Glossary updates of finished documents. Each rewrites the synopsis the
+    # previous one wrote, so they run one at a time, earliest document first.
+    pending_updates: List = []
+    update_order = itertools.count()
+    updates = set()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while queue or running or updates or pending_updates:
+            stopping = should_stop is not None and should_stop()
+            paused = is_paused is not None and is_paused()
+
+            if pending_updates and not updates:
+                document = heapq.heappop(pending_updates)[-1]
+                updates.add(
+                    executor.submit(
+                        _update_glossary,
+                        document,
+                        glossary,
+                        source_lang,
+                        target_lang,
+                        caller_trackers,
+                        api_client,
+                    )
+                )
+
+            while (
+                not (stopping or paused)
+                and len(running) + len(updates) < max_workers
+            ):
+                job = queue.pop(pool_free if stage_pools else None)
+                if job is None:
+                    break
+                document, index, stage = job
+                pool, _ = pool_of(document, stage)
+                in_flight[pool] = in_flight.get(pool, 0) + 1
+                if not document.started:
+                    document.started = True
+                    report(document)
+                future = executor.submit(
+                    _run_job,
+                    document,
+                    index,
+                    stage,
+                    source_lang,
+                    target_lang,
+                    country,
+                    quality_threshold,
+                    quality_check,
+                    synopsis_cache,
+                    glossary,
+                    fuzzy,
+                    caller_trackers,
+                    api_client,
+                )
+                running[future] = job
+
+            if not running and not updates:
+                if stopping or not queue:
+                    break
+                time.sleep(POLL_INTERVAL)
+                continue
+
+            done, _ = wait(
+                [*running, *updates],
+                timeout=POLL_INTERVAL,
+                return_when=FIRST_COMPLETED,
+            )
+            for future in done:
+                if future in updates:
+                    # A failed update leaves the glossary as it was; the
+                    # document itself is done.
+                    updates.discard(future)
+                    continue
+                document, index, stage = running.pop(future)
+                pool, _ = pool_of(document, stage)
+                in_flight[pool] -= 1
+                if document.failed:
+                    continue
+                try:
+                    output = future.result()
+                except Exception as e:
+                    document.fail(e)
+                    for member in document.members:
+                        yield from settle(member)
+                    continue
+
+                accepted = output.pop("accepted", False)
+                document.store(index, output)
+                if len(document.stages) == 1:
+                    # Without revision stages the draft is the final text.
+                    document.store(
+                        index,
+                        {"translation_2_chunks": output["translation_1_chunks"]},
+                    )
+                document.done_jobs += 1
+                if stage == 0:
+                    document.drafted_jobs += 1
+                    if (
+                        on_draft is not None
+                        and document.drafted_jobs == document.draft_jobs
+                    ):
+                        for member in document.members:
+                            if member.key in position:
+                                on_draft(member)
+
+                if accepted:
+                    _skip_revision(document, index, caller_trackers)
+                    stage = len(document.stages) - 1
+                report(document)
+
+                result = document.result
+                if (
+                    result.masked is not None
+                    and stage + 1 == len(document.stages)
+                    and result.masked.missing(
+                        result.chunks[index],
+                        result.translation_2_chunks[index],
+                    )
+                ):
+                    # A placeholder was lost: translate the chunk unmasked.
+                    result.chunks[index] = result.masked.unmask(
+                        result.chunks[index]
+                    )
+                    document.done_jobs -= len(document.stages)
+                    queue.push(document, index, 0)
+                    continue
+
+                if stage + 1 < len(document.stages):
+                    queue.push(document, index, stage + 1)
+                elif document.done_jobs == document.total_jobs:
+                    if glossary is not None and document.in_book:
+                        first = min(
+                            position[owner(member.key)]
+                            for member in document.members
+                        )
+                        heapq.heappush(
+                            pending_updates,
+                            (first, next(update_order), document),
+                        )
+                    for member in finish(document):
+                        yield from settle(member)
@@ -0,0 +1,216 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, List, Optional
+
+from . import packing, utils
+from .usage import record_skip, usage_stage
+
+
+SYNOPSIS_STAGE = "synopsis"
+# Source tokens summarised in one call; longer texts are summarised part by
+# part and the partial synopses merged.
+SYNOPSIS_MAP_TOKENS = 16000
+# Length limit given to the model for a synopsis and its terminology list.
+SYNOPSIS_MAX_WORDS = 400
+
+SYNOPSIS_SYSTEM_MESSAGE = "You are an expert editor preparing a text for translation."
+
+_INSTRUCTIONS = """Translators will work on this text one part at a time and will see only that part, the text around it and your notes. \
+Write notes that keep the translation of every part consistent, in {source_lang} and in at most {max_words} words:
+1. A synopsis: what the text is about, its genre, register and tone, and how it develops from beginning to end.
+2. A terminology list: the names of people, places and organisations and the recurring terms and phrases, one per line as "term: short explanation".
+
+Output only the synopsis and the terminology list."""
+
+
+class SynopsisCache:
+    """
+    Synopses keyed by a hash of the source text.
+
+    A synopsis depends on the source text alone, so one entry serves every
+    target language. With a path the entries are kept in a JSON file and
+    reused by later runs.
+
+    Args:
+        path (str, optional): The JSON file, created on the first put.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: Dict[str, str] = {}
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self._entries = json.load(f)
+
+    @staticmethod
+    def key(source_lang: str, source_text: str) -> str:
+        payload = f"{source_lang}\n{source_text}"
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, source_lang: str, source_text: str) -> Optional[str]:
+        with self._lock:
+            return self._entries.get(self.key(source_lang, source_text))
+
+    def put(self, source_lang: str, source_text: str, synopsis: str):
+        with self._lock:
+            self._entries[self.key(source_lang, source_text)] = synopsis
+            if not self.path:
+                return
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.path)
+
+
+_default_cache = SynopsisCache()
+
+
+def summarize_text(
+    source_lang: str, source_text: str, part: int = 0, parts: int = 1
+) -> str:
+    """
+    Write the synopsis and terminology list of a text, or of one part of it.
+
+    Args:
+        source_lang (str): The language of the text.
+        source_text (str): The text, or its part ``part`` of ``parts``.
+        part (int): The index of the part.
+        parts (int): The number of parts of the whole text.
+
+    Returns:
+        str: The synopsis followed by the terminology list.
+    """
+    what = f"a {source_lang} text"
+    if parts > 1:
+        what = f"part {part + 1} of {parts} of a {source_lang} text"
+    instructions = _INSTRUCTIONS.format(
+        source_lang=source_lang, max_words=SYNOPSIS_MAX_WORDS
+    )
+    prompt = f"""Below, delimited by XML tags <SOURCE_TEXT> and </SOURCE_TEXT>, is {what}.
+
+<SOURCE_TEXT>
+{source_text}
+</SOURCE_TEXT>
+
+{instructions}"""
+
+    with usage_stage(SYNOPSIS_STAGE):
+        return utils.get_completion(
+            prompt, system_message=SYNOPSIS_SYSTEM_MESSAGE
+        )
+
+
+def merge_synopses(source_lang: str, synopses: List[str]) -> str:
+    """
+    Merge the notes on consecutive parts of a text into notes on the whole.
+
+    Args:
+        source_lang (str): The language of the text.
+        synopses (List[str]): The synopsis and terminology list of each
+            part, in order.
+
+    Returns:
+        str: One synopsis followed by one terminology list.
+    """
+    notes = "\n\n".join(
+        f"<PART_{i + 1}>\n{synopsis}\n</PART_{i + 1}>"
+        for i, synopsis in enumerate(synopses)
+    )
+    instructions = _INSTRUCTIONS.format(
+        source_lang=source_lang, max_words=SYNOPSIS_MAX_WORDS
+    )
+    prompt = f"""Below are notes on {len(synopses)} consecutive parts of a {source_lang} text, \
+each delimited by XML tags <PART_n> and </PART_n>. \
+Merge them into notes on the whole text, with one synopsis and a single terminology list in which every term appears once.
+
+{notes}
+
+{instructions}"""
+
+    with usage_stage(SYNOPSIS_STAGE):
+        return utils.get_completion(
+            prompt, system_message=SYNOPSIS_SYSTEM_MESSAGE
+        )
+
+
+def build_synopsis(
+    source_lang: str, source_text: str, map_tokens: int = SYNOPSIS_MAP_TOKENS
+) -> str:
+    """
+    Write the synopsis and terminology list of a whole text.
+
+    A text of up to ``map_tokens`` tokens is summarised in one call. Longer
+    texts are split into parts of that size that are summarised separately
+    (map) and their notes merged, in groups of up to ``map_tokens`` tokens
+    until one remains (reduce).
+
+    Args:
+        source_lang (str): The language of the text.
+        source_text (str): The text.
+        map_tokens (int): The most source or note tokens sent in one call.
+
+    Returns:
+        str: The synopsis followed by the terminology list.
+    """
+    num_tokens = utils.num_tokens_in_string(source_text)
+    if num_tokens <= map_tokens:
+        return summarize_text(source_lang, source_text)
+
+    parts = utils.split_source_text(source_text, map_tokens, num_tokens)
+    synopses = [
+        summarize_text(source_lang, part, i, len(parts))
+        for i, part in enumerate(parts)
+    ]
+    while len(synopses) > 1:
+        groups = packing.pack_segments(
+            [utils.num_tokens_in_string(s) for s in synopses], map_tokens
+        )
+        if len(groups) == len(synopses):
+            # Every note fills a call of its own: merge them all at once.
+            groups = [list(range(len(synopses)))]
+        synopses = [
+            merge_synopses(source_lang, [synopses[i] for i in group])
+            if len(group) > 1
+            else synopses[group[0]]
+            for group in groups
+        ]
+    return synopses[0]
+
+
+def document_synopsis(
+    source_lang: str,
+    source_text: str,
+    cache: Optional[SynopsisCache] = None,
+    map_tokens: int = SYNOPSIS_MAP_TOKENS,
+) -> str:
+    """
+    Return the synopsis of a text, from the cache when it was built before.
+
+    A cache hit is recorded as a skipped "synopsis" call.
+
+    Args:
+        source_lang (str): The language of the text.
+        source_text (str): The text.
+        cache (SynopsisCache, optional): Where synopses are looked up and
+            stored; by default a cache shared by the whole process.
+        map_tokens (int): See build_synopsis.
+
+    Returns:
+        str: The synopsis followed by the terminology list.
+    """
+    cache = cache if cache is not None else _default_cache
+    synopsis = cache.get(source_lang, source_text)
+    if synopsis is not None:
+        record_skip(SYNOPSIS_STAGE)
+        return synopsis
+    synopsis = build_synopsis(source_lang, source_text, map_tokens)
+    cache.put(source_lang, source_text, synopsis)
+    return synopsis
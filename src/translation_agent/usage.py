@@ -0,0 +1,681 @@
+import csv
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+# Prices in USD per 1M tokens: (input, cached input, output).
+# Models missing from the table are accounted with zero cost.
+DEFAULT_PRICE_TABLE = {
+    "gpt-4-turbo": (10.0, 10.0, 30.0),
+    "gpt-4o": (2.5, 1.25, 10.0),
+    "gpt-4o-mini": (0.15, 0.075, 0.6),
+}
+
+STAGE_OTHER = "other"
+
+_local = threading.local()
+
+
+def _usage_field(usage, name: str) -> int:
+    """Read a field from an OpenAI usage object or a plain dict."""
+    if usage is None:
+        return 0
+    if isinstance(usage, dict):
+        value = usage.get(name)
+    else:
+        value = getattr(usage, name, None)
+    return int(value or 0)
+
+
+def cached_prompt_tokens(usage) -> int:
+    """
+    Return the number of cached prompt tokens reported by the provider.
+
+    OpenAI reports them under ``prompt_tokens_details.cached_tokens``; some
+    compatible providers use a flat ``cached_tokens`` or
+    ``prompt_cache_hit_tokens`` field instead.
+    """
+    if usage is None:
+        return 0
+    if isinstance(usage, dict):
+        details = usage.get("prompt_tokens_details")
+    else:
+        details = getattr(usage, "prompt_tokens_details", None)
+    cached = _usage_field(details, "cached_tokens")
+    if cached:
+        return cached
+    return _usage_field(usage, "cached_tokens") or _usage_field(
+        usage, "prompt_cache_hit_tokens"
+    )
+
+
+def prediction_tokens(usage) -> Tuple[int, int]:
+    """
+    Return the accepted and rejected predicted-output tokens of a completion.
+
+    OpenAI reports them under ``completion_tokens_details`` when the request
+    carried a ``prediction``; other providers report nothing, i.e. (0, 0).
+    """
+    if usage is None:
+        return 0, 0
+    if isinstance(usage, dict):
+        details = usage.get("completion_tokens_details")
+    else:
+        details = getattr(usage, "completion_tokens_details", None)
+    return (
+        _usage_field(details, "accepted_prediction_tokens"),
+        _usage_field(details, "rejected_prediction_tokens"),
+    )
+
+
+class UsageStats:
+    """Token counters for a group of completions."""
+
+    def __init__(self):
+        self.calls = 0
+        # Calls the pipeline decided not to make, e.g. improve calls after a
+        # reflection that found nothing to fix.
+        self.skipped = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        # Predicted-output tokens that did / did not match the completion.
+        self.accepted_prediction_tokens = 0
+        self.rejected_prediction_tokens = 0
+        self.latency = 0.0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def add(
+        self,
+        prompt_tokens: int,
+        completion_tokens: int,
+        cached_tokens: int = 0,
+        latency: float = 0.0,
+        calls: int = 1,
+        accepted_prediction_tokens: int = 0,
+        rejected_prediction_tokens: int = 0,
+    ):
+        self.calls += calls
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.cached_tokens += cached_tokens
+        self.latency += latency
+        self.accepted_prediction_tokens += accepted_prediction_tokens
+        self.rejected_prediction_tokens += rejected_prediction_tokens
+
+    def merge(self, other: "UsageStats"):
+        self.add(
+            other.prompt_tokens,
+            other.completion_tokens,
+            other.cached_tokens,
+            other.latency,
+            other.calls,
+            other.accepted_prediction_tokens,
+            other.rejected_prediction_tokens,
+        )
+        self.skipped += other.skipped
+
+    def to_dict(self) -> Dict[str, float]:
+        return {
+            "calls": self.calls,
+            "skipped": self.skipped,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "completion_tokens": self.completion_tokens,
+            "accepted_prediction_tokens": self.accepted_prediction_tokens,
+            "rejected_prediction_tokens": self.rejected_prediction_tokens,
+            "total_tokens": self.total_tokens,
+            "latency": round(self.latency, 3),
+        }
+
+
+class UsageTracker:
+    """
+    Thread-safe aggregation of completion usage per stage and per model.
+
+    A tracker is bound to the current thread with ``track_usage``; every
+    completion made while it is bound is recorded into it. Trackers can be
+    nested, e.g. one per file inside one per batch.
+    """
+
+    def __init__(self, name: str = "", price_table: Optional[Dict] = None):
+        self.name = name
+        self.price_table = (
+            DEFAULT_PRICE_TABLE if price_table is None else price_table
+        )
+        self._lock = threading.Lock()
+        self._stages: Dict[str, UsageStats] = {}
+        self._models: Dict[str, UsageStats] = {}
+        self.total = UsageStats()
+        # Chunks whose draft went through the cascade check, and how many of
+        # them were escalated to the revision stages.
+        self.checked = 0
+        self.escalated = 0
+        # Paragraphs looked up in a translation memory, how many were served
+        # from it, and their source tokens, which no call had to send.
+        self.memory_segments = 0
+        self.memory_hits = 0
+        self.memory_tokens = 0
+        # Duplicate documents and paragraphs of a batch that were translated
+        # once and copied, and the calls the copies did not make.
+        self.duplicate_documents = 0
+        self.duplicate_paragraphs = 0
+        self.duplicate_calls = 0
+        # Untranslatable segments passed through behind placeholders, and
+        # the source tokens they took out of the prompts.
+        self.masked_segments = 0
+        self.masked_tokens = 0
+
+    def record(
+        self,
+        stage: str,
+        model: str,
+        prompt_tokens: int,
+        completion_tokens: int,
+        cached_tokens: int = 0,
+        latency: float = 0.0,
+        accepted_prediction_tokens: int = 0,
+        rejected_prediction_tokens: int = 0,
+    ):
+        counts = (
+            prompt_tokens,
+            completion_tokens,
+            cached_tokens,
+            latency,
+            1,
+            accepted_prediction_tokens,
+            rejected_prediction_tokens,
+        )
+        with self._lock:
+            for key, table in ((stage, self._stages), (model, self._models)):
+                table.setdefault(key, UsageStats()).add(*counts)
+            self.total.add(*counts)
+
+    def record_skip(self, stage: str):
+        with self._lock:
+            self._stages.setdefault(stage, UsageStats()).skipped += 1
+            self.total.skipped += 1
+
+    def record_cascade(self, escalated: bool):
+        with self._lock:
+            self.checked += 1
+            self.escalated += int(escalated)
+
+    def record_memory(self, segments: int, hits: int, tokens: int):
+        with self._lock:
+            self.memory_segments += segments
+            self.memory_hits += hits
+            self.memory_tokens += tokens
+
+    def record_duplicates(self, documents: int, paragraphs: int, calls: int):
+        with self._lock:
+            self.duplicate_documents += documents
+            self.duplicate_paragraphs += paragraphs
+            self.duplicate_calls += calls
+
+    def record_masked(self, segments: int, tokens: int):
+        with self._lock:
+            self.masked_segments += segments
+            self.masked_tokens += tokens
+
+    @property
+    def memory_hit_rate(self) -> Optional[float]:
+        """The share of paragraphs served from memory, None if none was."""
+        if not self.memory_segments:
+            return None
+        return self.memory_hits / self.memory_segments
+
+    @property
+    def escalation_rate(self) -> Optional[float]:
+        """The share of checked drafts that were revised, None if none was."""
+        if not self.checked:
+            return None
+        return self.escalated / self.checked
+
+    def saved_latency(self) -> float:
+        """
+        Estimate the request time saved by the skipped calls.
+
+        Each skipped call is valued at the mean latency of the calls made in
+        the same stage; stages where every call was skipped count as zero.
+        """
+        return sum(
+            stats.skipped * stats.latency / stats.calls
+            for stats in self.stages.values()
+            if stats.calls
+        )
+
+    @property
+    def stages(self) -> Dict[str, UsageStats]:
+        with self._lock:
+            return dict(self._stages)
+
+    @property
+    def models(self) -> Dict[str, UsageStats]:
+        with self._lock:
+            return dict(self._models)
+
+    def cost(self) -> float:
+        """Return the estimated cost in USD using the tracker's price table."""
+        return sum(
+            estimate_cost(model, stats, self.price_table)
+            for model, stats in self.models.items()
+        )
+
+    def summary(self) -> Dict:
+        """Return a JSON-serialisable summary of the recorded usage."""
+        return {
+            "name": self.name,
+            **self.total.to_dict(),
+            "cost": round(self.cost(), 6),
+            "cascade": {
+                "checked": self.checked,
+                "escalated": self.escalated,
+                "saved_latency": round(self.saved_latency(), 3),
+            },
+            "memory": {
+                "segments": self.memory_segments,
+                "hits": self.memory_hits,
+                "tokens": self.memory_tokens,
+            },
+            "duplicates": {
+                "documents": self.duplicate_documents,
+                "paragraphs": self.duplicate_paragraphs,
+                "calls": self.duplicate_calls,
+            },
+            "masked": {
+                "segments": self.masked_segments,
+                "tokens": self.masked_tokens,
+            },
+            "stages": {k: v.to_dict() for k, v in self.stages.items()},
+            "models": {k: v.to_dict() for k, v in self.models.items()},
+        }
+
+    def format_summary(self) -> str:
+        """Return a short human readable summary."""
+        total = self.total
+        lines = [
+            f"calls: {total.calls}",
+            f"prompt tokens: {total.prompt_tokens} "
+            f"(cached: {total.cached_tokens})",
+            f"completion tokens: {total.completion_tokens}",
+            f"cost: ${self.cost():.4f}",
+        ]
+        for stage, stats in self.stages.items():
+            line = (
+                f"  {stage}: {stats.calls} calls, "
+                f"{stats.prompt_tokens} in / {stats.completion_tokens} out"
+            )
+            if stats.skipped:
+                line += f", {stats.skipped} skipped"
+            predicted = (
+                stats.accepted_prediction_tokens
+                + stats.rejected_prediction_tokens
+            )
+            if predicted:
+                line += (
+                    f", {stats.accepted_prediction_tokens}/{predicted} "
+                    "prediction tokens accepted"
+                )
+            lines.append(line)
+        if self.checked:
+            lines.append(
+                f"cascade: {self.escalated}/{self.checked} drafts escalated "
+                f"({self.escalation_rate:.0%}), "
+                f"~{self.saved_latency():.1f}s of requests saved"
+            )
+        if self.memory_segments:
+            lines.append(
+                f"memory: {self.memory_hits}/{self.memory_segments} "
+                f"paragraphs served ({self.memory_hit_rate:.0%}), "
+                f"{self.memory_tokens} source tokens not sent"
+            )
+        if self.duplicate_documents or self.duplicate_paragraphs:
+            lines.append(
+                f"duplicates: {self.duplicate_documents} documents and "
+                f"{self.duplicate_paragraphs} paragraphs copied, "
+                f"{self.duplicate_calls} calls skipped"
+            )
+        if self.masked_segments:
+            lines.append(
+                f"masked: {self.masked_segments} segments passed through, "
+                f"{self.masked_tokens} source tokens not sent"
+            )
+        return "\n".join(lines)
+
+
+class SharedTracker:
+    """
+    Record a share of each completion into another tracker.
+
+    Used where one request serves several documents, e.g. a packed request:
+    every document counts the call, and the fraction ``share`` of its tokens
+    and latency. Skipped calls cannot be attributed to one document and are
+    not forwarded.
+    """
+
+    def __init__(self, tracker: UsageTracker, share: float):
+        self.tracker = tracker
+        self.share = share
+
+    def record(
+        self,
+        stage: str,
+        model: str,
+        prompt_tokens: int,
+        completion_tokens: int,
+        cached_tokens: int = 0,
+        latency: float = 0.0,
+        accepted_prediction_tokens: int = 0,
+        rejected_prediction_tokens: int = 0,
+    ):
+        share = self.share
+        self.tracker.record(
+            stage,
+            model,
+            round(prompt_tokens * share),
+            round(completion_tokens * share),
+            round(cached_tokens * share),
+            latency * share,
+            round(accepted_prediction_tokens * share),
+            round(rejected_prediction_tokens * share),
+        )
+
+    def record_skip(self, stage: str):
+        pass
+
+    def record_cascade(self, escalated: bool):
+        pass
+
+    def record_memory(self, segments: int, hits: int, tokens: int):
+        pass
+
+    def record_duplicates(self, documents: int, paragraphs: int, calls: int):
+        pass
+
+    def record_masked(self, segments: int, tokens: int):
+        pass
+
+
+def estimate_cost(
+    model: str, stats: UsageStats, price_table: Optional[Dict] = None
+) -> float:
+    """
+    Estimate the cost of the given usage in USD.
+
+    Args:
+        model (str): The model name used to look up prices.
+        stats (UsageStats): The usage to price.
+        price_table (dict, optional): Maps model name to a tuple or list of
+            (input, cached input, output) USD prices per 1M tokens.
+
+    Returns:
+        float: The estimated cost, 0.0 for models missing from the table.
+    """
+    price_table = DEFAULT_PRICE_TABLE if price_table is None else price_table
+    prices = price_table.get(model)
+    if not prices:
+        return 0.0
+    input_price, cached_price, output_price = (list(prices) + [0, 0, 0])[:3]
+    uncached = stats.prompt_tokens - stats.cached_tokens
+    return (
+        uncached * input_price
+        + stats.cached_tokens * cached_price
+        + stats.completion_tokens * output_price
+    ) / 1_000_000
+
+
+def merge_price_table(overrides: Optional[Dict] = None) -> Dict:
+    """Return the default price table updated with user supplied prices."""
+    table = dict(DEFAULT_PRICE_TABLE)
+    table.update(overrides or {})
+    return table
+
+
+def _trackers() -> List[UsageTracker]:
+    if not hasattr(_local, "trackers"):
+        _local.trackers = []
+    return _local.trackers
+
+
+def current_stage() -> str:
+    """Return the pipeline stage bound to the current thread."""
+    stages = getattr(_local, "stages", None)
+    return stages[-1] if stages else STAGE_OTHER
+
+
+@contextmanager
+def usage_stage(stage: str):
+    """Attribute completions made inside the block to ``stage``."""
+    if not hasattr(_local, "stages"):
+        _local.stages = []
+    _local.stages.append(stage)
+    try:
+        yield
+    finally:
+        _local.stages.pop()
+
+
+@contextmanager
+def track_usage(*trackers: UsageTracker):
+    """Record completions made by the current thread into ``trackers``."""
+    bound = _trackers()
+    bound.extend(trackers)
+    try:
+        yield
+    finally:
+        del bound[len(bound) - len(trackers) :]
+
+
+def bound_trackers() -> List[UsageTracker]:
+    """Return the trackers bound to the current thread."""
+    return list(_trackers())
+
+
+def record_usage(
+    model: str, usage, latency: float = 0.0, measured: bool = False
+):
+    """
+    Record the usage of a completion response into the bound trackers.
+
+    Args:
+        model (str): The model that served the completion.
+        usage: The ``usage`` attribute of the response, may be None.
+        latency (float): Wall time of the request in seconds.
+        measured (bool): Whether the latency comes from a real request and
+            should feed ``latency_model``.
+    """
+    prompt_tokens = _usage_field(usage, "prompt_tokens")
+    completion_tokens = _usage_field(usage, "completion_tokens")
+    cached_tokens = cached_prompt_tokens(usage)
+    accepted, rejected = prediction_tokens(usage)
+    if measured:
+        latency_model.observe(model, latency, completion_tokens)
+    stage = current_stage()
+    for tracker in _trackers():
+        tracker.record(
+            stage,
+            model,
+            prompt_tokens,
+            completion_tokens,
+            cached_tokens,
+            latency,
+            accepted,
+            rejected,
+        )
+
+
+def record_skip(stage: Optional[str] = None):
+    """Count a call skipped by the pipeline in the bound trackers."""
+    stage = stage or current_stage()
+    for tracker in _trackers():
+        tracker.record_skip(stage)
+
+
+def record_cascade(escalated: bool):
+    """Count a cascade decision on one draft in the bound trackers."""
+    for tracker in _trackers():
+        tracker.record_cascade(escalated)
+
+
+def record_memory(segments: int, hits: int, tokens: int):
+    """Count translation memory lookups of one text in the bound trackers."""
+    for tracker in _trackers():
+        tracker.record_memory(segments, hits, tokens)
+
+
+def record_duplicates(documents: int, paragraphs: int, calls: int):
+    """Count batch duplicates served by copying in the bound trackers."""
+    for tracker in _trackers():
+        tracker.record_duplicates(documents, paragraphs, calls)
+
+
+def record_masked(segments: int, tokens: int):
+    """Count segments passed through untranslated in the bound trackers."""
+    for tracker in _trackers():
+        tracker.record_masked(segments, tokens)
+
+
+class LatencyModel:
+    """
+    Per-model linear fit of request latency against completion tokens.
+
+    Fed with the measured latency of real requests, it predicts how long a
+    planned request will take: ``latency = a + b * completion_tokens``.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sums: Dict[str, List[float]] = {}
+
+    def observe(self, model: str, latency: float, completion_tokens: int):
+        with self._lock:
+            sums = self._sums.setdefault(model, [0.0] * 5)
+            x, y = float(completion_tokens), float(latency)
+            for i, value in enumerate((1.0, x, y, x * x, x * y)):
+                sums[i] += value
+
+    def has_data(self, model: str) -> bool:
+        with self._lock:
+            return model in self._sums
+
+    def coefficients(self, model: str):
+        """Return (seconds per request, seconds per completion token)."""
+        with self._lock:
+            sums = self._sums.get(model)
+            if sums is None:
+                return None
+            n, sx, sy, sxx, sxy = sums
+        denominator = n * sxx - sx * sx
+        if n < 2 or denominator <= 0:
+            return sy / n, 0.0
+        slope = max((n * sxy - sx * sy) / denominator, 0.0)
+        intercept = max((sy - slope * sx) / n, 0.0)
+        return intercept, slope
+
+    def predict(self, model: str, calls: int, completion_tokens: int):
+        """Return the summed latency of ``calls`` requests, or None."""
+        coefficients = self.coefficients(model)
+        if coefficients is None:
+            return None
+        intercept, slope = coefficients
+        return calls * intercept + completion_tokens * slope
+
+
+# Latency measured across all real requests of this process.
+latency_model = LatencyModel()
+
+
+class Timer:
+    """Measure the wall time of a request."""
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.elapsed = 0.0
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+        return False
+
+
+REPORT_FIELDS = [
+    "name",
+    "stage",
+    "calls",
+    "skipped",
+    "prompt_tokens",
+    "cached_tokens",
+    "completion_tokens",
+    "accepted_prediction_tokens",
+    "rejected_prediction_tokens",
+    "total_tokens",
+    "latency",
+    "cost",
+    "masked_tokens",
+]
+
+
+def write_usage_report(
+    trackers: Iterable[UsageTracker],
+    output_folder: str,
+    basename: str = "usage_report",
+    batch: Optional[UsageTracker] = None,
+) -> List[str]:
+    """
+    Write CSV and JSON usage reports next to the translation outputs.
+
+    Args:
+        trackers (Iterable[UsageTracker]): One tracker per translated file.
+        output_folder (str): The folder the reports are written to.
+        basename (str): File name of the reports without extension.
+        batch (UsageTracker, optional): Batch totals to append to the report.
+
+    Returns:
+        List[str]: The paths of the written reports.
+    """
+    trackers = list(trackers)
+    if batch is not None:
+        trackers.append(batch)
+
+    rows = []
+    for tracker in trackers:
+        rows.append(
+            {
+                "name": tracker.name,
+                "stage": "total",
+                **tracker.total.to_dict(),
+                "cost": round(tracker.cost(), 6),
+                "masked_tokens": tracker.masked_tokens,
+            }
+        )
+        for stage, stats in tracker.stages.items():
+            rows.append(
+                {"name": tracker.name, "stage": stage, **stats.to_dict()}
+            )
+
+    os.makedirs(output_folder, exist_ok=True)
+    csv_path = os.path.join(output_folder, f"{basename}.csv")
+    json_path = os.path.join(output_folder, f"{basename}.json")
+
+    with open(csv_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS, restval="")
+        writer.writeheader()
+        writer.writerows(rows)
+
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(
+            [tracker.summary() for tracker in trackers],
+            f,
+            indent=2,
+            ensure_ascii=False,
+        )
+
+    return [csv_path, json_path]
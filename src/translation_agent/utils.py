@@ -1,11 +1,25 @@
+import json
 import os
-from typing import List, Union
+import re
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple, Union
 
 import openai
 import tiktoken
 from dotenv import load_dotenv
 from icecream import ic
 
+from .cassette import CassetteMiss, active_cassette
+from .quality import passes_quality_gate
+from .usage import (
+    Timer,
+    record_cascade,
+    record_skip,
+    record_usage,
+    usage_stage,
+)
+
 # Delay import of langchain_text_splitters to avoid initialization issues
 RecursiveCharacterTextSplitter = None
 
@@ -37,6 +51,31 @@ MAX_TOKENS_PER_CHUNK = (
 )
 # discrete chunks to translate one chunk at a time
 
+# How the initial translation is revised: a reflect call followed by an
+# improve call, or one call returning both as JSON.
+REVISION_SEPARATE = "separate"
+REVISION_COMBINED = "combined"
+# The reflection is a JSON list of span replacements applied locally, with
+# the improve call only as a fallback when they do not apply cleanly.
+REVISION_EDITS = "edits"
+
+# How much LLM work each chunk gets: the initial translation only, one
+# revision call on top of it, or the full reflect and improve stages.
+TIER_DRAFT = "draft"
+TIER_STANDARD = "standard"
+TIER_FULL = "full"
+PIPELINE_TIERS = (TIER_DRAFT, TIER_STANDARD, TIER_FULL)
+
+# How a draft is checked before it is escalated to the revision stages: the
+# local heuristics of quality.score_translation only, or the heuristics
+# followed by a short self-rating call to the drafting model.
+CHECK_HEURISTIC = "heuristic"
+CHECK_SELF_RATING = "self_rating"
+QUALITY_CHECKS = (CHECK_HEURISTIC, CHECK_SELF_RATING)
+
+# Verdict the reflection prompts ask for when the translation is fine.
+NO_CHANGES = "NO_CHANGES"
+
 
 def get_completion(
     prompt: str,
@@ -44,6 +83,7 @@ def get_completion(
     model: str = "gpt-4-turbo",
     temperature: float = 0.3,
     json_mode: bool = False,
+    prediction: Optional[str] = None,
 ) -> Union[str, dict]:
     """
         Generate a completion using the OpenAI API.
@@ -58,6 +98,9 @@ def get_completion(
             Defaults to 0.3.
         json_mode (bool, optional): Whether to return the response in JSON format.
             Defaults to False.
+        prediction (str, optional): Text the completion is expected to mostly
+            repeat, sent as a predicted output on endpoints that accept one.
+            Defaults to None.
 
     Returns:
         Union[str, dict]: The generated completion.
@@ -65,8 +108,10 @@ def get_completion(
             If json_mode is False, returns the generated text as a string.
     """
 
+    params = prediction_params(prediction)
     if json_mode:
-        response = client.chat.completions.create(
+        response = chat_completion(
+            client,
             model=model,
             temperature=temperature,
             top_p=1,
@@ -75,10 +120,12 @@ def get_completion(
                 {"role": "system", "content": system_message},
                 {"role": "user", "content": prompt},
             ],
+            **params,
         )
         return response.choices[0].message.content
     else:
-        response = client.chat.completions.create(
+        response = chat_completion(
+            client,
             model=model,
             temperature=temperature,
             top_p=1,
@@ -86,10 +133,216 @@ def get_completion(
                 {"role": "system", "content": system_message},
                 {"role": "user", "content": prompt},
             ],
+            **params,
         )
         return response.choices[0].message.content
 
 
+# (base URL, model) -> whether the endpoint accepts predicted outputs.
+# Endpoints missing from the table are tried once with a prediction.
+_prediction_support: Dict[Tuple[str, str], bool] = {}
+
+
+def prediction_params(prediction: Optional[str]) -> Dict:
+    """Return the request parameters carrying a predicted output."""
+    if not prediction:
+        return {}
+    return {"prediction": {"type": "content", "content": prediction}}
+
+
+def _endpoint(api_client, model: str) -> Tuple[str, str]:
+    return str(getattr(api_client, "base_url", "") or ""), model or ""
+
+
+def prediction_supported(api_client, model: str) -> Optional[bool]:
+    """
+    Whether an endpoint accepts predicted outputs.
+
+    Returns:
+        Optional[bool]: None until a request with a prediction has been
+            made to the endpoint.
+    """
+    return _prediction_support.get(_endpoint(api_client, model))
+
+
+def _rejects_prediction(error: Exception) -> bool:
+    """Whether the API rejected a request for its ``prediction`` parameter."""
+    if not isinstance(
+        error, (openai.BadRequestError, openai.UnprocessableEntityError)
+    ):
+        return False
+    return "predict" in str(error).lower()
+
+
+_client_override = threading.local()
+
+
+@contextmanager
+def use_client(api_client):
+    """
+    Send the completions made by the current thread to ``api_client``.
+
+    Used for dry runs: the override takes precedence over the configured
+    client and any installed cassette, and only affects the calling thread.
+    """
+    previous = getattr(_client_override, "client", None)
+    _client_override.client = api_client
+    try:
+        yield api_client
+    finally:
+        _client_override.client = previous
+
+
+def overriding_client():
+    """Return the client installed with ``use_client`` on this thread."""
+    return getattr(_client_override, "client", None)
+
+
+_synopsis = threading.local()
+
+
+@contextmanager
+def use_synopsis(synopsis: Optional[str]):
+    """
+    Send ``synopsis`` instead of the whole source text with the chunk
+    prompts made by the current thread.
+
+    None keeps the whole source text. See synopsis.document_synopsis.
+    """
+    previous = getattr(_synopsis, "text", None)
+    _synopsis.text = synopsis
+    try:
+        yield synopsis
+    finally:
+        _synopsis.text = previous
+
+
+def current_synopsis() -> Optional[str]:
+    """Return the synopsis installed with ``use_synopsis`` on this thread."""
+    return getattr(_synopsis, "text", None)
+
+
+_book_context = threading.local()
+
+
+@contextmanager
+def use_book_context(notes: Optional[str]):
+    """
+    Add ``notes`` to the system message of the completions made by the
+    current thread.
+
+    Used for the names, terms and synopsis a book shares across its
+    documents, see glossary.BookGlossary.context, and for the references of
+    fuzzy.FuzzyMemory. Nested blocks add their notes to those of the
+    enclosing ones. None or "" adds nothing.
+    """
+    previous = getattr(_book_context, "notes", None)
+    if previous and notes:
+        _book_context.notes = f"{previous}\n\n{notes}"
+    else:
+        _book_context.notes = notes or previous
+    try:
+        yield _book_context.notes
+    finally:
+        _book_context.notes = previous
+
+
+def current_book_context() -> Optional[str]:
+    """Return the notes installed with ``use_book_context`` on this thread."""
+    return getattr(_book_context, "notes", None)
+
+
+def _with_book_context(messages: List[Dict], notes: str) -> List[Dict]:
+    """Append the book notes to the system message, or add one."""
+    if messages and messages[0].get("role") == "system":
+        system = dict(messages[0])
+        system["content"] = f"{system.get('content') or ''}\n\n{notes}"
+        return [system] + list(messages[1:])
+    return [{"role": "system", "content": notes}] + list(messages)
+
+
+def _send(api_client, cassette, params: Dict):
+    """Send a request, through the cassette if any, and time it."""
+    with Timer() as timer:
+        if cassette is not None:
+            response = cassette.create(api_client, **params)
+        else:
+            response = api_client.chat.completions.create(**params)
+    return response, timer.elapsed
+
+
+def chat_completion(api_client, **params):
+    """
+    Send a chat completion request and record its token usage.
+
+    Every completion made by the pipeline goes through this function, so the
+    usage reported in ``response.usage`` (including cached prompt tokens) is
+    attributed to the stage and trackers bound to the calling thread. When a
+    cassette is installed the request is recorded or replayed through it.
+    Notes bound with ``use_book_context`` are added to the system message,
+    so every prompt of a document carries them whoever built it.
+
+    A ``prediction`` parameter is dropped for endpoints that rejected one
+    before; the first rejection by an endpoint is retried without it. A
+    replayed request with a prediction that misses the cassette is retried
+    once without it too, and the endpoint is marked unsupported only when
+    that retry is found.
+
+    Args:
+        api_client: An OpenAI compatible client.
+        **params: Keyword arguments for ``client.chat.completions.create``.
+
+    Returns:
+        The API response.
+    """
+    notes = current_book_context()
+    if notes:
+        params = dict(
+            params,
+            messages=_with_book_context(params.get("messages", []), notes),
+        )
+
+    cassette = active_cassette()
+    dry_run = overriding_client() is not None
+    if dry_run:
+        api_client, cassette = overriding_client(), None
+
+    # Predicted outputs are only sent to endpoints not known to reject them.
+    endpoint = _endpoint(api_client, params.get("model", ""))
+    if "prediction" in params and _prediction_support.get(endpoint) is False:
+        params = {k: v for k, v in params.items() if k != "prediction"}
+
+    try:
+        response, latency = _send(api_client, cassette, params)
+    except CassetteMiss:
+        if "prediction" not in params:
+            raise
+        # A cassette recorded against an endpoint that rejected the
+        # prediction holds the retry without it; only that hit says so.
+        params = {k: v for k, v in params.items() if k != "prediction"}
+        response, latency = _send(api_client, cassette, params)
+        _prediction_support[endpoint] = False
+    except Exception as e:
+        if "prediction" not in params or not _rejects_prediction(e):
+            raise
+        ic("Endpoint does not support predicted outputs", endpoint)
+        _prediction_support[endpoint] = False
+        params = {k: v for k, v in params.items() if k != "prediction"}
+        response, latency = _send(api_client, cassette, params)
+    if "prediction" in params:
+        _prediction_support[endpoint] = True
+    # Keyed on the requested model: responses name a dated snapshot
+    # (gpt-4o-2024-08-06) that the price table does not list.
+    record_usage(
+        params["model"],
+        getattr(response, "usage", None),
+        latency,
+        measured=not dry_run
+        and (cassette is None or cassette.mode == "record"),
+    )
+    return response
+
+
 def one_chunk_initial_translation(
     source_lang: str, target_lang: str, source_text: str
 ) -> str:
@@ -113,7 +366,10 @@ Do not provide any explanations or text apart from the translation.
 
 {target_lang}:"""
 
-    translation = get_completion(translation_prompt, system_message=system_message)
+    with usage_stage("initial"):
+        translation = get_completion(
+            translation_prompt, system_message=system_message
+        )
 
     return translation
 
@@ -164,7 +420,8 @@ When writing suggestions, pay attention to whether there are ways to improve the
 
 Write a list of specific, helpful and constructive suggestions for improving the translation.
 Each suggestion should address one specific part of the translation.
-Output only the suggestions and nothing else."""
+Output only the suggestions and nothing else.
+If the translation needs no changes, output only NO_CHANGES."""
 
     else:
         reflection_prompt = f"""Your task is to carefully read a source text and a translation from {source_lang} to {target_lang}, and then give constructive criticisms and helpful suggestions to improve the translation. \
@@ -187,12 +444,122 @@ When writing suggestions, pay attention to whether there are ways to improve the
 
 Write a list of specific, helpful and constructive suggestions for improving the translation.
 Each suggestion should address one specific part of the translation.
-Output only the suggestions and nothing else."""
+Output only the suggestions and nothing else.
+If the translation needs no changes, output only NO_CHANGES."""
 
-    reflection = get_completion(reflection_prompt, system_message=system_message)
+    with usage_stage("reflect"):
+        reflection = get_completion(
+            reflection_prompt, system_message=system_message
+        )
     return reflection
 
 
+def rate_translation(
+    source_lang: str, target_lang: str, source_text: str, translation: str
+) -> Optional[float]:
+    """
+    Ask the drafting model to rate a translation on a 1 to 10 scale.
+
+    The call runs in the "rate" stage and only returns a number, so it costs
+    a fraction of a reflect call.
+
+    Args:
+        source_lang (str): The source language of the text.
+        target_lang (str): The target language of the translation.
+        source_text (str): The text in the source language.
+        translation (str): Its translation.
+
+    Returns:
+        Optional[float]: The rating scaled to 0.0 - 1.0, or None if the
+            answer holds no rating.
+    """
+
+    system_message = f"You are an expert linguist, specializing in translation from {source_lang} to {target_lang}."
+
+    rating_prompt = f"""Rate the {target_lang} translation of the {source_lang} source text below for accuracy, fluency and completeness, \
+on a scale from 1 (unusable) to 10 (publishable as is). Reply with the number only.
+
+<SOURCE_TEXT>
+{source_text}
+</SOURCE_TEXT>
+
+<TRANSLATION>
+{translation}
+</TRANSLATION>"""
+
+    with usage_stage("rate"):
+        answer = get_completion(rating_prompt, system_message=system_message)
+
+    match = re.search(r"\b(10|[1-9])(?:\.\d+)?\b", answer)
+    if match is None:
+        return None
+    return min(float(match.group(0)), 10.0) / 10
+
+
+def accept_draft(
+    source_text: str,
+    translation_1: str,
+    source_lang: str,
+    target_lang: str,
+    quality_threshold: Optional[float],
+    quality_check: str = CHECK_HEURISTIC,
+) -> bool:
+    """
+    Decide whether a draft is kept or escalated to the revision stages.
+
+    The draft must pass the local quality gate; with CHECK_SELF_RATING it
+    must also be rated at least quality_threshold by rate_translation. Drafts
+    failing the heuristics are escalated without the rating call. Each
+    decision is counted in the bound usage trackers.
+
+    Args:
+        source_text (str): The text in the source language.
+        translation_1 (str): Its initial translation.
+        source_lang (str): The source language of the text.
+        target_lang (str): The target language of the translation.
+        quality_threshold (float, optional): Minimum score to keep the draft.
+            None escalates every draft without checking or counting it.
+        quality_check (str): CHECK_HEURISTIC or CHECK_SELF_RATING.
+
+    Returns:
+        bool: True if the draft is kept as the final translation.
+    """
+    if quality_check not in QUALITY_CHECKS:
+        raise ValueError(f"Unknown quality check: {quality_check}")
+    if quality_threshold is None:
+        return False
+
+    accepted = passes_quality_gate(
+        source_text, translation_1, source_lang, target_lang, quality_threshold
+    )
+    if accepted and quality_check == CHECK_SELF_RATING:
+        rating = rate_translation(
+            source_lang, target_lang, source_text, translation_1
+        )
+        accepted = rating is not None and rating >= quality_threshold
+    record_cascade(not accepted)
+    return accepted
+
+
+def reflection_finds_nothing(reflection: str) -> bool:
+    """
+    Check whether a reflection says the translation needs no changes.
+
+    True only for an empty reflection and the bare NO_CHANGES verdict the
+    reflection prompts ask for. Prose such as "No changes to meaning; only
+    fix the punctuation." can still carry a fix, so it keeps the improve
+    call.
+
+    Args:
+        reflection (str): The output of the reflect stage.
+
+    Returns:
+        bool: Whether the improve call can be skipped.
+    """
+    text = reflection.strip()
+    return not text or text.strip(" .`'\"").upper() == NO_CHANGES
+
+
 def one_chunk_improve_translation(
     source_lang: str,
     target_lang: str,
@@ -211,9 +578,14 @@ def one_chunk_improve_translation(
         reflection (str): Expert suggestions and constructive criticism for improving the translation.
 
     Returns:
-        str: The improved translation based on the expert suggestions.
+        str: The improved translation based on the expert suggestions, or
+            translation_1 when the reflection found nothing to fix.
     """
 
+    if reflection_finds_nothing(reflection):
+        record_skip("improve")
+        return translation_1
+
     system_message = f"You are an expert linguist, specializing in translation editing from {source_lang} to {target_lang}."
 
     prompt = f"""Your task is to carefully read, then edit, a translation from {source_lang} to {target_lang}, taking into
@@ -244,246 +616,661 @@ Please take into account the expert suggestions when editing the translation. Ed
 
 Output only the new translation and nothing else."""
 
-    translation_2 = get_completion(prompt, system_message)
+    with usage_stage("improve"):
+        translation_2 = get_completion(
+            prompt, system_message, prediction=translation_1
+        )
 
     return translation_2
 
 
-def one_chunk_translate_text(
-    source_lang: str, target_lang: str, source_text: str, country: str = ""
-) -> str:
+def one_chunk_reflect_and_improve(
+    source_lang: str,
+    target_lang: str,
+    source_text: str,
+    translation_1: str,
+    country: str = "",
+) -> Tuple[str, str]:
     """
-    Translate a single chunk of text from the source language to the target language.
+    Reflect on and improve the translation in a single call, treating the entire text as one chunk.
 
-    This function performs a two-step translation process:
-    1. Get an initial translation of the source text.
-    2. Reflect on the initial translation and generate an improved translation.
+    The LLM is asked for a JSON object holding both its suggestions and the
+    edited translation. If the answer cannot be parsed, the separate reflect
+    and improve calls are made instead.
 
     Args:
         source_lang (str): The source language of the text.
-        target_lang (str): The target language for the translation.
-        source_text (str): The text to be translated.
+        target_lang (str): The target language of the translation.
+        source_text (str): The original text in the source language.
+        translation_1 (str): The initial translation of the source text.
         country (str): Country specified for the target language.
+
     Returns:
-        str: The improved translation of the source text.
+        Tuple[str, str]: The reflection and the improved translation.
     """
-    translation_1 = one_chunk_initial_translation(
-        source_lang, target_lang, source_text
-    )
 
-    reflection = one_chunk_reflect_on_translation(
-        source_lang, target_lang, source_text, translation_1, country
-    )
-    translation_2 = one_chunk_improve_translation(
-        source_lang, target_lang, source_text, translation_1, reflection
-    )
+    system_message = f"You are an expert linguist specializing in translation from {source_lang} to {target_lang}. \
+You will be provided with a source text and its translation and your goal is to improve the translation."
 
-    return translation_2
+    style = ""
+    if country != "":
+        style = f"\nThe final style and tone of the translation should match the style of {target_lang} colloquially spoken in {country}.\n"
 
+    prompt = f"""Your task is to carefully read a source text and a translation from {source_lang} to {target_lang}, write constructive criticism and helpful suggestions to improve the translation, and then edit the translation taking your suggestions into account.
+{style}
+The source text and initial translation, delimited by XML tags <SOURCE_TEXT></SOURCE_TEXT> and <TRANSLATION></TRANSLATION>, are as follows:
 
-def num_tokens_in_string(
-    input_str: str, encoding_name: str = "cl100k_base"
-) -> int:
-    """
-    Calculate the number of tokens in a given string using a specified encoding.
+<SOURCE_TEXT>
+{source_text}
+</SOURCE_TEXT>
 
-    Args:
-        str (str): The input string to be tokenized.
-        encoding_name (str, optional): The name of the encoding to use. Defaults to "cl100k_base",
-            which is the most commonly used encoder (used by GPT-4).
+<TRANSLATION>
+{translation_1}
+</TRANSLATION>
 
-    Returns:
-        int: The number of tokens in the input string.
+When writing suggestions, pay attention to whether there are ways to improve the translation's \n\
+(i) accuracy (by correcting errors of addition, mistranslation, omission, or untranslated text),\n\
+(ii) fluency (by applying {target_lang} grammar, spelling and punctuation rules, and ensuring there are no unnecessary repetitions),\n\
+(iii) style (by ensuring the translations reflect the style of the source text and take into account any cultural context),\n\
+(iv) terminology (by ensuring terminology use is consistent and reflects the source text domain; and by only ensuring you use equivalent idioms {target_lang}).\n\
 
-    Example:
-        >>> text = "Hello, how are you?"
-        >>> num_tokens = num_tokens_in_string(text)
-        >>> print(num_tokens)
-        5
-    """
-    encoding = tiktoken.get_encoding(encoding_name)
-    num_tokens = len(encoding.encode(input_str))
-    return num_tokens
+Respond with a JSON object with exactly two string fields:
+"reflection": your specific, helpful and constructive suggestions, one per line, each addressing one specific part of the translation;
+"translation": the edited translation and nothing else."""
 
+    with usage_stage("revise"):
+        response = get_completion(
+            prompt, system_message=system_message, json_mode=True
+        )
 
-def multichunk_initial_translation(
-    source_lang: str, target_lang: str, source_text_chunks: List[str]
-) -> List[str]:
+    revision = parse_revision(response)
+    if revision is not None:
+        return revision
+
+    ic("Malformed revision output, reflecting and improving separately")
+    reflection = one_chunk_reflect_on_translation(
+        source_lang, target_lang, source_text, translation_1, country
+    )
+    translation_2 = one_chunk_improve_translation(
+        source_lang, target_lang, source_text, translation_1, reflection
+    )
+    return reflection, translation_2
+
+
+def parse_json_response(response):
+    """Decode a JSON answer, tolerating code fences and surrounding text."""
+    if not isinstance(response, str):
+        return response
+    text = response.strip()
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end <= start:
+        return None
+    try:
+        return json.loads(text[start : end + 1])
+    except ValueError:
+        return None
+
+
+def parse_revision(response: Union[str, dict]) -> Optional[Tuple[str, str]]:
     """
-    Translate a text in multiple chunks from the source language to the target language.
+    Parse the JSON answer of a combined reflect-and-improve call.
+
+    Code fences and text around the JSON object are tolerated, and the
+    suggestions may be given as a list.
 
     Args:
-        source_lang (str): The source language of the text.
-        target_lang (str): The target language for translation.
-        source_text_chunks (List[str]): A list of text chunks to be translated.
+        response (Union[str, dict]): The completion returned by get_completion.
 
     Returns:
-        List[str]: A list of translated text chunks.
+        Optional[Tuple[str, str]]: The reflection and the improved translation,
+            or None if the answer has no usable translation.
     """
+    data = parse_json_response(response)
+    if not isinstance(data, dict):
+        return None
 
-    system_message = f"You are an expert linguist, specializing in translation from {source_lang} to {target_lang}."
+    translation = data.get("translation")
+    if not isinstance(translation, str) or not translation.strip():
+        return None
 
-    translation_prompt = """Your task is to provide a professional translation from {source_lang} to {target_lang} of PART of a text.
+    reflection = data.get("reflection", "")
+    if isinstance(reflection, list):
+        reflection = "\n".join(str(item) for item in reflection)
+    elif not isinstance(reflection, str):
+        reflection = json.dumps(reflection, ensure_ascii=False)
 
-The source text is below, delimited by XML tags <SOURCE_TEXT> and </SOURCE_TEXT>. Translate only the part within the source text
-delimited by <TRANSLATE_THIS> and </TRANSLATE_THIS>. You can use the rest of the source text as context, but do not translate any
-of the other text. Do not output anything other than the translation of the indicated part of the text.
+    return reflection, translation
 
-<SOURCE_TEXT>
-{tagged_text}
-</SOURCE_TEXT>
 
-To reiterate, you should translate only this part of the text, shown here again between <TRANSLATE_THIS> and </TRANSLATE_THIS>:
-<TRANSLATE_THIS>
-{chunk_to_translate}
-</TRANSLATE_THIS>
+def parse_edits(response: Union[str, dict, list]) -> Optional[List[dict]]:
+    """
+    Parse the JSON answer of an edit-list reflection call.
 
-Output only the translation of the portion you are asked to translate, and nothing else.
-"""
+    Args:
+        response (Union[str, dict, list]): The completion returned by
+            get_completion, or the list of edits itself.
 
-    translation_chunks = []
-    for i in range(len(source_text_chunks)):
-        # Will translate chunk i
-        tagged_text = (
-            "".join(source_text_chunks[0:i])
-            + "<TRANSLATE_THIS>"
-            + source_text_chunks[i]
-            + "</TRANSLATE_THIS>"
-            + "".join(source_text_chunks[i + 1 :])
+    Returns:
+        Optional[List[dict]]: The edits, each with "original", "replacement"
+            and "reason" strings, or None if the answer is malformed.
+    """
+    data = parse_json_response(response)
+    if isinstance(data, dict):
+        data = data.get("edits")
+    if not isinstance(data, list):
+        return None
+
+    edits = []
+    for item in data:
+        if not isinstance(item, dict):
+            return None
+        original = item.get("original")
+        replacement = item.get("replacement")
+        if not isinstance(original, str) or not isinstance(replacement, str):
+            return None
+        reason = item.get("reason", "")
+        edits.append(
+            {
+                "original": original,
+                "replacement": replacement,
+                "reason": reason if isinstance(reason, str) else str(reason),
+            }
         )
+    return edits
 
-        prompt = translation_prompt.format(
-            source_lang=source_lang,
-            target_lang=target_lang,
-            tagged_text=tagged_text,
-            chunk_to_translate=source_text_chunks[i],
-        )
 
-        translation = get_completion(prompt, system_message=system_message)
-        translation_chunks.append(translation)
+def apply_edits(translation: str, edits: List[dict]) -> Optional[str]:
+    """
+    Apply span replacements to a translation without calling the LLM.
 
-    return translation_chunks
+    An edit applies cleanly when its original span is non-empty and occurs
+    exactly once in the translation, and no two spans overlap.
 
+    Args:
+        translation (str): The translation to edit.
+        edits (List[dict]): The edits returned by parse_edits.
 
-def multichunk_reflect_on_translation(
+    Returns:
+        Optional[str]: The edited translation, or None if any edit does not
+            apply cleanly.
+    """
+    spans = []
+    for edit in edits:
+        original = edit["original"]
+        start = translation.find(original) if original else -1
+        if start < 0 or translation.find(original, start + 1) >= 0:
+            return None
+        spans.append((start, start + len(original), edit["replacement"]))
+
+    spans.sort()
+    for (_, end, _), (start, _, _) in zip(spans, spans[1:]):
+        if start < end:
+            return None
+
+    parts = []
+    position = 0
+    for start, end, replacement in spans:
+        parts.append(translation[position:start])
+        parts.append(replacement)
+        position = end
+    parts.append(translation[position:])
+    return "".join(parts)
+
+
+def format_edits(edits: List[dict]) -> str:
+    """Render edits as reflection text, one suggestion per line."""
+    if not edits:
+        return NO_CHANGES
+    lines = []
+    for edit in edits:
+        line = f'Replace "{edit["original"]}" with "{edit["replacement"]}"'
+        if edit["reason"]:
+            line += f': {edit["reason"]}'
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def one_chunk_edit_translation(
     source_lang: str,
     target_lang: str,
-    source_text_chunks: List[str],
-    translation_1_chunks: List[str],
+    source_text: str,
+    translation_1: str,
     country: str = "",
-) -> List[str]:
+) -> Tuple[str, str]:
     """
-    Provides constructive criticism and suggestions for improving a partial translation.
+    Revise the translation with an edit list applied locally, treating the entire text as one chunk.
+
+    The LLM returns its suggestions as span replacements, so it only writes
+    the changed words instead of the whole translation again. When the edits
+    do not apply cleanly the improve call is made with them as reflection,
+    and when the answer cannot be parsed the separate reflect and improve
+    calls are made instead.
 
     Args:
         source_lang (str): The source language of the text.
         target_lang (str): The target language of the translation.
-        source_text_chunks (List[str]): The source text divided into chunks.
-        translation_1_chunks (List[str]): The translated chunks corresponding to the source text chunks.
+        source_text (str): The original text in the source language.
+        translation_1 (str): The initial translation of the source text.
         country (str): Country specified for the target language.
 
     Returns:
-        List[str]: A list of reflections containing suggestions for improving each translated chunk.
+        Tuple[str, str]: The reflection and the improved translation.
     """
 
     system_message = f"You are an expert linguist specializing in translation from {source_lang} to {target_lang}. \
 You will be provided with a source text and its translation and your goal is to improve the translation."
 
+    style = ""
     if country != "":
-        reflection_prompt = """Your task is to carefully read a source text and part of a translation of that text from {source_lang} to {target_lang}, and then give constructive criticism and helpful suggestions for improving the translation.
-The final style and tone of the translation should match the style of {target_lang} colloquially spoken in {country}.
+        style = f"\nThe final style and tone of the translation should match the style of {target_lang} colloquially spoken in {country}.\n"
 
-The source text is below, delimited by XML tags <SOURCE_TEXT> and </SOURCE_TEXT>, and the part that has been translated
-is delimited by <TRANSLATE_THIS> and </TRANSLATE_THIS> within the source text. You can use the rest of the source text
-as context for critiquing the translated part.
+    prompt = f"""Your task is to carefully read a source text and a translation from {source_lang} to {target_lang}, and then list the edits that would improve the translation.
+{style}
+The source text and initial translation, delimited by XML tags <SOURCE_TEXT></SOURCE_TEXT> and <TRANSLATION></TRANSLATION>, are as follows:
 
 <SOURCE_TEXT>
-{tagged_text}
+{source_text}
 </SOURCE_TEXT>
 
-To reiterate, only part of the text is being translated, shown here again between <TRANSLATE_THIS> and </TRANSLATE_THIS>:
-<TRANSLATE_THIS>
-{chunk_to_translate}
-</TRANSLATE_THIS>
-
-The translation of the indicated part, delimited below by <TRANSLATION> and </TRANSLATION>, is as follows:
 <TRANSLATION>
-{translation_1_chunk}
+{translation_1}
 </TRANSLATION>
 
-When writing suggestions, pay attention to whether there are ways to improve the translation's:\n\
+When choosing edits, pay attention to whether there are ways to improve the translation's \n\
 (i) accuracy (by correcting errors of addition, mistranslation, omission, or untranslated text),\n\
 (ii) fluency (by applying {target_lang} grammar, spelling and punctuation rules, and ensuring there are no unnecessary repetitions),\n\
 (iii) style (by ensuring the translations reflect the style of the source text and take into account any cultural context),\n\
 (iv) terminology (by ensuring terminology use is consistent and reflects the source text domain; and by only ensuring you use equivalent idioms {target_lang}).\n\
 
-Write a list of specific, helpful and constructive suggestions for improving the translation.
-Each suggestion should address one specific part of the translation.
-Output only the suggestions and nothing else."""
-
-    else:
-        reflection_prompt = """Your task is to carefully read a source text and part of a translation of that text from {source_lang} to {target_lang}, and then give constructive criticism and helpful suggestions for improving the translation.
+Respond with a JSON object with a single field "edits", a list of the edits to make to the translation. Each edit is an object with three string fields:
+"original": a span of the translation, copied character for character, that occurs only once in it;
+"replacement": the text that replaces the span;
+"reason": a short explanation of the edit.
+Keep every span as short as possible while unique, and do not let spans overlap.
+If the translation needs no changes, respond with {{"edits": []}}."""
 
-The source text is below, delimited by XML tags <SOURCE_TEXT> and </SOURCE_TEXT>, and the part that has been translated
-is delimited by <TRANSLATE_THIS> and </TRANSLATE_THIS> within the source text. You can use the rest of the source text
-as context for critiquing the translated part.
+    with usage_stage("edit"):
+        response = get_completion(
+            prompt, system_message=system_message, json_mode=True
+        )
 
-<SOURCE_TEXT>
-{tagged_text}
-</SOURCE_TEXT>
+    edits = parse_edits(response)
+    if edits is None:
+        ic("Malformed edit list, reflecting and improving separately")
+        reflection = one_chunk_reflect_on_translation(
+            source_lang, target_lang, source_text, translation_1, country
+        )
+        translation_2 = one_chunk_improve_translation(
+            source_lang, target_lang, source_text, translation_1, reflection
+        )
+        return reflection, translation_2
 
-To reiterate, only part of the text is being translated, shown here again between <TRANSLATE_THIS> and </TRANSLATE_THIS>:
-<TRANSLATE_THIS>
-{chunk_to_translate}
-</TRANSLATE_THIS>
+    reflection = format_edits(edits)
+    translation_2 = apply_edits(translation_1, edits)
+    if translation_2 is not None:
+        record_skip("improve")
+        return reflection, translation_2
 
-The translation of the indicated part, delimited below by <TRANSLATION> and </TRANSLATION>, is as follows:
-<TRANSLATION>
-{translation_1_chunk}
-</TRANSLATION>
+    ic("Edits do not apply cleanly, improving with the LLM")
+    translation_2 = one_chunk_improve_translation(
+        source_lang, target_lang, source_text, translation_1, reflection
+    )
+    return reflection, translation_2
 
-When writing suggestions, pay attention to whether there are ways to improve the translation's:\n\
-(i) accuracy (by correcting errors of addition, mistranslation, omission, or untranslated text),\n\
-(ii) fluency (by applying {target_lang} grammar, spelling and punctuation rules, and ensuring there are no unnecessary repetitions),\n\
-(iii) style (by ensuring the translations reflect the style of the source text and take into account any cultural context),\n\
-(iv) terminology (by ensuring terminology use is consistent and reflects the source text domain; and by only ensuring you use equivalent idioms {target_lang}).\n\
 
-Write a list of specific, helpful and constructive suggestions for improving the translation.
+def one_chunk_translate_text(
+    source_lang: str,
+    target_lang: str,
+    source_text: str,
+    country: str = "",
+    revision_mode: str = REVISION_SEPARATE,
+    quality_threshold: Optional[float] = None,
+    quality_check: str = CHECK_HEURISTIC,
+    translation_1: Optional[str] = None,
+) -> str:
+    """
+    Translate a single chunk of text from the source language to the target language.
+
+    This function performs a two-step translation process:
+    1. Get an initial translation of the source text.
+    2. Reflect on the initial translation and generate an improved translation.
+
+    Args:
+        source_lang (str): The source language of the text.
+        target_lang (str): The target language for the translation.
+        source_text (str): The text to be translated.
+        country (str): Country specified for the target language.
+        revision_mode (str): REVISION_SEPARATE, REVISION_COMBINED or
+            REVISION_EDITS; None returns the initial translation.
+        quality_threshold (float, optional): Skip reflection when the initial
+            translation scores at least this much in quality.score_translation.
+        quality_check (str): How the initial translation is scored, see
+            accept_draft.
+        translation_1 (str, optional): A draft to revise instead of making
+            the initial translation, e.g. from fuzzy.FuzzyMemory.draft. It
+            is always revised, and ignored when revision_mode is None.
+    Returns:
+        str: The improved translation of the source text.
+    """
+    drafted = translation_1 is not None and revision_mode is not None
+    if drafted:
+        record_skip("initial")
+    else:
+        translation_1 = one_chunk_initial_translation(
+            source_lang, target_lang, source_text
+        )
+    if revision_mode is None:
+        return translation_1
+
+    if not drafted and accept_draft(
+        source_text,
+        translation_1,
+        source_lang,
+        target_lang,
+        quality_threshold,
+        quality_check,
+    ):
+        record_revision_skipped(revision_mode)
+        return translation_1
+
+    if revision_mode != REVISION_SEPARATE:
+        revise = one_chunk_reflect_and_improve
+        if revision_mode == REVISION_EDITS:
+            revise = one_chunk_edit_translation
+        _, translation_2 = revise(
+            source_lang, target_lang, source_text, translation_1, country
+        )
+        return translation_2
+
+    reflection = one_chunk_reflect_on_translation(
+        source_lang, target_lang, source_text, translation_1, country
+    )
+    translation_2 = one_chunk_improve_translation(
+        source_lang, target_lang, source_text, translation_1, reflection
+    )
+
+    return translation_2
+
+
+def num_tokens_in_string(
+    input_str: str, encoding_name: str = "cl100k_base"
+) -> int:
+    """
+    Calculate the number of tokens in a given string using a specified encoding.
+
+    Args:
+        str (str): The input string to be tokenized.
+        encoding_name (str, optional): The name of the encoding to use. Defaults to "cl100k_base",
+            which is the most commonly used encoder (used by GPT-4).
+
+    Returns:
+        int: The number of tokens in the input string.
+
+    Example:
+        >>> text = "Hello, how are you?"
+        >>> num_tokens = num_tokens_in_string(text)
+        >>> print(num_tokens)
+        5
+    """
+    encoding = tiktoken.get_encoding(encoding_name)
+    num_tokens = len(encoding.encode(input_str))
+    return num_tokens
+
+
+def chunk_system_message(source_lang: str, target_lang: str) -> str:
+    """Return the system message shared by all chunk prompts of a text."""
+    return f"You are an expert linguist, specializing in translation from {source_lang} to {target_lang}."
+
+
+def chunk_context(
+    source_lang: str, target_lang: str, source_text_chunks: List[str]
+) -> str:
+    """
+    Return the prompt prefix shared by all chunk prompts of a text.
+
+    The prefix holds the static instructions and the whole untagged source
+    text, so it is byte-identical for every chunk in every stage and
+    providers that cache prompt prefixes serve it from cache after the first
+    call. What a prompt asks for, and the chunk it works on, follow it.
+
+    Inside ``use_synopsis`` the prefix holds the synopsis of the text
+    instead, which stays small however long the text is.
+
+    Args:
+        source_lang (str): The source language of the text.
+        target_lang (str): The target language for translation.
+        source_text_chunks (List[str]): The source text divided into chunks.
+
+    Returns:
+        str: The shared prompt prefix.
+    """
+    synopsis = current_synopsis()
+    if synopsis is not None:
+        return f"""A text is being translated from {source_lang} to {target_lang} one part at a time.
+The text is too long to show in full. Below, delimited by XML tags <SYNOPSIS> and </SYNOPSIS>, are a synopsis of the whole text and a list of its key terms. \
+Use them only as context: every task concerns one part of the text, given after the task with the text around it, and no other part of the text should be translated.
+
+<SYNOPSIS>
+{synopsis}
+</SYNOPSIS>
+
+"""
+    return f"""A text is being translated from {source_lang} to {target_lang} one part at a time.
+The whole source text is below, delimited by XML tags <SOURCE_TEXT> and </SOURCE_TEXT>. Use it only as context: \
+every task concerns one part of it, given after the task, and no other part of the text should be translated.
+
+<SOURCE_TEXT>
+{"".join(source_text_chunks)}
+</SOURCE_TEXT>
+
+"""
+
+
+def chunk_part(source_text_chunks: List[str], index: int) -> str:
+    """
+    Show the chunk a prompt works on, for the suffix after chunk_context.
+
+    Inside ``use_synopsis`` the neighbouring chunks are shown as well, since
+    the prefix no longer holds the text around the chunk.
+    """
+    if current_synopsis() is not None:
+        before = after = ""
+        if index > 0:
+            before = f"""The text just before it, for context only:
+<PRECEDING_TEXT>
+{source_text_chunks[index - 1]}
+</PRECEDING_TEXT>
+"""
+        if index + 1 < len(source_text_chunks):
+            after = f"""
+The text just after it, for context only:
+<FOLLOWING_TEXT>
+{source_text_chunks[index + 1]}
+</FOLLOWING_TEXT>"""
+        return f"""The part to work on is part {index + 1} of {len(source_text_chunks)} of the source text.
+{before}The part itself, shown here between <TRANSLATE_THIS> and </TRANSLATE_THIS>:
+<TRANSLATE_THIS>
+{source_text_chunks[index]}
+</TRANSLATE_THIS>{after}"""
+    return f"""The part to work on is part {index + 1} of {len(source_text_chunks)} of the source text, shown here between <TRANSLATE_THIS> and </TRANSLATE_THIS>:
+<TRANSLATE_THIS>
+{source_text_chunks[index]}
+</TRANSLATE_THIS>"""
+
+
+def multichunk_initial_translation(
+    source_lang: str,
+    target_lang: str,
+    source_text_chunks: List[str],
+    indices: Optional[Sequence[int]] = None,
+) -> List[str]:
+    """
+    Translate a text in multiple chunks from the source language to the target language.
+
+    Args:
+        source_lang (str): The source language of the text.
+        target_lang (str): The target language for translation.
+        source_text_chunks (List[str]): A list of text chunks to be translated.
+        indices (Sequence[int], optional): Translate only these chunks; the
+            others are context and come back untranslated.
+
+    Returns:
+        List[str]: A list of translated text chunks.
+    """
+
+    if indices is None:
+        indices = range(len(source_text_chunks))
+    translation_1_chunks = list(source_text_chunks)
+    for i in indices:
+        translation_1_chunks[i] = chunk_initial_translation(
+            source_lang, target_lang, source_text_chunks, i
+        )
+    return translation_1_chunks
+
+
+def chunk_initial_translation(
+    source_lang: str,
+    target_lang: str,
+    source_text_chunks: List[str],
+    index: int,
+) -> str:
+    """
+    Translate one chunk of a text split into multiple chunks.
+
+    Args:
+        source_lang (str): The source language of the text.
+        target_lang (str): The target language for translation.
+        source_text_chunks (List[str]): The source text divided into chunks.
+        index (int): The index of the chunk to translate.
+
+    Returns:
+        str: The translation of the chunk.
+    """
+
+    system_message = chunk_system_message(source_lang, target_lang)
+
+    translation_prompt = """Your task is to provide a professional translation from {source_lang} to {target_lang} of one part of the source text.
+
+{part}
+
+Output only the translation of this part, and nothing else.
+"""
+
+    prompt = chunk_context(
+        source_lang, target_lang, source_text_chunks
+    ) + translation_prompt.format(
+        source_lang=source_lang,
+        target_lang=target_lang,
+        part=chunk_part(source_text_chunks, index),
+    )
+
+    with usage_stage("initial"):
+        translation = get_completion(prompt, system_message=system_message)
+
+    return translation
+
+
+def multichunk_reflect_on_translation(
+    source_lang: str,
+    target_lang: str,
+    source_text_chunks: List[str],
+    translation_1_chunks: List[str],
+    country: str = "",
+) -> List[str]:
+    """
+    Provides constructive criticism and suggestions for improving a partial translation.
+
+    Args:
+        source_lang (str): The source language of the text.
+        target_lang (str): The target language of the translation.
+        source_text_chunks (List[str]): The source text divided into chunks.
+        translation_1_chunks (List[str]): The translated chunks corresponding to the source text chunks.
+        country (str): Country specified for the target language.
+
+    Returns:
+        List[str]: A list of reflections containing suggestions for improving each translated chunk.
+    """
+
+    return [
+        chunk_reflect_on_translation(
+            source_lang,
+            target_lang,
+            source_text_chunks,
+            i,
+            translation_1_chunks[i],
+            country,
+        )
+        for i in range(len(source_text_chunks))
+    ]
+
+
+def chunk_reflect_on_translation(
+    source_lang: str,
+    target_lang: str,
+    source_text_chunks: List[str],
+    index: int,
+    translation_1_chunk: str,
+    country: str = "",
+) -> str:
+    """
+    Provides constructive criticism and suggestions for improving the translation of one chunk.
+
+    Args:
+        source_lang (str): The source language of the text.
+        target_lang (str): The target language of the translation.
+        source_text_chunks (List[str]): The source text divided into chunks.
+        index (int): The index of the translated chunk.
+        translation_1_chunk (str): The initial translation of the chunk.
+        country (str): Country specified for the target language.
+
+    Returns:
+        str: Suggestions for improving the translated chunk.
+    """
+
+    system_message = chunk_system_message(source_lang, target_lang)
+
+    style = ""
+    if country != "":
+        style = f"\nThe final style and tone of the translation should match the style of {target_lang} colloquially spoken in {country}."
+
+    reflection_prompt = """Your task is to carefully read one part of the source text and its translation from {source_lang} to {target_lang}, and then give constructive criticism and helpful suggestions for improving the translation.{style}
+
+{part}
+
+The translation of this part, delimited below by <TRANSLATION> and </TRANSLATION>, is as follows:
+<TRANSLATION>
+{translation_1_chunk}
+</TRANSLATION>
+
+When writing suggestions, pay attention to whether there are ways to improve the translation's:\n\
+(i) accuracy (by correcting errors of addition, mistranslation, omission, or untranslated text),\n\
+(ii) fluency (by applying {target_lang} grammar, spelling and punctuation rules, and ensuring there are no unnecessary repetitions),\n\
+(iii) style (by ensuring the translations reflect the style of the source text and take into account any cultural context),\n\
+(iv) terminology (by ensuring terminology use is consistent and reflects the source text domain; and by only ensuring you use equivalent idioms {target_lang}).\n\
+
+Write a list of specific, helpful and constructive suggestions for improving the translation.
 Each suggestion should address one specific part of the translation.
-Output only the suggestions and nothing else."""
+Output only the suggestions and nothing else.
+If the translation needs no changes, output only NO_CHANGES."""
 
-    reflection_chunks = []
-    for i in range(len(source_text_chunks)):
-        # Will translate chunk i
-        tagged_text = (
-            "".join(source_text_chunks[0:i])
-            + "<TRANSLATE_THIS>"
-            + source_text_chunks[i]
-            + "</TRANSLATE_THIS>"
-            + "".join(source_text_chunks[i + 1 :])
-        )
-        if country != "":
-            prompt = reflection_prompt.format(
-                source_lang=source_lang,
-                target_lang=target_lang,
-                tagged_text=tagged_text,
-                chunk_to_translate=source_text_chunks[i],
-                translation_1_chunk=translation_1_chunks[i],
-                country=country,
-            )
-        else:
-            prompt = reflection_prompt.format(
-                source_lang=source_lang,
-                target_lang=target_lang,
-                tagged_text=tagged_text,
-                chunk_to_translate=source_text_chunks[i],
-                translation_1_chunk=translation_1_chunks[i],
-            )
+    prompt = chunk_context(
+        source_lang, target_lang, source_text_chunks
+    ) + reflection_prompt.format(
+        source_lang=source_lang,
+        target_lang=target_lang,
+        style=style,
+        part=chunk_part(source_text_chunks, index),
+        translation_1_chunk=translation_1_chunk,
+    )
 
+    with usage_stage("reflect"):
         reflection = get_completion(prompt, system_message=system_message)
-        reflection_chunks.append(reflection)
 
-    return reflection_chunks
+    return reflection
 
 
 def multichunk_improve_translation(
@@ -507,30 +1294,60 @@ def multichunk_improve_translation(
         List[str]: The improved translation of each chunk.
     """
 
-    system_message = f"You are an expert linguist, specializing in translation editing from {source_lang} to {target_lang}."
+    return [
+        chunk_improve_translation(
+            source_lang,
+            target_lang,
+            source_text_chunks,
+            i,
+            translation_1_chunks[i],
+            reflection_chunks[i],
+        )
+        for i in range(len(source_text_chunks))
+    ]
 
-    improvement_prompt = """Your task is to carefully read, then improve, a translation from {source_lang} to {target_lang}, taking into
-account a set of expert suggestions and constructive criticisms. Below, the source text, initial translation, and expert suggestions are provided.
 
-The source text is below, delimited by XML tags <SOURCE_TEXT> and </SOURCE_TEXT>, and the part that has been translated
-is delimited by <TRANSLATE_THIS> and </TRANSLATE_THIS> within the source text. You can use the rest of the source text
-as context, but need to provide a translation only of the part indicated by <TRANSLATE_THIS> and </TRANSLATE_THIS>.
+def chunk_improve_translation(
+    source_lang: str,
+    target_lang: str,
+    source_text_chunks: List[str],
+    index: int,
+    translation_1_chunk: str,
+    reflection_chunk: str,
+) -> str:
+    """
+    Improves the translation of one chunk by considering expert suggestions.
 
-<SOURCE_TEXT>
-{tagged_text}
-</SOURCE_TEXT>
+    Args:
+        source_lang (str): The source language of the text.
+        target_lang (str): The target language for translation.
+        source_text_chunks (List[str]): The source text divided into chunks.
+        index (int): The index of the translated chunk.
+        translation_1_chunk (str): The initial translation of the chunk.
+        reflection_chunk (str): Expert suggestions for improving the chunk.
 
-To reiterate, only part of the text is being translated, shown here again between <TRANSLATE_THIS> and </TRANSLATE_THIS>:
-<TRANSLATE_THIS>
-{chunk_to_translate}
-</TRANSLATE_THIS>
+    Returns:
+        str: The improved translation of the chunk, or translation_1_chunk
+            when the reflection found nothing to fix.
+    """
+
+    if reflection_finds_nothing(reflection_chunk):
+        record_skip("improve")
+        return translation_1_chunk
+
+    system_message = chunk_system_message(source_lang, target_lang)
 
-The translation of the indicated part, delimited below by <TRANSLATION> and </TRANSLATION>, is as follows:
+    improvement_prompt = """Your task is to carefully read, then improve, the translation from {source_lang} to {target_lang} of one part of the source text, taking into
+account a set of expert suggestions and constructive criticisms. Below, the part, its initial translation, and expert suggestions are provided.
+
+{part}
+
+The translation of this part, delimited below by <TRANSLATION> and </TRANSLATION>, is as follows:
 <TRANSLATION>
 {translation_1_chunk}
 </TRANSLATION>
 
-The expert translations of the indicated part, delimited below by <EXPERT_SUGGESTIONS> and </EXPERT_SUGGESTIONS>, are as follows:
+The expert suggestions for this part, delimited below by <EXPERT_SUGGESTIONS> and </EXPERT_SUGGESTIONS>, are as follows:
 <EXPERT_SUGGESTIONS>
 {reflection_chunk}
 </EXPERT_SUGGESTIONS>
@@ -544,36 +1361,305 @@ to whether there are ways to improve the translation's
 (iv) terminology (inappropriate for context, inconsistent use), or
 (v) other errors.
 
-Output only the new translation of the indicated part and nothing else."""
+Output only the new translation of this part and nothing else."""
+
+    prompt = chunk_context(
+        source_lang, target_lang, source_text_chunks
+    ) + improvement_prompt.format(
+        source_lang=source_lang,
+        target_lang=target_lang,
+        part=chunk_part(source_text_chunks, index),
+        translation_1_chunk=translation_1_chunk,
+        reflection_chunk=reflection_chunk,
+    )
+
+    with usage_stage("improve"):
+        translation_2 = get_completion(
+            prompt,
+            system_message=system_message,
+            prediction=translation_1_chunk,
+        )
+
+    return translation_2
+
+
+def multichunk_reflect_and_improve(
+    source_lang: str,
+    target_lang: str,
+    source_text_chunks: List[str],
+    translation_1_chunks: List[str],
+    country: str = "",
+) -> Tuple[List[str], List[str]]:
+    """
+    Reflect on and improve the translation of each chunk with one call per chunk.
+
+    Args:
+        source_lang (str): The source language of the text.
+        target_lang (str): The target language of the translation.
+        source_text_chunks (List[str]): The source text divided into chunks.
+        translation_1_chunks (List[str]): The initial translation of each chunk.
+        country (str): Country specified for the target language.
+
+    Returns:
+        Tuple[List[str], List[str]]: The reflection and the improved
+            translation of each chunk.
+    """
 
+    reflection_chunks = []
     translation_2_chunks = []
     for i in range(len(source_text_chunks)):
-        # Will translate chunk i
-        tagged_text = (
-            "".join(source_text_chunks[0:i])
-            + "<TRANSLATE_THIS>"
-            + source_text_chunks[i]
-            + "</TRANSLATE_THIS>"
-            + "".join(source_text_chunks[i + 1 :])
+        reflection, translation_2 = chunk_reflect_and_improve(
+            source_lang,
+            target_lang,
+            source_text_chunks,
+            i,
+            translation_1_chunks[i],
+            country,
         )
+        reflection_chunks.append(reflection)
+        translation_2_chunks.append(translation_2)
 
-        prompt = improvement_prompt.format(
-            source_lang=source_lang,
-            target_lang=target_lang,
-            tagged_text=tagged_text,
-            chunk_to_translate=source_text_chunks[i],
-            translation_1_chunk=translation_1_chunks[i],
-            reflection_chunk=reflection_chunks[i],
+    return reflection_chunks, translation_2_chunks
+
+
+def chunk_reflect_and_improve(
+    source_lang: str,
+    target_lang: str,
+    source_text_chunks: List[str],
+    index: int,
+    translation_1_chunk: str,
+    country: str = "",
+) -> Tuple[str, str]:
+    """
+    Reflect on and improve the translation of one chunk in a single call.
+
+    If the JSON answer cannot be parsed, the separate reflect and improve
+    calls are made instead.
+
+    Args:
+        source_lang (str): The source language of the text.
+        target_lang (str): The target language of the translation.
+        source_text_chunks (List[str]): The source text divided into chunks.
+        index (int): The index of the translated chunk.
+        translation_1_chunk (str): The initial translation of the chunk.
+        country (str): Country specified for the target language.
+
+    Returns:
+        Tuple[str, str]: The reflection and the improved translation of the chunk.
+    """
+
+    system_message = chunk_system_message(source_lang, target_lang)
+
+    style = ""
+    if country != "":
+        style = f"\nThe final style and tone of the translation should match the style of {target_lang} colloquially spoken in {country}."
+
+    revision_prompt = """Your task is to carefully read one part of the source text and its translation from {source_lang} to {target_lang}, write constructive criticism and helpful suggestions for improving the translation, and then edit the translation taking your suggestions into account.{style}
+
+{part}
+
+The translation of this part, delimited below by <TRANSLATION> and </TRANSLATION>, is as follows:
+<TRANSLATION>
+{translation_1_chunk}
+</TRANSLATION>
+
+When writing suggestions, pay attention to whether there are ways to improve the translation's:\n\
+(i) accuracy (by correcting errors of addition, mistranslation, omission, or untranslated text),\n\
+(ii) fluency (by applying {target_lang} grammar, spelling and punctuation rules, and ensuring there are no unnecessary repetitions),\n\
+(iii) style (by ensuring the translations reflect the style of the source text and take into account any cultural context),\n\
+(iv) terminology (by ensuring terminology use is consistent and reflects the source text domain; and by only ensuring you use equivalent idioms {target_lang}).\n\
+
+Respond with a JSON object with exactly two string fields:
+"reflection": your specific, helpful and constructive suggestions, one per line, each addressing one specific part of the translation;
+"translation": the edited translation of this part and nothing else."""
+
+    prompt = chunk_context(
+        source_lang, target_lang, source_text_chunks
+    ) + revision_prompt.format(
+        source_lang=source_lang,
+        target_lang=target_lang,
+        style=style,
+        part=chunk_part(source_text_chunks, index),
+        translation_1_chunk=translation_1_chunk,
+    )
+
+    with usage_stage("revise"):
+        response = get_completion(
+            prompt, system_message=system_message, json_mode=True
         )
 
-        translation_2 = get_completion(prompt, system_message=system_message)
+    revision = parse_revision(response)
+    if revision is not None:
+        return revision
+
+    ic("Malformed revision output, reflecting and improving separately")
+    reflection = chunk_reflect_on_translation(
+        source_lang,
+        target_lang,
+        source_text_chunks,
+        index,
+        translation_1_chunk,
+        country,
+    )
+    translation_2 = chunk_improve_translation(
+        source_lang,
+        target_lang,
+        source_text_chunks,
+        index,
+        translation_1_chunk,
+        reflection,
+    )
+    return reflection, translation_2
+
+
+def multichunk_edit_translation(
+    source_lang: str,
+    target_lang: str,
+    source_text_chunks: List[str],
+    translation_1_chunks: List[str],
+    country: str = "",
+) -> Tuple[List[str], List[str]]:
+    """
+    Revise the translation of each chunk with an edit list applied locally.
+
+    Args:
+        source_lang (str): The source language of the text.
+        target_lang (str): The target language of the translation.
+        source_text_chunks (List[str]): The source text divided into chunks.
+        translation_1_chunks (List[str]): The initial translation of each chunk.
+        country (str): Country specified for the target language.
+
+    Returns:
+        Tuple[List[str], List[str]]: The reflection and the improved
+            translation of each chunk.
+    """
+
+    reflection_chunks = []
+    translation_2_chunks = []
+    for i in range(len(source_text_chunks)):
+        reflection, translation_2 = chunk_edit_translation(
+            source_lang,
+            target_lang,
+            source_text_chunks,
+            i,
+            translation_1_chunks[i],
+            country,
+        )
+        reflection_chunks.append(reflection)
         translation_2_chunks.append(translation_2)
 
-    return translation_2_chunks
+    return reflection_chunks, translation_2_chunks
+
+
+def chunk_edit_translation(
+    source_lang: str,
+    target_lang: str,
+    source_text_chunks: List[str],
+    index: int,
+    translation_1_chunk: str,
+    country: str = "",
+) -> Tuple[str, str]:
+    """
+    Revise the translation of one chunk with an edit list applied locally.
+
+    When the edits do not apply cleanly the improve call is made with them
+    as reflection, and when the answer cannot be parsed the separate reflect
+    and improve calls are made instead.
+
+    Args:
+        source_lang (str): The source language of the text.
+        target_lang (str): The target language of the translation.
+        source_text_chunks (List[str]): The source text divided into chunks.
+        index (int): The index of the translated chunk.
+        translation_1_chunk (str): The initial translation of the chunk.
+        country (str): Country specified for the target language.
+
+    Returns:
+        Tuple[str, str]: The reflection and the improved translation of the chunk.
+    """
+
+    system_message = chunk_system_message(source_lang, target_lang)
+
+    style = ""
+    if country != "":
+        style = f"\nThe final style and tone of the translation should match the style of {target_lang} colloquially spoken in {country}."
+
+    edit_prompt = """Your task is to carefully read one part of the source text and its translation from {source_lang} to {target_lang}, and then list the edits that would improve the translation.{style}
+
+{part}
+
+The translation of this part, delimited below by <TRANSLATION> and </TRANSLATION>, is as follows:
+<TRANSLATION>
+{translation_1_chunk}
+</TRANSLATION>
+
+When choosing edits, pay attention to whether there are ways to improve the translation's:\n\
+(i) accuracy (by correcting errors of addition, mistranslation, omission, or untranslated text),\n\
+(ii) fluency (by applying {target_lang} grammar, spelling and punctuation rules, and ensuring there are no unnecessary repetitions),\n\
+(iii) style (by ensuring the translations reflect the style of the source text and take into account any cultural context),\n\
+(iv) terminology (by ensuring terminology use is consistent and reflects the source text domain; and by only ensuring you use equivalent idioms {target_lang}).\n\
+
+Respond with a JSON object with a single field "edits", a list of the edits to make to the translation. Each edit is an object with three string fields:
+"original": a span of the translation, copied character for character, that occurs only once in it;
+"replacement": the text that replaces the span;
+"reason": a short explanation of the edit.
+Keep every span as short as possible while unique, and do not let spans overlap.
+If the translation needs no changes, respond with {{"edits": []}}."""
+
+    prompt = chunk_context(
+        source_lang, target_lang, source_text_chunks
+    ) + edit_prompt.format(
+        source_lang=source_lang,
+        target_lang=target_lang,
+        style=style,
+        part=chunk_part(source_text_chunks, index),
+        translation_1_chunk=translation_1_chunk,
+    )
+
+    with usage_stage("edit"):
+        response = get_completion(
+            prompt, system_message=system_message, json_mode=True
+        )
+
+    edits = parse_edits(response)
+    if edits is None:
+        ic("Malformed edit list, reflecting and improving separately")
+        reflection = chunk_reflect_on_translation(
+            source_lang,
+            target_lang,
+            source_text_chunks,
+            index,
+            translation_1_chunk,
+            country,
+        )
+    else:
+        reflection = format_edits(edits)
+        translation_2 = apply_edits(translation_1_chunk, edits)
+        if translation_2 is not None:
+            record_skip("improve")
+            return reflection, translation_2
+        ic("Edits do not apply cleanly, improving with the LLM")
+
+    translation_2 = chunk_improve_translation(
+        source_lang,
+        target_lang,
+        source_text_chunks,
+        index,
+        translation_1_chunk,
+        reflection,
+    )
+    return reflection, translation_2
 
 
 def multichunk_translation(
-    source_lang, target_lang, source_text_chunks, country: str = ""
+    source_lang,
+    target_lang,
+    source_text_chunks,
+    country: str = "",
+    revision_mode: str = REVISION_SEPARATE,
+    quality_threshold: Optional[float] = None,
+    quality_check: str = CHECK_HEURISTIC,
+    indices: Optional[Sequence[int]] = None,
 ):
     """
     Improves the translation of multiple text chunks based on the initial translation and reflection.
@@ -585,33 +1671,173 @@ def multichunk_translation(
         translation_1_chunks (List[str]): The list of initial translations for each source text chunk.
         reflection_chunks (List[str]): The list of reflections on the initial translations.
         country (str): Country specified for the target language
+        revision_mode (str): REVISION_SEPARATE, REVISION_COMBINED or
+            REVISION_EDITS; None returns the initial translations.
+        quality_threshold (float, optional): Only chunks whose initial
+            translation scores below this in quality.score_translation are
+            reflected on and improved. None reflects on every chunk.
+        quality_check (str): How the initial translations are scored, see
+            accept_draft.
+        indices (Sequence[int], optional): Translate only these chunks, e.g.
+            the edited paragraphs of a text; the others are context and come
+            back untranslated.
     Returns:
         List[str]: The list of improved translations for each source text chunk.
     """
 
-    translation_1_chunks = multichunk_initial_translation(
-        source_lang, target_lang, source_text_chunks
-    )
+    if indices is None:
+        translation_1_chunks = multichunk_initial_translation(
+            source_lang, target_lang, source_text_chunks
+        )
+        indices = range(len(source_text_chunks))
+    else:
+        translation_1_chunks = multichunk_initial_translation(
+            source_lang, target_lang, source_text_chunks, indices
+        )
+    if revision_mode is None:
+        return translation_1_chunks
 
-    reflection_chunks = multichunk_reflect_on_translation(
+    pending = escalated_chunks(
         source_lang,
         target_lang,
         source_text_chunks,
         translation_1_chunks,
-        country,
+        revision_mode,
+        quality_threshold,
+        quality_check,
+        indices,
     )
 
-    translation_2_chunks = multichunk_improve_translation(
-        source_lang,
-        target_lang,
-        source_text_chunks,
-        translation_1_chunks,
-        reflection_chunks,
-    )
+    translation_2_chunks = list(translation_1_chunks)
+    if revision_mode != REVISION_SEPARATE:
+        revise = chunk_reflect_and_improve
+        if revision_mode == REVISION_EDITS:
+            revise = chunk_edit_translation
+        for i in pending:
+            _, translation_2_chunks[i] = revise(
+                source_lang,
+                target_lang,
+                source_text_chunks,
+                i,
+                translation_1_chunks[i],
+                country,
+            )
+        return translation_2_chunks
+
+    reflection_chunks = {
+        i: chunk_reflect_on_translation(
+            source_lang,
+            target_lang,
+            source_text_chunks,
+            i,
+            translation_1_chunks[i],
+            country,
+        )
+        for i in pending
+    }
+    for i in pending:
+        translation_2_chunks[i] = chunk_improve_translation(
+            source_lang,
+            target_lang,
+            source_text_chunks,
+            i,
+            translation_1_chunks[i],
+            reflection_chunks[i],
+        )
 
     return translation_2_chunks
 
 
+def tier_revision_mode(
+    tier: str, revision_mode: str = REVISION_SEPARATE
+) -> Optional[str]:
+    """
+    Return the revision mode a pipeline tier runs.
+
+    Args:
+        tier (str): TIER_DRAFT, TIER_STANDARD or TIER_FULL.
+        revision_mode (str): The configured revision mode. TIER_FULL runs it
+            as given; TIER_STANDARD keeps it only if it makes one call.
+
+    Returns:
+        Optional[str]: The revision mode, or None when the tier does not
+            revise the initial translation.
+    """
+    if tier == TIER_DRAFT:
+        return None
+    if tier == TIER_STANDARD:
+        if revision_mode == REVISION_EDITS:
+            return revision_mode
+        return REVISION_COMBINED
+    if tier == TIER_FULL:
+        return revision_mode
+    raise ValueError(f"Unknown pipeline tier: {tier}")
+
+
+def revision_stages(revision_mode: Optional[str]) -> Tuple[str, ...]:
+    """Return the stages that follow the initial translation."""
+    if revision_mode is None:
+        return ()
+    if revision_mode == REVISION_COMBINED:
+        return ("revise",)
+    if revision_mode == REVISION_EDITS:
+        return ("edit",)
+    return ("reflect", "improve")
+
+
+def record_revision_skipped(revision_mode: str):
+    """Count the revision calls of a chunk that passed the quality gate."""
+    for stage in revision_stages(revision_mode):
+        record_skip(stage)
+
+
+def escalated_chunks(
+    source_lang: str,
+    target_lang: str,
+    source_text_chunks: List[str],
+    translation_1_chunks: List[str],
+    revision_mode: str,
+    quality_threshold: Optional[float],
+    quality_check: str = CHECK_HEURISTIC,
+    indices: Optional[Sequence[int]] = None,
+) -> List[int]:
+    """
+    Run the cascade check over the initial translations of a text.
+
+    Chunks whose draft is kept by accept_draft have their revision calls
+    counted as skipped; the others are escalated to the revision stages.
+
+    Args:
+        source_lang (str): The source language of the text chunks.
+        target_lang (str): The target language of the translations.
+        source_text_chunks (List[str]): The source text chunks.
+        translation_1_chunks (List[str]): Their initial translations.
+        revision_mode (str): The revision mode the skipped calls count for.
+        quality_threshold (float, optional): See accept_draft.
+        quality_check (str): See accept_draft.
+        indices (Sequence[int], optional): Check only these chunks.
+
+    Returns:
+        List[int]: The indices of the chunks to revise, in order.
+    """
+    if indices is None:
+        indices = range(len(source_text_chunks))
+    escalated = []
+    for i in indices:
+        if accept_draft(
+            source_text_chunks[i],
+            translation_1_chunks[i],
+            source_lang,
+            target_lang,
+            quality_threshold,
+            quality_check,
+        ):
+            record_revision_skipped(revision_mode)
+        else:
+            escalated.append(i)
+    return escalated
+
+
 def calculate_chunk_size(token_count: int, token_limit: int) -> int:
     """
     Calculate the chunk size based on the token count and token limit.
@@ -653,24 +1879,352 @@ def calculate_chunk_size(token_count: int, token_limit: int) -> int:
     return chunk_size
 
 
+def split_source_text(
+    source_text: str,
+    max_tokens: int = MAX_TOKENS_PER_CHUNK,
+    num_tokens_in_text: Union[int, None] = None,
+) -> List[str]:
+    """
+    Split the source text into the chunks that translate() works on.
+
+    Args:
+        source_text (str): The text to be translated.
+        max_tokens (int): The maximum number of tokens per chunk.
+        num_tokens_in_text (int, optional): The token count of source_text,
+            computed when not given.
+
+    Returns:
+        List[str]: A single element list if the text fits in one chunk,
+            otherwise the chunks produced by the text splitter.
+    """
+    if num_tokens_in_text is None:
+        num_tokens_in_text = num_tokens_in_string(source_text)
+
+    if num_tokens_in_text < max_tokens:
+        return [source_text]
+
+    token_size = calculate_chunk_size(
+        token_count=num_tokens_in_text, token_limit=max_tokens
+    )
+
+    ic(token_size)
+
+    TextSplitter = get_text_splitter()
+    text_splitter = TextSplitter.from_tiktoken_encoder(
+        model_name="gpt-4",
+        chunk_size=token_size,
+        chunk_overlap=0,
+    )
+
+    return text_splitter.split_text(source_text)
+
+
+def _translate_masked(
+    source_lang: str,
+    target_lang: str,
+    source_text: str,
+    masked,
+    country: str,
+    max_tokens: int,
+    revision_mode: Optional[str],
+    quality_threshold: Optional[float],
+    quality_check: str,
+    synopsis_tokens: int,
+    synopsis_cache,
+) -> Optional[str]:
+    """
+    Translate a masked text and put the kept text back.
+
+    The chunks of a long text whose translation lost a placeholder are
+    translated again from their unmasked source, with the other chunks as
+    context, so one bad chunk does not cost the whole text.
+
+    Args:
+        source_text (str): The unmasked text, summarised for the synopsis.
+        masked (masking.MaskedText): The masked text.
+
+    Returns:
+        Optional[str]: The translation, or None if the text fits in one
+            chunk and its translation lost a placeholder.
+    """
+    num_tokens_in_text = num_tokens_in_string(masked.text)
+    if num_tokens_in_text < max_tokens:
+        with use_book_context(masked.notes):
+            translation = one_chunk_translate_text(
+                source_lang,
+                target_lang,
+                masked.text,
+                country,
+                revision_mode,
+                quality_threshold,
+                quality_check,
+            )
+        return masked.restore(translation)
+
+    chunks = split_source_text(masked.text, max_tokens, num_tokens_in_text)
+    synopsis = None
+    if synopsis_tokens and num_tokens_in_text >= synopsis_tokens:
+        from .synopsis import document_synopsis
+
+        synopsis = document_synopsis(source_lang, source_text, synopsis_cache)
+    with use_synopsis(synopsis), use_book_context(masked.notes):
+        translations = multichunk_translation(
+            source_lang,
+            target_lang,
+            chunks,
+            country,
+            revision_mode,
+            quality_threshold,
+            quality_check,
+        )
+        lost = [
+            i
+            for i, chunk in enumerate(chunks)
+            if masked.missing(chunk, translations[i])
+        ]
+        if lost:
+            ic(f"Translating {len(lost)} chunks that lost a placeholder")
+            for i in lost:
+                chunks[i] = masked.unmask(chunks[i])
+            retried = multichunk_translation(
+                source_lang,
+                target_lang,
+                chunks,
+                country,
+                revision_mode,
+                quality_threshold,
+                quality_check,
+                lost,
+            )
+            for i in lost:
+                translations[i] = retried[i]
+    return masked.unmask("".join(translations))
+
+
 def translate(
     source_lang,
     target_lang,
     source_text,
     country,
     max_tokens=MAX_TOKENS_PER_CHUNK,
+    *,
+    revision_mode=REVISION_SEPARATE,
+    quality_threshold=None,
+    tier=TIER_FULL,
+    quality_check=CHECK_HEURISTIC,
+    synopsis_tokens=0,
+    synopsis_cache=None,
+    glossary=None,
+    memory=None,
+    fuzzy=None,
+    draft=None,
+    alignment=None,
+    skip_untranslatable=False,
+    mask_markup=False,
 ):
-    """Translate the source_text from source_lang to target_lang."""
+    """Translate the source_text from source_lang to target_lang.
+
+    The tier sets how much LLM work each chunk gets: TIER_DRAFT returns the
+    initial translation, TIER_STANDARD adds one revision call per chunk and
+    TIER_FULL runs the configured revision_mode, by default the separate
+    reflect and improve calls. The options after max_tokens are keyword-only.
+
+    With revision_mode set to REVISION_COMBINED the reflection and the
+    improved translation come from one JSON call per chunk instead of two
+    calls, which saves a third of the calls and of the resent input tokens.
+    With REVISION_EDITS the reflection is a list of span replacements that
+    is applied locally, so the improved translation is not written out again
+    unless the edits do not apply cleanly.
+    With a quality_threshold, chunks whose initial translation passes the
+    local quality heuristics are not reflected on at all. With quality_check
+    set to CHECK_SELF_RATING those drafts must also be rated at least
+    quality_threshold by the drafting model, so only the chunks that need it
+    are escalated to the (possibly stronger) revision model.
+    A text of at least synopsis_tokens tokens that is split into chunks is
+    first summarised, and every chunk prompt carries the synopsis and the
+    neighbouring chunks instead of the whole text. Synopses are cached by
+    synopsis_cache (a synopsis.SynopsisCache), so reruns and other target
+    languages reuse them. 0 always sends the whole text.
+    With a glossary (a glossary.BookGlossary) every prompt carries the names,
+    terms and synopsis the book shares with this text, and the glossary is
+    updated with the finished translation.
+    With a memory (a memory.TranslationMemory) the paragraphs at the start
+    and end of the text found in it are served without any call, and only
+    the span between them goes through the pipeline; the finished
+    translation is added to the memory. Only these leading and trailing
+    runs are served: a paragraph found in the memory between two that are
+    not is translated again with the span around it, keeping its context.
+    With fuzzy (a fuzzy.FuzzyMemory) prior translations of similar
+    paragraphs are sent with every prompt as references, and a text that
+    fits in one chunk and is a near-identical revision of translated
+    paragraphs is revised from them instead of translated from scratch.
+    A draft given directly is used the same way.
+    With an alignment (an incremental.Alignment of an earlier version of
+    the text and its translation) the paragraphs left as they were keep
+    their translation, and only runs of edited paragraphs are translated,
+    with the text around them as context. The translation memory is not
+    consulted then.
+    With skip_untranslatable, lines that need no translation (code, URLs,
+    numbers and separators, text already in the target script; see
+    masking.classify_segment) are replaced with placeholders and put back
+    afterwards, so only the translatable text is sent. With mask_markup,
+    inline code, Markdown link targets, HTML tags, URLs and long numbers
+    inside the lines are replaced the same way. A chunk whose translation
+    loses a placeholder is translated again unmasked.
+    """
+    if memory is not None and alignment is None:
+        match = memory.match(source_lang, target_lang, source_text)
+        translation = ""
+        if not match.complete:
+            translation = translate(
+                source_lang,
+                target_lang,
+                match.middle,
+                country,
+                max_tokens,
+                revision_mode=revision_mode,
+                quality_threshold=quality_threshold,
+                tier=tier,
+                quality_check=quality_check,
+                synopsis_tokens=synopsis_tokens,
+                synopsis_cache=synopsis_cache,
+                glossary=glossary,
+                fuzzy=fuzzy,
+                skip_untranslatable=skip_untranslatable,
+                mask_markup=mask_markup,
+            )
+        final_translation = match.join(translation)
+        memory.add_aligned(
+            source_lang, target_lang, source_text, final_translation
+        )
+        if fuzzy is not None:
+            fuzzy.refresh()
+        return final_translation
+
+    if glossary is not None:
+        with use_book_context(glossary.context(source_text)):
+            final_translation = translate(
+                source_lang,
+                target_lang,
+                source_text,
+                country,
+                max_tokens,
+                revision_mode=revision_mode,
+                quality_threshold=quality_threshold,
+                tier=tier,
+                quality_check=quality_check,
+                synopsis_tokens=synopsis_tokens,
+                synopsis_cache=synopsis_cache,
+                fuzzy=fuzzy,
+                alignment=alignment,
+                skip_untranslatable=skip_untranslatable,
+                mask_markup=mask_markup,
+            )
+        glossary.update(
+            source_lang, target_lang, source_text, final_translation
+        )
+        return final_translation
+
+    if fuzzy is not None:
+        if draft is None and tier != TIER_DRAFT:
+            draft = fuzzy.draft(source_text)
+        with use_book_context(fuzzy.references(source_text)):
+            return translate(
+                source_lang,
+                target_lang,
+                source_text,
+                country,
+                max_tokens,
+                revision_mode=revision_mode,
+                quality_threshold=quality_threshold,
+                tier=tier,
+                quality_check=quality_check,
+                synopsis_tokens=synopsis_tokens,
+                synopsis_cache=synopsis_cache,
+                draft=draft,
+                alignment=alignment,
+                skip_untranslatable=skip_untranslatable,
+                mask_markup=mask_markup,
+            )
+
+    revision_mode = tier_revision_mode(tier, revision_mode)
+
+    if (skip_untranslatable or mask_markup) and alignment is None:
+        from .masking import mask_untranslatable
+
+        masked = mask_untranslatable(
+            source_text,
+            source_lang,
+            target_lang,
+            lines=skip_untranslatable,
+            inline=mask_markup,
+        )
+        if masked.kept:
+            if not masked.translatable:
+                return masked.unmask(masked.text)
+            restored = _translate_masked(
+                source_lang,
+                target_lang,
+                source_text,
+                masked,
+                country,
+                max_tokens,
+                revision_mode,
+                quality_threshold,
+                quality_check,
+                synopsis_tokens,
+                synopsis_cache,
+            )
+            if restored is not None:
+                return restored
+            ic("A placeholder was lost, translating the text unmasked")
+            draft = None
 
     num_tokens_in_text = num_tokens_in_string(source_text)
 
     ic(num_tokens_in_text)
 
+    if alignment is not None and (
+        alignment.source_lang,
+        alignment.target_lang,
+    ) == (source_lang, target_lang):
+        plan = alignment.plan(source_text, max_tokens)
+        if plan.hits:
+            ic(f"Translating {len(plan.changed)} edited parts")
+            translations = plan.chunks
+            if plan.changed:
+                synopsis = None
+                if synopsis_tokens and num_tokens_in_text >= synopsis_tokens:
+                    from .synopsis import document_synopsis
+
+                    synopsis = document_synopsis(
+                        source_lang, source_text, synopsis_cache
+                    )
+                with use_synopsis(synopsis):
+                    translations = multichunk_translation(
+                        source_lang,
+                        target_lang,
+                        plan.chunks,
+                        country,
+                        revision_mode,
+                        quality_threshold,
+                        quality_check,
+                        plan.changed,
+                    )
+            return plan.join(translations)
+
     if num_tokens_in_text < max_tokens:
         ic("Translating text as a single chunk")
 
         final_translation = one_chunk_translate_text(
-            source_lang, target_lang, source_text, country
+            source_lang,
+            target_lang,
+            source_text,
+            country,
+            revision_mode,
+            quality_threshold,
+            quality_check,
+            draft,
         )
 
         return final_translation
@@ -678,23 +2232,27 @@ def translate(
     else:
         ic("Translating text as multiple chunks")
 
-        token_size = calculate_chunk_size(
-            token_count=num_tokens_in_text, token_limit=max_tokens
+        source_text_chunks = split_source_text(
+            source_text, max_tokens, num_tokens_in_text
         )
 
-        ic(token_size)
-
-        TextSplitter = get_text_splitter()
-        text_splitter = TextSplitter.from_tiktoken_encoder(
-            model_name="gpt-4",
-            chunk_size=token_size,
-            chunk_overlap=0,
-        )
+        synopsis = None
+        if synopsis_tokens and num_tokens_in_text >= synopsis_tokens:
+            from .synopsis import document_synopsis
 
-        source_text_chunks = text_splitter.split_text(source_text)
+            synopsis = document_synopsis(
+                source_lang, source_text, synopsis_cache
+            )
 
-        translation_2_chunks = multichunk_translation(
-            source_lang, target_lang, source_text_chunks, country
-        )
+        with use_synopsis(synopsis):
+            translation_2_chunks = multichunk_translation(
+                source_lang,
+                target_lang,
+                source_text_chunks,
+                country,
+                revision_mode,
+                quality_threshold,
+                quality_check,
+            )
 
         return "".join(translation_2_chunks)
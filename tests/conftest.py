@@ -0,0 +1,74 @@
+import json
+import re
+
+import pytest
+
+import translation_agent.utils as utils
+from translation_agent.usage import record_usage
+
+
+SEGMENT = re.compile(r"<SEGMENT_(\d+)>\n(.*?)\n</SEGMENT_\1>", re.DOTALL)
+
+
+def word_count(text, encoding_name="cl100k_base"):
+    return len(text.split())
+
+
+def split_paragraphs(source_text, max_tokens=1000, num_tokens_in_text=None):
+    if len(source_text.split()) < max_tokens:
+        return [source_text]
+    return [p + "\n" for p in source_text.split("\n") if p]
+
+
+class UpperCompletion:
+    """
+    Translate into upper case and record the prompts.
+
+    The text of a single-chunk prompt, the part of a chunk prompt and every
+    segment of a packed prompt are translated, with ``drop`` (a placeholder
+    the model loses) removed first.
+    """
+
+    def __init__(self, drop=None):
+        self.drop = drop
+        self.prompts = []
+        self.parts = []
+
+    def translate(self, text):
+        if self.drop:
+            text = text.replace(self.drop, "")
+        return text.upper()
+
+    def __call__(self, prompt, system_message="", **kwargs):
+        self.prompts.append(prompt)
+        record_usage("fake", {"prompt_tokens": 1, "completion_tokens": 1})
+        segments = SEGMENT.findall(prompt)
+        if segments:
+            return json.dumps({n: self.translate(t) for n, t in segments})
+        if "<TRANSLATE_THIS>\n" in prompt:
+            part = prompt.split("<TRANSLATE_THIS>\n", 1)[1]
+            part = part.split("\n</TRANSLATE_THIS>", 1)[0]
+        else:
+            part = prompt.split("English: ", 1)[1].split("\n\nSpanish:")[0]
+        self.parts.append(part)
+        return self.translate(part)
+
+
+@pytest.fixture
+def word_tokens(monkeypatch):
+    """Count words instead of tokens, so no tokenizer is downloaded."""
+    monkeypatch.setattr(utils, "num_tokens_in_string", word_count)
+
+
+@pytest.fixture
+def paragraph_chunks(monkeypatch):
+    """Split texts of max_tokens words or more into one chunk per line."""
+    monkeypatch.setattr(utils, "split_source_text", split_paragraphs)
+
+
+@pytest.fixture
+def upper_completion(monkeypatch):
+    """Install an UpperCompletion as the LLM and return it."""
+    completion = UpperCompletion()
+    monkeypatch.setattr(utils, "get_completion", completion)
+    return completion
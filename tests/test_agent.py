@@ -6,13 +6,22 @@ import openai
 import pytest
 from dotenv import load_dotenv
 
+from translation_agent.usage import track_usage
+from translation_agent.usage import UsageTracker
+
 # from translation_agent.utils import find_sentence_starts
+from translation_agent.utils import apply_edits
 from translation_agent.utils import get_completion
 from translation_agent.utils import num_tokens_in_string
+from translation_agent.utils import one_chunk_edit_translation
 from translation_agent.utils import one_chunk_improve_translation
 from translation_agent.utils import one_chunk_initial_translation
+from translation_agent.utils import one_chunk_reflect_and_improve
 from translation_agent.utils import one_chunk_reflect_on_translation
 from translation_agent.utils import one_chunk_translate_text
+from translation_agent.utils import parse_edits
+from translation_agent.utils import parse_revision
+from translation_agent.utils import reflection_finds_nothing
 
 
 load_dotenv()
@@ -141,7 +150,8 @@ When writing suggestions, pay attention to whether there are ways to improve the
 
 Write a list of specific, helpful and constructive suggestions for improving the translation.
 Each suggestion should address one specific part of the translation.
-Output only the suggestions and nothing else."""
+Output only the suggestions and nothing else.
+If the translation needs no changes, output only NO_CHANGES."""
         expected_system_message = f"You are an expert linguist specializing in translation from {source_lang} to {target_lang}. \
 You will be provided with a source text and its translation and your goal is to improve the translation."
         mock_get_completion.assert_called_once_with(
@@ -211,7 +221,9 @@ Output only the new translation and nothing else."""
     expected_system_message = f"You are an expert linguist, specializing in translation editing from English to Spanish."
 
     mock_get_completion.assert_called_once_with(
-        expected_prompt, expected_system_message
+        expected_prompt,
+        expected_system_message,
+        prediction=example_data["translation_1"],
     )
 
 
@@ -259,6 +271,169 @@ def test_one_chunk_translate_text(mocker):
     )
 
 
+def test_reflection_finds_nothing():
+    assert reflection_finds_nothing("NO_CHANGES")
+    assert reflection_finds_nothing("  `NO_CHANGES`. ")
+    assert reflection_finds_nothing("")
+    assert not reflection_finds_nothing(
+        "The translation is accurate and fluent. No changes are needed."
+    )
+    assert not reflection_finds_nothing(
+        "No changes to meaning; only fix the punctuation in line 2."
+    )
+    assert not reflection_finds_nothing(
+        "The translation is accurate but could be more fluent."
+    )
+    assert not reflection_finds_nothing(
+        "1. Use 'usted' instead of 'tú'.\n2. No other changes."
+    )
+
+
+def test_one_chunk_improve_translation_skips_when_nothing_to_fix(
+    mocker, example_data
+):
+    mock_get_completion = mocker.patch(
+        "translation_agent.utils.get_completion"
+    )
+    tracker = UsageTracker("test")
+
+    with track_usage(tracker):
+        result = one_chunk_improve_translation(
+            example_data["source_lang"],
+            example_data["target_lang"],
+            example_data["source_text"],
+            example_data["translation_1"],
+            "NO_CHANGES",
+        )
+
+    assert result == example_data["translation_1"]
+    mock_get_completion.assert_not_called()
+    assert tracker.stages["improve"].skipped == 1
+    assert tracker.total.calls == 0
+
+
+def test_parse_revision():
+    assert parse_revision(
+        '{"reflection": "Use usted.", "translation": "Hola"}'
+    ) == ("Use usted.", "Hola")
+    # Code fences and list suggestions are tolerated.
+    assert parse_revision(
+        '```json\n{"reflection": ["a", "b"], "translation": "Hola"}\n```'
+    ) == ("a\nb", "Hola")
+    assert parse_revision("Hola, ¿cómo estás?") is None
+    assert parse_revision('{"reflection": "ok"}') is None
+    assert parse_revision('{"reflection": "ok", "translation": " "}') is None
+
+
+def test_one_chunk_reflect_and_improve_falls_back(mocker):
+    source_lang = "English"
+    target_lang = "Spanish"
+    source_text = "Hello, how are you?"
+    translation_1 = "Hola, ¿cómo estás?"
+
+    mock_get_completion = mocker.patch(
+        "translation_agent.utils.get_completion",
+        return_value='{"reflection": "More formal.", "translation": "Hola"}',
+    )
+    assert one_chunk_reflect_and_improve(
+        source_lang, target_lang, source_text, translation_1
+    ) == ("More formal.", "Hola")
+    assert mock_get_completion.call_count == 1
+    assert mock_get_completion.call_args.kwargs["json_mode"] is True
+
+    # Malformed output falls back to the separate reflect and improve calls.
+    mock_get_completion.return_value = "not json"
+    mock_reflect = mocker.patch(
+        "translation_agent.utils.one_chunk_reflect_on_translation",
+        return_value="reflection",
+    )
+    mock_improve = mocker.patch(
+        "translation_agent.utils.one_chunk_improve_translation",
+        return_value="Hola, ¿cómo está usted?",
+    )
+    assert one_chunk_reflect_and_improve(
+        source_lang, target_lang, source_text, translation_1
+    ) == ("reflection", "Hola, ¿cómo está usted?")
+    mock_reflect.assert_called_once_with(
+        source_lang, target_lang, source_text, translation_1, ""
+    )
+    mock_improve.assert_called_once_with(
+        source_lang, target_lang, source_text, translation_1, "reflection"
+    )
+
+
+def test_parse_and_apply_edits():
+    edits = parse_edits(
+        '```json\n{"edits": [{"original": "estás", "replacement": "está '
+        'usted", "reason": "formal"}, {"original": "Hola", '
+        '"replacement": "Buenos días"}]}\n```'
+    )
+    assert edits[1] == {
+        "original": "Hola",
+        "replacement": "Buenos días",
+        "reason": "",
+    }
+    assert apply_edits("Hola, ¿cómo estás?", edits) == (
+        "Buenos días, ¿cómo está usted?"
+    )
+    assert parse_edits('{"edits": []}') == []
+    assert parse_edits('{"edits": [{"original": "x"}]}') is None
+    assert parse_edits("Hola") is None
+
+    # Missing, ambiguous and overlapping spans do not apply.
+    replace = lambda original: {
+        "original": original,
+        "replacement": "x",
+        "reason": "",
+    }
+    assert apply_edits("a b a", [replace("c")]) is None
+    assert apply_edits("a b a", [replace("a")]) is None
+    assert apply_edits("a b c", [replace("a b"), replace("b c")]) is None
+    assert apply_edits("a b c", [replace("")]) is None
+
+
+def test_one_chunk_edit_translation(mocker):
+    source_lang = "English"
+    target_lang = "Spanish"
+    source_text = "Hello, how are you?"
+    translation_1 = "Hola, ¿cómo estás?"
+
+    mock_get_completion = mocker.patch(
+        "translation_agent.utils.get_completion",
+        return_value='{"edits": [{"original": "estás", '
+        '"replacement": "está usted", "reason": "More formal."}]}',
+    )
+    mock_improve = mocker.patch(
+        "translation_agent.utils.one_chunk_improve_translation",
+        return_value="Hola, ¿qué tal?",
+    )
+    tracker = UsageTracker()
+    with track_usage(tracker):
+        reflection, translation_2 = one_chunk_edit_translation(
+            source_lang, target_lang, source_text, translation_1
+        )
+    assert translation_2 == "Hola, ¿cómo está usted?"
+    assert reflection == 'Replace "estás" with "está usted": More formal.'
+    assert mock_get_completion.call_args.kwargs["json_mode"] is True
+    mock_improve.assert_not_called()
+    assert tracker.stages["improve"].skipped == 1
+
+    # Edits that do not apply cleanly are handed to the improve call.
+    mock_get_completion.return_value = (
+        '{"edits": [{"original": "adiós", "replacement": "hasta luego"}]}'
+    )
+    assert one_chunk_edit_translation(
+        source_lang, target_lang, source_text, translation_1
+    ) == ('Replace "adiós" with "hasta luego"', "Hola, ¿qué tal?")
+    mock_improve.assert_called_once_with(
+        source_lang,
+        target_lang,
+        source_text,
+        translation_1,
+        'Replace "adiós" with "hasta luego"',
+    )
+
+
 def test_num_tokens_in_string():
     # Test case 1: Empty string
     assert num_tokens_in_string("") == 0
@@ -0,0 +1,49 @@
+import json
+
+import translation_agent.utils as utils
+from translation_agent.benchmark import benchmark_revision_modes
+from translation_agent.benchmark import format_benchmark
+from translation_agent.usage import current_stage
+from translation_agent.usage import record_usage
+
+
+def fake_completion(prompt, system_message="", **kwargs):
+    """Answer like an LLM whose every edit applies cleanly."""
+    stage = current_stage()
+    if stage == "edit":
+        answer = json.dumps(
+            {"edits": [{"original": "uno", "replacement": "one"}]}
+        )
+    elif stage == "reflect":
+        answer = "Translate uno as one."
+    else:
+        answer = "one " + "word " * 20
+    record_usage(
+        "fake",
+        {"prompt_tokens": 10, "completion_tokens": len(answer.split())},
+        latency=0.1,
+    )
+    return answer
+
+
+def test_benchmark_revision_modes(monkeypatch, word_tokens, paragraph_chunks):
+    monkeypatch.setattr(utils, "get_completion", fake_completion)
+    fake_initial = lambda *args: ["uno dos\n", "uno tres\n"]
+    monkeypatch.setattr(utils, "multichunk_initial_translation", fake_initial)
+
+    rows = benchmark_revision_modes(
+        "one two\none three",
+        "English",
+        "Spanish",
+        [utils.REVISION_SEPARATE, utils.REVISION_EDITS],
+        max_tokens=2,
+    )
+
+    separate, edits = rows
+    assert separate["calls"] == 4
+    assert separate["completion_ratio"] == 1.0
+    assert edits["calls"] == 2
+    assert edits["skipped"] == 2
+    assert edits["completion_tokens"] < separate["completion_tokens"]
+    assert edits["latency"] == 0.2
+    assert "edits" in format_benchmark(rows)
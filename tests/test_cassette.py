@@ -0,0 +1,84 @@
+from types import SimpleNamespace
+
+import pytest
+
+import translation_agent.utils as utils
+from translation_agent.cassette import CassetteMiss
+from translation_agent.cassette import use_cassette
+from translation_agent.utils import chat_completion
+from translation_agent.utils import get_completion
+from translation_agent.utils import prediction_params
+from translation_agent.utils import prediction_supported
+
+
+class EchoClient:
+    """Fake client answering every prompt with its reversed text."""
+
+    def __init__(self):
+        self.calls = 0
+        self.chat = SimpleNamespace(
+            completions=SimpleNamespace(create=self.create)
+        )
+
+    def create(self, **params):
+        self.calls += 1
+        prompt = params["messages"][-1]["content"]
+        return SimpleNamespace(
+            model=params["model"],
+            usage=SimpleNamespace(prompt_tokens=3, completion_tokens=2),
+            choices=[
+                SimpleNamespace(message=SimpleNamespace(content=prompt[::-1]))
+            ],
+        )
+
+
+def test_record_then_replay_offline(tmp_path, monkeypatch):
+    path = str(tmp_path / "run.jsonl")
+    client = EchoClient()
+    monkeypatch.setattr(utils, "client", client)
+
+    with use_cassette(path, mode="record") as cassette:
+        recorded = [get_completion("hello"), get_completion("world")]
+    assert cassette.summary()["recorded"] == 2
+    assert client.calls == 2
+
+    # Replay without any client: nothing reaches the network.
+    monkeypatch.setattr(utils, "client", None)
+    with use_cassette(path, latency_scale=0) as cassette:
+        replayed = [get_completion("hello"), get_completion("world")]
+        with pytest.raises(CassetteMiss):
+            get_completion("never recorded")
+
+    assert replayed == recorded == ["olleh", "dlrow"]
+    summary = cassette.summary()
+    assert summary["calls"] == 2
+    assert summary["unused"] == 0
+    assert summary["misses"] == 1
+
+
+def test_replayed_prediction_miss_retries_without_it(tmp_path):
+    path = str(tmp_path / "run.jsonl")
+    client = EchoClient()
+    hello = [{"role": "user", "content": "hello"}]
+    with use_cassette(path, mode="record"):
+        chat_completion(client, model="replay-model", messages=hello)
+
+    prediction = prediction_params("draft")
+    with use_cassette(path, latency_scale=0) as cassette:
+        # A miss on a request never recorded says nothing about support.
+        with pytest.raises(CassetteMiss):
+            chat_completion(
+                client,
+                model="replay-model",
+                messages=[{"role": "user", "content": "other"}],
+                **prediction,
+            )
+        assert prediction_supported(client, "replay-model") is None
+
+        # The recording holds the request without the prediction.
+        response = chat_completion(
+            client, model="replay-model", messages=hello, **prediction
+        )
+    assert response.choices[0].message.content == "olleh"
+    assert prediction_supported(client, "replay-model") is False
+    assert cassette.summary()["calls"] == 1
@@ -0,0 +1,63 @@
+import translation_agent.utils as utils
+from translation_agent import translate_many
+from translation_agent.dedup import find_duplicates
+from translation_agent.usage import UsageTracker
+from translation_agent.usage import track_usage
+
+
+NOTE = "Thanks for reading! Support me on my page."
+DOCUMENTS = {
+    "one": f"Chapter 1\nIt rained.\n{NOTE}",
+    "two": f"Chapter 2\nThe sun came out.\n{NOTE}",
+    "copy": f"Chapter 1\nIt rained.\n{NOTE}",
+}
+
+
+def test_find_duplicates():
+    duplicates = find_duplicates(list(DOCUMENTS.items()))
+    assert duplicates.copies == {"one": [("copy", DOCUMENTS["copy"])]}
+    assert duplicates.documents == 1
+    assert duplicates.units == [NOTE]
+    assert duplicates.paragraphs == 1
+
+    # Whitespace changes the output, so near-copies are not copies.
+    near = find_duplicates(
+        [("a", "Hello.\nIt rained.\n"), ("b", "Hello.\nIt rained.")]
+    )
+    assert near.copies == {}
+
+
+def test_translate_many_deduplicates(word_tokens, upper_completion):
+    batch = UsageTracker("batch")
+    copy = UsageTracker("copy")
+    progress = set()
+
+    with track_usage(batch):
+        results = {
+            r.key: r
+            for r in translate_many(
+                DOCUMENTS,
+                "English",
+                "Spanish",
+                tier=utils.TIER_DRAFT,
+                deduplicate=True,
+                trackers={"copy": [copy]},
+                on_progress=lambda key, done, total: progress.add(key),
+            )
+        }
+
+    note = NOTE.upper()
+    assert results["one"].final_translation == f"CHAPTER 1\nIT RAINED.\n{note}"
+    assert results["copy"].final_translation == (
+        results["one"].final_translation
+    )
+    assert results["two"].final_translation.endswith(f"\n{note}")
+    # The note once, then each unique document without it.
+    assert len(upper_completion.prompts) == 3
+    assert sum(NOTE in prompt for prompt in upper_completion.prompts) == 1
+    # The note shares the queue but is not reported as a document.
+    assert progress == {"one", "two"}
+    assert copy.stages["initial"].skipped == 1
+    assert (batch.duplicate_documents, batch.duplicate_paragraphs) == (1, 1)
+    assert batch.duplicate_calls == 1
+    assert "duplicates: 1 documents and 1 paragraphs" in batch.format_summary()
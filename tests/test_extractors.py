@@ -0,0 +1,125 @@
+import json
+
+import translation_agent.utils as utils
+from translation_agent import translate_many
+from translation_agent.extractors import extract_segments
+from translation_agent.usage import UsageTracker
+
+
+PYTHON = '''#!/usr/bin/env python
+"""Tools.
+
+    Helpers for the demo.
+"""
+import os  # the os module
+
+# A comment wrapped
+# over two lines.
+# x = compute(1, 2);
+def f(a):
+    """Return a."""
+    s = "# not a comment"
+    return a  # noqa
+'''
+
+CPP = """#include <cstdio>
+/**
+ * Adds two numbers.
+ */
+int add(int a, int b) { return a + b; }  // sum them
+const char *s = "// not a comment";
+"""
+
+
+def test_extract_segments():
+    python = extract_segments(PYTHON, "tools.py")
+    assert python.segments == [
+        "Tools.\n\nHelpers for the demo.",
+        "the os module",
+        "A comment wrapped\nover two lines.",
+        "Return a.",
+    ]
+    assert python.rebuild(python.segments) == PYTHON
+    translated = python.rebuild(
+        ["Herramientas.\n\nAyuda.", "el módulo os", "Un comentario", 'a"""b']
+    )
+    assert '"""Herramientas.\n\n    Ayuda.\n"""' in translated
+    assert "import os  # el módulo os\n" in translated
+    assert "# Un comentario\n# x = compute(1, 2);" in translated
+    assert '"""a\\"\\"\\"b"""' in translated
+    assert extract_segments("def f(:\n", ".py") is None
+
+    cpp = extract_segments(CPP, "add.cpp")
+    assert cpp.segments == ["Adds two numbers.", "sum them"]
+    assert cpp.rebuild(["Suma dos\nnúmeros.", "los suma"]) == CPP.replace(
+        " * Adds two numbers.", " * Suma dos\n * números."
+    ).replace("sum them", "los suma")
+    block = extract_segments("/* Block comment */", ".cpp")
+    assert block.rebuild(["块 */ 注释"]) == "/* 块 * / 注释 */"
+
+    document = '{"title": "Hello", "id": "user_name", "tags": ["Hello", 3]}'
+    data = extract_segments(document, ".json")
+    assert data.segments == ["Hello"]
+    assert json.loads(data.rebuild(['Di "hola"'])) == {
+        "title": 'Di "hola"',
+        "id": "user_name",
+        "tags": ['Di "hola"', 3],
+    }
+    assert extract_segments("{", ".json") is None
+
+    markdown = "# Title\n\nText.\n\n```\ncode()\n```\n[a]: https://a.io\n"
+    prose = extract_segments(markdown, "README.md")
+    assert prose.segments == ["# Title\n\nText."]
+    rebuilt = prose.rebuild(["# Título\n\nTexto."])
+    assert rebuilt == markdown.replace("Title", "Título").replace(
+        "Text.", "Texto."
+    )
+    assert extract_segments("text", "notes.txt") is None
+
+
+def test_translate_many_extractions(word_tokens, upper_completion):
+    documents = {
+        "tools.py": PYTHON,
+        "add.cpp": CPP,
+        "README.md": "See [docs](https://a.io/docs/index.html) now.\n",
+        "notes.txt": "Plain text.",
+    }
+    extractions = {
+        key: extract_segments(text, key) for key, text in documents.items()
+    }
+    extractions = {k: e for k, e in extractions.items() if e is not None}
+    trackers = {key: [UsageTracker(key)] for key in documents}
+    progress = []
+
+    results = {
+        r.key: r
+        for r in translate_many(
+            documents,
+            "English",
+            "Spanish",
+            tier=utils.TIER_DRAFT,
+            extractions=extractions,
+            trackers=trackers,
+            on_progress=lambda key, done, total: progress.append(key),
+        )
+    }
+
+    python = results["tools.py"].final_translation
+    assert "# A COMMENT WRAPPED\n# OVER TWO LINES.\n# x = compute" in python
+    assert python.count("def f(a):") == 1 and "RETURN A." in python
+    assert results["add.cpp"].final_translation.endswith(
+        "}  // SUM THEM\nconst char *s = \"// not a comment\";\n"
+    )
+    assert results["README.md"].final_translation == (
+        "SEE [DOCS](https://a.io/docs/index.html) NOW.\n"
+    )
+    assert results["notes.txt"].final_translation == "PLAIN TEXT."
+    prompts = upper_completion.prompts
+    assert not any("return a" in prompt for prompt in prompts)
+    assert not any("a.io" in prompt for prompt in prompts)
+    # The code segments share one packed call.
+    assert len(upper_completion.prompts) == 3
+    assert trackers["tools.py"][0].masked_tokens > 0
+    assert "add.cpp" in progress
+    # The segments share the batch's queue but are reported per file.
+    assert set(progress) == set(documents)
@@ -0,0 +1,105 @@
+from types import SimpleNamespace
+
+import pytest
+
+import translation_agent.utils as utils
+from translation_agent.memory import TranslationMemory
+from translation_agent.usage import UsageTracker
+from translation_agent.usage import current_stage
+from translation_agent.usage import track_usage
+
+
+pytest.importorskip("numpy")
+
+import translation_agent.fuzzy as fuzzy  # noqa: E402
+from translation_agent.fuzzy import FuzzyIndex  # noqa: E402
+from translation_agent.fuzzy import FuzzyMemory  # noqa: E402
+
+
+SENTENCES = [
+    "The old lighthouse keeper climbed the stairs every night.",
+    "Rain fell on the harbour while the boats waited for dawn.",
+    "She folded the letter twice and hid it under the floorboard.",
+    "Nobody in the village remembered who had planted the oak.",
+]
+
+
+def test_index_finds_near_duplicates(tmp_path):
+    index = FuzzyIndex()
+    index.add(range(len(SENTENCES)), SENTENCES)
+    index.build()
+    index.add([10], ["A completely different line about mountain goats."])
+
+    probe = "The old lighthouse keeper climbed the stairs each night."
+    (best, similarity), *_ = index.query(probe)
+    assert best == 0 and similarity >= 0.7
+    assert index.query("Quantum chromodynamics lecture notes.") == []
+    assert index.query("A completely different line about mountain goat.")
+
+    index.save(str(tmp_path))
+    loaded = FuzzyIndex.load(str(tmp_path))
+    assert len(loaded) == len(SENTENCES) + 1
+    assert loaded.query(probe)[0][0] == 0
+
+
+def test_index_merges_pending_segments(monkeypatch):
+    monkeypatch.setattr(fuzzy, "PENDING_LIMIT", 2)
+    index = FuzzyIndex()
+    full = FuzzyIndex()
+    full.add(range(len(SENTENCES)), SENTENCES)
+    full.build()
+    for i, sentence in enumerate(SENTENCES):
+        index.add([i], [sentence])
+    # Merged by themselves every two segments; an odd one stays pending.
+    merged = len(SENTENCES) - len(SENTENCES) % 2
+    assert (len(index.ids), index.pending) == (merged, len(SENTENCES) % 2)
+    assert index.max_id == len(SENTENCES) - 1
+    for sentence in SENTENCES:
+        assert index.query(sentence) == full.query(sentence)
+
+
+class FakeClient:
+    """Record the stage and system message of every request."""
+
+    def __init__(self):
+        self.requests = []
+        self.chat = SimpleNamespace(
+            completions=SimpleNamespace(create=self.create)
+        )
+
+    def create(self, **params):
+        self.requests.append((current_stage(), params["messages"][0]))
+        return SimpleNamespace(
+            model="fake",
+            usage=SimpleNamespace(prompt_tokens=1, completion_tokens=1),
+            choices=[SimpleNamespace(message=SimpleNamespace(content="ok"))],
+        )
+
+
+def test_translate_revises_fuzzy_draft(word_tokens, tmp_path):
+    client = FakeClient()
+    memory = TranslationMemory()
+    memory.add_many(
+        "English", "Spanish", [(s, f"ES {i}") for i, s in enumerate(SENTENCES)]
+    )
+    fuzzy = FuzzyMemory(memory, "English", "Spanish", str(tmp_path))
+    assert len(FuzzyMemory(memory, "English", "Spanish", str(tmp_path)).index)
+
+    tracker = UsageTracker("doc")
+    with utils.use_client(client), track_usage(tracker):
+        translation = utils.translate(
+            "English",
+            "Spanish",
+            "Rain fell on the harbour while the boats waited for the dawn.",
+            "",
+            fuzzy=fuzzy,
+        )
+    assert translation == "ok"
+    stages = [stage for stage, _ in client.requests]
+    assert stages == ["reflect", "improve"]
+    assert tracker.stages["initial"].skipped == 1
+    assert "=> ES 1" in client.requests[0][1]["content"]
+
+    memory.add("English", "Spanish", "Brand new sentence here.", "Nueva.")
+    fuzzy.refresh()
+    assert fuzzy.lookup("Brand new sentence here!")[0][2] == "Nueva."
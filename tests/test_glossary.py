@@ -0,0 +1,140 @@
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import translation_agent.utils as utils
+from translation_agent import translate_many
+from translation_agent.glossary import BookGlossary
+from translation_agent.usage import UsageTracker
+from translation_agent.usage import current_stage
+from translation_agent.usage import track_usage
+
+
+class FakeClient:
+    """Record the messages sent and answer glossary calls with new terms."""
+
+    def __init__(self, terms):
+        self.terms = terms
+        self.requests = []
+        self.lock = threading.Lock()
+        self.chat = SimpleNamespace(
+            completions=SimpleNamespace(create=self.create)
+        )
+
+    def create(self, **params):
+        stage = current_stage()
+        with self.lock:
+            self.requests.append((stage, params["messages"]))
+        content = "translated"
+        if stage == "glossary":
+            content = json.dumps({"terms": self.terms, "synopsis": "So far."})
+        return SimpleNamespace(
+            model="fake",
+            usage=SimpleNamespace(prompt_tokens=1, completion_tokens=1),
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+        )
+
+
+def test_glossary_keeps_first_translation(monkeypatch, tmp_path):
+    path = str(tmp_path / "book.json")
+    glossary = BookGlossary(path)
+    assert glossary.context("Alice walks.") == ""
+
+    client = FakeClient({"Alice": "Alicia", "Bob": "Roberto"})
+    with utils.use_client(client):
+        assert glossary.update("English", "Spanish", "Alice and Bob.", "x") == 2
+        client.terms = {"Alice": "Alisa", "Carol": "Carolina"}
+        assert glossary.update("English", "Spanish", "Alice, Carol.", "y") == 1
+
+    # The fixed names of the chapter are sent with the extraction prompt.
+    assert "Alice = Alicia" in client.requests[1][1][1]["content"]
+
+    reloaded = BookGlossary(path)
+    assert reloaded.terms == {
+        "Alice": "Alicia",
+        "Bob": "Roberto",
+        "Carol": "Carolina",
+    }
+    assert reloaded.documents == 2
+    notes = reloaded.context("Carol meets Alice.")
+    assert "The book so far: So far." in notes
+    assert "Alice = Alicia" in notes and "Carol = Carolina" in notes
+    assert "Bob" not in notes
+
+
+def test_translate_many_shares_glossary(word_tokens):
+    glossary = BookGlossary()
+    glossary.terms = {"Alice": "Alicia", "Bob": "Roberto"}
+    client = FakeClient({"Dave": "David"})
+    tracker = UsageTracker("batch")
+
+    with utils.use_client(client), track_usage(tracker):
+        results = list(
+            translate_many(
+                ["Alice runs.", "Dave sleeps."],
+                "English",
+                "Spanish",
+                max_workers=2,
+                glossary=glossary,
+            )
+        )
+
+    assert all(r.error is None for r in results)
+    assert glossary.terms["Dave"] == "David"
+    assert tracker.stages["glossary"].calls == 2
+    for stage, messages in client.requests:
+        system = messages[0]["content"]
+        if stage == "glossary":
+            assert "Alice = Alicia" not in system
+        elif "Alice runs." in messages[1]["content"]:
+            assert system.endswith("\nAlice = Alicia")
+            assert "Bob" not in system
+
+
+class SynopsisClient(FakeClient):
+    """Answer glossary calls with a synopsis naming how many came before."""
+
+    def __init__(self):
+        super().__init__({})
+        self.active = 0
+        self.overlapped = False
+
+    def create(self, **params):
+        if current_stage() != "glossary":
+            return super().create(**params)
+        with self.lock:
+            self.active += 1
+            self.overlapped |= self.active > 1
+            done = sum(stage == "glossary" for stage, _ in self.requests)
+        time.sleep(0.01)
+        response = super().create(**params)
+        content = json.dumps({"terms": {}, "synopsis": f"Part {done + 1}."})
+        response.choices[0].message.content = content
+        with self.lock:
+            self.active -= 1
+        return response
+
+
+def test_glossary_updates_run_one_at_a_time(word_tokens):
+    glossary = BookGlossary()
+    client = SynopsisClient()
+
+    with utils.use_client(client):
+        results = list(
+            translate_many(
+                [f"Chapter {i}." for i in range(4)],
+                "English",
+                "Spanish",
+                max_workers=4,
+                glossary=glossary,
+            )
+        )
+
+    assert all(r.error is None for r in results)
+    assert not client.overlapped
+    # Every update builds on the synopsis the previous one wrote.
+    assert glossary.synopsis == "Part 4."
+    prompts = [m[1]["content"] for s, m in client.requests if s == "glossary"]
+    for i, prompt in enumerate(prompts[1:], 1):
+        assert f"Synopsis so far: Part {i}." in prompt
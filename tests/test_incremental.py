@@ -0,0 +1,79 @@
+import translation_agent.utils as utils
+from translation_agent import translate_many
+from translation_agent.incremental import Alignment
+from translation_agent.usage import UsageTracker
+from translation_agent.usage import track_usage
+
+
+OLD = "Chapter 1\n\nShe smiled.\nIt was late.\n\nThe end."
+OLD_TRANSLATION = "Capítulo 1\n\nElla sonrió.\nEra tarde.\n\nFin."
+NEW = "Chapter 1\n\nShe  smiled.\nIt was early.\nA bird sang.\n\nThe end."
+
+
+def test_plan_keeps_unchanged_paragraphs(word_tokens, tmp_path):
+    assert Alignment.from_translation("en", "es", "a\nb", "x") is None
+    path = str(tmp_path / "chapter.json")
+    Alignment.from_translation("en", "es", OLD, OLD_TRANSLATION).save(path)
+    alignment = Alignment.load(path)
+    assert alignment.pairs[1] == ("She smiled.", "Ella sonrió.")
+
+    tracker = UsageTracker("doc")
+    with track_usage(tracker):
+        plan = alignment.plan(NEW)
+    assert plan.chunks == [
+        "Chapter 1\n\nShe  smiled.\n",
+        "It was early.\nA bird sang.\n\n",
+        "The end.",
+    ]
+    assert plan.changed == [1]
+    assert (plan.hits, plan.segments) == (3, 5)
+    assert tracker.memory_hits == 3
+    assert plan.join(["", "ERA TEMPRANO.\nUN PÁJARO.", ""]) == (
+        "Capítulo 1\n\nElla sonrió.\nERA TEMPRANO.\nUN PÁJARO.\n\nFin."
+    )
+    assert alignment.plan(OLD).complete
+
+
+def test_translate_updates_edited_paragraphs(word_tokens, upper_completion):
+    alignment = Alignment.from_translation(
+        "English", "Spanish", OLD, OLD_TRANSLATION
+    )
+
+    translation = utils.translate(
+        "English",
+        "Spanish",
+        NEW,
+        "",
+        tier=utils.TIER_DRAFT,
+        alignment=alignment,
+    )
+    assert translation == (
+        "Capítulo 1\n\nElla sonrió.\nIT WAS EARLY.\nA BIRD SANG.\n\nFin."
+    )
+    assert upper_completion.parts == ["It was early.\nA bird sang.\n\n"]
+
+
+def test_translate_many_updates_edited_documents(
+    word_tokens, upper_completion
+):
+    alignment = Alignment.from_translation(
+        "English", "Spanish", OLD, OLD_TRANSLATION
+    )
+
+    results = {
+        r.key: r
+        for r in translate_many(
+            {"edited": NEW, "same": OLD},
+            "English",
+            "Spanish",
+            revision_mode=utils.REVISION_COMBINED,
+            alignments={"edited": alignment, "same": alignment},
+        )
+    }
+
+    assert results["same"].final_translation == OLD_TRANSLATION
+    edited = results["edited"].final_translation
+    assert edited.startswith("Capítulo 1\n\nElla sonrió.\n")
+    assert edited.endswith("\n\nFin.")
+    parts = upper_completion.parts
+    assert all(part.startswith("It was early.") for part in parts)
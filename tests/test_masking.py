@@ -0,0 +1,146 @@
+import translation_agent.utils as utils
+from translation_agent import translate_many
+from translation_agent.masking import classify_segment
+from translation_agent.masking import mask_untranslatable
+from translation_agent.usage import UsageTracker
+from translation_agent.usage import track_usage
+
+
+def test_classify_segment():
+    def kind(line, source="Chinese", target="English"):
+        return classify_segment(line, source, target)
+
+    assert kind("https://example.com/a?b=c") == "url"
+    assert kind("2024-01-01  * * *") == "number"
+    assert kind("for (int i = 0; i < n; i++) {") == "code"
+    assert kind("import numpy as np", "English", "Spanish") == "code"
+    assert kind("iPhone 15 Pro Max") == "target"
+    assert kind("他买了一部 iPhone。") is None
+    assert kind("// 计算总数") is None
+    assert kind("Return to the castle.", "English", "Spanish") is None
+    assert kind("return x;", "English", "Spanish") == "code"
+    assert kind("function add(a, b) {", "English", "Spanish") == "code"
+    for prose in (
+        "return the book to the library tomorrow",
+        "public opinion turned against him.",
+        "static crackled on the radio.",
+        "let them eat cake",
+        "var is short for variable.",
+    ):
+        assert kind(prose, "English", "Spanish") is None
+    assert kind("Hello there.", "English", "Spanish") is None
+
+
+def test_mask_untranslatable(word_tokens):
+    text = "Intro.\n```\nx = 1\n\ny = 2\n```\nSee https://a.io\n\n12:30\nEnd."
+    tracker = UsageTracker("doc")
+    with track_usage(tracker):
+        masked = mask_untranslatable(text, "English", "Spanish")
+
+    assert masked.text == "Intro.\n⟦1⟧\nSee https://a.io\n\n⟦2⟧\nEnd."
+    assert masked.kept[2] == "12:30"
+    assert masked.restore("INTRO.\n⟦ 1 ⟧\nX\n\n⟦2⟧\nFIN.") == (
+        "INTRO.\n```\nx = 1\n\ny = 2\n```\nX\n\n12:30\nFIN."
+    )
+    assert masked.restore("INTRO.\nX\n\n⟦2⟧") is None
+    assert tracker.masked_segments == 2
+    assert tracker.masked_tokens == masked.tokens == 7
+    assert "masked: 2 segments passed through" in tracker.format_summary()
+
+
+def test_translate_skips_untranslatable(word_tokens, upper_completion):
+    text = "Hello.\n```\ncode()\n```\nBye."
+
+    translation = utils.translate(
+        "English",
+        "Spanish",
+        text,
+        "",
+        tier=utils.TIER_DRAFT,
+        skip_untranslatable=True,
+    )
+    assert translation == "HELLO.\n```\ncode()\n```\nBYE."
+    assert "code()" not in upper_completion.prompts[0]
+
+    assert utils.translate(
+        "English", "Spanish", "42\n---", "", skip_untranslatable=True
+    ) == "42\n---"
+    assert len(upper_completion.prompts) == 1
+
+    upper_completion.drop = "⟦1⟧"
+    translation = utils.translate(
+        "English",
+        "Spanish",
+        text,
+        "",
+        tier=utils.TIER_DRAFT,
+        skip_untranslatable=True,
+    )
+    assert translation == "HELLO.\n```\nCODE()\n```\nBYE."
+    assert "code()" in upper_completion.prompts[-1]
+
+
+def test_translate_many_retranslates_chunks_that_lose_placeholders(
+    word_tokens, upper_completion
+):
+    upper_completion.drop = "⟦1⟧"
+
+    results = list(
+        translate_many(
+            ["Hi.\nhttps://a.io/x\nBye.", "7 8 9"],
+            "English",
+            "Spanish",
+            tier=utils.TIER_DRAFT,
+            skip_untranslatable=True,
+        )
+    )
+    finals = {r.key: r.final_translation for r in results}
+    assert finals[1] == "7 8 9"
+    assert finals[0] == "HI.\nHTTPS://A.IO/X\nBYE."
+    assert len(upper_completion.prompts) == 2
+
+
+def test_mask_markup(word_tokens):
+    text = (
+        "See [the docs](https://a.io/docs \"Docs\") or <b>www.b.org</b>.\n"
+        "Run `pip install x` for 1,234,567 users, not 12."
+    )
+    tracker = UsageTracker("doc")
+    with track_usage(tracker):
+        masked = mask_untranslatable(
+            text, "English", "Spanish", lines=False, inline=True
+        )
+
+    assert masked.text == (
+        "See [the docs](⟦1⟧) or <b>⟦2⟧</b>.\n"
+        "Run ⟦3⟧ for ⟦4⟧ users, not 12."
+    )
+    assert masked.kept[1] == 'https://a.io/docs "Docs"'
+    assert masked.unmask(masked.text) == text
+    assert tracker.masked_segments == 4
+
+
+def test_translate_retries_chunks_that_lose_placeholders(
+    monkeypatch, word_tokens, upper_completion
+):
+    monkeypatch.setattr(
+        utils,
+        "split_source_text",
+        lambda text, max_tokens, num_tokens: text.splitlines(True),
+    )
+    upper_completion.drop = "⟦2⟧"
+    text = "Read [it](https://a.io/x) now.\nCall 5551234 later."
+
+    translation = utils.translate(
+        "English",
+        "Spanish",
+        text,
+        "",
+        max_tokens=5,
+        tier=utils.TIER_DRAFT,
+        mask_markup=True,
+    )
+    assert translation == "READ [IT](https://a.io/x) NOW.\nCALL 5551234 LATER."
+    assert len(upper_completion.prompts) == 3
+    assert not any("a.io" in prompt for prompt in upper_completion.prompts)
+    assert "5551234" in upper_completion.prompts[-1]
@@ -0,0 +1,102 @@
+import translation_agent.utils as utils
+from translation_agent import translate_many
+from translation_agent.memory import TranslationMemory
+from translation_agent.usage import UsageTracker
+from translation_agent.usage import track_usage
+
+
+def test_memory_serves_edge_paragraphs(word_tokens, tmp_path):
+    path = str(tmp_path / "memory.db")
+    memory = TranslationMemory(path)
+    stored = memory.add_aligned(
+        "English",
+        "Spanish",
+        "Chapter 1\nShe smiled.\nAll rights reserved.",
+        "Capítulo 1\nElla sonrió.\nTodos los derechos reservados.",
+    )
+    assert stored == 3
+    assert memory.add_aligned("English", "Spanish", "a\nb", "x") == 0
+
+    memory = TranslationMemory(path)
+    assert len(memory) == 3
+    # Keys are normalised; other language pairs are kept apart.
+    found = memory.lookup("English", "Spanish", "  Chapter   1 ")
+    assert found == "Capítulo 1"
+    assert memory.lookup("English", "French", "Chapter 1") is None
+
+    tracker = UsageTracker("doc")
+    with track_usage(tracker):
+        match = memory.match(
+            "English",
+            "Spanish",
+            "Chapter 1\n\nNew text.\nShe smiled.\nAll rights reserved.",
+        )
+    assert match.head == ["Capítulo 1", ""]
+    assert match.middle == "New text."
+    assert match.tail == ["Ella sonrió.", "Todos los derechos reservados."]
+    assert match.join("Texto nuevo.") == (
+        "Capítulo 1\n\nTexto nuevo.\nElla sonrió.\n"
+        "Todos los derechos reservados."
+    )
+    assert (tracker.memory_hits, tracker.memory_segments) == (3, 4)
+    assert tracker.memory_hit_rate == 0.75
+    assert "memory: 3/4 paragraphs served" in tracker.format_summary()
+
+
+def test_translate_uses_memory(
+    word_tokens, paragraph_chunks, upper_completion
+):
+    memory = TranslationMemory()
+
+    text = "Chapter 1\nIt was late."
+    first = utils.translate(
+        "English", "Spanish", text, "", tier=utils.TIER_DRAFT, memory=memory
+    )
+    assert first == "CHAPTER 1\nIT WAS LATE."
+    assert len(upper_completion.prompts) == 1
+
+    calls = len(upper_completion.prompts)
+    again = utils.translate(
+        "English", "Spanish", text, "", tier=utils.TIER_DRAFT, memory=memory
+    )
+    assert again == first
+    assert len(upper_completion.prompts) == calls
+
+    edited = utils.translate(
+        "English",
+        "Spanish",
+        "Chapter 1\nIt was early.",
+        "",
+        tier=utils.TIER_DRAFT,
+        memory=memory,
+    )
+    assert edited == "CHAPTER 1\nIT WAS EARLY."
+    assert "Chapter 1" not in upper_completion.prompts[-1]
+
+
+def test_translate_many_uses_memory(
+    word_tokens, paragraph_chunks, upper_completion
+):
+    memory = TranslationMemory()
+    memory.add("English", "Spanish", "Disclaimer.", "Aviso.")
+    memory.add("English", "Spanish", "Known line.", "Línea conocida.")
+
+    documents = {
+        "known": "Disclaimer.\nKnown line.",
+        "new": "Hello.\nDisclaimer.",
+    }
+    results = {
+        r.key: r
+        for r in translate_many(
+            documents,
+            "English",
+            "Spanish",
+            tier=utils.TIER_DRAFT,
+            memory=memory,
+        )
+    }
+
+    assert results["known"].final_translation == "Aviso.\nLínea conocida."
+    assert results["new"].final_translation == "HELLO.\nAviso."
+    assert len(upper_completion.prompts) == 1
+    assert memory.lookup("English", "Spanish", "Hello.") == "HELLO."
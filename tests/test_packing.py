@@ -0,0 +1,109 @@
+import json
+import re
+
+import translation_agent.utils as utils
+from translation_agent import translate_many
+from translation_agent.packing import pack_segments
+from translation_agent.packing import parse_segments
+from translation_agent.packing import translate_packed
+from translation_agent.usage import UsageTracker
+from translation_agent.usage import current_stage
+from translation_agent.usage import record_usage
+
+
+SEGMENT = re.compile(r"<SEGMENT_(\d+)>\n(.*?)\n</SEGMENT_\1>", re.DOTALL)
+
+
+class PackedCompletion:
+    """Answer packed prompts in JSON, dropping segments of large packs."""
+
+    def __init__(self, max_segments=None):
+        self.max_segments = max_segments
+        self.calls = []
+
+    def __call__(self, prompt, system_message="", **kwargs):
+        stage = current_stage()
+        segments = SEGMENT.findall(prompt)
+        self.calls.append((stage, len(segments)))
+        record_usage("fake", {"prompt_tokens": 30, "completion_tokens": 6})
+        if not segments:
+            return f"{stage}:single"
+        answer = "fix" if stage == "reflect" else stage
+        outputs = {n: f"{answer}:{n}" for n, _ in segments}
+        if self.max_segments and len(segments) > self.max_segments:
+            outputs.pop(str(len(segments)))
+        return json.dumps(outputs)
+
+
+def test_pack_segments():
+    assert pack_segments([3, 3, 3, 8, 1], max_tokens=6) == [
+        [0, 1],
+        [2],
+        [3],
+        [4],
+    ]
+    assert pack_segments([]) == []
+
+
+def test_parse_segments():
+    assert parse_segments('{"1": "a", "2": "b"}', 2) == ["a", "b"]
+    assert parse_segments('{"segments": ["a", "b"]}', 2) == ["a", "b"]
+    assert parse_segments(
+        "<SEGMENT_1>\na\n</SEGMENT_1>\n<SEGMENT_2>\nb {x}\n</SEGMENT_2>", 2
+    ) == ["a", "b {x}"]
+    # Missing, extra and empty outputs are misaligned.
+    assert parse_segments('{"1": "a"}', 2) is None
+    assert parse_segments('{"1": "a", "2": "b", "3": "c"}', 2) is None
+    assert parse_segments('{"1": "a", "2": " "}', 2) is None
+    assert parse_segments("a\nb", 2) is None
+
+
+def test_translate_packed_splits_misaligned_packs(monkeypatch, word_tokens):
+    completion = PackedCompletion(max_segments=2)
+    monkeypatch.setattr(utils, "get_completion", completion)
+
+    texts = ["one", "two", "three", "four"]
+    translations = translate_packed(texts, "English", "Spanish")
+
+    assert translations == [
+        "improve:1",
+        "improve:2",
+        "improve:1",
+        "improve:2",
+    ]
+    # Each stage: the pack of 4 is misaligned and split into two packs of 2.
+    assert completion.calls.count(("initial", 4)) == 1
+    assert completion.calls.count(("initial", 2)) == 2
+    assert len(completion.calls) == 9
+
+
+def test_translate_many_packs_small_documents(monkeypatch, word_tokens):
+    completion = PackedCompletion()
+    monkeypatch.setattr(utils, "get_completion", completion)
+
+    documents = {"a": "tiny text", "b": "another tiny text", "c": "more"}
+    trackers = {key: [UsageTracker(key)] for key in documents}
+    progress = []
+    results = {
+        r.key: r
+        for r in translate_many(
+            documents,
+            "English",
+            "Spanish",
+            pack_tokens=100,
+            trackers=trackers,
+            on_progress=lambda *args: progress.append(args),
+        )
+    }
+
+    assert completion.calls == [
+        ("initial", 3),
+        ("reflect", 3),
+        ("improve", 3),
+    ]
+    assert results["b"].final_translation == "improve:2"
+    assert results["c"].reflection == "fix:3"
+    assert ("a", 3, 3) in progress
+    # Every document counts the shared calls and its share of the tokens.
+    assert trackers["a"][0].total.calls == 3
+    assert trackers["b"][0].total.prompt_tokens == 45
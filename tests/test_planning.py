@@ -0,0 +1,139 @@
+import translation_agent.planning as planning
+import translation_agent.utils as utils
+from translation_agent.planning import estimate_batch
+from translation_agent.planning import plan_translation
+from translation_agent.planning import token_growth_curve
+from translation_agent.usage import LatencyModel
+
+
+def test_plan_counts_calls_without_network(
+    monkeypatch, word_tokens, paragraph_chunks
+):
+    # No client is configured: any real request would fail.
+    monkeypatch.setattr(utils, "client", None)
+
+    text = "\n".join(["one two three four five"] * 4)
+
+    single = plan_translation(text, "English", "Spanish", max_tokens=1000)
+    assert single.calls == 3
+    assert set(single.usage.stages) == {"initial", "reflect", "improve"}
+
+    multi = plan_translation(text, "English", "Spanish", max_tokens=10)
+    assert len(multi.chunks) == 4
+    assert multi.calls == 12
+
+    draft = plan_translation(
+        text, "English", "Spanish", max_tokens=10, reflection=False
+    )
+    assert draft.calls == 4
+    # Every initial call estimates one translated word per source word.
+    assert draft.completion_tokens == 20
+
+    combined = plan_translation(
+        text,
+        "English",
+        "Spanish",
+        max_tokens=10,
+        revision_mode=utils.REVISION_COMBINED,
+    )
+    assert combined.calls == 8
+    assert set(combined.usage.stages) == {"initial", "revise"}
+
+    edits = plan_translation(
+        text,
+        "English",
+        "Spanish",
+        max_tokens=10,
+        revision_mode=utils.REVISION_EDITS,
+    )
+    assert edits.calls == 8
+    assert edits.usage.stages["improve"].skipped == 4
+
+
+def test_growth_curve_is_superlinear(word_tokens, paragraph_chunks):
+    text = "\n".join(["word " * 20] * 16)
+    plans = token_growth_curve(
+        text,
+        points=4,
+        source_lang="English",
+        target_lang="Spanish",
+        max_tokens=10,
+    )
+
+    per_doc_token = [p.prompt_tokens / p.document_tokens for p in plans]
+    assert per_doc_token == sorted(per_doc_token)
+    assert per_doc_token[-1] > per_doc_token[0]
+
+
+def test_estimate_batch_time_and_cost(
+    monkeypatch, word_tokens, paragraph_chunks
+):
+    latency_model = LatencyModel()
+    monkeypatch.setattr(planning, "latency_model", latency_model)
+
+    text = "\n".join(["one two three four five"] * 4)
+    plans = [
+        plan_translation(text, "English", "Spanish", max_tokens=10)
+        for _ in range(3)
+    ]
+    models = {"initial": "model-a", "reflect": "model-b", "improve": "model-b"}
+
+    unmeasured = estimate_batch(plans, models)
+    assert unmeasured["calls"] == 36
+    assert unmeasured["seconds"] is None
+
+    # 1 second per request plus 0.1 second per completion token.
+    for model in ("model-a", "model-b"):
+        latency_model.observe(model, 2.0, 10)
+        latency_model.observe(model, 3.0, 20)
+    latency = 36 + 0.1 * plans[0].completion_tokens * 3
+
+    batch = estimate_batch(plans, models, concurrency=4)
+    assert abs(batch["seconds"] - latency / 4) < 1e-6
+
+    # 36 calls at 6 requests per minute take at least 6 minutes.
+    limited = estimate_batch(plans, models, concurrency=4, rpm=6)
+    assert limited["seconds"] == 360
+
+    priced = estimate_batch(
+        plans, models, price_table={"model-a": [1_000_000, 0, 0]}
+    )
+    assert priced["cost"] == batch["stages"]["initial"]["prompt_tokens"]
+
+
+def test_chunk_prompts_share_a_cacheable_prefix(
+    monkeypatch, word_tokens, paragraph_chunks
+):
+    prompts = []
+
+    def completion(prompt, system_message="", **kwargs):
+        prompts.append(system_message + prompt)
+        return "NO_CHANGES" if "suggestions" in prompt else "text"
+
+    get_completion = utils.get_completion
+    monkeypatch.setattr(utils, "get_completion", completion)
+    chunks = ["First part.\n", "Second part.\n", "Third part.\n"]
+    translations = utils.multichunk_initial_translation(
+        "English", "Spanish", chunks
+    )
+    utils.multichunk_reflect_on_translation(
+        "English", "Spanish", chunks, translations, "Mexico"
+    )
+
+    prefix = utils.chunk_system_message(
+        "English", "Spanish"
+    ) + utils.chunk_context("English", "Spanish", chunks)
+    assert len(prompts) == 6
+    assert all(prompt.startswith(prefix) for prompt in prompts)
+    assert "<TRANSLATE_THIS>" not in prefix
+    assert "<TRANSLATE_THIS>\nSecond part." in prompts[1][len(prefix) :]
+
+    # Past the minimum cacheable length, every call after the first is a
+    # cache hit on the shared prefix.
+    monkeypatch.setattr(utils, "get_completion", get_completion)
+    text = "\n".join(["word " * 300] * 4)
+    plan = plan_translation(text, "English", "Spanish", max_tokens=500)
+    assert plan.calls == 12
+    prefix_tokens = plan.usage.stages["initial"].cached_tokens / 3
+    assert prefix_tokens > planning.CACHE_MIN_PREFIX_TOKENS
+    assert plan.cached_tokens == 11 * prefix_tokens
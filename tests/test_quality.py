@@ -0,0 +1,111 @@
+import translation_agent.utils as utils
+from translation_agent.quality import passes_quality_gate
+from translation_agent.quality import score_translation
+from translation_agent.usage import track_usage
+from translation_agent.usage import UsageTracker
+
+
+SOURCE = "他走进房间。\n她笑了起来。\n窗外下着雨。"
+GOOD = "He walked into the room.\nShe started laughing.\nIt was raining outside."
+
+
+def test_score_translation_flags_common_failures():
+    assert score_translation(SOURCE, GOOD, "Chinese", "English").score == 1.0
+
+    leaked = score_translation(
+        SOURCE, "<TRANSLATE_THIS>" + GOOD, "Chinese", "English"
+    )
+    assert "leaked prompt tags" in leaked.issues
+
+    untranslated = score_translation(
+        SOURCE,
+        "He walked into the room.\n她笑了起来。\nIt was raining outside.",
+        "Chinese",
+        "English",
+    )
+    assert any("source script" in issue for issue in untranslated.issues)
+
+    missing = score_translation(
+        SOURCE, "He walked into the room.", "Chinese", "English"
+    )
+    assert missing.score < 1.0
+
+    repeated = score_translation(
+        "Line one.\nLine two.\nLine three.",
+        "Línea uno otra vez.\nLínea uno otra vez.\nLínea uno otra vez.",
+        "English",
+        "Spanish",
+    )
+    assert any("repeated" in issue for issue in repeated.issues)
+
+    # CJK output is expected when translating into Chinese.
+    assert (
+        score_translation(GOOD, SOURCE, "English", "Chinese").score == 1.0
+    )
+
+
+def test_passes_quality_gate_threshold():
+    assert not passes_quality_gate(SOURCE, GOOD, "Chinese", "English", None)
+    assert passes_quality_gate(SOURCE, GOOD, "Chinese", "English", 0.8)
+    assert not passes_quality_gate(
+        SOURCE, "<TRANSLATION>", "Chinese", "English", 0.8
+    )
+
+
+def test_multichunk_translation_reflects_only_weak_chunks(mocker):
+    chunks = ["他走进房间。\n", "她笑了起来。\n"]
+    mocker.patch(
+        "translation_agent.utils.multichunk_initial_translation",
+        return_value=["He walked into the room.\n", "她笑了起来。\n"],
+    )
+    reflect = mocker.patch(
+        "translation_agent.utils.chunk_reflect_on_translation",
+        return_value="Translate the sentence.",
+    )
+    improve = mocker.patch(
+        "translation_agent.utils.chunk_improve_translation",
+        return_value="She started laughing.\n",
+    )
+    tracker = UsageTracker("test")
+
+    with track_usage(tracker):
+        result = utils.multichunk_translation(
+            "Chinese", "English", chunks, quality_threshold=0.8
+        )
+
+    assert result == ["He walked into the room.\n", "She started laughing.\n"]
+    assert reflect.call_count == 1
+    assert reflect.call_args.args[3] == 1
+    assert improve.call_count == 1
+    assert tracker.stages["reflect"].skipped == 1
+    assert tracker.stages["improve"].skipped == 1
+    assert (tracker.checked, tracker.escalated) == (2, 1)
+
+
+def test_accept_draft_self_rating(mocker):
+    completion = mocker.patch(
+        "translation_agent.utils.get_completion", side_effect=["8", "Rating: 6/10"]
+    )
+    tracker = UsageTracker("test")
+
+    with track_usage(tracker):
+        assert utils.accept_draft(
+            SOURCE, GOOD, "Chinese", "English", 0.8, utils.CHECK_SELF_RATING
+        )
+        assert not utils.accept_draft(
+            SOURCE, GOOD, "Chinese", "English", 0.8, utils.CHECK_SELF_RATING
+        )
+        # Drafts failing the heuristics are escalated without a rating call.
+        assert not utils.accept_draft(
+            SOURCE, "<TRANSLATION>", "Chinese", "English", 0.8,
+            utils.CHECK_SELF_RATING,
+        )
+
+    assert completion.call_count == 2
+    assert (tracker.checked, tracker.escalated) == (3, 2)
+    assert tracker.escalation_rate == 2 / 3
+
+    tracker.record("reflect", "strong", 10, 10, latency=4.0)
+    tracker.record_skip("reflect")
+    assert tracker.saved_latency() == 4.0
+    assert "2/3 drafts escalated (67%)" in tracker.format_summary()
@@ -0,0 +1,211 @@
+import json
+import threading
+import time
+
+import translation_agent.utils as utils
+from translation_agent import translate_many
+from translation_agent.usage import UsageTracker
+from translation_agent.usage import current_stage
+from translation_agent.usage import record_usage
+from translation_agent.usage import track_usage
+
+
+class FakeCompletion:
+    """Answer every prompt with the stage and the chunk it works on."""
+
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.stages = []
+        self.lock = threading.Lock()
+
+    def __call__(self, prompt, system_message="", **kwargs):
+        stage = current_stage()
+        chunk = prompt
+        if "<TRANSLATE_THIS>\n" in prompt:
+            chunk = prompt.rsplit("<TRANSLATE_THIS>\n", 1)[1]
+            chunk = chunk.split("\n</TRANSLATE_THIS>", 1)[0]
+        if self.fail_on and self.fail_on in chunk:
+            raise RuntimeError("boom")
+        with self.lock:
+            self.stages.append((stage, chunk.strip()))
+        record_usage("fake", {"prompt_tokens": 1, "completion_tokens": 1})
+        if kwargs.get("json_mode"):
+            return json.dumps(
+                {"reflection": "ok|", "translation": f"{stage}:{chunk.strip()}|"}
+            )
+        return f"{stage}:{chunk.strip()}|"
+
+
+def test_translate_many_streams_every_document(
+    monkeypatch, word_tokens, paragraph_chunks
+):
+    completion = FakeCompletion()
+    monkeypatch.setattr(utils, "get_completion", completion)
+
+    long_doc = "\n".join(f"para{i} a b c" for i in range(6))
+    documents = {"long": long_doc, "short": "tiny text"}
+    trackers = {key: [UsageTracker(key)] for key in documents}
+    batch = UsageTracker("batch")
+    progress = []
+
+    with track_usage(batch):
+        results = {
+            r.key: r
+            for r in translate_many(
+                documents,
+                "English",
+                "Spanish",
+                max_tokens=10,
+                max_workers=1,
+                trackers=trackers,
+                on_progress=lambda *args: progress.append(args),
+            )
+        }
+
+    assert set(results) == {"long", "short"}
+    long_result = results["long"]
+    assert len(long_result.chunks) == 6
+    assert long_result.error is None
+    assert long_result.final_translation.count("improve:") == 6
+    assert long_result.final_translation.startswith("improve:para0")
+
+    # With one worker the document with the most remaining work goes first.
+    assert completion.stages[0] == ("initial", "para0 a b c")
+    assert progress[-1] in (("long", 18, 18), ("short", 3, 3))
+
+    assert trackers["long"][0].total.calls == 18
+    assert trackers["short"][0].total.calls == 3
+    assert batch.total.calls == 21
+
+
+def test_translate_many_reports_failed_document(
+    monkeypatch, word_tokens, paragraph_chunks
+):
+    monkeypatch.setattr(utils, "get_completion", FakeCompletion("broken"))
+
+    documents = ["good text", "broken text"]
+    results = list(
+        translate_many(documents, "English", "Spanish", max_workers=2)
+    )
+
+    by_key = {r.key: r for r in results}
+    assert by_key[0].error is None
+    assert by_key[0].final_translation.startswith("improve:")
+    assert isinstance(by_key[1].error, RuntimeError)
+
+
+def test_translate_many_combined_revision(
+    monkeypatch, word_tokens, paragraph_chunks
+):
+    completion = FakeCompletion()
+    monkeypatch.setattr(utils, "get_completion", completion)
+
+    long_doc = "\n".join(f"para{i} a b c" for i in range(3))
+    (result,) = translate_many(
+        [long_doc],
+        "English",
+        "Spanish",
+        max_tokens=10,
+        revision_mode=utils.REVISION_COMBINED,
+    )
+
+    assert len(completion.stages) == 6
+    assert result.reflection == "ok|ok|ok|"
+    assert result.final_translation.startswith("revise:para0")
+
+
+def test_translate_many_draft_first(
+    monkeypatch, word_tokens, paragraph_chunks
+):
+    completion = FakeCompletion()
+    monkeypatch.setattr(utils, "get_completion", completion)
+
+    documents = {
+        "long": "\n".join(f"para{i} a b c" for i in range(3)),
+        "short": "tiny text",
+    }
+    drafts = []
+
+    def on_draft(result):
+        drafts.append((result.key, len(completion.stages)))
+        assert result.init_translation.startswith("initial:")
+
+    results = list(
+        translate_many(
+            documents,
+            "English",
+            "Spanish",
+            max_tokens=10,
+            max_workers=1,
+            draft_first=True,
+            on_draft=on_draft,
+        )
+    )
+
+    # Every initial translation runs before the first reflection.
+    stages = [stage for stage, _ in completion.stages]
+    assert stages[:4] == ["initial"] * 4
+    assert set(stages[4:]) == {"reflect", "improve"}
+    assert sorted(drafts) == [("long", 3), ("short", 4)]
+    assert {r.key for r in results} == {"long", "short"}
+
+
+def test_translate_many_tiers(monkeypatch, word_tokens, paragraph_chunks):
+    completion = FakeCompletion()
+    monkeypatch.setattr(utils, "get_completion", completion)
+
+    long_doc = "\n".join(f"para{i} a b c" for i in range(3))
+    (draft,) = translate_many(
+        [long_doc], "English", "Spanish", max_tokens=10, tier=utils.TIER_DRAFT
+    )
+    assert len(completion.stages) == 3
+    assert draft.tier == utils.TIER_DRAFT
+    assert draft.final_translation == draft.init_translation
+
+    (standard,) = translate_many(
+        [long_doc],
+        "English",
+        "Spanish",
+        max_tokens=10,
+        tier=utils.TIER_STANDARD,
+    )
+    assert [stage for stage, _ in completion.stages[3:]].count("revise") == 3
+    assert standard.final_translation.startswith("revise:para0")
+
+
+def test_translate_many_stage_pools(
+    monkeypatch, word_tokens, paragraph_chunks
+):
+    pools = {
+        "initial": ("main", 1),
+        "reflect": ("extra", 1),
+        "improve": ("extra", 1),
+    }
+    in_flight = {}
+    peak = {}
+
+    class PooledCompletion(FakeCompletion):
+        def __call__(self, prompt, system_message="", **kwargs):
+            pool = pools[current_stage()][0]
+            with self.lock:
+                in_flight[pool] = in_flight.get(pool, 0) + 1
+                peak[pool] = max(peak.get(pool, 0), in_flight[pool])
+            time.sleep(0.01)
+            with self.lock:
+                in_flight[pool] -= 1
+            return super().__call__(prompt, system_message, **kwargs)
+
+    completion = PooledCompletion()
+    monkeypatch.setattr(utils, "get_completion", completion)
+
+    documents = [f"text number {i}" for i in range(4)]
+    results = list(
+        translate_many(
+            documents, "English", "Spanish", max_workers=4, stage_pools=pools
+        )
+    )
+
+    assert len(results) == 4
+    assert all(r.final_translation.startswith("improve:") for r in results)
+    assert len(completion.stages) == 12
+    assert peak == {"main": 1, "extra": 1}
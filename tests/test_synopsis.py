@@ -0,0 +1,132 @@
+import pytest
+
+import translation_agent.utils as utils
+from translation_agent import translate_many
+from translation_agent.planning import plan_translation
+from translation_agent.synopsis import SynopsisCache, build_synopsis
+from translation_agent.usage import UsageTracker
+from translation_agent.usage import current_stage
+from translation_agent.usage import record_usage
+from translation_agent.usage import track_usage
+
+
+class FakeCompletion:
+    """Answer synopsis prompts with a short note and others with the stage."""
+
+    def __init__(self):
+        self.prompts = []
+
+    def __call__(self, prompt, system_message="", **kwargs):
+        stage = current_stage()
+        self.prompts.append((stage, prompt))
+        record_usage("fake", {"prompt_tokens": 1, "completion_tokens": 1})
+        if stage == "synopsis":
+            return f"note {len(self.prompts)}"
+        return f"{stage}|"
+
+
+@pytest.fixture
+def completion(monkeypatch, word_tokens, paragraph_chunks):
+    completion = FakeCompletion()
+    monkeypatch.setattr(utils, "get_completion", completion)
+    return completion
+
+
+def test_build_synopsis_map_reduce(completion):
+    assert build_synopsis("English", "a short text", map_tokens=10) == "note 1"
+
+    text = "\n".join(f"para{i} a b c" for i in range(6))
+    build_synopsis("English", text, map_tokens=12)
+    stages = [stage for stage, _ in completion.prompts[1:]]
+    # Six parts are summarised, then their notes merged in one call.
+    assert stages == ["synopsis"] * 7
+    assert "part 2 of 6" in completion.prompts[2][1]
+    assert "<PART_6>\nnote 7\n</PART_6>" in completion.prompts[-1][1]
+
+
+def test_translate_sends_cached_synopsis(completion, tmp_path):
+    text = "\n".join(f"para{i} a b c" for i in range(4))
+    cache = SynopsisCache(str(tmp_path / "synopses.json"))
+
+    tracker = UsageTracker("doc")
+    with track_usage(tracker):
+        utils.translate(
+            "English",
+            "Spanish",
+            text,
+            "",
+            max_tokens=10,
+            synopsis_tokens=10,
+            synopsis_cache=cache,
+        )
+    prompts = [p for stage, p in completion.prompts if stage != "synopsis"]
+    assert len(completion.prompts) - len(prompts) == 1
+    assert len(prompts) == 12
+    for prompt in prompts:
+        assert "<SYNOPSIS>\nnote 1\n</SYNOPSIS>" in prompt
+        assert "<SOURCE_TEXT>" not in prompt
+    assert "para2" not in prompts[0]
+    assert "<PRECEDING_TEXT>\npara0 a b c\n" in prompts[1]
+    assert "<FOLLOWING_TEXT>\npara2 a b c\n" in prompts[1]
+    assert tracker.stages["synopsis"].calls == 1
+
+    # Another target language, in a later run, reuses the stored synopsis.
+    completion.prompts.clear()
+    tracker = UsageTracker("doc")
+    with track_usage(tracker):
+        utils.translate(
+            "English",
+            "French",
+            text,
+            "",
+            max_tokens=10,
+            synopsis_tokens=10,
+            synopsis_cache=SynopsisCache(cache.path),
+        )
+    assert all(stage != "synopsis" for stage, _ in completion.prompts)
+    assert tracker.stages["synopsis"].skipped == 1
+
+
+def test_translate_many_builds_one_synopsis_per_document(completion):
+    documents = {
+        "long": "\n".join(f"para{i} a b c" for i in range(4)),
+        "short": "\n".join(f"line{i} a b c" for i in range(3)),
+    }
+
+    results = {
+        r.key: r
+        for r in translate_many(
+            documents,
+            "English",
+            "Spanish",
+            max_tokens=10,
+            max_workers=3,
+            synopsis_tokens=16,
+            synopsis_cache=SynopsisCache(),
+        )
+    }
+
+    synopsis_prompts = [p for s, p in completion.prompts if s == "synopsis"]
+    assert len(synopsis_prompts) == 1
+    assert "para0" in synopsis_prompts[0]
+    assert results["long"].synopsis.startswith("note")
+    assert results["short"].synopsis is None
+    for stage, prompt in completion.prompts:
+        if "line0" in prompt:
+            assert "<SOURCE_TEXT>" in prompt
+        elif stage != "synopsis":
+            assert "<SYNOPSIS>" in prompt
+    assert results["long"].final_translation == "improve|" * 4
+
+
+def test_plan_translation_with_synopsis(word_tokens, paragraph_chunks):
+    text = "\n".join(["word " * 300] * 6)
+
+    full = plan_translation(text, "English", "Spanish", max_tokens=500)
+    short = plan_translation(
+        text, "English", "Spanish", max_tokens=500, synopsis_tokens=1000
+    )
+
+    assert short.calls == full.calls + 1
+    assert short.usage.stages["synopsis"].completion_tokens > 1
+    assert short.prompt_tokens < full.prompt_tokens
@@ -0,0 +1,138 @@
+import json
+from types import SimpleNamespace
+
+import httpx
+import openai
+
+from translation_agent.usage import UsageTracker
+from translation_agent.usage import cached_prompt_tokens
+from translation_agent.usage import track_usage
+from translation_agent.usage import usage_stage
+from translation_agent.usage import write_usage_report
+from translation_agent.utils import chat_completion
+from translation_agent.utils import prediction_params
+from translation_agent.utils import prediction_supported
+
+
+class FakeClient:
+    """Minimal stand-in for openai.OpenAI returning canned usage."""
+
+    def __init__(self, prompt_tokens=100, completion_tokens=20, cached=0):
+        usage = SimpleNamespace(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            prompt_tokens_details=SimpleNamespace(cached_tokens=cached),
+        )
+        message = SimpleNamespace(content="ok")
+        response = SimpleNamespace(
+            model="gpt-4o-2024-08-06",
+            usage=usage,
+            choices=[SimpleNamespace(message=message)],
+        )
+        self.chat = SimpleNamespace(
+            completions=SimpleNamespace(create=lambda **kwargs: response)
+        )
+
+
+def test_cached_prompt_tokens_variants():
+    assert cached_prompt_tokens(None) == 0
+    assert (
+        cached_prompt_tokens({"prompt_tokens_details": {"cached_tokens": 7}})
+        == 7
+    )
+    assert cached_prompt_tokens({"prompt_cache_hit_tokens": 3}) == 3
+
+
+def test_chat_completion_records_per_stage_and_tracker():
+    client = FakeClient(prompt_tokens=1000, completion_tokens=200, cached=400)
+    task = UsageTracker("task")
+    batch = UsageTracker("batch")
+
+    with track_usage(task, batch):
+        with usage_stage("initial"):
+            chat_completion(client, model="gpt-4o", messages=[])
+        with usage_stage("reflect"):
+            chat_completion(client, model="gpt-4o", messages=[])
+
+    # Calls made outside of track_usage are not recorded.
+    chat_completion(client, model="gpt-4o", messages=[])
+
+    for tracker in (task, batch):
+        assert tracker.total.calls == 2
+        assert tracker.total.prompt_tokens == 2000
+        assert tracker.total.cached_tokens == 800
+        assert tracker.total.completion_tokens == 400
+        assert set(tracker.stages) == {"initial", "reflect"}
+
+    # (1200 uncached * 2.5 + 800 cached * 1.25 + 400 * 10) / 1M
+    assert abs(task.cost() - 0.008) < 1e-9
+
+
+def test_chat_completion_drops_rejected_prediction():
+    requests = []
+    usage = {
+        "prompt_tokens": 10,
+        "completion_tokens": 5,
+        "completion_tokens_details": {
+            "accepted_prediction_tokens": 4,
+            "rejected_prediction_tokens": 1,
+        },
+    }
+    response = SimpleNamespace(
+        usage=usage,
+        choices=[SimpleNamespace(message=SimpleNamespace(content="ok"))],
+    )
+
+    def create(**params):
+        requests.append(params)
+        if "prediction" in params and params["model"] == "old-model":
+            raise openai.BadRequestError(
+                "Predicted outputs are not supported with this model",
+                response=httpx.Response(
+                    400, request=httpx.Request("POST", "http://test")
+                ),
+                body=None,
+            )
+        return response
+
+    client = SimpleNamespace(
+        base_url="http://test/v1",
+        chat=SimpleNamespace(completions=SimpleNamespace(create=create)),
+    )
+    tracker = UsageTracker("task")
+    prediction = prediction_params("draft")
+
+    with track_usage(tracker), usage_stage("improve"):
+        chat_completion(client, model="new-model", messages=[], **prediction)
+        for _ in range(2):
+            chat_completion(
+                client, model="old-model", messages=[], **prediction
+            )
+
+    assert prediction_supported(client, "new-model") is True
+    assert prediction_supported(client, "old-model") is False
+    # The rejection is retried once; later requests omit the prediction.
+    assert ["prediction" in r for r in requests] == [True, True, False, False]
+
+    stats = tracker.stages["improve"]
+    assert stats.calls == 3
+    assert stats.accepted_prediction_tokens == 12
+    assert stats.rejected_prediction_tokens == 3
+    assert "12/15 prediction tokens accepted" in tracker.format_summary()
+
+
+def test_write_usage_report(tmp_path):
+    tracker = UsageTracker("chapter1", price_table={})
+    tracker.record("initial", "some-model", 10, 5)
+
+    csv_path, json_path = write_usage_report(
+        [tracker], str(tmp_path), batch=UsageTracker("batch")
+    )
+
+    with open(json_path, encoding="utf-8") as f:
+        report = json.load(f)
+    assert [r["name"] for r in report] == ["chapter1", "batch"]
+    assert report[0]["stages"]["initial"]["prompt_tokens"] == 10
+
+    with open(csv_path, encoding="utf-8") as f:
+        assert f.readline().startswith("name,stage,calls")
@@ -24,14 +24,41 @@ if app_dir not in sys.path:
 try:
     from process import (
         extract_docx, extract_pdf, extract_text,
-        model_load, translator, translator_sec
+        model_load
     )
+    from translation_agent import translate_many
+    from translation_agent.utils import REVISION_COMBINED, REVISION_EDITS, REVISION_SEPARATE
+    from translation_agent.utils import TIER_DRAFT, TIER_FULL, TIER_STANDARD
+    from translation_agent.utils import CHECK_HEURISTIC, CHECK_SELF_RATING
+    from translation_agent.usage import (
+        UsageTracker, merge_price_table, write_usage_report
+    )
+    from translation_agent.cassette import cassette_from_config
+    from translation_agent.planning import estimate_batch, plan_translation
+    from translation_agent.synopsis import SynopsisCache
+    from translation_agent.glossary import BookGlossary
+    from translation_agent.memory import TranslationMemory
+    from translation_agent.fuzzy import NUMPY_AVAILABLE, FuzzyMemory
+    from translation_agent.incremental import ALIGNMENT_DIR, Alignment
+    from translation_agent.extractors import extract_segments
+    from translation_agent.usage import latency_model
+    from patch import model_load_stages, stage_pools
 except ImportError as e:
     print(f"导入模块失败: {e}")
     print("请确保 app 目录下的相关文件存在")
 
 # 配置文件路径
 CONFIG_FILE = "translation_config.json"
+# 文档概要缓存：按原文哈希保存，重跑和翻译成其他语言时复用
+SYNOPSIS_CACHE_FILE = "synopsis_cache.json"
+# 书籍术语表：保存在输出文件夹中，同一本书的各章节共享人名、术语译法和前情概要
+BOOK_GLOSSARY_FILE = "book_glossary.json"
+# 翻译记忆库：按语言对保存已完成译文的段落，文件开头和结尾完全相同的段落不再调用LLM
+TRANSLATION_MEMORY_FILE = "translation_memory.db"
+# 模糊匹配索引：翻译记忆库的MinHash索引（需要numpy），重启后内存映射打开，只签名新增段落
+FUZZY_INDEX_DIR = "translation_memory_index"
+# 按格式提取时原样写出的代码/数据文件类型（Markdown仍按文本保存）
+CODE_FILE_TYPES = ('.py', '.cpp', '.json')
 MAX_CONCURRENT_TASKS = 1
 
 class TranslationTask:
@@ -49,6 +76,11 @@ class TranslationTask:
         self.error_message = ""
         self.start_time = None
         self.end_time = None
+        self.usage = None  # UsageTracker，记录该文件的token用量
+        self.draft_saved = False  # 初稿是否已写出（先出初稿模式）
+        self.output_filename = None  # 输出文件名，初稿与终稿共用，终稿覆盖初稿
+        self.tier = None  # 实际使用的质量档位
+        self.keep_format = False  # 代码/JSON文件按格式提取翻译，按原文件名和格式写出
 
 
 class TranslationAgentGUI:
@@ -68,6 +100,27 @@ class TranslationAgentGUI:
         self.is_translating = False
         self.is_paused = False  # 暂停标志
         self.is_loading_config = False  # 标志：是否正在加载配置（防止 endpoint.change 覆盖模型名）
+        self.price_table = {}  # 用户自定义价格表（每百万token美元价格）
+        self.batch_usage = None  # 当前批次的token用量
+        # 修订方式在下拉框中显示的名称
+        self.revision_mode_labels = {
+            REVISION_SEPARATE: "反思+改进",
+            REVISION_COMBINED: "合并为一次调用",
+            REVISION_EDITS: "编辑列表",
+        }
+        # 质量档位在下拉框中显示的名称
+        self.tier_labels = {
+            TIER_DRAFT: "初稿（仅初译）",
+            TIER_STANDARD: "标准（初译+一次修订）",
+            TIER_FULL: "完整（反思+改进）",
+        }
+        # 级联检查方式在下拉框中显示的名称
+        self.quality_check_labels = {
+            CHECK_HEURISTIC: "本地启发式",
+            CHECK_SELF_RATING: "启发式+快模型自评",
+        }
+        # 录制/回放配置：{"mode": "off"|"record"|"replay", "path": ..., "latency_scale": 1.0}
+        self.cassette_config = {"mode": "off", "path": "", "latency_scale": 1.0}
         
         # 创建界面
         self.create_widgets()
@@ -279,6 +332,24 @@ class TranslationAgentGUI:
         ttk.Checkbutton(extra_key_row, text="👁️", variable=self.show_key2_var,
                        command=lambda: extra_key_entry.config(show="" if self.show_key2_var.get() else "*")).pack(side='right', padx=(5, 0))
         
+        # 额外端点独立的限速和并发：两个端点的额度同时使用
+        extra_limit_row = ttk.Frame(self.extra_endpoint_frame)
+        extra_limit_row.pack(fill='x', pady=(0, 10))
+        
+        ttk.Label(extra_limit_row, text="额外RPM:", font=('Arial', 10, 'bold')).pack(side='left')
+        self.rpm2_var = tk.IntVar(value=60)
+        ttk.Spinbox(extra_limit_row, from_=1, to=1000, textvariable=self.rpm2_var,
+                    width=6, font=('Arial', 10)).pack(side='left', padx=(10, 15))
+        ttk.Label(extra_limit_row, text="额外TPM:", font=('Arial', 10, 'bold')).pack(side='left')
+        self.tpm2_var = tk.IntVar(value=0)
+        ttk.Spinbox(extra_limit_row, from_=0, to=10000000, increment=10000, textvariable=self.tpm2_var,
+                    width=10, font=('Arial', 10)).pack(side='left', padx=(10, 15))
+        ttk.Label(extra_limit_row, text="额外并发:", font=('Arial', 10, 'bold')).pack(side='left')
+        self.concurrent2_var = tk.IntVar(value=2)
+        ttk.Spinbox(extra_limit_row, from_=1, to=20, textvariable=self.concurrent2_var,
+                    width=4, font=('Arial', 10)).pack(side='left', padx=(10, 10))
+        ttk.Label(extra_limit_row, text="(TPM 0 = 不限制)", font=('Arial', 8), foreground='gray').pack(side='left')
+        
         # 额外基础URL行（条件显示）
         self.base_url2_row = ttk.Frame(self.extra_endpoint_frame)
         
@@ -386,6 +457,130 @@ class TranslationAgentGUI:
                                   font=('Arial', 10, 'bold'), foreground='red')
         self.rpm_label.pack(side='left')
         
+        # TPM配置（0表示不限制）
+        tpm_frame = ttk.Frame(advanced_frame)
+        tpm_frame.pack(fill='x', pady=(0, 10))
+        
+        ttk.Label(tpm_frame, text="每分钟Token数:", font=('Arial', 10, 'bold')).pack(side='left')
+        self.tpm_var = tk.IntVar(value=0)
+        ttk.Spinbox(tpm_frame, from_=0, to=10000000, increment=10000,
+                    textvariable=self.tpm_var, width=10, font=('Arial', 10)).pack(side='left', padx=(10, 10))
+        ttk.Label(tpm_frame, text="(0 = 不限制)", font=('Arial', 8), foreground='gray').pack(side='left')
+        
+        # 质量档位：初稿只做初译；标准做一次合并修订；完整按下面的修订方式
+        tier_frame = ttk.Frame(advanced_frame)
+        tier_frame.pack(fill='x', pady=(0, 10))
+        
+        ttk.Label(tier_frame, text="质量档位:", font=('Arial', 10, 'bold')).pack(side='left')
+        self.tier_var = tk.StringVar(value=self.tier_labels[TIER_FULL])
+        ttk.Combobox(tier_frame, textvariable=self.tier_var,
+                     values=list(self.tier_labels.values()), state="readonly",
+                     width=20).pack(side='left', padx=(10, 10))
+        ttk.Label(tier_frame, text="(初稿: 每块1次调用；标准: 2次；完整: 3次，修订方式仅对完整档生效)",
+                  font=('Arial', 8), foreground='gray').pack(side='left')
+        
+        # 修订方式：反思+改进两次调用 / 合并为一次JSON调用 / 编辑列表本地应用
+        revision_frame = ttk.Frame(advanced_frame)
+        revision_frame.pack(fill='x', pady=(0, 10))
+        
+        ttk.Label(revision_frame, text="修订方式:", font=('Arial', 10, 'bold')).pack(side='left')
+        self.revision_mode_var = tk.StringVar(value=self.revision_mode_labels[REVISION_SEPARATE])
+        ttk.Combobox(revision_frame, textvariable=self.revision_mode_var,
+                     values=list(self.revision_mode_labels.values()), state="readonly",
+                     width=14).pack(side='left', padx=(10, 10))
+        ttk.Label(revision_frame, text="(合并: 约省1/3请求和输入token；编辑列表: 只输出修改处，大幅减少输出token)",
+                  font=('Arial', 8), foreground='gray').pack(side='left')
+        
+        # 质量门限：初译的本地质量评分达到门限的分块跳过反思和改进
+        quality_frame = ttk.Frame(advanced_frame)
+        quality_frame.pack(fill='x', pady=(0, 10))
+        
+        ttk.Label(quality_frame, text="质量门限:", font=('Arial', 10, 'bold')).pack(side='left')
+        self.quality_threshold_var = tk.DoubleVar(value=0.0)
+        ttk.Spinbox(quality_frame, from_=0.0, to=1.0, increment=0.05,
+                    textvariable=self.quality_threshold_var, width=6, font=('Arial', 10)).pack(side='left', padx=(10, 10))
+        ttk.Label(quality_frame, text="(0 = 所有分块都反思；越低越快，评分≥门限的分块直接采用初译)",
+                  font=('Arial', 8), foreground='gray').pack(side='left')
+        
+        # 级联检查：初译（主端点快模型）未通过检查的分块才升级到额外端点（强模型）修订
+        check_frame = ttk.Frame(advanced_frame)
+        check_frame.pack(fill='x', pady=(0, 10))
+        
+        ttk.Label(check_frame, text="初译检查:", font=('Arial', 10, 'bold')).pack(side='left')
+        self.quality_check_var = tk.StringVar(value=self.quality_check_labels[CHECK_HEURISTIC])
+        ttk.Combobox(check_frame, textvariable=self.quality_check_var,
+                     values=list(self.quality_check_labels.values()), state="readonly",
+                     width=18).pack(side='left', padx=(10, 10))
+        ttk.Label(check_frame, text="(自评: 启发式通过后再让快模型给初译打分，分数/10≥门限才不升级)",
+                  font=('Arial', 8), foreground='gray').pack(side='left')
+        
+        # 小文件打包：多个短文件合并到一个请求中，每个阶段一次调用
+        pack_frame = ttk.Frame(advanced_frame)
+        pack_frame.pack(fill='x', pady=(0, 10))
+        
+        ttk.Label(pack_frame, text="小文件打包Token数:", font=('Arial', 10, 'bold')).pack(side='left')
+        self.pack_tokens_var = tk.IntVar(value=0)
+        ttk.Spinbox(pack_frame, from_=0, to=8000, increment=250,
+                    textvariable=self.pack_tokens_var, width=8, font=('Arial', 10)).pack(side='left', padx=(10, 10))
+        ttk.Label(pack_frame, text="(0 = 不打包；短于此值的文件合并请求，始终使用反思+改进)",
+                  font=('Arial', 8), foreground='gray').pack(side='left')
+        
+        # 概要上下文：长文档先生成一份概要和术语表，每个分块只带概要和相邻分块，而不是全文
+        synopsis_frame = ttk.Frame(advanced_frame)
+        synopsis_frame.pack(fill='x', pady=(0, 10))
+        
+        ttk.Label(synopsis_frame, text="概要上下文Token数:", font=('Arial', 10, 'bold')).pack(side='left')
+        self.synopsis_tokens_var = tk.IntVar(value=0)
+        ttk.Spinbox(synopsis_frame, from_=0, to=200000, increment=2000,
+                    textvariable=self.synopsis_tokens_var, width=8, font=('Arial', 10)).pack(side='left', padx=(10, 10))
+        ttk.Label(synopsis_frame, text="(0 = 始终发送全文；不短于此值的文件每个分块只带概要和前后分块)",
+                  font=('Arial', 8), foreground='gray').pack(side='left')
+        
+        # 书籍术语表：每章完成后提取新的人名和术语译法，后续章节的提示词带上这些译法和前情概要
+        self.book_glossary_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(advanced_frame, text="书籍术语表（各章节共享人名、术语译法和前情概要，保存在输出文件夹）",
+                        variable=self.book_glossary_var).pack(anchor='w', pady=(0, 10))
+        
+        # 翻译记忆：章节标题、免责声明等重复段落直接使用以前的译文
+        self.translation_memory_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(advanced_frame, text="翻译记忆（文件开头/结尾与以前译过的段落完全相同时直接复用译文）",
+                        variable=self.translation_memory_var).pack(anchor='w', pady=(0, 10))
+        
+        # 模糊匹配：相似段落的旧译文作为参考随提示词发送，作者小改过的短文件直接在旧译文上修改
+        self.fuzzy_memory_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(advanced_frame, text="模糊匹配（相似段落的旧译文作为参考；需要开启翻译记忆并安装numpy）",
+                        variable=self.fuzzy_memory_var).pack(anchor='w', pady=(0, 10))
+        
+        # 增量翻译：输出文件夹保存每个文件的原文/译文段落对齐，源文件修改后只重译改动的段落
+        self.incremental_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(advanced_frame, text="增量翻译（源文件修改后只重译改动的段落，其余段落沿用上次的译文）",
+                        variable=self.incremental_var).pack(anchor='w', pady=(0, 10))
+        
+        # 去重：重复的章节文件只翻译一次；多个文件开头/结尾重复的段落（作者的话、分隔线、广告）只翻译一次
+        self.deduplicate_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(advanced_frame, text="去重（重复文件和各文件开头/结尾重复的段落只翻译一次，译文复制到每处）",
+                        variable=self.deduplicate_var).pack(anchor='w', pady=(0, 10))
+        
+        # 按格式提取：Python/C++只翻译注释和文档字符串，JSON只翻译字符串值（去重），Markdown跳过代码块和链接目标，译后按原结构重建
+        self.structured_files_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(advanced_frame, text="按格式提取（代码只译注释/文档字符串，JSON只译字符串值，Markdown跳过代码块，保留原文件结构）",
+                        variable=self.structured_files_var).pack(anchor='w', pady=(0, 10))
+        
+        # 跳过无需翻译的段落：代码、网址、数字/分隔线、已是目标语言的行用占位符代替，不发送给LLM
+        self.skip_untranslatable_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(advanced_frame, text="跳过无需翻译的段落（代码块、网址、数字、已是目标语言的行原样保留）",
+                        variable=self.skip_untranslatable_var).pack(anchor='w', pady=(0, 10))
+        
+        # 占位符保护：行内的网址、链接目标、HTML标签、行内代码、长数字用短占位符代替，译后还原；占位符丢失的分块不遮盖重译
+        self.mask_markup_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(advanced_frame, text="占位符保护（网址、链接目标、HTML标签、行内代码、长数字不发送，译后原样还原）",
+                        variable=self.mask_markup_var).pack(anchor='w', pady=(0, 10))
+        
+        # 先出初稿：所有文件先完成初译并写出，反思和改进作为第二阶段在后台覆盖
+        self.draft_first_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(advanced_frame, text="先出初稿（全部文件先完成初译并保存，之后再反思改进并覆盖）",
+                        variable=self.draft_first_var).pack(anchor='w', pady=(0, 10))
+        
         # === 性能优化配置区域 ===
         performance_frame = ttk.LabelFrame(scrollable_frame, text="🚀 性能优化", padding=20)
         performance_frame.pack(fill='x', pady=(0, 15))
@@ -429,7 +624,7 @@ class TranslationAgentGUI:
         mode_combo.bind('<<ComboboxSelected>>', self.on_performance_mode_change)
         
         # 模式说明
-        self.mode_desc_label = ttk.Label(mode_frame, text="• 平衡: 适合大多数情况", 
+        self.mode_desc_label = ttk.Label(mode_frame, text="• 平衡: 初译+一次修订，适合大多数情况", 
                                         font=('Arial', 8), foreground='blue')
         self.mode_desc_label.pack(side='left', padx=(10, 0))
         
@@ -776,6 +971,10 @@ class TranslationAgentGUI:
         ttk.Button(left_buttons, text="🗑️ 清空任务", 
                   command=self.clear_tasks).pack(side='left', padx=(0, 10))
         
+        self.plan_btn = ttk.Button(left_buttons, text="📐 预估用量", 
+                  command=self.estimate_translation_plan)
+        self.plan_btn.pack(side='left', padx=(0, 10))
+        
         # 右侧选择按钮组
         select_buttons = ttk.Frame(action_frame)
         select_buttons.pack(side='right')
@@ -845,7 +1044,8 @@ class TranslationAgentGUI:
             self.rpm_var.set(80)
             if hasattr(self, 'retry_count_var'):
                 self.retry_count_var.set(1)
-            desc = "• 快速: 适中超时高并发，适合小文件"
+            tier = TIER_DRAFT
+            desc = "• 快速: 仅初译，适中超时高并发，适合小文件"
         elif mode == "平衡":
             # 平衡模式：中等设置
             if hasattr(self, 'api_timeout_var'):
@@ -854,7 +1054,8 @@ class TranslationAgentGUI:
             self.rpm_var.set(60)
             if hasattr(self, 'retry_count_var'):
                 self.retry_count_var.set(2)
-            desc = "• 平衡: 适合大多数情况"
+            tier = TIER_STANDARD
+            desc = "• 平衡: 初译+一次修订，适合大多数情况"
         elif mode == "稳定":
             # 稳定模式：较长超时，较低并发
             if hasattr(self, 'api_timeout_var'):
@@ -863,8 +1064,12 @@ class TranslationAgentGUI:
             self.rpm_var.set(30)
             if hasattr(self, 'retry_count_var'):
                 self.retry_count_var.set(3)
-            desc = "• 稳定: 长超时低并发，适合大文件"
+            tier = TIER_FULL
+            desc = "• 稳定: 完整反思+改进，长超时低并发，适合大文件"
         
+        # 预设同时决定每个分块的LLM工作量（质量档位），之后仍可单独修改档位
+        if hasattr(self, 'tier_var'):
+            self.tier_var.set(self.tier_labels[tier])
         if hasattr(self, 'mode_desc_label'):
             self.mode_desc_label.config(text=desc)
     
@@ -1113,6 +1318,7 @@ class TranslationAgentGUI:
 🆔 任务ID: {task.task_id}
 📊 状态: {task.status}
 📈 进度: {task.progress}%
+🎚️ 质量档位: {self.tier_labels.get(task.tier, task.tier) if task.tier else '未完成'}
 
 ⏱️ 时间信息:
 • 开始: {time.strftime('%H:%M:%S', time.localtime(task.start_time)) if task.start_time else '未开始'}
@@ -1124,6 +1330,9 @@ class TranslationAgentGUI:
 • 初始翻译: {len(task.init_translation)} 字符
 • 最终翻译: {len(task.final_translation)} 字符
 
+💰 Token用量:
+{task.usage.format_summary() if task.usage is not None else '无'}
+
 """
         
         # 根据任务状态显示不同内容
@@ -1164,6 +1373,16 @@ class TranslationAgentGUI:
 • 检查文件内容是否有特殊字符
 • 尝试降低并发任务数"""
         
+        elif task.status == "初稿已完成":
+            # 先出初稿模式：初稿已保存，反思和改进仍在进行
+            detail_content = basic_info + f"""━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+📝 初稿（已保存，终稿完成后覆盖）:
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+{task.init_translation}
+
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+🔄 反思与改进进行中: {task.progress}%"""
+        
         elif task.status == "翻译中":
             # 显示进度信息
             elapsed = time.time() - task.start_time if task.start_time else 0
@@ -1263,6 +1482,7 @@ class TranslationAgentGUI:
 • 完成率: {f'{(completed/total_tasks*100):.1f}%' if total_tasks > 0 else '0%'}
 • 平均耗时: {avg_time:.1f}s
 • 预计剩余: {f'{(avg_time * (total_tasks - completed)):.0f}s' if avg_time > 0 and total_tasks > completed else '0s'}
+{self.format_usage_stats()}
 
 🔄 状态: {'翻译中' if self.is_translating else '空闲'}"""
             
@@ -1271,6 +1491,48 @@ class TranslationAgentGUI:
             self.realtime_stats_text.insert(tk.END, stats_info)
             self.realtime_stats_text.config(state=tk.DISABLED)
     
+    def format_usage_stats(self):
+        """格式化批次token用量和费用"""
+        usage = self.batch_usage
+        if usage is None or not usage.total.calls:
+            return ""
+        total = usage.total
+        lines = [
+            "",
+            "💰 Token用量:",
+            f"• 调用次数: {total.calls}",
+            f"• 输入: {total.prompt_tokens} (缓存: {total.cached_tokens})",
+            f"• 输出: {total.completion_tokens}",
+            f"• 费用: ${usage.cost():.4f}",
+        ]
+        for stage, stats in usage.stages.items():
+            line = f"  - {stage}: {stats.calls}次, {stats.prompt_tokens}/{stats.completion_tokens}"
+            if stats.skipped:
+                # 反思认为无需修改时跳过的改进调用
+                skip_rate = stats.skipped / (stats.calls + stats.skipped) * 100
+                line += f", 跳过{stats.skipped}次 ({skip_rate:.0f}%)"
+            predicted = stats.accepted_prediction_tokens + stats.rejected_prediction_tokens
+            if predicted:
+                # 改进阶段预测输出（初译）被采纳的token比例
+                line += f", 预测采纳{stats.accepted_prediction_tokens}/{predicted}"
+            lines.append(line)
+        if usage.checked:
+            # 级联：初译未通过检查、升级到修订阶段的分块比例
+            lines.append(f"• 级联升级: {usage.escalated}/{usage.checked} ({usage.escalation_rate:.0%}), "
+                         f"约节省请求时间 {usage.saved_latency():.1f}秒")
+        if usage.memory_segments:
+            # 翻译记忆：直接复用译文的段落比例和未发送的原文token
+            lines.append(f"• 翻译记忆: {usage.memory_hits}/{usage.memory_segments}段 ({usage.memory_hit_rate:.0%}), "
+                         f"节省原文 {usage.memory_tokens} tokens")
+        if usage.duplicate_documents or usage.duplicate_paragraphs:
+            # 去重：复制译文的重复文件和段落，以及因此跳过的调用
+            lines.append(f"• 去重: 重复文件 {usage.duplicate_documents} 个, 重复段落 {usage.duplicate_paragraphs} 段, "
+                         f"跳过调用 {usage.duplicate_calls} 次")
+        if usage.masked_segments:
+            # 无需翻译的段落和占位符保护的片段：原样保留的处数和未发送的原文token
+            lines.append(f"• 无需翻译: {usage.masked_segments}处原样保留, 节省原文 {usage.masked_tokens} tokens")
+        return "\n".join(lines)
+    
     def create_about_tab(self):
         """创建关于页面"""
         about_frame = ttk.Frame(self.notebook)
@@ -1308,7 +1570,7 @@ class TranslationAgentGUI:
 
 • 文本文件: .txt, .md
 • 文档文件: .pdf, .docx
-• 代码文件: .py, .json, .cpp
+• 代码文件: .py, .json, .cpp（按格式提取时只翻译注释、文档字符串和字符串值）
 
 🎯 使用流程
 
@@ -1632,6 +1894,7 @@ class TranslationAgentGUI:
                         print(f"[API测试] 发送请求...")
                         
                         # 发送请求（15秒超时）
+                        start_time = time.time()
                         response = requests.post(
                             test_url,
                             headers=headers,
@@ -1646,6 +1909,9 @@ class TranslationAgentGUI:
                             if 'choices' in result and len(result['choices']) > 0:
                                 content = result['choices'][0]['message']['content']
                                 print(f"[API测试] 响应内容: {content}")
+                                # 记录实测延迟，供用量预估估算耗时
+                                completion_tokens = (result.get('usage') or {}).get('completion_tokens', 0)
+                                latency_model.observe(model, time.time() - start_time, completion_tokens)
                                 return True, "连接成功"
                             else:
                                 return False, "API响应格式异常"
@@ -1760,23 +2026,13 @@ class TranslationAgentGUI:
             return
         
         # 获取选中的文件
-        selected_items = self.file_tree.selection() if hasattr(self, 'file_tree') else []
+        selected_files = self.get_selected_files()
         
-        if not selected_items:
+        if not selected_files:
             # 如果没有选中任何文件，询问是否翻译所有文件
             if not messagebox.askyesno("确认", "未选择任何文件，是否翻译所有文件？"):
                 return
             selected_files = self.scanned_files
-        else:
-            # 获取选中文件的路径
-            selected_files = []
-            for item in selected_items:
-                filename = self.file_tree.item(item)['values'][0]
-                # 从scanned_files中找到对应的完整路径
-                for file_path in self.scanned_files:
-                    if os.path.basename(file_path) == filename:
-                        selected_files.append(file_path)
-                        break
         
         if not selected_files:
             messagebox.showerror("错误", "没有可翻译的文件")
@@ -1795,6 +2051,7 @@ class TranslationAgentGUI:
                     task_id = f"task_{self.task_counter}"
                     filename = os.path.splitext(os.path.basename(file_path))[0]
                     task = TranslationTask(task_id, filename, content, file_path)
+                    task.usage = UsageTracker(filename, merge_price_table(self.price_table))
                     self.translation_tasks[task_id] = task
             except Exception as e:
                 print(f"读取文件 {file_path} 失败: {e}")
@@ -1803,6 +2060,8 @@ class TranslationAgentGUI:
             messagebox.showerror("错误", "没有可翻译的文件内容")
             return
         
+        self.batch_usage = UsageTracker("batch", merge_price_table(self.price_table))
+        
         # 开始翻译
         self.is_translating = True
         self.is_paused = False
@@ -1814,7 +2073,138 @@ class TranslationAgentGUI:
         self.stop_btn.config(state='normal')
         
         # 在后台线程中执行翻译
-        threading.Thread(target=self.run_translation, daemon=True).start()
+        threading.Thread(target=self.run_translation_session, daemon=True).start()
+    
+    def get_selected_files(self):
+        """获取文件列表中选中文件的完整路径"""
+        selected_items = self.file_tree.selection() if hasattr(self, 'file_tree') else []
+        paths_by_name = {os.path.basename(p): p for p in self.scanned_files}
+        selected_files = []
+        for item in selected_items:
+            filename = self.file_tree.item(item)['values'][0]
+            if filename in paths_by_name:
+                selected_files.append(paths_by_name[filename])
+        return selected_files
+    
+    def estimate_translation_plan(self):
+        """预估选中文件（未选中时为全部文件）的调用次数、token、耗时和费用"""
+        if getattr(self, 'is_planning', False):
+            return
+        if not self.scanned_files:
+            messagebox.showerror("错误", "请先扫描文件")
+            return
+        
+        files = self.get_selected_files() or list(self.scanned_files)
+        use_extra = self.use_extra_endpoint_var.get()
+        config = {
+            'endpoint': self.endpoint_var.get(),
+            'model': self.model_var.get(),
+            'api_key': self.api_key_var.get(),
+            'base_url': self.base_url_var.get(),
+            'model2': self.model2_var.get() if use_extra else self.model_var.get(),
+            'source_lang': self.source_lang_var.get(),
+            'target_lang': self.target_lang_var.get(),
+            'country': self.country_var.get(),
+            'max_tokens': self.max_tokens_var.get(),
+            'temperature': self.temperature_var.get(),
+            'rpm': self.rpm_var.get(),
+            'tpm': self.tpm_var.get(),
+            'concurrent_tasks': self.concurrent_var.get(),
+            'revision_mode': self.get_revision_mode(),
+            'pipeline_tier': self.get_tier(),
+            'synopsis_tokens': self.synopsis_tokens_var.get(),
+            'structured_files': self.structured_files_var.get(),
+        }
+        
+        self.is_planning = True
+        self.plan_btn.config(state='disabled')
+        self.file_status_var.set(f"正在预估 {len(files)} 个文件...")
+        # 在后台线程中扫描，避免大文件夹冻结界面
+        threading.Thread(target=self.run_translation_plan, args=(files, config), daemon=True).start()
+    
+    def run_translation_plan(self, files, config):
+        """后台预估：复用真实的分块与提示词代码，不调用LLM"""
+        try:
+            plans = []
+            for i, file_path in enumerate(files, 1):
+                content = self.read_file_content(file_path)
+                if not content:
+                    continue
+                filename = os.path.splitext(os.path.basename(file_path))[0]
+                processed_content, extraction = self.prepare_document(
+                    content, file_path, filename, config['structured_files'])
+                if extraction is not None:
+                    # 只预估提取出的段落
+                    processed_content = "\n\n".join(extraction.segments)
+                plans.append(plan_translation(
+                    processed_content,
+                    config['source_lang'],
+                    config['target_lang'],
+                    config['country'],
+                    max_tokens=config['max_tokens'],
+                    revision_mode=config['revision_mode'],
+                    tier=config['pipeline_tier'],
+                    synopsis_tokens=config['synopsis_tokens'],
+                ))
+                if i % 20 == 0 or i == len(files):
+                    self.root.after(0, lambda i=i: self.file_status_var.set(f"正在预估 {i}/{len(files)} 个文件..."))
+            
+            # 耗时只用测试API连接和已完成请求记录的实测延迟；没有实测数据时显示"未知"
+            stage_models = {
+                'initial': config['model'],
+                'reflect': config['model2'],
+                'improve': config['model2'],
+                'revise': config['model2'],
+                'edit': config['model2'],
+            }
+            estimate = estimate_batch(
+                plans, stage_models,
+                concurrency=config['concurrent_tasks'],
+                rpm=config['rpm'],
+                tpm=config['tpm'],
+                price_table=self.price_table,
+            )
+            self.root.after(0, lambda: self.show_translation_plan(estimate))
+        except Exception as e:
+            print(f"[用量预估] 预估失败: {e}")
+            import traceback
+            traceback.print_exc()
+            self.root.after(0, lambda: self.file_status_var.set(f"❌ 预估失败: {e}"))
+        finally:
+            self.is_planning = False
+            self.root.after(0, lambda: self.plan_btn.config(state='normal'))
+    
+    def show_translation_plan(self, estimate):
+        """在文件统计面板中显示预估结果"""
+        seconds = estimate['seconds']
+        if seconds is None:
+            time_str = "未知（请先测试API连接）"
+        elif seconds >= 3600:
+            time_str = f"{seconds / 3600:.1f} 小时"
+        else:
+            time_str = f"{seconds / 60:.1f} 分钟"
+        
+        stage_lines = "\n".join(
+            f"• {stage}: {stats['calls']}次, {stats['prompt_tokens']}/{stats['completion_tokens']}"
+            for stage, stats in estimate['stages'].items()
+        )
+        plan_info = f"""📐 翻译预估
+━━━━━━━━━━━━━━━━━━━━
+📁 文件数: {estimate['documents']}
+🔁 LLM调用: {estimate['calls']}
+📥 输入Token: {estimate['prompt_tokens']} (预计缓存命中: {estimate['cached_tokens']})
+📤 输出Token(估): {estimate['completion_tokens']}
+⏱️ 预计耗时: {time_str}
+💰 预计费用: ${estimate['cost']:.4f}
+
+各阶段(调用, 输入/输出):
+{stage_lines}"""
+        
+        self.file_stats_text.config(state=tk.NORMAL)
+        self.file_stats_text.delete(1.0, tk.END)
+        self.file_stats_text.insert(tk.END, plan_info)
+        self.file_stats_text.config(state=tk.DISABLED)
+        self.file_status_var.set(f"预估完成：{estimate['calls']} 次调用，预计耗时 {time_str}")
     
     def pause_translation(self):
         """暂停/继续翻译"""
@@ -1847,6 +2237,19 @@ class TranslationAgentGUI:
                     task.status = "已取消"
                     task.error_message = "用户停止翻译"
     
+    def prepare_document(self, content, file_path, filename, structured):
+        """返回要翻译的文本和按格式提取的结果；代码/JSON文件不添加标题，无法解析时按普通文本翻译"""
+        ext = os.path.splitext(file_path)[1].lower()
+        if not structured:
+            return self.preprocess_content_with_title(content, filename), None
+        if ext not in CODE_FILE_TYPES:
+            content = self.preprocess_content_with_title(content, filename)
+        extraction = extract_segments(content, ext)
+        if extraction is None and ext in CODE_FILE_TYPES:
+            print(f"[按格式提取] 无法解析，按普通文本翻译: {filename}{ext}")
+            content = self.preprocess_content_with_title(content, filename)
+        return content, extraction
+    
     def read_file_content(self, file_path):
         """读取文件内容"""
         try:
@@ -1862,6 +2265,23 @@ class TranslationAgentGUI:
             print(f"读取文件内容失败: {e}")
             return None
     
+    def run_translation_session(self):
+        """运行翻译任务，按配置录制或回放所有API请求（用于离线性能回归测试）"""
+        try:
+            with cassette_from_config(self.cassette_config) as cassette:
+                if cassette is not None:
+                    print(f"[录制回放] 模式: {cassette.mode}, 文件: {cassette.path}")
+                self.run_translation()
+                if cassette is not None:
+                    print(f"[录制回放] 调用统计: {json.dumps(cassette.summary(), ensure_ascii=False)}")
+        except Exception as e:
+            print(f"[录制回放] 无法使用录制文件: {e}")
+            self.is_translating = False
+            self.root.after(0, lambda: self.start_btn.config(state='normal'))
+            self.root.after(0, lambda: self.pause_btn.config(state='disabled', text="⏸️ 暂停翻译"))
+            self.root.after(0, lambda: self.stop_btn.config(state='disabled'))
+            self.root.after(0, lambda: self.file_status_var.set(f"❌ 录制/回放失败: {e}"))
+    
     def run_translation(self):
         """运行翻译任务 - 优化版本，增加更好的并发控制和错误处理"""
         try:
@@ -1887,7 +2307,27 @@ class TranslationAgentGUI:
                 'country': self.country_var.get(),
                 'max_tokens': self.max_tokens_var.get(),
                 'temperature': self.temperature_var.get(),
-                'rpm': self.rpm_var.get()
+                'rpm': self.rpm_var.get(),
+                'tpm': self.tpm_var.get(),
+                'concurrent_tasks': self.concurrent_var.get(),
+                'rpm2': self.rpm2_var.get(),
+                'tpm2': self.tpm2_var.get(),
+                'concurrent_tasks2': self.concurrent2_var.get(),
+                'revision_mode': self.get_revision_mode(),
+                'pipeline_tier': self.get_tier(),
+                'quality_threshold': self.get_quality_threshold(),
+                'quality_check': self.get_quality_check(),
+                'pack_tokens': self.pack_tokens_var.get(),
+                'draft_first': self.draft_first_var.get(),
+                'synopsis_tokens': self.synopsis_tokens_var.get(),
+                'book_glossary': self.book_glossary_var.get(),
+                'translation_memory': self.translation_memory_var.get(),
+                'fuzzy_memory': self.fuzzy_memory_var.get(),
+                'incremental': self.incremental_var.get(),
+                'deduplicate': self.deduplicate_var.get(),
+                'skip_untranslatable': self.skip_untranslatable_var.get(),
+                'mask_markup': self.mask_markup_var.get(),
+                'structured_files': self.structured_files_var.get(),
             }
             
             concurrent_tasks = self.concurrent_var.get()
@@ -1896,118 +2336,101 @@ class TranslationAgentGUI:
             completed_count = 0
             failed_count = 0
             
-            # 将任务列表转换为队列，便于管理
-            task_queue = list(self.translation_tasks.values())
-            active_futures = {}
+            # 加载模型（额外端点按阶段路由，不在翻译途中切换全局客户端）
+            self.load_models(config)
+            
+            # 启用额外端点时两个端点各有并发上限，工作线程数为两者之和：
+            # 一些分块在主端点初译的同时，另一些分块在额外端点反思/改进
+            pools = None
+            max_workers = concurrent_tasks
+            if config['use_extra_endpoint']:
+                pools = stage_pools()
+                max_workers += config['concurrent_tasks2']
+            
+            glossary = None
+            if config['book_glossary']:
+                glossary = BookGlossary(os.path.join(output_folder, BOOK_GLOSSARY_FILE))
+            memory = None
+            if config['translation_memory']:
+                memory = TranslationMemory(TRANSLATION_MEMORY_FILE)
+            fuzzy = None
+            if memory is not None and config['fuzzy_memory']:
+                if NUMPY_AVAILABLE:
+                    fuzzy = FuzzyMemory(memory, config['source_lang'], config['target_lang'],
+                                        os.path.join(FUZZY_INDEX_DIR, f"{config['source_lang']}-{config['target_lang']}"))
+                else:
+                    print("模糊匹配需要numpy，本次翻译未启用：pip install numpy")
             
-            # 使用线程池执行翻译 - 优化版本
-            with ThreadPoolExecutor(max_workers=concurrent_tasks) as executor:
-                # 提交初始批次的任务
-                for i in range(min(concurrent_tasks, len(task_queue))):
-                    if not self.is_translating:
-                        break
-                    
-                    task = task_queue.pop(0)
-                    print(f"[任务管理] 提交任务: {task.filename}")
-                    future = executor.submit(self.translate_single_file, task, config)
-                    active_futures[future] = task
-                
-                # 处理完成的任务并提交新任务
-                while active_futures and self.is_translating:
-                    # 等待暂停结束
-                    while self.is_paused and self.is_translating:
-                        time.sleep(0.5)
-                    
-                    if not self.is_translating:
-                        print("⚠️ 用户停止翻译，取消剩余任务")
-                        break
-                    
-                    # 检查已完成的任务（设置较短的超时以便及时响应暂停/停止）
-                    try:
-                        completed_futures = []
-                        for future in list(active_futures.keys()):
-                            if future.done():
-                                completed_futures.append(future)
-                        
-                        # 如果没有完成的任务，短暂等待
-                        if not completed_futures:
-                            time.sleep(0.1)
-                            continue
-                        
-                        # 处理完成的任务
-                        for future in completed_futures:
-                            task = active_futures.pop(future)
-                            
-                            try:
-                                completed_task = future.result()
-                                if completed_task.status == "已完成":
-                                    completed_count += 1
-                                    print(f"✓ 任务完成: {completed_task.filename}")
-                                    self.save_translation_result(completed_task, output_folder)
-                                elif completed_task.status == "失败":
-                                    failed_count += 1
-                                    print(f"✗ 任务失败: {completed_task.filename} - {completed_task.error_message}")
-                                else:
-                                    print(f"⚠️ 任务状态异常: {completed_task.filename} - {completed_task.status}")
-                                    
-                            except Exception as e:
-                                failed_count += 1
-                                task.status = "失败"
-                                task.error_message = f"处理任务结果时出错: {str(e)}"
-                                print(f"✗ 处理任务结果时出错: {task.filename} - {str(e)}")
-                                import traceback
-                                traceback.print_exc()
-                        
-                        # 提交新任务（如果还有待处理的任务）
-                        while len(active_futures) < concurrent_tasks and task_queue and self.is_translating:
-                            if self.is_paused:
-                                break
-                                
-                            task = task_queue.pop(0)
-                            print(f"[任务管理] 提交新任务: {task.filename}")
-                            future = executor.submit(self.translate_single_file, task, config)
-                            active_futures[future] = task
-                        
-                        # 更新状态显示
-                        total_tasks = len(self.translation_tasks)
-                        processed = completed_count + failed_count
-                        remaining = total_tasks - processed
-                        
-                        status_msg = f"翻译进度: {processed}/{total_tasks} (成功:{completed_count}, 失败:{failed_count}, 剩余:{remaining})"
-                        self.root.after(0, lambda msg=status_msg: self.file_status_var.set(msg))
-                        
-                    except Exception as e:
-                        print(f"⚠️ 任务管理循环中出错: {e}")
-                        import traceback
-                        traceback.print_exc()
-                        time.sleep(1)  # 出错时稍作等待
+            # 预处理内容：检查是否需要添加标题
+            documents = {}
+            trackers = {}
+            alignments = {}
+            extractions = {}
+            for task in self.translation_tasks.values():
+                documents[task.task_id], extraction = self.prepare_document(
+                    task.content, task.file_path, task.filename, config['structured_files'])
+                if extraction is not None:
+                    extractions[task.task_id] = extraction
+                    task.keep_format = os.path.splitext(task.file_path)[1].lower() in CODE_FILE_TYPES
+                trackers[task.task_id] = [t for t in (task.usage, self.batch_usage) if t is not None]
+                # 增量翻译：上次的段落对齐存在时，只重译改动的段落
+                if config['incremental']:
+                    alignment = Alignment.load(self.alignment_path(task, output_folder))
+                    if alignment is not None:
+                        alignments[task.task_id] = alignment
+            
+            # 所有文件拆分为"分块×阶段"的作业，共享一个优先队列：
+            # 大文件的分块可以并行，小文件也不会被大文件阻塞
+            results = translate_many(
+                documents,
+                config['source_lang'],
+                config['target_lang'],
+                config['country'],
+                max_tokens=config['max_tokens'],
+                max_workers=max_workers,
+                revision_mode=config['revision_mode'],
+                tier=config['pipeline_tier'],
+                quality_threshold=config['quality_threshold'],
+                quality_check=config['quality_check'],
+                pack_tokens=config['pack_tokens'],
+                draft_first=config['draft_first'],
+                synopsis_tokens=config['synopsis_tokens'],
+                synopsis_cache=SynopsisCache(SYNOPSIS_CACHE_FILE),
+                glossary=glossary,
+                memory=memory,
+                fuzzy=fuzzy,
+                alignments=alignments,
+                deduplicate=config['deduplicate'],
+                skip_untranslatable=config['skip_untranslatable'],
+                mask_markup=config['mask_markup'],
+                extractions=extractions,
+                stage_pools=pools,
+                trackers=trackers,
+                on_progress=self.on_task_progress,
+                on_draft=lambda result: self.on_task_draft(result, output_folder),
+                should_stop=lambda: not self.is_translating,
+                is_paused=lambda: self.is_paused,
+            )
+            for result in results:
+                task = self.translation_tasks[result.key]
+                self.finish_task(task, result)
+                if task.status == "已完成":
+                    completed_count += 1
+                    self.save_translation_result(task, output_folder)
+                    # 按格式提取的文件不做增量翻译，不保存段落对齐
+                    if config['incremental'] and result.extraction is None:
+                        self.save_alignment(task, result, config, output_folder)
+                else:
+                    failed_count += 1
                 
-                # 等待所有剩余任务完成
-                print(f"[任务管理] 等待剩余 {len(active_futures)} 个任务完成...")
-                for future in active_futures:
-                    try:
-                        task = active_futures[future]
-                        completed_task = future.result(timeout=30)  # 给每个任务30秒的额外等待时间
-                        
-                        if completed_task.status == "已完成":
-                            completed_count += 1
-                            print(f"✓ 最终任务完成: {completed_task.filename}")
-                            self.save_translation_result(completed_task, output_folder)
-                        elif completed_task.status == "失败":
-                            failed_count += 1
-                            print(f"✗ 最终任务失败: {completed_task.filename} - {completed_task.error_message}")
-                            
-                    except concurrent.futures.TimeoutError:
-                        failed_count += 1
-                        task.status = "失败"
-                        task.error_message = "任务最终等待超时"
-                        print(f"✗ 最终任务超时: {task.filename}")
-                        
-                    except Exception as e:
-                        failed_count += 1
-                        task.status = "失败"
-                        task.error_message = str(e)
-                        print(f"✗ 最终任务处理出错: {task.filename} - {str(e)}")
+                # 更新状态显示
+                self.show_batch_status(completed_count, failed_count)
+            
+            # 用户停止时未完成的任务
+            for task in self.translation_tasks.values():
+                if task.status in ("等待中", "翻译中"):
+                    task.status = "已取消"
+                    task.end_time = time.time()
             
             self.is_translating = False
             self.is_paused = False
@@ -2017,6 +2440,9 @@ class TranslationAgentGUI:
             self.root.after(0, lambda: self.pause_btn.config(state='disabled', text="⏸️ 暂停翻译"))
             self.root.after(0, lambda: self.stop_btn.config(state='disabled'))
             
+            # 写出token用量与费用报告（CSV/JSON，与译文同目录）
+            self.write_usage_report(output_folder)
+            
             # 显示完成统计
             print(f"\n{'#'*60}")
             print(f"# 批量翻译完成")
@@ -2050,148 +2476,174 @@ class TranslationAgentGUI:
             
             self.root.after(0, lambda: self.file_status_var.set(error_msg))
     
-    def translate_single_file(self, task, config):
-        """翻译单个文件 - 修复超时问题"""
+    def alignment_path(self, task, output_folder):
+        """文件的段落对齐保存在输出文件夹的隐藏子目录中，按输入文件名区分"""
+        return os.path.join(output_folder, ALIGNMENT_DIR, f"{task.filename}.json")
+    
+    def save_alignment(self, task, result, config, output_folder):
+        """保存原文与终稿的段落对齐；段落数不一致时无法对齐，下次整篇重译"""
         try:
-            # 检查是否停止
-            if not self.is_translating:
-                task.status = "已取消"
-                return task
-            
-            task.status = "翻译中"
-            task.start_time = time.time()
-            task.progress = 10
-            
-            print(f"\n{'='*60}")
-            print(f"开始翻译文件: {task.filename}")
-            print(f"文件大小: {len(task.content)} 字符")
-            print(f"{'='*60}\n")
-            
-            # 预处理内容：检查是否需要添加标题
-            processed_content = self.preprocess_content_with_title(task.content, task.filename)
-            print(f"[预处理] 内容处理完成，最终大小: {len(processed_content)} 字符")
-            
-            # 加载模型
-            print(f"[1/4] 加载模型: {config['model']} (端点: {config['endpoint']})")
-            model_load(
-                config['endpoint'],
-                config['base_url'],
-                config['model'],
-                config['api_key'],
-                config['temperature'],
-                config['rpm']
+            alignment = Alignment.from_translation(
+                config['source_lang'], config['target_lang'],
+                result.source_text, result.final_translation
             )
-            task.progress = 20
-            print(f"✓ 模型加载完成")
-            
-            # 定义进度回调函数
-            def progress_callback(current, total, desc=""):
-                """进度回调函数"""
-                if not self.is_translating:
-                    return
-                
-                # 计算进度百分比 (20-100)
-                # 20% 已经用于模型加载
-                # 剩余80%分配给翻译的3个阶段
-                progress_percent = 20 + int((current / total) * 80)
-                task.progress = progress_percent
-                
-                # 打印进度信息
-                if desc:
-                    print(f"[{current}/{total}] {desc} - 进度: {progress_percent}%")
-            
-            # 临时替换全局progress函数
-            import sys
-            # 获取process模块（已在文件顶部导入）
-            process_module = sys.modules.get('process')
-            if not process_module:
-                # 如果没有找到，尝试从app目录导入
-                import importlib.util
-                spec = importlib.util.spec_from_file_location("process", os.path.join(os.path.dirname(__file__), 'app', 'process.py'))
-                process_module = importlib.util.module_from_spec(spec)
-                spec.loader.exec_module(process_module)
-            
-            original_progress = getattr(process_module, 'progress', None)
-            
-            # 创建新的progress函数
-            def new_progress(progress_tuple, desc=""):
-                if isinstance(progress_tuple, tuple) and len(progress_tuple) == 2:
-                    current, total = progress_tuple
-                    progress_callback(current, total, desc)
-                # 如果有原始progress函数，也调用它
-                if original_progress and callable(original_progress):
-                    try:
-                        original_progress(progress_tuple, desc=desc)
-                    except:
-                        pass
-            
-            # 替换progress函数
-            process_module.progress = new_progress
-            
-            try:
-                # 执行翻译（使用预处理后的内容）
-                print(f"\n[2/4] 开始翻译流程...")
-                if config['use_extra_endpoint']:
-                    print(f"使用额外端点: {config['endpoint2']} / {config['model2']}")
-                    init_translation, reflect_translation, final_translation = translator_sec(
-                        endpoint2=config['endpoint2'],
-                        base2=config['base_url2'],
-                        model2=config['model2'],
-                        api_key2=config['api_key2'],
-                        source_lang=config['source_lang'],
-                        target_lang=config['target_lang'],
-                        source_text=processed_content,  # 使用预处理后的内容
-                        country=config['country'],
-                        max_tokens=config['max_tokens']
-                    )
-                else:
-                    print(f"使用单一端点翻译")
-                    init_translation, reflect_translation, final_translation = translator(
-                        source_lang=config['source_lang'],
-                        target_lang=config['target_lang'],
-                        source_text=processed_content,  # 使用预处理后的内容
-                        country=config['country'],
-                        max_tokens=config['max_tokens']
-                    )
-                print(f"✓ 翻译流程完成")
-            finally:
-                # 恢复原始progress函数
-                if original_progress:
-                    process_module.progress = original_progress
-            
-            task.init_translation = init_translation
-            task.reflect_translation = reflect_translation
-            task.final_translation = final_translation
-            task.progress = 100
-            task.status = "已完成"
-            task.end_time = time.time()
-            
-            elapsed = task.end_time - task.start_time
-            print(f"\n{'='*60}")
-            print(f"✅ 翻译完成: {task.filename}")
-            print(f"耗时: {elapsed:.2f} 秒")
-            print(f"初始翻译: {len(init_translation)} 字符")
-            print(f"最终翻译: {len(final_translation)} 字符")
-            print(f"{'='*60}\n")
-            
+            if alignment is None:
+                print(f"[增量翻译] 译文段落数与原文不一致，未保存对齐: {task.filename}")
+                return
+            alignment.save(self.alignment_path(task, output_folder))
         except Exception as e:
+            print(f"[增量翻译] 保存段落对齐失败: {e}")
+    
+    def write_usage_report(self, output_folder):
+        """将各文件及批次的token用量写入输出文件夹"""
+        try:
+            trackers = [t.usage for t in self.translation_tasks.values() if t.usage is not None]
+            if not trackers:
+                return
+            paths = write_usage_report(trackers, output_folder, batch=self.batch_usage)
+            print(f"[用量报告] 已保存: {', '.join(paths)}")
+        except Exception as e:
+            print(f"[用量报告] 保存失败: {e}")
+    
+    def load_models(self, config):
+        """加载主端点模型；启用额外端点时，反思和改进阶段使用额外端点"""
+        print(f"[模型] 加载模型: {config['model']} (端点: {config['endpoint']})")
+        model_load(
+            config['endpoint'],
+            config['base_url'],
+            config['model'],
+            config['api_key'],
+            config['temperature'],
+            config['rpm'],
+            tpm=config['tpm'],
+            max_concurrency=config['concurrent_tasks'],
+        )
+        if config['use_extra_endpoint']:
+            print(f"[模型] 反思/改进使用额外端点: {config['endpoint2']} / {config['model2']}")
+            try:
+                model_load_stages(
+                    ("reflect", "improve", "revise", "edit"),
+                    config['endpoint2'],
+                    config['base_url2'],
+                    config['model2'],
+                    config['api_key2'],
+                    rpm=config['rpm2'],
+                    tpm=config['tpm2'],
+                    max_concurrency=config['concurrent_tasks2'],
+                )
+            except Exception as e:
+                raise Exception(f"额外端点模型加载失败: {e}") from e
+    
+    def get_revision_mode(self):
+        """反思/改进的调用方式：分两次调用、合并为一次JSON调用，或编辑列表本地应用"""
+        label = self.revision_mode_var.get()
+        for mode, mode_label in self.revision_mode_labels.items():
+            if mode_label == label:
+                return mode
+        return REVISION_SEPARATE
+    
+    def get_tier(self):
+        """质量档位：初稿、标准或完整"""
+        label = self.tier_var.get()
+        for tier, tier_label in self.tier_labels.items():
+            if tier_label == label:
+                return tier
+        return TIER_FULL
+    
+    def get_quality_check(self):
+        """初译检查方式：本地启发式，或启发式加快模型自评"""
+        label = self.quality_check_var.get()
+        for check, check_label in self.quality_check_labels.items():
+            if check_label == label:
+                return check
+        return CHECK_HEURISTIC
+    
+    def get_quality_threshold(self):
+        """质量门限，0表示关闭（所有分块都反思）"""
+        try:
+            threshold = float(self.quality_threshold_var.get())
+        except (tk.TclError, ValueError):
+            return None
+        return threshold if threshold > 0 else None
+    
+    def on_task_progress(self, task_id, finished_jobs, total_jobs):
+        """调度器进度回调：每个文件的作业完成情况"""
+        task = self.translation_tasks.get(task_id)
+        if task is None:
+            return
+        if task.start_time is None:
+            task.status = "翻译中"
+            task.start_time = time.time()
+            print(f"[任务管理] 开始翻译: {task.filename}")
+        task.progress = 10 + int(finished_jobs / max(total_jobs, 1) * 90)
+    
+    def on_task_draft(self, result, output_folder):
+        """先出初稿模式：文件的初译全部完成后立即写出初稿，终稿完成后原子覆盖"""
+        task = self.translation_tasks.get(result.key)
+        if task is None or not self.draft_first_var.get():
+            return
+        task.init_translation = result.init_translation
+        task.final_translation = result.init_translation
+        self.save_translation_result(task, output_folder)
+        if task.status == "保存失败":
+            return
+        task.draft_saved = True
+        task.status = "初稿已完成"
+        print(f"[初稿] 已保存: {task.filename}")
+        self.show_batch_status()
+    
+    def show_batch_status(self, completed_count=None, failed_count=None):
+        """状态栏显示批次进度，先出初稿模式下分别显示初稿和终稿两个阶段"""
+        tasks = list(self.translation_tasks.values())
+        total_tasks = len(tasks)
+        if completed_count is None:
+            completed_count = sum(1 for t in tasks if t.status == "已完成")
+        if failed_count is None:
+            failed_count = sum(1 for t in tasks if t.status in ("失败", "保存失败"))
+        processed = completed_count + failed_count
+        remaining = total_tasks - processed
+        
+        status_msg = f"翻译进度: {processed}/{total_tasks} (成功:{completed_count}, 失败:{failed_count}, 剩余:{remaining})"
+        drafted = sum(1 for t in tasks if t.draft_saved)
+        if drafted:
+            status_msg = f"初稿: {drafted}/{total_tasks} | 终稿" + status_msg[len("翻译"):]
+        self.root.after(0, lambda msg=status_msg: self.file_status_var.set(msg))
+    
+    def finish_task(self, task, result):
+        """将调度器返回的结果写入任务"""
+        task.end_time = time.time()
+        if task.start_time is None:
+            task.start_time = task.end_time
+        
+        if result.error is not None:
             task.status = "失败"
-            task.error_message = str(e)
+            task.error_message = str(result.error)
             task.progress = 0
-            task.end_time = time.time()
-            
-            # 打印详细错误信息
             print(f"\n{'='*60}")
             print(f"❌ 翻译失败: {task.filename}")
-            print(f"错误类型: {type(e).__name__}")
-            print(f"错误信息: {str(e)}")
+            print(f"错误类型: {type(result.error).__name__}")
+            print(f"错误信息: {result.error}")
             print(f"{'='*60}\n")
-            
-            # 打印完整的错误堆栈
-            import traceback
-            traceback.print_exc()
+            return
         
-        return task
+        task.init_translation = result.init_translation
+        task.reflect_translation = result.reflection
+        task.final_translation = result.final_translation
+        task.tier = result.tier
+        task.progress = 100
+        task.status = "已完成"
+        
+        elapsed = task.end_time - task.start_time
+        print(f"\n{'='*60}")
+        print(f"✅ 翻译完成: {task.filename}")
+        print(f"分块数: {len(result.chunks)}")
+        print(f"质量档位: {self.tier_labels.get(task.tier, task.tier)}")
+        print(f"耗时: {elapsed:.2f} 秒")
+        print(f"初始翻译: {len(task.init_translation)} 字符")
+        print(f"最终翻译: {len(task.final_translation)} 字符")
+        if task.usage is not None:
+            print(f"Token用量:\n{task.usage.format_summary()}")
+        print(f"{'='*60}\n")
     
     def preprocess_content_with_title(self, content, filename):
         """预处理内容：如果没有标题则添加文件名作为标题"""
@@ -2238,7 +2690,9 @@ class TranslationAgentGUI:
             
             print(f"[3/4] 保存翻译结果: {task.filename}.{output_format}")
             
-            if output_format == "txt":
+            if task.keep_format:
+                self.save_in_source_format(task, output_folder)
+            elif output_format == "txt":
                 self.save_as_txt(task, output_folder)
             elif output_format == "docx":
                 self.save_as_docx(task, output_folder)
@@ -2253,6 +2707,15 @@ class TranslationAgentGUI:
             task.status = "保存失败"
             task.error_message = f"保存文件时出错: {e}"
     
+    def save_in_source_format(self, task, output_folder):
+        """代码/JSON文件按原文件名写出重建后的译文，不做小说排版清理"""
+        output_path = os.path.join(output_folder, os.path.basename(task.file_path))
+        temp_path = output_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(task.final_translation)
+        os.replace(temp_path, output_path)
+        print(f"文件已按原格式保存到: {output_path}")
+    
     def save_as_txt(self, task, output_folder):
         """保存为TXT格式 - 只输出最终翻译结果"""
         # 智能选择文件名：优先使用翻译内容中的章节名，否则使用文件名翻译
@@ -2262,14 +2725,25 @@ class TranslationAgentGUI:
         # 清理和格式化翻译内容，使其适合小说网站阅读
         cleaned_content = self.clean_translation_for_novel(task.final_translation)
         
-        # 只保存最终翻译结果
-        with open(output_path, "w", encoding="utf-8") as f:
+        # 只保存最终翻译结果；先写临时文件再替换，终稿覆盖初稿时不会留下半个文件
+        temp_path = output_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
             f.write(cleaned_content)
+        os.replace(temp_path, output_path)
         
         print(f"TXT文件已保存到: {output_path}")
     
     def get_smart_filename(self, task):
-        """智能获取文件名：优先使用内容中的章节名，否则使用文件名翻译"""
+        """智能获取文件名：优先使用内容中的章节名，否则使用文件名翻译
+        
+        文件名在第一次保存时确定，之后的保存（终稿覆盖初稿）沿用同一文件名。
+        """
+        if task.output_filename is None:
+            task.output_filename = self.choose_smart_filename(task)
+        return task.output_filename
+    
+    def choose_smart_filename(self, task):
+        """根据翻译内容或原文件名选择输出文件名"""
         try:
             # 1. 尝试从翻译内容中提取章节名
             if task.final_translation:
@@ -2488,8 +2962,10 @@ class TranslationAgentGUI:
             else:
                 doc.add_paragraph()  # 保留空行
         
-        # 保存文档
-        doc.save(output_path)
+        # 保存文档（先写临时文件再替换）
+        temp_path = output_path + ".tmp"
+        doc.save(temp_path)
+        os.replace(temp_path, output_path)
         print(f"DOCX文件已保存到: {output_path}")
     
     def clear_tasks(self):
@@ -2518,10 +2994,14 @@ class TranslationAgentGUI:
             self.overall_progress_bar['value'] = 0
         else:
             completed = sum(1 for task in self.translation_tasks.values() if task.status == "已完成")
+            drafted = sum(1 for task in self.translation_tasks.values() if task.draft_saved)
             total = len(self.translation_tasks)
             progress = (completed / total) * 100 if total > 0 else 0
             
-            self.overall_progress_var.set(f"总体进度: {completed}/{total} 已完成 ({progress:.1f}%)")
+            overall = f"总体进度: {completed}/{total} 已完成 ({progress:.1f}%)"
+            if drafted:
+                overall = f"初稿: {drafted}/{total} | " + overall
+            self.overall_progress_var.set(overall)
             self.overall_progress_bar['value'] = progress
         
         # 更新详细进度
@@ -2586,12 +3066,31 @@ class TranslationAgentGUI:
                 'model2': self.model2_var.get(),
                 'api_key2': self.api_key2_var.get(),
                 'base_url2': self.base_url2_var.get(),
+                'rpm2': self.rpm2_var.get(),
+                'tpm2': self.tpm2_var.get(),
+                'concurrent_tasks2': self.concurrent2_var.get(),
                 'source_lang': self.source_lang_var.get(),
                 'target_lang': self.target_lang_var.get(),
                 'country': self.country_var.get(),
                 'max_tokens': self.max_tokens_var.get(),
                 'temperature': self.temperature_var.get(),
                 'rpm': self.rpm_var.get(),
+                'tpm': self.tpm_var.get(),
+                'revision_mode': self.get_revision_mode(),
+                'pipeline_tier': self.get_tier(),
+                'quality_threshold': self.get_quality_threshold() or 0.0,
+                'quality_check': self.get_quality_check(),
+                'pack_tokens': self.pack_tokens_var.get(),
+                'draft_first': self.draft_first_var.get(),
+                'synopsis_tokens': self.synopsis_tokens_var.get(),
+                'book_glossary': self.book_glossary_var.get(),
+                'translation_memory': self.translation_memory_var.get(),
+                'fuzzy_memory': self.fuzzy_memory_var.get(),
+                'incremental': self.incremental_var.get(),
+                'deduplicate': self.deduplicate_var.get(),
+                'skip_untranslatable': self.skip_untranslatable_var.get(),
+                'mask_markup': self.mask_markup_var.get(),
+                'structured_files': self.structured_files_var.get(),
                 'input_folder': self.input_folder_var.get(),
                 'output_folder': self.output_folder_var.get(),
                 'output_format': self.output_format_var.get(),
@@ -2600,7 +3099,10 @@ class TranslationAgentGUI:
                 # 新增性能优化设置
                 'api_timeout': getattr(self, 'api_timeout_var', tk.IntVar(value=300)).get(),
                 'performance_mode': getattr(self, 'performance_mode_var', tk.StringVar(value="平衡")).get(),
-                'retry_count': getattr(self, 'retry_count_var', tk.IntVar(value=2)).get()
+                'retry_count': getattr(self, 'retry_count_var', tk.IntVar(value=2)).get(),
+                # 价格表：模型名 -> [输入, 缓存输入, 输出] 每百万token美元价格
+                'price_table': self.price_table,
+                'cassette': self.cassette_config
             }
             
             with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
@@ -2631,6 +3133,9 @@ class TranslationAgentGUI:
                 self.model2_var.set(config.get('model2', 'gpt-4o'))
                 self.api_key2_var.set(config.get('api_key2', ''))
                 self.base_url2_var.set(config.get('base_url2', ''))
+                self.rpm2_var.set(config.get('rpm2', 60))
+                self.tpm2_var.set(config.get('tpm2', 0))
+                self.concurrent2_var.set(config.get('concurrent_tasks2', 2))
                 
                 # 加载翻译参数
                 self.source_lang_var.set(config.get('source_lang', 'Chinese'))
@@ -2639,6 +3144,25 @@ class TranslationAgentGUI:
                 self.max_tokens_var.set(config.get('max_tokens', 1000))
                 self.temperature_var.set(config.get('temperature', 0.3))
                 self.rpm_var.set(config.get('rpm', 60))
+                self.tpm_var.set(config.get('tpm', 0))
+                self.revision_mode_var.set(self.revision_mode_labels.get(
+                    config.get('revision_mode'), self.revision_mode_labels[REVISION_SEPARATE]))
+                self.tier_var.set(self.tier_labels.get(
+                    config.get('pipeline_tier'), self.tier_labels[TIER_FULL]))
+                self.quality_threshold_var.set(config.get('quality_threshold', 0.0))
+                self.quality_check_var.set(self.quality_check_labels.get(
+                    config.get('quality_check'), self.quality_check_labels[CHECK_HEURISTIC]))
+                self.pack_tokens_var.set(config.get('pack_tokens', 0))
+                self.draft_first_var.set(config.get('draft_first', False))
+                self.synopsis_tokens_var.set(config.get('synopsis_tokens', 0))
+                self.book_glossary_var.set(config.get('book_glossary', False))
+                self.translation_memory_var.set(config.get('translation_memory', False))
+                self.fuzzy_memory_var.set(config.get('fuzzy_memory', False))
+                self.incremental_var.set(config.get('incremental', False))
+                self.deduplicate_var.set(config.get('deduplicate', False))
+                self.skip_untranslatable_var.set(config.get('skip_untranslatable', False))
+                self.mask_markup_var.set(config.get('mask_markup', False))
+                self.structured_files_var.set(config.get('structured_files', True))
                 
                 # 加载文件设置
                 self.input_folder_var.set(config.get('input_folder', ''))
@@ -2659,6 +3183,10 @@ class TranslationAgentGUI:
                 if hasattr(self, 'retry_count_var'):
                     self.retry_count_var.set(config.get('retry_count', 2))
                 
+                # 加载价格表
+                self.price_table = config.get('price_table', {})
+                self.cassette_config = config.get('cassette', self.cassette_config)
+                
                 # 更新界面（显示/隐藏base_url字段）
                 self.on_endpoint_change()
                 self.on_endpoint2_change()